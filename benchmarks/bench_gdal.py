@@ -0,0 +1,79 @@
+# -*- coding: utf8 -*-
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # compare GDAL profiles ( downscale.gdalenv.GDALProfile ) of the full
+# # DeltaDownscale.downscale on a synthetic case: worker processes x
+# # warp threads, warp memory, block cache and SOURCE_EXTRA.  The first
+# # config is the reference -- the max abs difference of every other
+# # config's outputs from it is reported with its time.
+# #
+# # usage:
+# #   python benchmarks/bench_gdal.py --size large --configs 8x1,4x2,2x4 --cache_max 256
+# #   python benchmarks/bench_gdal.py --size medium --configs 4x1 --kernel_source_extra
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def parse_config( config ):
+	''' ( workers, threads ) of a WORKERSxTHREADS string '''
+	workers, threads = config.lower().split( 'x' )
+	return int( workers ), int( threads )
+
+def max_difference( output_dir, reference_dir ):
+	''' largest abs difference between the same-named outputs of two runs ( nodata cells compared as equal ) '''
+	import glob, rasterio
+	worst = 0.0
+	for fn in glob.glob( os.path.join( reference_dir, '*.tif' ) ):
+		with rasterio.open( fn ) as ref, rasterio.open( os.path.join( output_dir, os.path.basename( fn ) ) ) as out:
+			a, b = ref.read( 1, masked=True ), out.read( 1, masked=True )
+			if ( a.mask != b.mask ).any():
+				return np.inf
+			if a.count() > 0:
+				worst = max( worst, float( np.abs( a - b ).max() ) )
+	return worst
+
+if __name__ == '__main__':
+	import os, sys, shutil, tempfile, argparse
+	import numpy as np
+	from downscale import synthetic, Dataset, Baseline, DeltaDownscale
+	from downscale.gdalenv import GDALProfile, DEFAULT_SOURCE_EXTRA, KERNEL_SOURCE_EXTRA
+	from harness import Recorder, RESULTS_DIR
+
+	parser = argparse.ArgumentParser( description='compare GDAL warp / cache profiles of DeltaDownscale.downscale' )
+	parser.add_argument( "-s", "--size", action='store', dest='size', type=str, default='medium', help="one of {}".format( sorted( synthetic.SIZES ) ) )
+	parser.add_argument( "-c", "--configs", action='store', dest='configs', type=str, default='4x1,2x2,1x4', help="comma separated WORKERSxTHREADS, the first is the reference" )
+	parser.add_argument( "-w", "--warp_mem_limit", action='store', dest='warp_mem_limit', type=int, default=0, help="MB of warp memory, 0 for GDAL's default" )
+	parser.add_argument( "-m", "--cache_max", action='store', dest='cache_max', type=int, default=None, help="MB of GDAL block cache per worker" )
+	parser.add_argument( "-k", "--kernel_source_extra", action='store_true', dest='kernel_source_extra', help="also run each config with KERNEL_SOURCE_EXTRA" )
+	parser.add_argument( "-r", "--results_dir", action='store', dest='results_dir', type=str, default=RESULTS_DIR, help="where results.jsonl is kept" )
+	args = parser.parse_args()
+
+	tmp_dir = tempfile.mkdtemp( prefix='downscale_bench_' )
+	try:
+		rec = Recorder( 'gdal', results_dir=args.results_dir, size=args.size, case='tas_{}'.format( args.size ),
+						warp_mem_limit=args.warp_mem_limit, cache_max=args.cache_max )
+		case = synthetic.make_case( os.path.join( tmp_dir, 'case' ), size=args.size, historical=(1950, 1959), future=(2006, 2007) )
+		historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='K', metric='mean' )
+		future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='K', metric='mean' )
+		dd = DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+							downscaling_operation='add', src_crs={'init':'epsg:4326'}, src_nodata=None, dst_nodata=None )
+
+		runs = []
+		for config in args.configs.split( ',' ):
+			runs.append( ( config, DEFAULT_SOURCE_EXTRA ) )
+			if args.kernel_source_extra:
+				runs.append( ( config + '_kernel', KERNEL_SOURCE_EXTRA ) )
+		reference_dir = None
+		for name, source_extra in runs:
+			workers, threads = parse_config( name.split( '_' )[0] )
+			dd.ncpus = workers
+			dd.gdal_profile = GDALProfile( num_threads=threads, warp_mem_limit=args.warp_mem_limit,
+											cache_max=args.cache_max, source_extra=source_extra )
+			output_dir = os.path.join( tmp_dir, name )
+			if rec.run( name, dd.downscale, output_dir ) is None:
+				continue
+			if reference_dir is None:
+				reference_dir = output_dir
+			difference = max_difference( output_dir, reference_dir )
+			rec.records[-1].update( workers=workers, threads=threads, max_difference=difference )
+			print( '{:<24} max abs difference from {}: {:g}'.format( '', runs[0][0], difference ) )
+		print( 'results: {}'.format( rec.save() ) )
+	finally:
+		shutil.rmtree( tmp_dir )
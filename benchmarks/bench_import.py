@@ -0,0 +1,55 @@
+# -*- coding: utf8 -*-
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # import time of the package and the modules short jobs / workers load,
+# # each in a fresh interpreter.  Exits 1 if `import downscale` is over
+# # its budget or pulls in any of the heavy libraries.
+# #
+# # usage:
+# #   python benchmarks/bench_import.py --budget 0.25 --repeat 7
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+MODULES = [ 'downscale', 'downscale.utils', 'downscale.grid', 'downscale.clip', 'downscale.warp',
+			'downscale.derived', 'downscale.zonal', 'downscale.rechunk', 'downscale.partition' ]
+
+# not loaded by `import downscale` -- only by the classes / functions that use them
+HEAVY = [ 'xarray', 'geopandas', 'pandas', 'rasterio', 'netCDF4', 'scipy', 'pathos' ]
+
+CODE = '''
+import sys, time, json
+tic = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - tic
+print( json.dumps({{ 'seconds':seconds, 'heavy':[ name for name in {heavy!r} if name in sys.modules ] }}) )
+'''
+
+def import_time( module, repeat=5 ):
+	''' median seconds to import a module in a fresh interpreter and the heavy libraries it loaded '''
+	import sys, json, subprocess
+	import numpy as np
+	runs = []
+	for i in range( repeat ):
+		out = subprocess.check_output([ sys.executable, '-c', CODE.format( module=module, heavy=HEAVY ) ])
+		runs.append( json.loads( out.decode().strip().splitlines()[-1] ) )
+	return float( np.median([ run[ 'seconds' ] for run in runs ]) ), runs[-1][ 'heavy' ]
+
+if __name__ == '__main__':
+	import sys, argparse
+	from harness import Recorder, RESULTS_DIR
+
+	parser = argparse.ArgumentParser( description='benchmark import time of the downscale package' )
+	parser.add_argument( "-b", "--budget", action='store', dest='budget', type=float, default=0.25, help="seconds allowed for `import downscale`" )
+	parser.add_argument( "-r", "--repeat", action='store', dest='repeat', type=int, default=5, help="fresh interpreters per module ( the median is kept )" )
+	parser.add_argument( "--results_dir", action='store', dest='results_dir', type=str, default=RESULTS_DIR, help="where results.jsonl is kept" )
+	args = parser.parse_args()
+
+	rec = Recorder( 'import', results_dir=args.results_dir, budget=args.budget, repeat=args.repeat )
+	failed = False
+	for module in MODULES:
+		seconds, heavy = import_time( module, repeat=args.repeat )
+		rec.records.append( dict( rec.tags, phase=module, seconds=seconds, peak_mb=None, maxrss_mb=None, status='ok', error=None, heavy=heavy ) )
+		print( '{:<24} {:>9.3f}s  {}'.format( module, seconds, ' '.join( heavy ) ) )
+		if module == 'downscale' and ( seconds > args.budget or len( heavy ) > 0 ):
+			print( 'FAIL: import downscale took {:.3f}s ( budget {:.3f}s ) and loaded {}'.format( seconds, args.budget, heavy ) )
+			failed = True
+	print( 'results: {}'.format( rec.save() ) )
+	sys.exit( int( failed ) )
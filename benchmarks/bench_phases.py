@@ -0,0 +1,86 @@
+# -*- coding: utf8 -*-
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # benchmark each phase of DeltaDownscale on synthetic data and store
+# # the timings / peak memory in benchmarks/results/results.jsonl
+# #
+# # usage:
+# #   python benchmarks/bench_phases.py --size small --ncpus 4
+# #   python benchmarks/bench_phases.py --compare <base commit> <head commit>
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def regrid( dd, grid ):
+	''' regrid the first 12 anomalies to the baseline grid in-process, as the workers do '''
+	from downscale import utils
+	anoms = dd.anomalies
+	src_transform = utils.transform_from_latlon( dd.historical.ds.lat, anoms.lon.data )
+	return [ utils.interp_ds( arr, base, src_crs={'init':'epsg:4326'}, src_nodata=None, dst_nodata=None,
+					src_transform=src_transform, grid=grid ) for arr, base in zip( anoms.data[:12], dd.baseline.filelist ) ]
+
+def write( arrs, grid, output_dir ):
+	''' write regridded months with the same profile as utils._run_ds '''
+	import rasterio
+	meta = grid.meta
+	meta.update( compress='lzw', dtype='float32' )
+	for idx, arr in enumerate( arrs ):
+		with rasterio.open( os.path.join( output_dir, 'write_{:02d}.tif'.format( idx + 1 ) ), 'w', **meta ) as out:
+			out.write( arr.astype( np.float32 ), 1 )
+	return output_dir
+
+def run_case( rec, case, ncpus, output_dir, operation, fix_clim ):
+	''' time the phases of one synthetic case '''
+	from downscale import Dataset, Baseline, DeltaDownscale
+
+	variable = case[ 'variable' ]
+	rec.tags[ 'case' ] = '{}_{}'.format( variable, case[ 'size' ] )
+	open_ds = lambda: ( Dataset( case[ 'historical' ], variable, 'SYNTH-GCM', 'historical', project='ar5', units='u', metric='mean' ),
+						Dataset( case[ 'future' ], variable, 'SYNTH-GCM', 'rcp85', project='ar5', units='u', metric='mean' ) )
+	historical, future = rec.run( 'dataset_open', open_ds )
+	baseline = rec.run( 'baseline_open', Baseline, case[ 'baseline' ] )
+	kwargs = dict( downscaling_operation=operation, ncpus=ncpus, src_crs={'init':'epsg:4326'}, src_nodata=None,
+					dst_nodata=None, varname=variable, modelname='SYNTH-GCM' )
+	dd = rec.run( 'delta_init', DeltaDownscale, baseline, case[ 'clim_begin' ], case[ 'clim_end' ], historical, future, **kwargs )
+	if dd is None:
+		return
+	rec.run( 'climatology', dd._calc_climatolgy )
+	rec.run( 'anomalies', dd._calc_anomalies )
+	if fix_clim:
+		rec.run( 'fix_clim', dd._fix_clim, aoi_mask=None, find_bounds=False )
+		rec.run( 'interp_na_fix_clim', dd._interp_na_fix_clim )
+	if np.isnan( dd.ds.data ).any():
+		rec.run( 'interp_na', dd.interp_na )
+	arrs = rec.run( 'regrid', regrid, dd, baseline.grid )
+	if arrs is not None:
+		rec.run( 'write', write, arrs, baseline.grid, output_dir )
+	rec.run( 'downscale', dd.downscale, os.path.join( output_dir, 'downscaled' ) )
+
+if __name__ == '__main__':
+	import os, sys, shutil, tempfile, argparse
+	import numpy as np
+	from downscale import synthetic
+	from harness import Recorder, compare, RESULTS_DIR
+
+	parser = argparse.ArgumentParser( description='benchmark DeltaDownscale phases on synthetic data' )
+	parser.add_argument( "-s", "--size", action='store', dest='size', type=str, default='small', help="one of {}".format( sorted( synthetic.SIZES ) ) )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=4, help="number of cores to use" )
+	parser.add_argument( "-c", "--calendar", action='store', dest='calendar', type=str, default='noleap', help="calendar of the synthetic series" )
+	parser.add_argument( "-r", "--results_dir", action='store', dest='results_dir', type=str, default=RESULTS_DIR, help="where results.jsonl is kept" )
+	parser.add_argument( "--compare", nargs=2, dest='compare', default=None, metavar=( 'BASE', 'HEAD' ), help="compare two stored commits and exit" )
+	args = parser.parse_args()
+
+	if args.compare is not None:
+		out = compare( args.compare[0], args.compare[1], results_dir=args.results_dir )
+		print( out.to_string( index=False ) )
+		sys.exit( int( out.regression.any() ) )
+
+	tmp_dir = tempfile.mkdtemp( prefix='downscale_bench_' )
+	try:
+		rec = Recorder( 'phases', results_dir=args.results_dir, size=args.size, ncpus=args.ncpus, calendar=args.calendar )
+		# global temperature -- additive anomalies
+		case = synthetic.make_case( os.path.join( tmp_dir, 'tas' ), size=args.size, variable='tas', calendar=args.calendar )
+		run_case( rec, case, args.ncpus, os.path.join( tmp_dir, 'tas', 'out' ), 'add', fix_clim=False )
+		# land-only precip -- multiplicative anomalies with the climatology fix and NA interpolation
+		case = synthetic.make_case( os.path.join( tmp_dir, 'pr' ), size=args.size, variable='pr', calendar=args.calendar, land_only=True )
+		run_case( rec, case, args.ncpus, os.path.join( tmp_dir, 'pr', 'out' ), 'mult', fix_clim=True )
+		print( 'results: {}'.format( rec.save() ) )
+	finally:
+		shutil.rmtree( tmp_dir )
@@ -0,0 +1,102 @@
+# -*- coding: utf8 -*-
+# # #
+# Minimal benchmark harness: time and peak memory of a callable, records
+#  tagged with the git commit, appended to a JSON-lines results file so
+#  runs from different commits can be compared.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, gc, json, time, platform, subprocess, tracemalloc
+
+RESULTS_DIR = os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), 'results' )
+
+def git_commit( path=None ):
+	''' ( commit hash, dirty ) of the working tree, or ( None, None ) outside a git repo '''
+	path = path or os.path.dirname( os.path.abspath( __file__ ) )
+	try:
+		commit = subprocess.check_output( [ 'git', 'rev-parse', 'HEAD' ], cwd=path, stderr=subprocess.DEVNULL ).decode().strip()
+		status = subprocess.check_output( [ 'git', 'status', '--porcelain', '--untracked-files=no' ], cwd=path, stderr=subprocess.DEVNULL ).decode()
+		return commit, len( status.strip() ) > 0
+	except Exception:
+		return None, None
+
+def maxrss_mb():
+	''' peak resident set size of this process so far (MB) '''
+	import resource
+	rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+	return rss / 1024.0 if platform.system() != 'Darwin' else rss / 1024.0**2
+
+def measure( func, *args, **kwargs ):
+	'''
+	run func once and return ( result, record ).  The record has seconds, peak_mb ( peak
+	python / numpy heap traced while running ), maxrss_mb, status and error.  Work done in
+	child processes is timed but its memory is not traced.
+	'''
+	gc.collect()
+	tracemalloc.start()
+	tic = time.perf_counter()
+	result, status, error = None, 'ok', None
+	try:
+		result = func( *args, **kwargs )
+	except Exception as e:
+		status, error = 'error', '{}: {}'.format( type( e ).__name__, e )
+	seconds = time.perf_counter() - tic
+	current, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	return result, { 'seconds':seconds, 'peak_mb':peak / 1024.0**2, 'maxrss_mb':maxrss_mb(), 'status':status, 'error':error }
+
+class Recorder( object ):
+	''' collect benchmark records and append them to <results_dir>/results.jsonl '''
+	def __init__( self, suite, results_dir=RESULTS_DIR, **tags ):
+		self.suite = suite
+		self.results_dir = results_dir
+		commit, dirty = git_commit()
+		self.tags = dict( tags, suite=suite, commit=commit, dirty=dirty, host=platform.node(),
+						python=platform.python_version(), timestamp=time.strftime( '%Y-%m-%dT%H:%M:%S' ) )
+		self.records = []
+	def run( self, phase, func, *args, **kwargs ):
+		''' measure func under a phase name, print and keep the record, return the result '''
+		result, record = measure( func, *args, **kwargs )
+		record = dict( self.tags, phase=phase, **record )
+		self.records.append( record )
+		msg = '{:<24} {:>9.3f}s {:>9.1f}MB peak'.format( phase, record[ 'seconds' ], record[ 'peak_mb' ] )
+		if record[ 'status' ] != 'ok':
+			msg = msg + '  ERROR {}'.format( record[ 'error' ] )
+		print( msg )
+		return result
+	def save( self ):
+		''' append the records to the results file '''
+		if not os.path.exists( self.results_dir ):
+			os.makedirs( self.results_dir )
+		fn = os.path.join( self.results_dir, 'results.jsonl' )
+		with open( fn, 'a' ) as f:
+			for record in self.records:
+				f.write( json.dumps( record ) + '\n' )
+		return fn
+
+def load_results( results_dir=RESULTS_DIR ):
+	''' all stored records as a pandas.DataFrame '''
+	import pandas as pd
+	fn = os.path.join( results_dir, 'results.jsonl' )
+	with open( fn ) as f:
+		return pd.DataFrame([ json.loads( line ) for line in f if line.strip() ])
+
+def compare( base, head, results_dir=RESULTS_DIR, threshold=1.2, by=[ 'suite', 'case', 'phase' ] ):
+	'''
+	compare the median seconds / peak_mb of two commits ( prefixes are fine ) per phase.
+	rows with a head / base ratio above threshold are flagged as regressions.
+	'''
+	df = load_results( results_dir )
+	df = df[ df.status == 'ok' ]
+	by = [ i for i in by if i in df.columns ]
+	def pick( commit ):
+		sub = df[ df.commit.fillna( '' ).str.startswith( commit ) ]
+		if len( sub ) == 0:
+			raise ValueError( 'no results for commit {}'.format( commit ) )
+		return sub.groupby( by )[ [ 'seconds', 'peak_mb' ] ].median()
+	out = pick( base ).join( pick( head ), lsuffix='_base', rsuffix='_head', how='inner' )
+	out[ 'seconds_ratio' ] = out.seconds_head / out.seconds_base
+	out[ 'peak_ratio' ] = out.peak_mb_head / out.peak_mb_base
+	out[ 'regression' ] = ( out.seconds_ratio > threshold ) | ( out.peak_ratio > threshold )
+	return out.reset_index()
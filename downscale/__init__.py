@@ -1,5 +1,37 @@
-from downscale.ds import *
-from downscale.dataset import *
-from downscale.ds_minmax import *
-# from downscale.ds_ff import *
-# from downscale.dataset_ff import *
+# -*- coding: utf8 -*-
+# # #
+# The public classes are imported from their modules on first use, so
+#  `import downscale` ( and every worker / short slurm job importing a
+#  submodule ) does not pay for xarray, geopandas, pandas and rasterio
+#  until something needs them.  Submodules ( downscale.utils, ... ) are
+#  also imported on attribute access.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import importlib
+
+# public name: module it lives in ( formerly star-imported here )
+_LAZY = { 'DeltaDownscale':'downscale.ds', 'calc_percentile':'downscale.ds', 'correct_boundary':'downscale.ds',
+		'correct_inner':'downscale.ds', 'correct_values':'downscale.ds', 'find_boundary':'downscale.ds',
+		'Baseline':'downscale.dataset', 'Dataset':'downscale.dataset', 'Mask':'downscale.dataset',
+		'DeltaDownscaleMinMax':'downscale.ds_minmax', 'delta_mm':'downscale.ds_minmax',
+		'GridSpec':'downscale.grid' }
+
+__all__ = sorted( _LAZY )
+
+def __getattr__( name ):
+	if name in _LAZY:
+		value = getattr( importlib.import_module( _LAZY[ name ] ), name )
+	else:
+		try:
+			value = importlib.import_module( __name__ + '.' + name )
+		except ImportError as e:
+			if e.name != __name__ + '.' + name:
+				raise
+			raise AttributeError( "module '{}' has no attribute '{}'".format( __name__, name ) )
+	globals()[ name ] = value
+	return value
+
+def __dir__():
+	return sorted( set( globals() ) | set( _LAZY ) )
@@ -0,0 +1,112 @@
+# -*- coding: utf8 -*-
+# # #
+# Persistent cache of the 12-month historical climatology used by
+#  DeltaDownscale.  Entries are small NetCDF files keyed by the historical
+#  input file hash, the climatology period, the variable / units and the
+#  fix_clim settings, so each scenario run of a model / variable reads the
+#  cached climatology instead of re-reading and concatenating 1860-2005.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json, hashlib
+
+# content hashes of the historical inputs -- ( path, size, mtime ) -> sha256, per process
+_HASHES = {}
+
+def input_hash( fn ):
+	''' sha256 of a file's content, computed once per process for an unchanged file '''
+	from downscale.diff import file_hash
+	st = os.stat( fn )
+	key = ( os.path.abspath( fn ), st.st_size, st.st_mtime_ns )
+	if key not in _HASHES:
+		_HASHES[ key ] = file_hash( fn )
+	return _HASHES[ key ]
+
+class CachedClimatology( object ):
+	''' one cache entry -- a NetCDF path and the key fields it was built from '''
+	def __init__( self, filename, key ):
+		self.filename = filename
+		self.key = key
+	def exists( self ):
+		return os.path.exists( self.filename )
+	def load( self ):
+		''' the cached climatology as an xarray.DataArray ( month, lat, lon ), loaded into memory '''
+		import xarray as xr
+		with xr.open_dataarray( self.filename ) as da:
+			return da.load()
+	def save( self, climatology ):
+		''' write the climatology ( xarray.DataArray grouped by month ) with the key in its attributes '''
+		dirname = os.path.dirname( self.filename )
+		try:
+			if dirname != '' and not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+		da = climatology.copy()
+		da.attrs.update( climatology_key=json.dumps( self.key, sort_keys=True ) )
+		# write next to the entry and move into place so concurrent jobs never read a partial file
+		tmp_fn = '{}.{}.part'.format( self.filename, os.getpid() )
+		da.to_netcdf( tmp_fn, mode='w' )
+		os.replace( tmp_fn, self.filename )
+		return self.filename
+	def __repr__( self ):
+		return 'CachedClimatology( {} )'.format( self.filename )
+
+def climatology_entry( cache, historical_fn, clim_begin, clim_end, variable, units=None, fix_clim=False, find_bounds=False,
+						interp=False, level=None, crop=None, grid=None, aoi_mask=None ):
+	'''
+	the cache entry of a DeltaDownscale climatology -- the one place its key is built, so a run script
+	can look the entry up ( i.e. to skip reading the historical series ) under the key the run would use.
+
+	ARGUMENTS:
+	----------
+	cache = [str/downscale.climcache.ClimatologyCache] cache ( directory ) to key the entry in.
+	historical_fn, clim_begin, clim_end, variable, units = see ClimatologyCache.entry
+	fix_clim, find_bounds, interp, crop = DeltaDownscale settings of the run.
+	level = level of the historical series ( downscale.Dataset.level ). default:None
+	grid = [downscale.GridSpec] baseline grid -- keys cropped runs only. default:None
+	aoi_mask = [str/downscale.Mask] aoi shapefile ( or Mask of it ) fix_clim computes its percentiles
+		over. default:None
+
+	RETURNS:
+	--------
+	CachedClimatology
+	'''
+	if isinstance( cache, str ):
+		cache = ClimatologyCache( cache )
+	settings = dict( fix_clim=fix_clim, find_bounds=find_bounds, interp=interp, level=level, crop=crop )
+	if crop is not None:
+		# the cropped footprint depends on the baseline grid as well as the halo
+		settings.update( grid=grid.signature )
+	if fix_clim and aoi_mask is not None:
+		# only the fixes read the aoi
+		settings.update( aoi_mask=getattr( aoi_mask, 'aoi', aoi_mask ) )
+	return cache.entry( historical_fn, clim_begin, clim_end, variable, units=units, **settings )
+
+class ClimatologyCache( object ):
+	''' a directory of CachedClimatology entries '''
+	def __init__( self, cache_dir ):
+		self.cache_dir = cache_dir
+	def entry( self, historical_fn, clim_begin, clim_end, variable, units=None, **settings ):
+		'''
+		the cache entry for a climatology.
+
+		ARGUMENTS:
+		----------
+		historical_fn = [str] path to the historical NetCDF the climatology is computed from.
+		clim_begin, clim_end = [str] climatology period ( i.e. '1961', '1990' )
+		variable = [str] variable name
+		units = [str] units of the series after any in-memory conversion ( i.e. 'C' from 'K' ). default:None
+		settings = anything else that changes the climatology ( i.e. fix_clim=True, find_bounds=False,
+			aoi_mask=<path> ).  Must be JSON serializable.
+
+		RETURNS:
+		--------
+		CachedClimatology
+		'''
+		key = dict( settings, historical=input_hash( historical_fn ), clim_begin=str( clim_begin ),
+					clim_end=str( clim_end ), variable=variable, units=units )
+		digest = hashlib.sha1( json.dumps( key, sort_keys=True, default=str ).encode( 'utf-8' ) ).hexdigest()[:16]
+		basename = '_'.join([ variable, str( clim_begin ), str( clim_end ), digest ]) + '.nc'
+		return CachedClimatology( os.path.join( self.cache_dir, basename ), key )
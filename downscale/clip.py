@@ -0,0 +1,260 @@
+# -*- coding: utf8 -*-
+# # #
+# Crop / clip rasters to an area of interest.  The cutline is read and
+#  rasterized once into a window + mask (on the source grid, or on a
+#  target grid when reprojecting), then each file only reads that window,
+#  applies the mask in memory and writes the result -- no per-file
+#  gdalwarp -cutline -crop_to_cutline subprocess.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, time
+import numpy as np
+
+class ClipPlan( object ):
+	'''
+	the source window to read, the output grid and the output mask for
+	clipping every raster on a common source grid to a cutline.
+	'''
+	def __init__( self, src_grid, geometries, dst_crs=None, resolution=None, all_touched=False, resampling='nearest', tap=True ):
+		'''
+		ARGUMENTS:
+		----------
+		src_grid = [downscale.GridSpec] grid of the rasters being clipped.
+		geometries = [list] of shapely geometries of the cutline in src_grid.crs
+			( or dst_crs when given ).
+		dst_crs = [str/dict/CRS] reproject to this crs.  default:None (the source crs)
+		resolution = [float] output resolution.  If the crs or resolution differ from the source, or
+			tap is set and the source pixel edges are not on multiples of it, the data are warped to a grid
+			aligned to multiples of it (gdalwarp -tr resolution resolution -tap), otherwise the output is a
+			window of the source grid. default:None (a window of the source grid)
+		all_touched = [bool] keep all cells touched by the cutline (CUTLINE_ALL_TOUCHED=TRUE). default:False
+		resampling = [str] rasterio.warp.Resampling name used when reprojecting. default:'nearest'
+		tap = [bool] with a resolution, keep the output pixel edges on multiples of it even when that
+			means resampling a same-resolution source ( i.e. the AKCAN 2km grid, whose origin is not on
+			multiples of 2000m ). False takes a window of such a source -- shifted from gdalwarp -tap
+			outputs. default:True
+		'''
+		from rasterio.crs import CRS
+		from rasterio.features import geometry_mask
+
+		self.src_grid = src_grid
+		self.resampling = resampling
+		dst_crs = src_grid.crs if dst_crs is None else CRS.from_user_input( dst_crs )
+		self.reproject = dst_crs != src_grid.crs
+		if resolution is not None:
+			self.reproject = self.reproject or resolution != abs( src_grid.transform.a ) or \
+							( tap and not self._on_multiples( src_grid.transform, resolution ) )
+		bounds = self._bounds( geometries )
+		if self.reproject:
+			self.dst_crs = dst_crs
+			if resolution is None:
+				resolution = abs( src_grid.transform.a )
+			self.dst_transform, self.dst_shape = self._aligned( bounds, resolution )
+			self.window = self._source_window()
+		else:
+			self.dst_crs = src_grid.crs
+			self.window = self._window( bounds )
+			self.dst_transform = self.window_transform
+			self.dst_shape = ( int( self.window.height ), int( self.window.width ) )
+		self.mask = geometry_mask( geometries, out_shape=self.dst_shape, transform=self.dst_transform,
+									all_touched=all_touched, invert=True )
+	@staticmethod
+	def _bounds( geometries ):
+		''' [hidden] ( left, bottom, right, top ) of a list of geometries '''
+		bounds = np.array([ geom.bounds for geom in geometries ])
+		return bounds[:,0].min(), bounds[:,1].min(), bounds[:,2].max(), bounds[:,3].max()
+	@staticmethod
+	def _on_multiples( transform, resolution ):
+		''' [hidden] are the pixel edges of a grid on multiples of resolution '''
+		return all([ np.isclose( value / resolution, np.round( value / resolution ), rtol=0, atol=1e-6 )
+					for value in ( transform.c, transform.f ) ])
+	@staticmethod
+	def _aligned( bounds, resolution ):
+		''' [hidden] transform and shape of a grid covering bounds with pixel edges on multiples of resolution '''
+		from affine import Affine
+		left, bottom, right, top = bounds
+		left = np.floor( left / resolution ) * resolution
+		bottom = np.floor( bottom / resolution ) * resolution
+		right = np.ceil( right / resolution ) * resolution
+		top = np.ceil( top / resolution ) * resolution
+		shape = ( int( round( ( top - bottom ) / resolution ) ), int( round( ( right - left ) / resolution ) ) )
+		return Affine( resolution, 0.0, left, 0.0, -resolution, top ), shape
+	def _window( self, bounds, pad=0 ):
+		''' [hidden] source window covering bounds, rounded outward to whole pixels and clipped to the grid '''
+		from rasterio.windows import from_bounds, Window
+		win = from_bounds( *bounds, transform=self.src_grid.transform )
+		col_off = max( int( np.floor( win.col_off ) ) - pad, 0 )
+		row_off = max( int( np.floor( win.row_off ) ) - pad, 0 )
+		col_end = min( int( np.ceil( win.col_off + win.width ) ) + pad, self.src_grid.width )
+		row_end = min( int( np.ceil( win.row_off + win.height ) ) + pad, self.src_grid.height )
+		if col_end <= col_off or row_end <= row_off:
+			raise ValueError( 'cutline does not overlap the source grid' )
+		return Window( col_off, row_off, col_end - col_off, row_end - row_off )
+	def _source_window( self ):
+		''' [hidden] source window covering the (reprojected) output grid plus a small halo for resampling '''
+		from rasterio.warp import transform_bounds
+		from rasterio.transform import array_bounds
+		bounds = array_bounds( self.dst_shape[0], self.dst_shape[1], self.dst_transform )
+		bounds = transform_bounds( self.dst_crs, self.src_grid.crs, *bounds, densify_pts=21 )
+		return self._window( bounds, pad=2 )
+	@property
+	def window_transform( self ):
+		''' affine transform of the source window '''
+		from rasterio.windows import transform
+		return transform( self.window, self.src_grid.transform )
+	@classmethod
+	def from_shapefile( cls, shp_fn, template_fn, dst_crs=None, resolution=None, all_touched=False, resampling='nearest', sidecar=None, tap=True ):
+		'''
+		build a plan from a cutline shapefile and a template raster on the source grid.
+
+		ARGUMENTS:
+		----------
+		shp_fn = [str/geopandas.GeoDataFrame] cutline polygons.  Reprojected as needed.
+		template_fn = [str] any raster on the source grid.
+		sidecar = [str] GridSpec sidecar for the template (see GridSpec.from_raster). default:None
+		see ClipPlan for the other arguments.
+		'''
+		import geopandas as gpd
+		from downscale.grid import GridSpec
+
+		src_grid = GridSpec.from_raster( template_fn, sidecar=sidecar )
+		gdf = gpd.read_file( shp_fn ) if isinstance( shp_fn, str ) else shp_fn
+		crs = dst_crs if dst_crs is not None else src_grid.crs
+		if gdf.crs is not None:
+			from rasterio.crs import CRS
+			gdf = gdf.to_crs( CRS.from_user_input( crs ).to_wkt() )
+		return cls( src_grid, list( gdf.geometry ), dst_crs=dst_crs, resolution=resolution,
+					all_touched=all_touched, resampling=resampling, tap=tap )
+	def clip( self, arr, nodata ):
+		'''
+		clip a 2-D array read from the source window to the output grid.
+
+		ARGUMENTS:
+		----------
+		arr = [numpy.ndarray] 2-D array of the source window ( see ClipPlan.window )
+		nodata = [float] nodata value of the source and output. Cells outside the cutline get it.
+
+		RETURNS:
+		--------
+		2-D numpy.ndarray on the output grid
+		'''
+		if self.reproject:
+			from rasterio.warp import reproject, Resampling
+			out = np.full( self.dst_shape, nodata, dtype=arr.dtype )
+			reproject( arr, out, src_transform=self.window_transform, src_crs=self.src_grid.crs,
+						dst_transform=self.dst_transform, dst_crs=self.dst_crs, src_nodata=nodata,
+						dst_nodata=nodata, resampling=getattr( Resampling, self.resampling ) )
+		else:
+			out = arr.copy()
+		out[ ~self.mask ] = nodata
+		return out
+	def clip_file( self, fn, out_fn, nodata=None ):
+		'''
+		read only the plan window of a raster, clip it in memory and write it once.
+
+		ARGUMENTS:
+		----------
+		fn = [str] input raster on the source grid
+		out_fn = [str] output raster
+		nodata = [float] nodata value to use. default:None (the input nodata, else the grid nodata)
+
+		Scaled-integer inputs ( downscale.encoding ) are clipped as physical values and written with
+		the same encoding ( dtype / scale / offset tags, nodata as given ).
+		'''
+		import rasterio
+		from downscale.encoding import Encoding, read_band
+
+		with rasterio.open( fn ) as rst:
+			if rst.shape != self.src_grid.shape or not rst.transform.almost_equals( self.src_grid.transform ):
+				raise ValueError( '{} is not on the plan source grid'.format( fn ) )
+			encoding = Encoding.from_raster( rst )
+			arr = read_band( rst, window=self.window )
+			meta = rst.meta.copy()
+		if nodata is None:
+			nodata = meta[ 'nodata' ] if meta[ 'nodata' ] is not None else self.src_grid.nodata
+		if nodata is None:
+			raise ValueError( 'no nodata value for {}'.format( fn ) )
+		if encoding is None:
+			# the given nodata is missing too, as gdalwarp -srcnodata
+			arr[ arr == nodata ] = np.nan
+		out_arr = self.clip( arr, np.nan )
+
+		meta.update( height=self.dst_shape[0], width=self.dst_shape[1], crs=self.dst_crs,
+					transform=self.dst_transform, nodata=nodata, compress='lzw' )
+		if encoding is not None:
+			encoding = Encoding( encoding.dtype, encoding.scale_factor, encoding.add_offset, nodata=nodata )
+			meta = encoding.meta( meta )
+		dirname = os.path.dirname( out_fn )
+		try:
+			if not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+		with rasterio.open( out_fn, 'w', **meta ) as out:
+			if encoding is not None:
+				encoding.write( out, out_arr )
+			else:
+				out_arr[ np.isnan( out_arr ) ] = nodata
+				out.write( out_arr.astype( meta[ 'dtype' ] ), 1 )
+		return out_fn
+
+# plan for the worker processes -- set once per worker by the pool initializer
+_PLAN = None
+
+def _init_worker( plan ):
+	''' [hidden] share the ClipPlan with each worker once rather than per task '''
+	global _PLAN
+	_PLAN = plan
+
+def _clip_file( x ):
+	''' [hidden] unpack ( fn, out_fn, nodata ) for pool.imap_unordered '''
+	fn, out_fn, nodata = x
+	return _PLAN.clip_file( fn, out_fn, nodata=nodata )
+
+def clip_files( plan, jobs, ncpus=16, threads=False, nodata=None, report_every=500 ):
+	'''
+	clip many files with one plan in a process ( or thread ) pool.
+
+	ARGUMENTS:
+	----------
+	plan = [downscale.clip.ClipPlan] the clip plan
+	jobs = [list] of ( input filename, output filename ) tuples
+	ncpus = [int] number of workers. default:16
+	threads = [bool] use a thread pool (GDAL I/O releases the GIL) rather than processes. default:False
+	nodata = [float] output nodata value. default:None (each input's nodata)
+	report_every = [int] print progress and throughput every n files. default:500
+
+	RETURNS:
+	--------
+	list of output filenames written
+	'''
+	args = [ ( fn, out_fn, nodata ) for fn, out_fn in jobs ]
+	if threads:
+		from multiprocessing.pool import ThreadPool
+		_init_worker( plan )
+		pool = ThreadPool( ncpus )
+	elif ncpus > 1:
+		import multiprocessing as mp
+		pool = mp.Pool( ncpus, initializer=_init_worker, initargs=( plan, ) )
+	else:
+		_init_worker( plan )
+		pool = None
+
+	tic = time.time()
+	results = pool.imap_unordered( _clip_file, args, chunksize=max( 1, len( args ) // ( ncpus * 4 ) ) ) if pool is not None else map( _clip_file, args )
+	out = []
+	try:
+		for out_fn in results:
+			out.append( out_fn )
+			if report_every and len( out ) % report_every == 0:
+				elapsed = time.time() - tic
+				print( 'clipped {} / {} files ( {:.1f} files/s )'.format( len( out ), len( args ), len( out ) / elapsed ) )
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	elapsed = time.time() - tic
+	print( 'clipped {} files in {:.1f}s ( {:.1f} files/s )'.format( len( out ), elapsed, len( out ) / max( elapsed, 1e-9 ) ) )
+	return out
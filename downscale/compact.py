@@ -0,0 +1,198 @@
+# -*- coding: utf8 -*-
+# # #
+# Valid-cell ( compact ) execution of the downscaling loop.  AKCAN and L48
+#  baselines are mostly ocean / outside the AOI, so the baseline months,
+#  the regrid weights and the outputs are kept as 1-D vectors over
+#  GridSpec.valid_index.  The operation, rounding and post_downscale
+#  functions run on those vectors only and are scattered back into the
+#  full rectangle just before writing.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import numpy as np
+
+class RegridWeights( object ):
+	'''
+	source cells and weights of the valid cells of a destination grid, from a regular
+	source grid ( i.e. the model anomalies on src_transform ).  Bilinear follows GDAL:
+	pixel centres, the 4 surrounding source cells, renormalized over the cells that
+	are not nodata.  Nearest takes the source pixel containing the cell centre.
+	'''
+	methods = ( 'bilinear', 'nearest' )
+	def __init__( self, grid, src_transform, src_shape, src_crs='EPSG:4326', method='bilinear', src_nodata=None,
+					index=None, weights=None ):
+		'''
+		ARGUMENTS:
+		----------
+		grid = [downscale.GridSpec] destination grid.  Its mask marks the cells computed.
+		src_transform = [affine.Affine] transform of the source arrays
+		src_shape = [tuple] ( rows, cols ) of the source arrays
+		src_crs = [str/dict/rasterio.crs.CRS] crs of the source arrays. default:'EPSG:4326'
+		method = [str] one of 'bilinear', 'nearest'. default:'bilinear'
+		src_nodata = [float] source value treated as missing ( NaN always is ). default:None
+		index, weights = [numpy.ndarray] precomputed ( n_valid, k ) flat source index and weights.
+			default:None ( computed here )
+		'''
+		from affine import Affine
+		from rasterio.crs import CRS
+		if method not in self.methods:
+			raise ValueError( 'unsupported method {} -- one of {}'.format( method, self.methods ) )
+		self.grid = grid
+		self.src_transform = Affine( *tuple( src_transform )[:6] )
+		self.src_shape = tuple([ int( i ) for i in src_shape ])
+		self.src_crs = CRS.from_user_input( src_crs )
+		self.method = method
+		self.src_nodata = src_nodata
+		if index is None or weights is None:
+			index, weights = self._plan()
+		self.index = np.asarray( index )
+		self.weights = np.asarray( weights )
+	def _src_pixels( self ):
+		''' [hidden] fractional source ( col, row ) of the valid destination pixel centres '''
+		from affine import Affine
+		grid = self.grid
+		dst_rows, dst_cols = np.unravel_index( grid.valid_index, grid.shape )
+		xs, ys = ( grid.transform * Affine.translation( 0.5, 0.5 ) ) * ( dst_cols, dst_rows )
+		xs, ys = np.asarray( xs, dtype=np.float64 ), np.asarray( ys, dtype=np.float64 )
+		if self.src_crs != grid.crs:
+			from pyproj import Transformer
+			transformer = Transformer.from_crs( grid.crs, self.src_crs, always_xy=True )
+			xs, ys = transformer.transform( xs, ys )
+			xs, ys = np.asarray( xs ), np.asarray( ys )
+		if self.src_crs.is_geographic:
+			# longitudes into the source range ( 0-360, -180-180 or a cropped window past either )
+			west = self.src_transform.c
+			xs = west + np.mod( xs - west, 360.0 )
+		cols, rows = ~self.src_transform * ( xs, ys )
+		return np.asarray( cols ), np.asarray( rows )
+	def _plan( self ):
+		''' [hidden] ( n_valid, k ) flat source index and weights '''
+		nrows, ncols = self.src_shape
+		cols, rows = self._src_pixels()
+		wrap = self.src_crs.is_geographic and abs( abs( self.src_transform.a ) * ncols - 360.0 ) < 1e-6
+		if self.method == 'nearest':
+			rr = np.floor( rows ).astype( np.int64 )[ :, None ]
+			cc = np.floor( cols ).astype( np.int64 )[ :, None ]
+			ww = np.ones( rr.shape, dtype=np.float32 )
+		else:
+			x, y = cols - 0.5, rows - 0.5
+			c0, r0 = np.floor( x ), np.floor( y )
+			fx, fy = ( x - c0 )[ :, None ], ( y - r0 )[ :, None ]
+			c0, r0 = c0.astype( np.int64 )[ :, None ], r0.astype( np.int64 )[ :, None ]
+			rr = np.hstack([ r0, r0, r0 + 1, r0 + 1 ])
+			cc = np.hstack([ c0, c0 + 1, c0, c0 + 1 ])
+			ww = np.hstack([ ( 1 - fx ) * ( 1 - fy ), fx * ( 1 - fy ), ( 1 - fx ) * fy, fx * fy ]).astype( np.float32 )
+		if wrap:
+			cc = np.mod( cc, ncols )
+		inside = ( rr >= 0 ) & ( rr < nrows ) & ( cc >= 0 ) & ( cc < ncols )
+		ww = np.where( inside, ww, 0 ).astype( np.float32 )
+		index = np.where( inside, rr * ncols + cc, 0 )
+		return index, ww
+	def apply( self, arr ):
+		'''
+		regrid a 2-D source array to a 1-D float32 vector over grid.valid_index -- NaN where no
+		source cell has data.
+		'''
+		arr = np.asarray( arr )
+		if arr.shape != self.src_shape:
+			raise ValueError( 'array shape {} does not match the source shape {}'.format( arr.shape, self.src_shape ) )
+		values = arr.ravel()[ self.index ].astype( np.float32 )
+		ok = np.isfinite( values ) & ( self.weights > 0 )
+		if self.src_nodata is not None:
+			ok &= values != self.src_nodata
+		w = np.where( ok, self.weights, 0 )
+		total = w.sum( axis=1 )
+		with np.errstate( invalid='ignore', divide='ignore' ):
+			out = ( w * np.where( ok, values, 0 ) ).sum( axis=1 ) / total
+		out[ total == 0 ] = np.nan
+		return out.astype( np.float32 )
+	@property
+	def nbytes( self ):
+		return self.index.nbytes + self.weights.nbytes
+
+# grid, weights and regrid function of the worker processes -- set once per worker by the pool initializer
+_GRID = None
+_WEIGHTS = None
+_F = None
+_BASE = {}
+
+def _init_worker( grid, weights=None, f=None ):
+	''' [hidden] share the grid / weights with each worker once rather than per task '''
+	global _GRID, _WEIGHTS, _F, _BASE
+	_GRID, _WEIGHTS, _F = grid, weights, f
+	_BASE = {}
+
+def _base_vector( fn ):
+	''' [hidden] valid cells of a baseline month, read once per worker ( the 12 months repeat ) '''
+	if fn not in _BASE:
+		import rasterio
+		with rasterio.open( fn ) as rst:
+			_BASE[ fn ] = _GRID.gather( rst.read( 1 ) )
+	return _BASE[ fn ]
+
+def _run_ds( d, operation_switch, anom=False, encoding=None ):
+	'''
+	[hidden] compact counterpart of utils._run_ds -- operation, rounding and post_downscale_function
+	run on the valid-cell vectors and the result is scattered into the grid only to write it.
+	'''
+	from downscale.utils import _write_ds
+	grid = _GRID
+	base = _base_vector( d[ 'base' ] )
+	if _WEIGHTS is not None:
+		interped = _WEIGHTS.apply( d[ 'anom' ] )
+	else:
+		interped = grid.gather( _F( **d ) )
+
+	output_arr = operation_switch[ d[ 'downscaling_operation' ] ]( base, interped )
+	post_downscale_function = d[ 'post_downscale_function' ]
+	if post_downscale_function != None:
+		output_arr = post_downscale_function( output_arr )
+		if hasattr( output_arr, 'mask'):
+			output_arr = output_arr.data
+
+	meta = grid.meta
+	meta.update( compress='lzw' )
+	nodata = meta[ 'nodata' ] if meta[ 'nodata' ] is not None else np.nan
+	if anom == True:
+		interped = grid.scatter( interped, fill=nodata )
+	return _write_ds( d, interped, grid.scatter( output_arr, fill=nodata ), meta, anom=anom, encoding=encoding )
+
+def downscale_compact( args, grid, operation_switch, weights=None, f=None, anom=False, ncpus=1, encoding=None ):
+	'''
+	run downscale tasks ( the dicts built in DeltaDownscale.downscale ) over the valid cells of the
+	baseline grid only.
+
+	ARGUMENTS:
+	----------
+	args = [list] of task dicts ( anom, base, output_filename, downscaling_operation, post_downscale_function, ... )
+	grid = [downscale.GridSpec] baseline grid -- its mask marks the cells computed ( the nodata of the outputs )
+	operation_switch = [dict] { 'add':utils.add, 'mult':utils.mult }
+	weights = [RegridWeights] regrid straight to the valid cells. default:None ( regrid the full grid with f
+		and gather the valid cells )
+	f = [function] regridding function called with **task, used when weights is None.  Must be picklable.
+	anom = [bool] also write the regridded anomalies. default:False
+	ncpus = [int] number of processes. default:1
+	encoding = [downscale.encoding.Encoding] store the outputs as scaled integers. default:None ( float )
+
+	post_downscale_function must be elementwise ( i.e. np.round ) -- it is called on 1-D vectors.
+
+	RETURNS:
+	--------
+	list of output filenames written
+	'''
+	import multiprocessing as mp
+	from functools import partial
+
+	if weights is None and f is None:
+		raise ValueError( 'one of weights or f is required' )
+	run = partial( _run_ds, operation_switch=operation_switch, anom=anom, encoding=encoding )
+	if ncpus > 1:
+		pool = mp.Pool( ncpus, initializer=_init_worker, initargs=( grid, weights, f ) )
+		out = pool.map( run, args, chunksize=max( 1, len( args ) // ( ncpus * 4 ) ) )
+		pool.close()
+		pool.join()
+	else:
+		_init_worker( grid, weights, f )
+		out = [ run( arg ) for arg in args ]
+	return out
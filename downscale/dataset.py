@@ -15,7 +15,7 @@ class Baseline( object ):
 	'''
 	simple class to store the baseline arr rasters
 	'''
-	def __init__( self, filelist ):
+	def __init__( self, filelist, sidecar=None ):
 		'''
 		class for the baseline arr used as the template climatology
 		to downscale the anomalies of the series to.
@@ -24,9 +24,13 @@ class Baseline( object ):
 		----------
 		filelist = [list] of str paths to each of the 12 monthly climatology files.
 				* must be in chronological order jan-dec.
+		sidecar = [str] path to a GridSpec sidecar (.npz) for the baseline grid.  
+				loaded if it exists, otherwise written there. default:None
 		'''
+		from downscale.grid import GridSpec
 		self.filelist = filelist
-		self.meta = rasterio.open( self.filelist[0] ).meta
+		self.grid = GridSpec.from_raster( self.filelist[0], sidecar=sidecar )
+		self.meta = self.grid.meta
 		self.arrlist = ( rasterio.open( fn ).read( 1 ) for fn in self.filelist )
 	def repeat( self, n ):
 		out = []
@@ -52,37 +56,41 @@ class Mask( object ):
 		self.ds = ds
 		self.mask_value = mask_value
 		self.fill_value = fill_value
+		self._grid = None
 	@property
 	def mask( self, latitude='lat', longitude='lon', all_touched=True ):
 		''' make a mask from the aoi shapefile and the low-res input NetCDF '''
 		import geopandas as gpd
-		from downscale import utils
+		from rasterio import features
 
 		gdf = gpd.read_file( self.aoi )
 		shapes = [ (geom, self.mask_value) for geom in gdf.geometry ]
-		ds = self.ds.ds # grab the ds sub-object from the Dataset object
-		coords = ds.coords # get lats and lons as a coords dict from xarray
-		return utils.rasterize( shapes, coords=coords, latitude=latitude, longitude=longitude, fill=self.fill_value, **{'all_touched':all_touched} ).data
+		return features.rasterize( shapes, out_shape=self.grid.shape, fill=self.fill_value, 
+						transform=self.grid.transform, dtype=float, all_touched=all_touched )
+	@property
+	def grid( self ):
+		''' GridSpec of the low-res input ds -- computed once '''
+		if self._grid is None:
+			from downscale.grid import GridSpec
+			ds = self.ds.ds # grab the ds sub-object from the Dataset object
+			self._grid = GridSpec.from_latlon( ds.lat, ds.lon )
+		return self._grid
 	def to_gtiff( self, output_filename ):
 		''' write the mask to geotiff given an output_filename '''
-		meta = {'compress':'lzw'}
-		count, height, width = self.ds.ds[ self.ds.variable ].shape
-		affine = self.ds._calc_affine()
-		meta.update( affine=affine, height=height, width=width, count=1, dtype='int16', driver='GTiff' )
+		meta = self.grid.meta
+		meta.update( compress='lzw', dtype='int16' )
 		with rasterio.open( output_filename, 'w', **meta ) as out:
 			out.write( self.mask.astype( np.int16 ), 1 )
 	def _dump_out_testfile( self, output_filename ):
 		''' hidden function to dump out a single representative raster from the NetCDF for comparison '''
-		meta = {'compress':'lzw'}
-		count, height, width = self.ds.ds[ self.ds.variable ].shape
-		affine = self.ds._calc_affine()
-		meta.update( affine=affine, height=height, width=width, count=1, dtype='float', driver='GTiff' )
+		meta = self.grid.meta
+		meta.update( compress='lzw', dtype='float64' )
 		with rasterio.open( output_filename, 'w', **meta ) as out:
 			out.write( self.ds.ds[self.ds.variable][0], 1 )
 
 class Dataset( object ):
 	def __init__( self, fn, variable, model, scenario, project=None, units=None, metric=None, 
-					interp=False, ncpus=32,	method='linear', begin=None, end=None, level=None, level_name=None, *args, **kwargs ):
+					interp=False, ncpus=32,	method='linear', begin=None, end=None, level=None, level_name=None, dtype='float32', *args, **kwargs ):
 		'''
 		build a dataset object to store the NetCDF low-res data for downscaling.
 		
@@ -101,6 +109,8 @@ class Dataset( object ):
 		method = [ str ] type of interpolation to use. hardwired to 'linear' currently
 		begin = year series begins
 		end = year series ends
+		dtype = [str/numpy.dtype] dtype the variable is held and computed in. None keeps the dtype it
+					decodes to ( float64 for packed or double files ). default:'float32'
 
 		'''
 		import xarray as xr
@@ -164,6 +174,11 @@ class Dataset( object ):
 		else:
 			print('4')
 			self.ds = self.ds
+
+		# hold the series in the compute dtype -- before the flip copies it
+		if dtype is not None and self.ds[ self.variable ].dtype != np.dtype( dtype ):
+			self.ds[ self.variable ] = self.ds[ self.variable ].astype( dtype )
+		self.dtype = self.ds[ self.variable ].dtype
 		
 		# update the lats and data to be NorthUp if necessary
 		self._northup()
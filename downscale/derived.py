@@ -0,0 +1,200 @@
+# -*- coding: utf8 -*-
+# # #
+# Derived-variable graph: declare products as functions of other
+#  variables ( i.e. vap = f(tas, hurs), rsds = g(girr, clt) ) and run
+#  them for a (model, scenario, month) so each input raster is read
+#  once and every dependent product is emitted from that read.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+from functools import partial
+
+class Product( object ):
+	'''
+	a derived variable computed from other variables (inputs) that are either
+	raw rasters on disk (sources) or other products.
+	'''
+	def __init__( self, name, inputs, func, round_func=None, encoding=None ):
+		'''
+		ARGUMENTS:
+		----------
+		name = [str] name of the derived variable. i.e. 'vap'
+		inputs = [list] of str names of the variables func takes, in positional order.
+		func = [function] taking the input arrays ( np.nan as nodata ) and returning an array.
+		round_func = [function] applied to the output before writing. default:None
+		encoding = [downscale.encoding.Encoding] store the output as scaled integers matching the
+			rounding ( i.e. scale_factor=0.01 for 2 decimals ). default:None ( float32 )
+		'''
+		self.name = name
+		self.inputs = list( inputs )
+		self.func = func
+		self.round_func = round_func
+		self.encoding = encoding
+
+def vap( tas, hurs ):
+	''' vapor pressure (hPa) from tas (C) and relative humidity (pct) '''
+	esa = 6.112 * np.exp( 17.62 * tas / (243.12 + tas) )
+	return (hurs * esa) / 100
+
+def nirr( girr, clt ):
+	'''
+	net irradiance through the clouds from girr and cloud cover (pct)
+	c++ version from Dave: nirr = girr * (0.251 + (0.509*(1.0 - clds/100.0)))
+	'''
+	return girr * ( 0.251 + ( 0.509 * ( 1.0 - clt/100.0 ) ) )
+
+VAP = Product( 'vap', [ 'tas', 'hurs' ], vap, round_func=partial( np.around, decimals=2 ) )
+NIRR = Product( 'rsds', [ 'girr', 'clt' ], nirr )
+
+class DerivedGraph( object ):
+	'''
+	a DAG of Products.  Anything a product needs that is not itself a product
+	is a source variable read from disk.
+	'''
+	def __init__( self, products, grid=None ):
+		'''
+		ARGUMENTS:
+		----------
+		products = [list] of downscale.derived.Product objects
+		grid = [downscale.GridSpec] grid shared by all inputs.  If given its mask and meta
+			are used for the outputs rather than each sources own. default:None
+		'''
+		self.products = { p.name:p for p in products }
+		self.grid = grid
+		self.order = self._toposort()
+	def _toposort( self ):
+		''' order products so each comes after the products it depends on '''
+		order = []
+		visiting = set()
+		def visit( name ):
+			if name in order or name not in self.products:
+				return
+			if name in visiting:
+				raise ValueError( 'cycle in derived graph at: {}'.format( name ) )
+			visiting.add( name )
+			for i in self.products[ name ].inputs:
+				visit( i )
+			visiting.remove( name )
+			order.append( name )
+		for name in sorted( self.products.keys() ):
+			visit( name )
+		return order
+	def required( self, outputs ):
+		''' the products needed (in run order) to make the requested outputs '''
+		needed = set()
+		def walk( name ):
+			if name in self.products and name not in needed:
+				needed.add( name )
+				for i in self.products[ name ].inputs:
+					walk( i )
+		for name in outputs:
+			if name not in self.products:
+				raise ValueError( 'unknown product: {}'.format( name ) )
+			walk( name )
+		return [ name for name in self.order if name in needed ]
+	@property
+	def sources( self ):
+		''' names of the variables that must be read from disk '''
+		return sorted( set([ i for p in self.products.values() for i in p.inputs if i not in self.products ]) )
+	def run_month( self, sources, output_filenames ):
+		'''
+		compute and write the requested products for a single timestep.  Each
+		source raster is read once and kept in memory only until its last consumer
+		has run.  Intermediate products are cached the same way.
+
+		ARGUMENTS:
+		----------
+		sources = [dict] of source variable name to raster path for this timestep.
+		output_filenames = [dict] of product name to output path. Only these are written,
+			but any intermediates they need are computed.
+
+		RETURNS:
+		--------
+		dict of product name to output filename written
+		'''
+		import rasterio
+		from downscale.encoding import read_band
+
+		order = self.required( output_filenames.keys() )
+
+		# how many products still need each variable -- drop it from the cache at zero
+		consumers = {}
+		for name in order:
+			for i in self.products[ name ].inputs:
+				consumers[ i ] = consumers.get( i, 0 ) + 1
+
+		missing = [ i for i in consumers if i not in self.products and i not in sources ]
+		if len( missing ) > 0:
+			raise ValueError( 'sources missing variables: {}'.format( missing ) )
+
+		cache = {}
+		masks = {}
+		metas = {}
+		for name in consumers:
+			if name in self.products:
+				continue
+			with rasterio.open( sources[ name ] ) as rst:
+				cache[ name ] = read_band( rst )
+				if self.grid is not None:
+					masks[ name ] = self.grid.mask
+					metas[ name ] = self.grid.meta
+				else:
+					masks[ name ] = rst.read_masks( 1 ) != 0
+					metas[ name ] = rst.meta.copy()
+
+		for name in order:
+			product = self.products[ name ]
+			args = [ cache[ i ] for i in product.inputs ]
+			with np.errstate( all='ignore' ):
+				arr = product.func( *args ).astype( np.float32 )
+				if product.round_func is not None:
+					arr = product.round_func( arr )
+			mask = np.logical_and.reduce([ masks[ i ] for i in product.inputs ])
+			cache[ name ] = arr
+			masks[ name ] = mask
+			metas[ name ] = metas[ product.inputs[0] ]
+
+			if name in output_filenames:
+				meta = metas[ name ].copy()
+				meta.update( compress='lzw', dtype='float32' )
+				out_arr = arr.copy()
+				out_arr[ ~mask ] = meta[ 'nodata' ]
+				output_filename = output_filenames[ name ]
+				dirname = os.path.dirname( output_filename )
+				try:
+					if not os.path.exists( dirname ):
+						os.makedirs( dirname )
+				except:
+					pass
+				if product.encoding is not None:
+					with rasterio.open( output_filename, 'w', **product.encoding.meta( meta ) ) as out:
+						product.encoding.write( out, out_arr, nodata=meta[ 'nodata' ] )
+				else:
+					with rasterio.open( output_filename, 'w', **meta ) as out:
+						out.write( out_arr, 1 )
+
+			# free anything with no remaining consumers
+			for i in product.inputs:
+				consumers[ i ] = consumers[ i ] - 1
+				if consumers[ i ] == 0:
+					del cache[ i ]
+		return output_filenames
+	def run( self, jobs, ncpus=32 ):
+		'''
+		run many timesteps in parallel.
+
+		ARGUMENTS:
+		----------
+		jobs = [list] of ( sources, output_filenames ) dict tuples, one per
+			(model, scenario, month) timestep.  See run_month.
+		ncpus = [int] number of processes. default:32
+
+		RETURNS:
+		--------
+		list of dicts of product name to output filename written
+		'''
+		from pathos.mp_map import mp_map
+		return mp_map( lambda x: self.run_month( *x ), jobs, nproc=ncpus )
@@ -0,0 +1,195 @@
+# -*- coding: utf8 -*-
+# # #
+# Regression diff of two downscaled output trees.  File pairs whose bytes
+#  hash the same are skipped without decoding; the rest are compared
+#  window by window so memory stays bounded, accumulating additive stats
+#  ( count / sum / sum-of-squares of the difference, max-abs, count of
+#  differing cells ) that roll up per variable / month into a report.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, hashlib
+import numpy as np
+
+FIELDS = [ 'count', 'n_diff', 'mask_mismatch', 'max_abs', 'sum', 'sumsq' ]
+
+def file_hash( fn, blocksize=2**24 ):
+	''' sha256 hex digest of a file, read in blocks '''
+	sha = hashlib.sha256()
+	with open( fn, 'rb' ) as f:
+		for block in iter( lambda: f.read( blocksize ), b'' ):
+			sha.update( block )
+	return sha.hexdigest()
+
+def diff_rasters( old_fn, new_fn, atol=0.0, max_rows=256 ):
+	'''
+	compare two single-band rasters on the same grid window by window.
+
+	ARGUMENTS:
+	----------
+	old_fn, new_fn = [str] paths to the rasters to compare.
+	atol = [float] absolute difference above which a cell counts as differing. default:0.0
+	max_rows = [int] rows per read window for striped rasters. see utils.iter_windows. default:256
+
+	RETURNS:
+	--------
+	dict of FIELDS -- count of cells valid in both, n_diff cells differing by more than
+	atol, mask_mismatch cells valid in only one, max_abs, sum and sumsq of ( new - old ).
+	'''
+	import rasterio
+	from downscale.utils import iter_windows
+	from downscale.encoding import read_band
+
+	out = dict( count=0, n_diff=0, mask_mismatch=0, max_abs=0.0, sum=0.0, sumsq=0.0 )
+	with rasterio.open( old_fn ) as old, rasterio.open( new_fn ) as new:
+		if old.shape != new.shape:
+			raise ValueError( 'shape mismatch: {} {} vs {} {}'.format( old_fn, old.shape, new_fn, new.shape ) )
+		for window in iter_windows( old, max_rows=max_rows ):
+			a = read_band( old, window=window, masked=True )
+			b = read_band( new, window=window, masked=True )
+			a_valid = ~np.ma.getmaskarray( a )
+			b_valid = ~np.ma.getmaskarray( b )
+			both = a_valid & b_valid
+			out[ 'mask_mismatch' ] += int( ( a_valid != b_valid ).sum() )
+			if not both.any():
+				continue
+			diff = b.data[ both ].astype( np.float64 ) - a.data[ both ].astype( np.float64 )
+			absdiff = np.abs( diff )
+			out[ 'count' ] += int( both.sum() )
+			out[ 'n_diff' ] += int( ( absdiff > atol ).sum() )
+			out[ 'max_abs' ] = max( out[ 'max_abs' ], float( absdiff.max() ) )
+			out[ 'sum' ] += float( diff.sum() )
+			out[ 'sumsq' ] += float( ( diff * diff ).sum() )
+	return out
+
+def compare_files( old_fn, new_fn, atol=0.0, max_rows=256 ):
+	'''
+	compare one file pair.  Missing files and byte-identical files are reported without
+	decoding any pixels.
+
+	RETURNS:
+	--------
+	dict with status ( 'identical', 'equal', 'different', 'missing_old', 'missing_new', 'error' ),
+	the FIELDS from diff_rasters and an error message if any.
+	'''
+	out = dict( old_fn=old_fn, new_fn=new_fn, status=None, error=None )
+	if not os.path.exists( old_fn ) or not os.path.exists( new_fn ):
+		out[ 'status' ] = 'missing_old' if not os.path.exists( old_fn ) else 'missing_new'
+		return out
+	if os.path.getsize( old_fn ) == os.path.getsize( new_fn ) and file_hash( old_fn ) == file_hash( new_fn ):
+		out[ 'status' ] = 'identical'
+		return out
+	try:
+		stats = diff_rasters( old_fn, new_fn, atol=atol, max_rows=max_rows )
+	except Exception as e:
+		out.update( status='error', error=str( e ) )
+		return out
+	out.update( stats )
+	out[ 'status' ] = 'different' if stats[ 'n_diff' ] > 0 or stats[ 'mask_mismatch' ] > 0 else 'equal'
+	return out
+
+def _compare_files( x ):
+	''' [hidden] unpack args for pool.imap_unordered '''
+	return compare_files( *x )
+
+def pair_files( old_dir, new_dir, ext='.tif' ):
+	''' ( relative path, old path, new path ) for every file under either tree '''
+	rel = set()
+	for base in [ old_dir, new_dir ]:
+		for root, subs, files in os.walk( base ):
+			rel.update([ os.path.relpath( os.path.join( root, fn ), base ) for fn in files if fn.endswith( ext ) ])
+	return [ ( i, os.path.join( old_dir, i ), os.path.join( new_dir, i ) ) for i in sorted( rel ) ]
+
+def diff_trees( old_dir, new_dir, ncpus=16, atol=0.0, ext='.tif', max_rows=256 ):
+	'''
+	compare every raster in two output trees with the same relative layout
+	( i.e. <model>/<scenario>/<variable>/<prefix>_MM_YYYY.tif ).
+
+	ARGUMENTS:
+	----------
+	old_dir, new_dir = [str] base directories of the two trees
+	ncpus = [int] number of processes comparing file pairs. default:16
+	atol = [float] absolute difference above which a cell counts as differing. default:0.0
+	ext = [str] file extension to compare. default:'.tif'
+	max_rows = [int] rows per read window. default:256
+
+	RETURNS:
+	--------
+	pandas.DataFrame with a row per file pair: path, the parsed SNAP filename fields,
+	status, FIELDS, bias, rmse and error.
+	'''
+	import pandas as pd
+	import multiprocessing as mp
+	from downscale.zonal import parse_snap_filename
+
+	pairs = pair_files( old_dir, new_dir, ext=ext )
+	args = [ ( old_fn, new_fn, atol, max_rows ) for rel, old_fn, new_fn in pairs ]
+	if ncpus > 1:
+		pool = mp.Pool( ncpus )
+		out = list( pool.imap_unordered( _compare_files, args, chunksize=max( 1, len( args ) // ( ncpus * 4 ) ) ) )
+		pool.close()
+		pool.join()
+	else:
+		out = [ _compare_files( arg ) for arg in args ]
+
+	df = pd.DataFrame( out, columns=[ 'old_fn', 'new_fn', 'status', 'error' ] + FIELDS )
+	df[ 'path' ] = [ os.path.relpath( fn, old_dir ) for fn in df.old_fn ]
+	parsed = []
+	for fn in df.path:
+		try:
+			parsed.append( parse_snap_filename( fn ) )
+		except ValueError:
+			parsed.append( {} )
+	df = pd.concat( [ pd.DataFrame( parsed, index=df.index ), df ], axis=1 )
+	with np.errstate( invalid='ignore', divide='ignore' ):
+		df[ 'bias' ] = df[ 'sum' ] / df[ 'count' ]
+		df[ 'rmse' ] = np.sqrt( df[ 'sumsq' ] / df[ 'count' ] )
+	return df.sort_values( 'path' ).reset_index( drop=True )
+
+def summarize( df, by=[ 'variable', 'month' ] ):
+	'''
+	roll file-level diffs up to groups ( i.e. per variable / month ).
+
+	RETURNS:
+	--------
+	pandas.DataFrame with files, files_different, files_identical, count, n_diff,
+	mask_mismatch, max_abs, bias and rmse per group.
+	'''
+	df = df.copy()
+	df[ 'files' ] = 1
+	df[ 'files_different' ] = df.status.isin([ 'different', 'missing_old', 'missing_new', 'error' ]).astype( int )
+	df[ 'files_identical' ] = ( df.status == 'identical' ).astype( int )
+	agg = { 'files':'sum', 'files_different':'sum', 'files_identical':'sum', 'count':'sum', 'n_diff':'sum',
+			'mask_mismatch':'sum', 'max_abs':'max', 'sum':'sum', 'sumsq':'sum' }
+	out = df.groupby( by ).agg( agg ).reset_index()
+	with np.errstate( invalid='ignore', divide='ignore' ):
+		out[ 'bias' ] = out[ 'sum' ] / out[ 'count' ]
+		out[ 'rmse' ] = np.sqrt( out[ 'sumsq' ] / out[ 'count' ] )
+	return out.drop( [ 'sum', 'sumsq' ], axis=1 )
+
+def write_report( df, output_filename, summary_by=[ 'variable', 'month' ] ):
+	'''
+	write a diff report as JSON ( {'summary':[...], 'files':[...]} ) or CSV ( the file level
+	table and a <name>_summary.csv ), chosen from the output_filename extension.
+	'''
+	import json
+
+	summary = summarize( df, by=summary_by )
+	dirname = os.path.dirname( output_filename )
+	try:
+		if dirname != '' and not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
+	if output_filename.endswith( '.json' ):
+		report = { 'summary':json.loads( summary.to_json( orient='records' ) ),
+					'files':json.loads( df.to_json( orient='records' ) ) }
+		with open( output_filename, 'w' ) as f:
+			json.dump( report, f, indent=2 )
+	elif output_filename.endswith( '.csv' ):
+		df.to_csv( output_filename, index=False )
+		summary.to_csv( output_filename.replace( '.csv', '_summary.csv' ), index=False )
+	else:
+		raise ValueError( 'report must be .json or .csv: {}'.format( output_filename ) )
+	return output_filename
@@ -12,6 +12,7 @@ import pandas as pd
 import geopandas as gpd
 import xarray as xr
 from downscale import utils
+from downscale.instrument import as_instrument
 
 class DeltaDownscale( object ):
 	def __init__( self, baseline, clim_begin, clim_end, historical, future=None,
@@ -19,7 +20,8 @@ class DeltaDownscale( object ):
 				src_crs={'init':'epsg:4326'}, src_nodata=-9999.0, dst_nodata=None, 
 				post_downscale_function=None, varname=None, modelname=None, anom=False, 
 				resample_type='bilinear', fix_clim=False, interp=False, find_bounds=False, 
-				aoi_mask=None, *args, **kwargs ):
+				aoi_mask=None, instrument=None, climatology_cache=None, crop=None, gdal_profile=None, dtype='float32',
+				partition=None, n_partitions=None, *args, **kwargs ):
 		
 		'''
 		simple delta downscaling
@@ -30,15 +32,34 @@ class DeltaDownscale( object ):
 		baseline = []
 		clim_begin = []
 		clim_end = []
-		historical = []
+		historical = [downscale.Dataset] historical series. May be None when the climatology comes from
+			a climatology_cache entry that exists and a future series is given.
 		future = []
 		...MORE...
+		instrument = [downscale.instrument.Instrument] per-phase timing / resource events. Also accepts a
+			sink callable, a list of sinks or a str path to a JSON-lines file. default:None ( no events )
+		climatology_cache = [downscale.climcache.ClimatologyCache/CachedClimatology/str] read the ( fixed )
+			climatology from this cache, or compute it and store it there.  A cache or cache directory is
+			keyed from the historical file, clim period, variable, units and fix_clim settings -- pass a
+			CachedClimatology entry when the series was modified in memory. With a cached climatology
+			only the future series is used. default:None ( no cache )
+		crop = [int] crop the model grid to the baseline extent plus this many model cells of halo
+			( dateline-aware, see downscale.subset ) before any computation. default:None ( the full grid )
+		gdal_profile = [downscale.gdalenv.GDALProfile] GDAL warp threads / memory, block cache and SOURCE_EXTRA
+			of the regrid, entered once per worker. Fewer workers with more warp threads suit few large
+			grids. default:None ( single-threaded warp, GDAL defaults )
+		dtype = [str/numpy.dtype] dtype of the series, climatology and anomalies. The climatology mean
+			accumulates in float64 and is stored in dtype. None keeps the dtype of the inputs. default:'float32'
+		partition, n_partitions = [int] process only the years of partition ( 0-based ) of n_partitions contiguous
+			blocks of the output series ( see downscale.partition ) -- the other years are dropped before any gap
+			filling / anomaly work, keeping the climatology period when the climatology is computed. default:None
 		
 		Returns:
 		--------
 		
 		'''
-		self.historical = historical
+		# with a cached climatology the future series carries the metadata
+		self.historical = historical if historical is not None else future
 		self.future = future
 		self.baseline = baseline
 		self.clim_begin = clim_begin
@@ -63,6 +84,25 @@ class DeltaDownscale( object ):
 		self.find_bounds = find_bounds
 		self.aoi_mask = aoi_mask
 		self.utils = utils
+		self.crop = crop
+		self.gdal_profile = gdal_profile
+		self.dtype = np.dtype( dtype ) if dtype is not None else None
+		self.partition = partition
+		self.n_partitions = n_partitions
+		self.series_years = self._series_years()
+		self._partition_years = None
+		if partition is not None:
+			from downscale.partition import partition_years
+			self._partition_years = partition_years( self.series_years, partition, n_partitions )
+		self._subset = None
+		if crop is not None:
+			from downscale.subset import SourceWindow
+			self._subset = SourceWindow.from_grid( self.historical.ds.lat, self.historical.ds.lon, self.baseline.grid, halo=crop )
+		self.instrument = as_instrument( instrument )
+		self.climatology_cache = self._climatology_entry( climatology_cache, historical )
+		cached = self.climatology_cache is not None and self.climatology_cache.exists()
+		if historical is None and not cached:
+			raise ValueError( 'historical is required unless climatology_cache holds the climatology' )
 
 		# interpolate across space GCLL/PCLL args
 		self._rotated = False
@@ -72,41 +112,62 @@ class DeltaDownscale( object ):
 		self.anomalies = None
 		self.climatology = None
 		self.ds = None
-		self._concat_nc() # make a self.ds variable...
+		with self._phase( 'concat', cached_climatology=cached ):
+			if cached:
+				self._select_nc() # the series to downscale only
+			else:
+				self._concat_nc() # make a self.ds variable...
+		if self.dtype is None:
+			self.dtype = self.ds.dtype
 
 		# fix pr climatologies if desired
 		if fix_clim == True:
-			print( 'fixing high/low values -- {}...'.format( self.varname ) )
+			self._progress( 'fixing high/low values -- {}...'.format( self.varname ) )
 			self.interp = True # force True 
 			
 			if self.aoi_mask is not None: # hairy
 				mask = self.aoi_mask.mask
+				if self._subset is not None:
+					mask = self._subset.crop_array( mask )
 			else:
 				mask = None
 
-			self._calc_climatolgy()
-			print( 'climmin:{}'.format( np.nanmin( self.climatology.data ) ) )
-			print( 'climmax:{}'.format( np.nanmax( self.climatology.data ) ) )
-
-			self._fix_clim( aoi_mask=mask, find_bounds=self.find_bounds )
-			
-			# interpolate clims across space
-			self._interp_na_fix_clim()
-
-			# if there are still values <0.5 set them to 0.5
-			climatology = self.climatology.data
-			climatology[ climatology < 0.5 ] = 0.5
-			self.climatology.data = climatology
-			del climatology
+			if cached:
+				# stored after the fixes below
+				with self._phase( 'climatology', cached=True ):
+					self.climatology = self._load_climatology()
+			else:
+				with self._phase( 'climatology' ) as event:
+					self._calc_climatolgy()
+					event.update( climmin=float( np.nanmin( self.climatology.data ) ), climmax=float( np.nanmax( self.climatology.data ) ) )
+				self._progress( 'climmin:{}'.format( event[ 'climmin' ] ) )
+				self._progress( 'climmax:{}'.format( event[ 'climmax' ] ) )
+
+				with self._phase( 'fix_clim', tasks=self.climatology.shape[0] ):
+					self._fix_clim( aoi_mask=mask, find_bounds=self.find_bounds )
+				
+				# interpolate clims across space
+				with self._phase( 'interp_na_fix_clim', tasks=self.climatology.shape[0] ):
+					self._interp_na_fix_clim()
+
+				# if there are still values <0.5 set them to 0.5
+				climatology = self.climatology.data
+				climatology[ climatology < 0.5 ] = 0.5
+				self.climatology.data = climatology
+				del climatology
+				self._store_climatology()
 			
 			# fix the ds values -- will be interped below...
-			self._fix_ds( aoi_mask=mask, find_bounds=self.find_bounds )
-			print( 'dsmin:{}'.format( np.nanmin( self.ds.data ) ) )
-			print( 'dsmax:{}'.format( np.nanmax( self.ds.data ) ) )
+			with self._phase( 'fix_ds', tasks=self.ds.shape[0] ) as event:
+				self._fix_ds( aoi_mask=mask, find_bounds=self.find_bounds )
+				event.update( dsmin=float( np.nanmin( self.ds.data ) ), dsmax=float( np.nanmax( self.ds.data ) ) )
+			self._progress( 'dsmin:{}'.format( event[ 'dsmin' ] ) )
+			self._progress( 'dsmax:{}'.format( event[ 'dsmax' ] ) )
 
 		if self.interp == True:
-			print( 'running interpolation across NAs -- base resolution' )
-			self.interp_na( )
+			self._progress( 'running interpolation across NAs -- base resolution' )
+			with self._phase( 'interp_na', tasks=self.ds.shape[0] ):
+				self.interp_na( )
 
 		if fix_clim == True:
 			# if there are still values <0.5 set them to 0.5
@@ -117,17 +178,89 @@ class DeltaDownscale( object ):
 
 		# calculate climatology if fix_clim == False
 		if self.fix_clim == False:
-			self._calc_climatolgy()
+			if cached:
+				with self._phase( 'climatology', cached=True ):
+					self.climatology = self._load_climatology()
+			else:
+				with self._phase( 'climatology' ):
+					self._calc_climatolgy()
+				self._store_climatology()
 			
 		# calculate anomalies with the new climatology values
-		self._calc_anomalies()
-
+		with self._phase( 'anomalies' ):
+			self._calc_anomalies()
+
+	def _phase( self, name, **fields ):
+		''' [hidden] instrument a phase of this run -- events are tagged with the class name '''
+		return self.instrument.phase( name, source=type( self ).__name__, **fields )
+	def _progress( self, message ):
+		''' [hidden] print a progress line -- unless the run has instrument sinks, whose phase events report it '''
+		if len( self.instrument.sinks ) == 0:
+			print( message )
+	def _climatology_entry( self, cache, historical ):
+		''' [hidden] the CachedClimatology to use -- keyed from the historical inputs and settings if needed '''
+		from downscale.climcache import CachedClimatology, climatology_entry
+		if cache is None or isinstance( cache, CachedClimatology ):
+			return cache
+		if historical is None:
+			raise ValueError( 'historical is required to key the climatology cache -- or pass a CachedClimatology' )
+		return climatology_entry( cache, historical.fn, self.clim_begin, self.clim_end, historical.variable,
+									units=historical.units, fix_clim=self.fix_clim, find_bounds=self.find_bounds,
+									interp=self.interp, level=historical.level, crop=self.crop,
+									grid=self.baseline.grid, aoi_mask=self.aoi_mask )
+	def _load_climatology( self ):
+		''' [hidden] the cached climatology -- raises ValueError if it is not on the grid of the series '''
+		climatology = self.climatology_cache.load()
+		for dim in [ 'lat', 'lon' ]:
+			cached, series = climatology[ dim ].values, self.ds[ dim ].values
+			if cached.shape != series.shape or not np.allclose( cached, series ):
+				raise ValueError( '{} of {} does not match the {} of the series -- built with another crop / baseline?'.format( dim, self.climatology_cache, dim ) )
+		return self._cast( climatology )
+	def _store_climatology( self ):
+		''' [hidden] write the computed climatology to the cache entry, if there is one '''
+		if self.climatology_cache is not None and self.climatology is not None:
+			with self._phase( 'climatology_store' ):
+				self.climatology_cache.save( self.climatology )
+	def _cast( self, da ):
+		''' [hidden] an array in the compute dtype -- as is if it already is ( or there is no dtype yet ) '''
+		if self.dtype is None or da.dtype == self.dtype:
+			return da
+		return da.astype( self.dtype )
+	def _crop( self, ds ):
+		''' [hidden] crop a series to the model cells covering the baseline, if cropping '''
+		if self._subset is None:
+			return ds
+		return self._subset.apply( ds )
+	def _output_series( self ):
+		''' [hidden] the Dataset whose time steps are downscaled -- the future if there is one '''
+		return self.future if self.future is not None else self.historical
+	def _series_years( self ):
+		''' [hidden] sorted unique years of the output series -- what partitions split '''
+		return [ int( year ) for year in np.unique( self._output_series().ds.time.dt.year.values ) ]
+	def _partition_series( self, ds, climatology=True ):
+		''' [hidden] the time steps of a series in the partition ( and the climatology period if climatology ) '''
+		if self._partition_years is None:
+			return ds
+		years = ds.time.dt.year.values
+		keep = np.isin( years, self._partition_years )
+		if climatology:
+			keep |= ( years >= int( str( self.clim_begin )[:4] ) ) & ( years <= int( str( self.clim_end )[:4] ) )
+		return ds.isel( time=np.where( keep )[0] )
+	def _output_times( self ):
+		''' [hidden] times of the output series that are downscaled -- those of the partition if partitioned '''
+		return self._partition_series( self._output_series().ds.time, climatology=False )
+	def _select_nc( self ):
+		''' [hidden] the series to downscale without the historical -- used with a cached climatology '''
+		series = self._output_series()
+		self.ds = self._cast( self._crop( self._partition_series( series.ds[ series.variable ], climatology=False ) ) )
 	def _concat_nc( self ):
+		# crop each input ( to the partition's years ) before the concat so the full grid is never copied
 		if self.historical and self.future:
-			ds = xr.concat([ self.historical.ds, self.future.ds ], dim='time' )
+			ds = xr.concat([ self._crop( self._partition_series( self.historical.ds ) ),
+							self._crop( self._partition_series( self.future.ds ) ) ], dim='time' )
 		else:
-			ds = self.historical.ds
-		self.ds = ds[ self.historical.variable ]
+			ds = self._crop( self._partition_series( self.historical.ds ) )
+		self.ds = self._cast( ds[ self.historical.variable ] )
 		# if self.level:
 		# 	# levidx, = np.where( ds[ self.level_name ] == self.level )
 		# 	# ds = ds[ :, levidx[0], ... ]
@@ -137,7 +270,8 @@ class DeltaDownscale( object ):
 		'''slice / aggregate to climatology using mean'''
 		try:
 			climatology = self.ds.sel( time=slice( self.clim_begin, self.clim_end ) )
-			self.climatology = climatology.groupby( 'time.month' ).mean( 'time' )
+			# accumulate in float64 -- only the 12 monthly means are stored in the compute dtype
+			self.climatology = self._cast( climatology.groupby( 'time.month' ).mean( 'time', dtype=np.float64 ) )
 		except Exception:
 			raise AttributeError( 'non-overlapping climatology period and series' )
 	def _calc_anomalies( self ):
@@ -149,16 +283,15 @@ class DeltaDownscale( object ):
 		else:
 			NameError( '_calc_anomalies (ar5): value of downscaling_operation must be "add" or "mult" ' )
 
+		anomalies = self._cast( anomalies )
+
 		# slice back to times we want
-		if self.historical != None and self.future != None:
-			self.anomalies = anomalies.sel( time=self.future.ds.time )
-		else:
-			self.anomalies = anomalies.sel( time=self.historical.ds.time )
+		self.anomalies = anomalies.sel( time=self._output_times() )
 	def _fix_clim( self, aoi_mask, find_bounds=False ):
 		''' fix values in precip data '''
-		print( '_fix_clim' )
+		self._progress( '_fix_clim' )
 		if find_bounds == True:
-			print('bounds')
+			self._progress('bounds')
 			bound_mask = find_boundary( self.climatology[ 0, ... ].data )
 			for idx in range( self.climatology.shape[0] ):
 				arr = self.climatology[ idx, ... ].data
@@ -173,8 +306,8 @@ class DeltaDownscale( object ):
 			ValueError( 'find_bounds arg is boolean only' )
 	def _fix_ds( self, aoi_mask, find_bounds=False ):
 		''' fix high/low values in precip data '''
-		print( '_fix_ds ' )
-		print( self.ds.shape[0] )
+		self._progress( '_fix_ds ' )
+		self._progress( self.ds.shape[0] )
 		if find_bounds == True:
 			bound_mask = find_boundary( self.ds[ 0, ... ].data )
 			for idx in range( self.ds.shape[0] ):
@@ -210,10 +343,10 @@ class DeltaDownscale( object ):
 
 		# remove the darn scientific notation
 		np.set_printoptions( suppress=True )
-		output_dtype = np.float32
+		output_dtype = self.dtype
 		
-		# if 0-360 leave it alone
-		if ( self.ds.lon > 200.0 ).any() == True:
+		# if 0-360 ( or cropped to monotonic longitudes ) leave it alone
+		if self._subset is not None or ( self.ds.lon > 200.0 ).any() == True:
 			dat, lons = np.array(self.ds.data), np.array(self.ds.lon)
 			self._lonpc = lons
 		else:
@@ -232,7 +365,7 @@ class DeltaDownscale( object ):
 		args = [ {'x':np.array(df['x']), 'y':np.array(df['y']), 'z':np.array(df['z']), \
 				'grid':(xi,yi), 'method':self.historical.method, 'output_dtype':output_dtype } for df in df_list ]
 		
-		print( 'processing interpolation to convex hull in parallel using {} cpus.'.format( self.ncpus ) )
+		self._progress( 'processing interpolation to convex hull in parallel using {} cpus.'.format( self.ncpus ) )
 		dat_list = mp_map( self.wrap, args, nproc=self.ncpus )
 		dat_list = [ np.array(i) for i in dat_list ] # drop the output mask
 		dat = np.array( dat_list )
@@ -244,7 +377,7 @@ class DeltaDownscale( object ):
 		# place back into a new xarray.Dataset object for further processing
 		# self.ds = self.ds.update( { self.historical.variable:( ['time','lat','lon'], dat ) } )
 		self.ds.data = dat
-		print( 'ds interpolated updated into self.ds' )
+		self._progress( 'ds interpolated updated into self.ds' )
 		return 1
 	def _interp_na_fix_clim( self ):
 		'''
@@ -260,10 +393,10 @@ class DeltaDownscale( object ):
 
 		# remove the darn scientific notation
 		np.set_printoptions( suppress=True )
-		output_dtype = np.float32
+		output_dtype = self.dtype
 		
-		# if 0-360 leave it alone
-		if ( self.ds.lon > 200.0 ).any() == True:
+		# if 0-360 ( or cropped to monotonic longitudes ) leave it alone
+		if self._subset is not None or ( self.ds.lon > 200.0 ).any() == True:
 			dat, lons = self.climatology.data, self.ds.lon
 			self._lonpc = lons
 			self._rotated = False
@@ -284,7 +417,7 @@ class DeltaDownscale( object ):
 		args = [ {'x':np.array(df['x']), 'y':np.array(df['y']), 'z':np.array(df['z']), \
 				'grid':(xi,yi), 'method':self.historical.method, 'output_dtype':output_dtype } for df in df_list ]
 		
-		print( 'processing interpolation to convex hull in parallel using {} cpus. -- CLIMATOLOGY'.format( self.ncpus ) )
+		self._progress( 'processing interpolation to convex hull in parallel using {} cpus. -- CLIMATOLOGY'.format( self.ncpus ) )
 		dat_list = mp_map( self.wrap, args, nproc=self.ncpus )
 		dat_list = [ np.array(i) for i in dat_list ] # drop the output mask
 		dat = np.array( dat_list )
@@ -303,16 +436,25 @@ class DeltaDownscale( object ):
 		# self.ds = self.ds.update( { self.historical.variable:( ['time','lat','lon'], dat ) } )
 		
 		self.climatology.data = dat
-		print( 'ds interpolated updated into self.ds' )
+		self._progress( 'ds interpolated updated into self.ds' )
 		return 1
-	def downscale( self, output_dir, prefix=None ):
-		import affine
-		from affine import Affine
-		import itertools
+	def downscale( self, output_dir, prefix=None, time_chunk=None, pipeline=False, depth=4, nwriters=2, compact=False, tile_size=None,
+				partition=None, n_partitions=None, encoding=None ):
+		'''
+		output_dir = [str] directory to write the downscaled GeoTIFFs
+		prefix = [str] output filename prefix. default:None ( built from the variable / model / scenario )
+		time_chunk, pipeline, depth, nwriters, compact, tile_size, partition, n_partitions, encoding = how the
+			tasks run and are written. see downscale.execute.run_downscale
+		'''
 		from functools import partial
-		from pathos.mp_map import mp_map
+		from downscale.execute import check_options, run_downscale, run_partition
 
-		operation_switch = { 'add':self.utils.add, 'mult':self.utils.mult }
+		partition, n_partitions = run_partition( self, partition, n_partitions )
+		# baseline grid geometry is computed once and shared with the workers
+		grid = getattr( self.baseline, 'grid', None )
+		check_options( grid, time_chunk=time_chunk, pipeline=pipeline, compact=compact, tile_size=tile_size,
+						partition=partition, n_partitions=n_partitions, encoding=encoding,
+						post_downscale_function=self.post_downscale_function )
 
 		def two_digit_month( x ):
 			''' make 1 digit month a standard 2-digit for output filenames '''
@@ -351,20 +493,24 @@ class DeltaDownscale( object ):
 			output_filenames = [ os.path.join( output_dir, '_'.join([prefix, ts]) + '.tif' ) for ts in time_suffix ]
 
 		# rotate to pacific-centered
-		if ( self.anomalies.lon.data > 200.0 ).any() == True:
-			dat, lons = ( np.array(self.anomalies), np.array(self.anomalies.lon) )
+		if self._subset is not None:
+			# cropped grids already have monotonic longitudes across the dateline
+			self.anomalies_rot = np.array( self.anomalies, dtype=self.dtype )
+			src_transform = self._subset.transform
+		elif ( self.anomalies.lon.data > 200.0 ).any() == True:
+			dat, lons = ( np.array(self.anomalies, dtype=self.dtype), np.array(self.anomalies.lon) )
 			self.anomalies_rot = dat
 			src_transform = self.historical.transform_from_latlon( self.historical.ds.lat, lons )
 			# print( 'anomalies NOT rotated!' )
 		else:
-			dat, lons = self.utils.shiftgrid( 0., np.array(self.anomalies), np.array(self.anomalies.lon) )
+			dat, lons = self.utils.shiftgrid( 0., np.array(self.anomalies, dtype=self.dtype), np.array(self.anomalies.lon) )
 			self.anomalies_rot = dat
 			src_transform = self.historical.transform_from_latlon( np.array(self.historical.ds.lat), np.array(lons) )
-			print( src_transform )
+			self._progress( src_transform )
 			# print( 'anomalies rotated!' )
 
 		# run and output # this can get you if there are an incomplete number of monthly baseline rasters
-		rstlist = self.baseline.repeat( n=self.anomalies_rot.shape[0] / 12 ) # months
+		rstlist = self.baseline.repeat( n=self.anomalies_rot.shape[0] // 12 ) # months
 		
 		if isinstance( self.anomalies_rot, xr.Dataset ):
 			self.anomalies_rot = self.anomalies_rot[ self.historical.variable ].data
@@ -382,13 +528,13 @@ class DeltaDownscale( object ):
 
 		# partial and wrapper
 		f = partial( self.utils.interp_ds, src_crs=self.src_crs, src_nodata=self.src_nodata, \
-					dst_nodata=self.dst_nodata, src_transform=src_transform, resample_type=self.resample_type )
-
-		run = partial( self.utils._run_ds, f=f, operation_switch=operation_switch, anom=self.anom, mask_value=self.mask_value )
+					dst_nodata=self.dst_nodata, src_transform=src_transform, resample_type=self.resample_type, grid=grid,\
+					gdal_profile=self.gdal_profile )
 
-		# run it
-		out = mp_map( run, args, nproc=self.ncpus )
-		return output_dir
+		return run_downscale( self, args, grid, f, src_transform, output_filenames, output_dir, self.anomalies.time.to_pandas(),
+							series_years=self.series_years, src_nodata=self.src_nodata, time_chunk=time_chunk, pipeline=pipeline, depth=depth, nwriters=nwriters,
+							compact=compact, tile_size=tile_size, partition=partition, n_partitions=n_partitions,
+							encoding=encoding )
 
 
 # # # # # # # # # NEW FILL Dataset FOR A SPECIFIC SNAP ISSUE WITH pre DATA from CRU 
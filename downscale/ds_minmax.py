@@ -69,23 +69,31 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 		self.clim_end = None
 
 		# calc deltas between the mean and the extreme data set 
-		print( 'calc anoms minmax' )
-		self._calc_anomalies()
+		self._progress( 'calc anoms minmax' )
+		with self._phase( 'anomalies' ):
+			self._calc_anomalies()
 		
 		# # TESTING
 		# print('type_mean_ds: {} '.format( type( self.mean_ds ) ) )
-		print( 'self.interp: {}'.format(self.interp) )
+		self._progress( 'self.interp: {}'.format(self.interp) )
 		if self.interp == True:
-			print( 'running interpolation across NAs -- base resolution -- !ANOMALIES! dataset' )
-			self.interp_na( )
-
+			self._progress( 'running interpolation across NAs -- base resolution -- !ANOMALIES! dataset' )
+			with self._phase( 'interp_na', tasks=self.anomalies.shape[0] ):
+				self.interp_na( )
+
+	def _concat_nc( self ):
+		''' crop the mean series along with the extremes so they stay aligned '''
+		super( DeltaDownscaleMinMax, self )._concat_nc()
+		# there is no climatology period to keep
+		self.ds = self._partition_series( self.ds, climatology=False )
+		self.mean_ds = self._cast( self._crop( self._partition_series( self.mean_ds, climatology=False ) ) )
 	def _calc_climatolgy( self ):
 		''' MASK THIS FOR MINMAX slice / aggregate to climatology using mean'''
 		self.climatology = None
 	def _calc_anomalies( self ):
 		''' calculate deltas but call them anomalies to fit the `downscale` pkg methods '''			
 		if self.downscaling_operation == 'add':
-			print( 'calc_anom minmax version' )
+			self._progress( 'calc_anom minmax version' )
 			# anomalies = (self.historical.ds[ self.historical.variable ] - self.mean_ds.ds[ self.mean_variable ] ) #.to_dataset( name=variable )
 			self.anomalies = (self.ds - self.mean_ds ) #.to_dataset( name=variable )
 		elif self.downscaling_operation == 'mult':
@@ -93,6 +101,7 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 			self.anomalies = (self.ds / self.mean_ds ) #.to_dataset( name=variable )
 		else:
 			NameError( '_calc_anomalies (ar5): value of downscaling_operation must be "add" or "mult" ' )
+		self.anomalies = self._cast( self.anomalies )
 		# self.mean_ds = None # watch this one... trying to save on RAM... 
 	# def _interp_na_mean( self ):
 	# 	'''
@@ -159,10 +168,10 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 
 		# remove the darn scientific notation
 		np.set_printoptions( suppress=True )
-		output_dtype = np.float32
+		output_dtype = self.dtype
 		
-		# if 0-360 leave it alone
-		if ( np.array(self.anomalies.lon) > 200.0 ).any() == True:
+		# if 0-360 ( or cropped to monotonic longitudes ) leave it alone
+		if self._subset is not None or ( np.array(self.anomalies.lon) > 200.0 ).any() == True:
 			dat, lons = np.array(self.anomalies.data), np.array(self.anomalies.lon)
 			self._lonpc = lons
 		else:
@@ -181,7 +190,7 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 		args = [ {'x':np.array(df['x']), 'y':np.array(df['y']), 'z':np.array(df['z']), \
 				'grid':(xi,yi), 'method':self.historical.method, 'output_dtype':output_dtype } for df in df_list ]
 		
-		print( 'processing interpolation to convex hull in parallel using {} cpus.'.format( self.ncpus ) )
+		self._progress( 'processing interpolation to convex hull in parallel using {} cpus.'.format( self.ncpus ) )
 		dat_list = mp_map( self.wrap, args, nproc=self.ncpus )
 		dat_list = [ np.array(i) for i in dat_list ] # drop the output mask
 		dat = np.array( dat_list )
@@ -193,20 +202,26 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 		# place back into a new xarray.Dataset object for further processing
 		# self.anomalies = self.anomalies.update( { self.historical.variable:( ['time','lat','lon'], dat ) } )
 		self.anomalies.data = dat
-		print( 'anomalies interpolated updated into self.anomalies' )
+		self._progress( 'anomalies interpolated updated into self.anomalies' )
 		return 1	
-	def downscale( self, output_dir, prefix=None ):
+	def downscale( self, output_dir, prefix=None, time_chunk=None, pipeline=False, depth=4, nwriters=2, compact=False, tile_size=None,
+				partition=None, n_partitions=None, encoding=None ):
 		'''
 		updated version of downscale function to mask the non-minmax version and how
 		it works with baseline climatology vs. the full mean series as with the min/max
+
+		time_chunk, pipeline, depth, nwriters, compact, tile_size, partition, n_partitions, encoding = how the
+			tasks run and are written. see downscale.execute.run_downscale
 		'''
-		import affine, rasterio
-		from affine import Affine
-		import itertools
 		from functools import partial
-		from pathos.mp_map import mp_map
+		from downscale.execute import check_options, run_downscale, run_partition
 
-		operation_switch = { 'add':self.utils.add, 'mult':self.utils.mult }
+		partition, n_partitions = run_partition( self, partition, n_partitions )
+		# baseline grid geometry is computed once and shared with the workers
+		grid = getattr( self.baseline, 'grid', None )
+		check_options( grid, time_chunk=time_chunk, pipeline=pipeline, compact=compact, tile_size=tile_size,
+						partition=partition, n_partitions=n_partitions, encoding=encoding,
+						post_downscale_function=self.post_downscale_function )
 
 		def two_digit_month( x ):
 			''' make 1 digit month a standard 2-digit for output filenames '''
@@ -240,13 +255,17 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 			output_filenames = [ os.path.join( output_dir, '_'.join([prefix, ts]) + '.tif' ) for ts in time_suffix ]
 
 		# rotate to pacific-centered
-		if ( self.anomalies.lon.data > 200.0 ).any() == True:
-			dat, lons = ( np.array(self.anomalies), np.array(self.anomalies.lon) )
+		if self._subset is not None:
+			# cropped grids already have monotonic longitudes across the dateline
+			self.anomalies_rot = np.array( self.anomalies, dtype=self.dtype )
+			src_transform = self._subset.transform
+		elif ( self.anomalies.lon.data > 200.0 ).any() == True:
+			dat, lons = ( np.array(self.anomalies, dtype=self.dtype), np.array(self.anomalies.lon) )
 			self.anomalies_rot = dat
 			src_transform = self.historical.transform_from_latlon( self.ds.lat, lons )
 			# print( 'anomalies NOT rotated!' )
 		else:
-			dat, lons = self.utils.shiftgrid( 0., np.array(self.anomalies), np.array(self.anomalies.lon) )
+			dat, lons = self.utils.shiftgrid( 0., np.array(self.anomalies, dtype=self.dtype), np.array(self.anomalies.lon) )
 			self.anomalies_rot = dat
 			src_transform = self.historical.transform_from_latlon( self.ds.lat, lons )
 			# print( 'anomalies rotated!' )
@@ -277,13 +296,13 @@ class DeltaDownscaleMinMax( DeltaDownscale ):
 
 		# partial and wrapper
 		f = partial( self.utils.interp_ds, src_crs=self.src_crs, src_nodata=None, \
-					dst_nodata=None, src_transform=src_transform, resample_type=self.resample_type )
-
-		run = partial( self.utils._run_ds, f=f, operation_switch=operation_switch, anom=self.anom, mask_value=self.mask_value )
+					dst_nodata=None, src_transform=src_transform, resample_type=self.resample_type, grid=grid,\
+					gdal_profile=self.gdal_profile )
 
-		# run it
-		out = mp_map( run, args, nproc=self.ncpus )
-		return output_dir
+		return run_downscale( self, args, grid, f, src_transform, output_filenames, output_dir, self.anomalies.time.to_pandas(),
+							series_years=self.series_years, src_nodata=None, time_chunk=time_chunk, pipeline=pipeline, depth=depth, nwriters=nwriters,
+							compact=compact, tile_size=tile_size, partition=partition, n_partitions=n_partitions,
+							encoding=encoding )
 	# @staticmethod
 	# def interp_ds( anom, base, src_crs, src_nodata, dst_nodata, src_transform, resample_type='bilinear',*args, **kwargs ):
 	# 	'''	
@@ -0,0 +1,129 @@
+# -*- coding: utf8 -*-
+# # #
+# Scaled-integer encoding of rounded outputs: a product rounded to 1
+#  decimal ( tas, hurs, clt ) or to whole numbers ( pr ) is stored as
+#  int16 / uint16 with the GeoTIFF scale / offset tags and an integer
+#  nodata, about half the bytes of float32.  read_band returns the
+#  physical float32 values of encoded and float rasters alike.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import numpy as np
+
+class Encoding( object ):
+	'''
+	physical = stored * scale_factor + add_offset, with nodata cells stored as nodata.
+	'''
+	def __init__( self, dtype='int16', scale_factor=1.0, add_offset=0.0, nodata=None ):
+		'''
+		ARGUMENTS:
+		----------
+		dtype = [str] integer dtype stored. default:'int16'
+		scale_factor = [float] physical units per stored unit -- the rounding of the product
+			( i.e. 0.1 for 1 decimal ). default:1.0
+		add_offset = [float] physical value of a stored 0. default:0.0
+		nodata = [int] stored nodata value. default:None ( the dtype minimum )
+		'''
+		self.dtype = np.dtype( dtype ).name
+		if np.dtype( self.dtype ).kind not in 'iu':
+			raise ValueError( 'Encoding dtype must be an integer type, not {}'.format( self.dtype ) )
+		self.scale_factor = float( scale_factor )
+		self.add_offset = float( add_offset )
+		if nodata is None:
+			nodata = np.iinfo( self.dtype ).min
+		self.nodata = int( nodata )
+	def valid_range( self ):
+		''' ( min, max ) physical values that can be stored -- the nodata value is excluded '''
+		info = np.iinfo( self.dtype )
+		low = info.min + 1 if self.nodata == info.min else info.min
+		high = info.max - 1 if self.nodata == info.max else info.max
+		return low * self.scale_factor + self.add_offset, high * self.scale_factor + self.add_offset
+	def meta( self, meta ):
+		''' a copy of a rasterio meta / profile for the encoded output '''
+		meta = meta.copy()
+		meta.update( dtype=self.dtype, nodata=self.nodata )
+		return meta
+	def encode( self, arr, nodata=None ):
+		'''
+		physical values to stored integers.  np.nan and nodata cells of arr become the
+		encoding's nodata.  Values outside valid_range raise ValueError rather than wrap.
+
+		ARGUMENTS:
+		----------
+		arr = [numpy.ndarray] physical values ( may be masked )
+		nodata = [float] nodata of arr. default:None ( np.nan / masked only )
+		'''
+		data = np.ma.getdata( arr )
+		missing = np.isnan( data ) | np.ma.getmaskarray( arr )
+		if nodata is not None:
+			missing |= data == nodata
+		with np.errstate( invalid='ignore' ):
+			packed = np.rint( ( data.astype( np.float64 ) - self.add_offset ) / self.scale_factor )
+		info = np.iinfo( self.dtype )
+		bad = ~missing & ( ( packed < info.min ) | ( packed > info.max ) | ( packed == self.nodata ) )
+		if bad.any():
+			values = data[ bad ]
+			raise ValueError( '{} values ( {} to {} ) outside the {} range {}'.format( int( bad.sum() ), values.min(), values.max(),
+								self.dtype, self.valid_range() ) )
+		packed[ missing ] = self.nodata
+		return packed.astype( self.dtype )
+	def decode( self, arr ):
+		''' stored integers to physical float32 values, nodata as np.nan '''
+		out = ( np.asarray( arr ).astype( np.float64 ) * self.scale_factor + self.add_offset ).astype( np.float32 )
+		out[ np.asarray( arr ) == self.nodata ] = np.nan
+		return out
+	def tag( self, rst ):
+		''' set the scale / offset tags of band 1 of an open rasterio dataset '''
+		rst.scales = ( self.scale_factor, )
+		rst.offsets = ( self.add_offset, )
+	def write( self, rst, arr, nodata=None, window=None ):
+		''' encode arr and write it to band 1 of an open rasterio dataset with its scale / offset tags '''
+		self.tag( rst )
+		rst.write( self.encode( arr, nodata=nodata ), 1, window=window )
+	@classmethod
+	def from_raster( cls, rst ):
+		''' the Encoding of band 1 of an open rasterio dataset, None if it is not integer or not scaled '''
+		dtype = np.dtype( rst.dtypes[0] )
+		scale, offset = rst.scales[0], rst.offsets[0]
+		if dtype.kind not in 'iu' or ( scale == 1 and offset == 0 and rst.nodata is None ):
+			return None
+		nodata = int( rst.nodata ) if rst.nodata is not None else None
+		return cls( dtype, scale_factor=scale, add_offset=offset, nodata=nodata )
+	def __eq__( self, other ):
+		return isinstance( other, Encoding ) and vars( self ) == vars( other )
+	def __ne__( self, other ):
+		return not self == other
+	def __repr__( self ):
+		return 'Encoding( {dtype!r}, scale_factor={scale_factor!r}, add_offset={add_offset!r}, nodata={nodata!r} )'.format( **vars( self ) )
+
+# the rounding of the SNAP products.  Whole mm of monthly pr are never negative and far below 65534
+#  ( the wettest month on record is ~9300mm ) -- 0 is a valid value, so nodata is the top of the range
+ONE_DECIMAL = Encoding( 'int16', scale_factor=0.1 )
+WHOLE = Encoding( 'uint16', scale_factor=1.0, nodata=65535 )
+ENCODINGS = { 'tas':ONE_DECIMAL, 'tasmin':ONE_DECIMAL, 'tasmax':ONE_DECIMAL, 'hurs':ONE_DECIMAL,
+			'clt':ONE_DECIMAL, 'pr':WHOLE }
+
+def read_band( rst, window=None, masked=False ):
+	'''
+	physical float32 values of band 1 of an open rasterio dataset -- scale / offset applied
+	to encoded rasters, float rasters as stored.
+
+	ARGUMENTS:
+	----------
+	rst = [rasterio.DatasetReader] open raster
+	window = [rasterio.windows.Window] window to read. default:None ( all )
+	masked = [bool] return a masked array instead of np.nan at nodata. default:False
+
+	RETURNS:
+	--------
+	numpy.ndarray ( or numpy.ma.MaskedArray ) of float32
+	'''
+	arr = rst.read( 1, window=window, masked=True )
+	scale, offset = rst.scales[0], rst.offsets[0]
+	out = arr.astype( np.float32 )
+	if scale != 1 or offset != 0:
+		out = ( arr.astype( np.float64 ) * scale + offset ).astype( np.float32 )
+	if masked:
+		return out
+	return out.filled( np.nan )
@@ -0,0 +1,137 @@
+# -*- coding: utf8 -*-
+# # #
+# Multi-model ensemble statistics computed block-by-block across N
+#  model rasters for a common month/year.  All requested statistics
+#  are computed from a single read of each block and written with
+#  windowed writes, so memory is bounded by (n_models x block size).
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, warnings
+import numpy as np
+from downscale import utils
+
+def _percentile( q ):
+	''' make a nan-aware percentile stat function for percentile q '''
+	def f( stack ):
+		return np.nanpercentile( stack, q, axis=0 )
+	return f
+
+STATS = { 'mean':lambda stack: np.nanmean( stack, axis=0 ),
+		'median':lambda stack: np.nanmedian( stack, axis=0 ),
+		'std':lambda stack: np.nanstd( stack, axis=0 ),
+		'min':lambda stack: np.nanmin( stack, axis=0 ),
+		'max':lambda stack: np.nanmax( stack, axis=0 ) }
+
+def stat_functions( stats=('mean',), percentiles=None ):
+	'''
+	build an ordered list of ( name, function ) for the stats requested.
+	percentiles are named like 'p10', 'p90'.
+
+	ARGUMENTS:
+	----------
+	stats = [tuple] of str stat names in STATS. default:('mean',)
+	percentiles = [list] of numeric percentiles (0-100) to compute. default:None
+
+	RETURNS:
+	--------
+	list of ( str stat name, function ) tuples
+	'''
+	out = []
+	for stat in stats:
+		if stat not in STATS:
+			raise ValueError( 'stat must be one of {}'.format( sorted( STATS.keys() ) ) )
+		out.append( (stat, STATS[ stat ]) )
+	if percentiles is not None:
+		out = out + [ ('p{}'.format( q ), _percentile( q )) for q in percentiles ]
+	return out
+
+def ensemble_stats( files, output_filenames, stats=('mean',), percentiles=None,
+					round_func=None, max_rows=256 ):
+	'''
+	compute ensemble statistics across a group of N co-registered rasters
+	(one per model) in a single windowed pass and write each stat to disk.
+
+	ARGUMENTS:
+	----------
+	files = [list] of str paths to the model rasters for a common timestep.
+		all must share the same grid.  The first file is used as the template.
+	output_filenames = [dict] of stat name (i.e. 'mean', 'std', 'p90') to output path.
+	stats = [tuple] of str stat names in downscale.ensemble.STATS. default:('mean',)
+	percentiles = [list] of numeric percentiles (0-100) to compute. default:None
+	round_func = [function] applied to each output block before writing. i.e. np.rint. default:None
+	max_rows = [int] row grouping for striped (non-tiled) rasters. default:256
+
+	RETURNS:
+	--------
+	dict of stat name to output filename written
+	'''
+	import rasterio
+	from downscale.encoding import read_band
+	funcs = stat_functions( stats, percentiles )
+	missing = [ name for name, f in funcs if name not in output_filenames ]
+	if len( missing ) > 0:
+		raise ValueError( 'output_filenames missing stats: {}'.format( missing ) )
+
+	srcs = [ rasterio.open( fn ) for fn in files ]
+	template = srcs[ 0 ]
+	nodata = template.nodata
+	profile = template.profile
+	profile.update( compress='lzw', dtype='float32' )
+
+	for name, f in funcs:
+		dirname = os.path.dirname( output_filenames[ name ] )
+		try:
+			if not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+
+	outs = dict([ (name, rasterio.open( output_filenames[ name ], 'w', **profile )) for name, f in funcs ])
+	try:
+		for window in utils.iter_windows( template, max_rows=max_rows ):
+			mask = template.read_masks( 1, window=window )
+			stack = np.array([ read_band( src, window=window ) for src in srcs ])
+			with np.errstate( all='ignore' ), warnings.catch_warnings():
+				# all-nan slices (oob cells) are expected and masked below
+				warnings.simplefilter( 'ignore', category=RuntimeWarning )
+				for name, f in funcs:
+					arr = f( stack ).astype( np.float32 )
+					if round_func is not None:
+						arr = round_func( arr )
+					arr[ (mask == 0) | np.isnan( arr ) ] = nodata
+					outs[ name ].write( arr, 1, window=window )
+	finally:
+		for out in outs.values():
+			out.close()
+		for src in srcs:
+			src.close()
+	return output_filenames
+
+def run_ensemble( groups, output_filenames, ncpus=32, **kwargs ):
+	'''
+	run ensemble_stats over many timesteps (i.e. months) in parallel.
+
+	ARGUMENTS:
+	----------
+	groups = [list] of lists of model raster paths, one list per timestep.
+	output_filenames = [list] of dicts (stat:path) matching groups.
+	ncpus = [int] number of processes to use. default:32
+	**kwargs = passed through to ensemble_stats
+
+	RETURNS:
+	--------
+	list of dicts of stat name to output filename written
+	'''
+	from functools import partial
+	from pathos.mp_map import mp_map
+
+	f = partial( _run_ensemble, **kwargs )
+	args = list( zip( groups, output_filenames ) )
+	return mp_map( f, args, nproc=ncpus )
+
+def _run_ensemble( x, **kwargs ):
+	''' [hidden] unpack args for mp_map '''
+	files, output_filenames = x
+	return ensemble_stats( files, output_filenames, **kwargs )
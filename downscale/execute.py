@@ -0,0 +1,167 @@
+# -*- coding: utf8 -*-
+# # #
+# Execution of the downscale tasks shared by DeltaDownscale.downscale and
+#  DeltaDownscaleMinMax.downscale: the checks of the run options, the
+#  choice of runner ( process pool, threaded pipeline, compact vectors or
+#  tiles ) and the manifest of a partitioned run.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import numpy as np
+from downscale.instrument import files_size
+
+def _grid_arguments( func ):
+	''' [hidden] names of the 2-D array arguments bound into a functools.partial ( i.e. a full-grid mask ) '''
+	from functools import partial
+	names = []
+	while isinstance( func, partial ):
+		names = names + [ 'args[{}]'.format( idx ) for idx, value in enumerate( func.args ) if np.ndim( value ) >= 2 ]
+		names = names + [ name for name, value in func.keywords.items() if np.ndim( value ) >= 2 ]
+		func = func.func
+	return names
+
+def check_options( grid, time_chunk=None, pipeline=False, compact=False, tile_size=None, partition=None,
+					n_partitions=None, encoding=None, post_downscale_function=None ):
+	'''
+	raise ValueError for downscale options that cannot run together -- called before any work is done.
+	see run_downscale for the options.  compact / tiled runs call post_downscale_function on 1-D vectors /
+	tiles, so it must be elementwise: a partial carrying a full-grid array ( i.e. round_it with mask= )
+	is refused here rather than failing in the workers.
+	'''
+	from downscale.encoding import Encoding
+	if time_chunk is not None and time_chunk < 1:
+		raise ValueError( 'time_chunk must be at least 1, not {}'.format( time_chunk ) )
+	if compact and ( pipeline or grid is None ):
+		raise ValueError( 'compact needs the baseline grid and does not run in the pipeline' )
+	if tile_size is not None and ( pipeline or compact or grid is None ):
+		raise ValueError( 'tile_size needs the baseline grid and does not combine with pipeline or compact' )
+	if tile_size is not None and tile_size % 16 != 0:
+		raise ValueError( 'tile_size must be a multiple of 16, not {}'.format( tile_size ) )
+	if ( partition is None ) != ( n_partitions is None ):
+		raise ValueError( 'partition and n_partitions go together' )
+	if partition is not None and ( n_partitions < 1 or not 0 <= partition < n_partitions ):
+		raise ValueError( 'partition must be in [0, {}), not {}'.format( n_partitions, partition ) )
+	if encoding is not None and not isinstance( encoding, Encoding ):
+		raise ValueError( 'encoding must be a downscale.encoding.Encoding, not {!r}'.format( encoding ) )
+	if ( compact or tile_size is not None ) and post_downscale_function is not None:
+		names = _grid_arguments( post_downscale_function )
+		if len( names ) > 0:
+			raise ValueError( 'post_downscale_function is bound to 2-D arrays ( {} ) but compact / tiled runs call it on '
+							'1-D vectors / tiles -- pass an elementwise function ( i.e. np.rint ), the outputs are '
+							'masked after it anyway'.format( ', '.join( names ) ) )
+
+def run_partition( dd, partition=None, n_partitions=None ):
+	'''
+	( partition, n_partitions ) a downscale call writes: those the run was built with ( its other years were
+	never loaded ), else those passed to downscale.  ValueError if they differ.
+	'''
+	built = ( getattr( dd, 'partition', None ), getattr( dd, 'n_partitions', None ) )
+	if partition is None:
+		return built
+	if built[0] is not None and built != ( partition, n_partitions ):
+		raise ValueError( 'partition {} of {} differs from partition {} of {} the run was built for'.format( partition, n_partitions, *built ) )
+	return partition, n_partitions
+
+def run_downscale( dd, args, grid, f, src_transform, output_filenames, output_dir, times, series_years=None, src_nodata=None,
+					time_chunk=None, pipeline=False, depth=4, nwriters=2, compact=False, tile_size=None,
+					partition=None, n_partitions=None, encoding=None ):
+	'''
+	run the downscale tasks of a DeltaDownscale ( or subclass ) and write the outputs.
+
+	ARGUMENTS:
+	----------
+	dd = [downscale.DeltaDownscale] the run -- ncpus, anom, mask_value, resample_type, src_crs,
+		gdal_profile and utils are taken from it
+	args = [list] task dicts ( anom, base, output_filename, ... ) of every time step, in order
+	grid = [downscale.GridSpec] baseline grid geometry. may be None ( process pool / pipeline only )
+	f = [function] interp_ds partial regridding an anomaly array to a baseline file
+	src_transform = [affine.Affine] transform of the anomaly arrays
+	output_filenames = [list] output filename of each task
+	output_dir = [str] directory of the outputs ( and partition manifest )
+	times = [pandas.Index] time of each task
+	series_years = [list] years of the full output series the partitions split. default:None ( those of times )
+	src_nodata = [float] nodata of the anomaly arrays, for the compact regrid weights. default:None
+
+	time_chunk = [int] time steps handed to the workers at once. default:None ( all of them ).
+		see downscale.planner.plan_run
+	pipeline = [bool] run the tasks through a threaded read / compute / write pipeline ( ncpus compute
+		threads ) instead of a process pool. see downscale.pipeline. default:False
+	depth = [int] pipeline queue depth in front of each stage. default:4
+	nwriters = [int] pipeline encode / write threads. default:2
+	compact = [bool] compute over the valid ( baseline mask ) cells only, as 1-D vectors, and fill
+		the rectangle just to write it. see downscale.compact. default:False
+	tile_size = [int] downscale tile by tile ( tile_size cells square, a multiple of 16 ) into tiled
+		GeoTIFFs, bounding worker memory by the tile. see downscale.tiles. default:None ( whole grids )
+	partition, n_partitions = [int] write only the months of partition ( 0-based ) of n_partitions contiguous
+		blocks of years, with a manifest for downscale.partition.merge_partitions. Pass them to DeltaDownscale
+		to skip the work on the other years. default:None ( all months )
+	encoding = [downscale.encoding.Encoding] store the outputs as scaled integers ( int16 / uint16 with
+		scale / offset tags ) -- i.e. downscale.encoding.ENCODINGS[ variable ] for outputs rounded by the
+		post_downscale_function. default:None ( float, as the baseline )
+
+	RETURNS:
+	--------
+	output_dir
+	'''
+	from functools import partial
+	from pathos.mp_map import mp_map
+
+	check_options( grid, time_chunk=time_chunk, pipeline=pipeline, compact=compact, tile_size=tile_size,
+					partition=partition, n_partitions=n_partitions, encoding=encoding,
+					post_downscale_function=dd.post_downscale_function )
+	operation_switch = { 'add':dd.utils.add, 'mult':dd.utils.mult }
+	src_shape = args[0][ 'anom' ].shape if len( args ) > 0 else None
+
+	# a partition writes a contiguous block of years -- the other partitions write the rest
+	if series_years is None:
+		series_years = sorted( set([ t.year for t in times ]) )
+	if partition is not None:
+		from downscale.partition import partition_years
+		years = partition_years( series_years, partition, n_partitions )
+		keep = np.isin([ t.year for t in times ], years )
+		args = [ arg for arg, k in zip( args, keep ) if k ]
+		output_filenames = [ fn for fn, k in zip( output_filenames, keep ) if k ]
+
+	run = partial( dd.utils._run_ds, f=f, operation_switch=operation_switch, anom=dd.anom, mask_value=dd.mask_value, grid=grid,
+				gdal_profile=dd.gdal_profile, encoding=encoding )
+
+	# run it -- the workers do the i/o, so bytes are counted from the files
+	# time_chunk bounds how many pickled task arguments are queued at once ( see downscale.planner )
+	if time_chunk is None:
+		time_chunk = len( args )
+	with dd._phase( 'downscale', tasks=len( args ), time_chunk=time_chunk, pipeline=pipeline, compact=compact,
+						tile_size=tile_size ) as event:
+		if tile_size is not None:
+			from downscale.tiles import downscale_tiled
+			out = downscale_tiled( args, grid, f, operation_switch, src_transform, src_shape,
+									tile_size=tile_size, anom=dd.anom, mask_value=dd.mask_value, ncpus=dd.ncpus,
+									encoding=encoding )
+		elif compact:
+			from downscale.compact import RegridWeights, downscale_compact
+			# bilinear / nearest regrid straight to the valid cells, anything else regrids the full grid and gathers
+			weights = None
+			if dd.resample_type in RegridWeights.methods:
+				weights = RegridWeights( grid, src_transform, src_shape, src_crs=dd.src_crs,
+										method=dd.resample_type, src_nodata=src_nodata )
+			out = downscale_compact( args, grid, operation_switch, weights=weights, f=f, anom=dd.anom, ncpus=dd.ncpus,
+										encoding=encoding )
+		elif pipeline:
+			from downscale.pipeline import downscale_tasks, report
+			out, dd.pipeline_stats = downscale_tasks( args, f, operation_switch, anom=dd.anom, mask_value=dd.mask_value,
+														grid=grid, ncompute=dd.ncpus, nwriters=nwriters, depth=depth,
+														encoding=encoding )
+			event[ 'stages' ] = dd.pipeline_stats
+			dd._progress( report( dd.pipeline_stats ) )
+		else:
+			out = []
+			for idx in range( 0, len( args ), max( 1, time_chunk ) ):
+				out = out + mp_map( run, args[ idx:idx + max( 1, time_chunk ) ], nproc=dd.ncpus )
+		event.update( bytes_read=files_size([ arg[ 'base' ] for arg in args ]), bytes_written=files_size( output_filenames ) )
+	if partition is not None:
+		from downscale.partition import write_manifest
+		from downscale.tiles import _anom_filename
+		anom_files = [ _anom_filename( fn ) for fn in output_filenames ] if dd.anom else None
+		write_manifest( output_dir, partition, n_partitions, output_filenames, years, ( min( series_years ), max( series_years ) ),
+						anom_files=anom_files )
+	return output_dir
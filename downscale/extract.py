@@ -0,0 +1,185 @@
+# -*- coding: utf8 -*-
+# # #
+# Point time-series extraction from downscaled archives.  Points are
+#  transformed to pixel indices once and only the 1x1 windows needed
+#  are read from each file (or indexed out of a cube), so I/O scales
+#  with the number of points and files, not the grid size.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, glob
+import numpy as np
+
+def _to_points( pts, names=None, crs='EPSG:4326' ):
+	'''
+	[hidden] normalize input points to ( names, xs, ys, crs ).
+
+	pts = [tuple/geopandas.GeoDataFrame] ( lons, lats ) sequences or a GeoDataFrame
+		of Point geometries.  A 'name' column is used for names if present.
+	'''
+	if hasattr( pts, 'geometry' ):
+		xs = np.array([ geom.x for geom in pts.geometry ])
+		ys = np.array([ geom.y for geom in pts.geometry ])
+		if names is None and 'name' in pts.columns:
+			names = pts[ 'name' ].tolist()
+		crs = pts.crs
+	else:
+		xs, ys = [ np.atleast_1d( np.asarray( i, dtype=np.float64 ) ) for i in pts ]
+	if names is None:
+		names = list( range( len( xs ) ) )
+	return list( names ), xs, ys, crs
+
+def pixel_index( xs, ys, src_crs, grid ):
+	'''
+	convert point coordinates to ( row, col ) on a grid with one vectorized transform.
+
+	ARGUMENTS:
+	----------
+	xs, ys = [numpy.ndarray] point coordinates in src_crs
+	src_crs = [str/dict/CRS] crs of the points
+	grid = [downscale.GridSpec] grid to index
+
+	RETURNS:
+	--------
+	rows, cols, inside -- int arrays and a bool array of points falling on the grid
+	'''
+	from rasterio.crs import CRS
+	from pyproj import Transformer
+
+	src_crs = CRS.from_user_input( src_crs )
+	if src_crs != grid.crs:
+		transformer = Transformer.from_crs( src_crs, grid.crs, always_xy=True )
+		xs, ys = transformer.transform( xs, ys )
+	cols, rows = ~grid.transform * ( np.asarray( xs ), np.asarray( ys ) )
+	rows = np.floor( rows ).astype( int )
+	cols = np.floor( cols ).astype( int )
+	inside = ( rows >= 0 ) & ( rows < grid.height ) & ( cols >= 0 ) & ( cols < grid.width )
+	return rows, cols, inside
+
+def read_points( fn, rows, cols ):
+	'''
+	read the values at ( rows, cols ) from a single raster using 1x1 windows.
+	nodata values are returned as np.nan, encoded rasters are decoded.
+	'''
+	import rasterio
+	from rasterio.windows import Window
+	from downscale.encoding import read_band
+
+	out = np.full( len( rows ), np.nan, dtype=np.float64 )
+	with rasterio.open( fn ) as rst:
+		for idx, (row, col) in enumerate( zip( rows, cols ) ):
+			val = read_band( rst, window=Window( int( col ), int( row ), 1, 1 ), masked=True )
+			if not np.ma.is_masked( val ):
+				out[ idx ] = val[ 0, 0 ]
+	return out
+
+def _read_points( x ):
+	''' [hidden] unpack args for pool.map '''
+	return read_points( *x )
+
+def list_files( archive, model, scenario, variable ):
+	''' list the SNAP-standard '<prefix>_MM_YYYY.tif' files for a model/scenario/variable in an archive '''
+	from downscale.utils import sort_files
+	files = glob.glob( os.path.join( archive, model, scenario, variable, '*.tif' ) )
+	files = [ fn for fn in files if not fn.endswith( '_anom.tif' ) ]
+	return sort_files( files )
+
+def points( archive, pts, variables, models, scenarios, names=None, crs='EPSG:4326', grid=None, ncpus=8 ):
+	'''
+	extract point time-series from a downscaled archive laid out as
+	<archive>/<model>/<scenario>/<variable>/<prefix>_MM_YYYY.tif
+
+	ARGUMENTS:
+	----------
+	archive = [str] path to the base directory of the downscaled archive.
+	pts = [tuple/geopandas.GeoDataFrame] ( lons, lats ) sequences in crs or a
+		GeoDataFrame of Point geometries (uses its own crs and 'name' column if present).
+	variables = [list] of str variable names
+	models = [list] of str model names
+	scenarios = [list] of str scenario names
+	names = [list] of point names. default:None (GeoDataFrame 'name' or 0..n-1)
+	crs = [str] crs of ( lons, lats ) point inputs. default:'EPSG:4326'
+	grid = [downscale.GridSpec] grid of the archive. default:None (read from the first file)
+	ncpus = [int] number of processes to read files with. default:8
+
+	RETURNS:
+	--------
+	tidy pandas.DataFrame with columns:
+		point, x, y, model, scenario, variable, month, year, value
+	'''
+	import pandas as pd
+	from downscale.grid import GridSpec
+	import multiprocessing as mp
+
+	names, xs, ys, crs = _to_points( pts, names=names, crs=crs )
+
+	jobs = [ (model, scenario, variable, list_files( archive, model, scenario, variable ))
+				for model in models for scenario in scenarios for variable in variables ]
+	jobs = [ job for job in jobs if len( job[-1] ) > 0 ]
+	if len( jobs ) == 0:
+		raise ValueError( 'no files found in archive for the requested models / scenarios / variables' )
+
+	if grid is None:
+		grid = GridSpec.from_raster( jobs[0][-1][0] )
+	rows, cols, inside = pixel_index( xs, ys, crs, grid )
+	if not inside.all():
+		import warnings
+		warnings.warn( 'points outside the grid are dropped: {}'.format( [ n for n, i in zip( names, inside ) if not i ] ) )
+	names = [ n for n, i in zip( names, inside ) if i ]
+	xs, ys, rows, cols = xs[ inside ], ys[ inside ], rows[ inside ], cols[ inside ]
+
+	pool = mp.Pool( ncpus ) if ncpus > 1 else None
+	out = []
+	try:
+		for model, scenario, variable, files in jobs:
+			args = [ (fn, rows, cols) for fn in files ]
+			if pool is not None:
+				values = pool.map( _read_points, args )
+			else:
+				values = [ _read_points( arg ) for arg in args ]
+			months, years = zip( *[ os.path.basename( fn ).split( '.' )[0].split( '_' )[-2:] for fn in files ] )
+			values = np.array( values ) # ( files, points )
+			nfiles, npts = values.shape
+			out.append( pd.DataFrame({ 'point':np.tile( names, nfiles ), 'x':np.tile( xs, nfiles ), 'y':np.tile( ys, nfiles ),
+							'model':model, 'scenario':scenario, 'variable':variable,
+							'month':np.repeat( np.array( months, dtype=int ), npts ),
+							'year':np.repeat( np.array( years, dtype=int ), npts ),
+							'value':values.ravel() }) )
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	return pd.concat( out, ignore_index=True )
+
+def points_from_cube( da, pts, names=None, crs='EPSG:4326', x='x', y='y' ):
+	'''
+	extract point time-series from an xarray ( time, y, x ) cube (i.e. a rechunked
+	NetCDF / Zarr store) with a single vectorized pointwise index so only the
+	chunks containing the points are read.
+
+	ARGUMENTS:
+	----------
+	da = [xarray.DataArray] cube with a 'time' dim and 1-D x / y coordinates.
+	pts = [tuple/geopandas.GeoDataFrame] see downscale.extract.points
+	names = [list] of point names. default:None
+	crs = [str] crs of the points.  default:'EPSG:4326'
+	x, y = [str] names of the x and y dims in da. default:'x','y'
+
+	RETURNS:
+	--------
+	tidy pandas.DataFrame with columns: point, time, value
+	'''
+	import xarray as xr
+	from pyproj import Transformer
+	from rasterio.crs import CRS
+
+	names, xs, ys, crs = _to_points( pts, names=names, crs=crs )
+	da_crs = da.attrs.get( 'crs', None )
+	if da_crs is not None and CRS.from_user_input( da_crs ) != CRS.from_user_input( crs ):
+		transformer = Transformer.from_crs( crs, da_crs, always_xy=True )
+		xs, ys = transformer.transform( xs, ys )
+	sel = da.sel( { x:xr.DataArray( xs, dims='point' ), y:xr.DataArray( ys, dims='point' ) }, method='nearest' )
+	sel = sel.assign_coords( point=names )
+	df = sel.to_dataframe( name='value' ).reset_index()
+	return df[ [ 'point', 'time', 'value' ] ]
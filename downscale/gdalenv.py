@@ -0,0 +1,98 @@
+# -*- coding: utf8 -*-
+# # #
+# GDAL performance profile of the downscale workers: warp threads, warp
+#  memory, block cache size and the SOURCE_EXTRA padding of each
+#  resampling method.  The profile's rasterio.Env is entered once per
+#  worker ( process or pipeline thread ) and kept for the life of the
+#  worker, so a few large months can use threaded warping in a handful
+#  of processes instead of 32 single-threaded ones.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import threading
+
+# source pixels of padding around the warp window -- the historical value used for every method
+DEFAULT_SOURCE_EXTRA = 1000
+
+# padding covering the kernel radius of each method.  Faster, but GDAL's approximate transformer then
+#  chunks the warp differently, so projected outputs are not identical to DEFAULT_SOURCE_EXTRA's
+KERNEL_SOURCE_EXTRA = { 'nearest':1, 'bilinear':2, 'cubic':3, 'cubic_spline':3, 'lanczos':4,
+						'average':2, 'mode':2 }
+
+class GDALProfile( object ):
+	'''
+	GDAL settings of the regrid / write in the downscale workers ( see utils.interp_ds ).
+	'''
+	def __init__( self, num_threads=1, warp_mem_limit=0, cache_max=None, source_extra=DEFAULT_SOURCE_EXTRA ):
+		'''
+		ARGUMENTS:
+		----------
+		num_threads = [int/str] warp threads per worker ( 'ALL_CPUS' for all ).  Also sets GDAL_NUM_THREADS
+			so GeoTiff compression of the outputs is threaded. default:1
+		warp_mem_limit = [int] MB of warp working memory, 0 for the GDAL default ( 64MB ). default:0
+		cache_max = [int] MB of GDAL block cache per worker ( GDAL_CACHEMAX ). default:None ( GDAL default,
+			5% of the node memory -- in every worker )
+		source_extra = [int/dict] SOURCE_EXTRA pixels around the warp source window, or a dict of them
+			by resample_type ( i.e. KERNEL_SOURCE_EXTRA ) falling back to DEFAULT_SOURCE_EXTRA.
+			default:DEFAULT_SOURCE_EXTRA
+		'''
+		self.num_threads = num_threads
+		self.warp_mem_limit = warp_mem_limit
+		self.cache_max = cache_max
+		self.source_extra = source_extra
+	def options( self ):
+		''' GDAL config options of the profile '''
+		options = {}
+		if self.num_threads not in ( None, 1 ):
+			options[ 'GDAL_NUM_THREADS' ] = str( self.num_threads )
+		if self.cache_max is not None:
+			options[ 'GDAL_CACHEMAX' ] = int( self.cache_max )
+		return options
+	def env( self ):
+		''' rasterio.Env with the profile's config options '''
+		import rasterio
+		return rasterio.Env( **self.options() )
+	def warp_kwargs( self, resample_type='bilinear' ):
+		''' keyword arguments of rasterio.warp.reproject for resample_type '''
+		source_extra = self.source_extra
+		if isinstance( source_extra, dict ):
+			source_extra = source_extra.get( resample_type, DEFAULT_SOURCE_EXTRA )
+		return { 'num_threads':self.num_threads, 'warp_mem_limit':self.warp_mem_limit, 'SOURCE_EXTRA':source_extra }
+	def __eq__( self, other ):
+		return isinstance( other, GDALProfile ) and vars( self ) == vars( other )
+	def __ne__( self, other ):
+		return not self == other
+	def __repr__( self ):
+		return 'GDALProfile( num_threads={num_threads!r}, warp_mem_limit={warp_mem_limit!r}, cache_max={cache_max!r}, source_extra={source_extra!r} )'.format( **vars( self ) )
+
+# the profile / entered Env of this worker -- per thread, as rasterio.Env is
+_LOCAL = threading.local()
+
+def activate( profile ):
+	'''
+	enter the rasterio.Env of profile in this process / thread and keep it -- the downscale
+	tasks call it first thing, so the Env is entered by the first task a worker runs.  A no-op
+	if profile is None or already active; a different profile replaces the active one.
+
+	RETURNS:
+	--------
+	the active GDALProfile or None
+	'''
+	if profile is None:
+		return None
+	active = getattr( _LOCAL, 'profile', None )
+	if active == profile:
+		return active
+	deactivate()
+	env = profile.env()
+	env.__enter__()
+	_LOCAL.profile, _LOCAL.env = profile, env
+	return profile
+
+def deactivate():
+	''' exit the Env entered by activate in this process / thread '''
+	env = getattr( _LOCAL, 'env', None )
+	if env is not None:
+		env.__exit__( None, None, None )
+	_LOCAL.profile, _LOCAL.env = None, None
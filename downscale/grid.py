@@ -0,0 +1,141 @@
+# -*- coding: utf8 -*-
+# # #
+# GridSpec: the geometry of a destination (or source) grid computed
+#  once -- crs, transform, shape, valid-cell mask, pixel-centre lon/lat
+#  and the flat index of valid cells -- and serialized to a small
+#  sidecar file so downstream steps don't reopen template rasters.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json
+import numpy as np
+
+class GridSpec( object ):
+	'''
+	geometry of a raster grid shared across Baseline, Mask, interp_ds and
+	the derived products.
+	'''
+	def __init__( self, crs, transform, shape, mask=None, nodata=None, dtype='float32' ):
+		'''
+		ARGUMENTS:
+		----------
+		crs = [str/dict/rasterio.crs.CRS] coordinate reference system of the grid.
+		transform = [affine.Affine] 6 element affine transform of the upper-left corner.
+		shape = [tuple] ( rows, cols )
+		mask = [numpy.ndarray] 2-D bool array where True marks valid (data) cells.
+			default:None (all cells are valid)
+		nodata = [float] nodata value used by rasters on this grid. default:None
+		dtype = [str] data type of rasters on this grid. default:'float32'
+		'''
+		from affine import Affine
+		from rasterio.crs import CRS
+
+		self.crs = CRS.from_user_input( crs )
+		self.transform = Affine( *tuple( transform )[:6] )
+		self.shape = tuple([ int( i ) for i in shape ])
+		if mask is None:
+			mask = np.ones( self.shape, dtype=bool )
+		self.mask = np.asarray( mask, dtype=bool )
+		if self.mask.shape != self.shape:
+			raise ValueError( 'mask shape {} does not match grid shape {}'.format( self.mask.shape, self.shape ) )
+		self.nodata = nodata
+		self.dtype = dtype
+		self._valid_index = None
+		self._lonlat = None
+	@classmethod
+	def from_raster( cls, fn, sidecar=None ):
+		'''
+		build a GridSpec from a template raster.  If a sidecar path is given and
+		exists it is loaded instead of opening the raster, otherwise it is written
+		there for the next run.
+		'''
+		import rasterio
+		if sidecar is not None and os.path.exists( sidecar ):
+			return cls.load( sidecar )
+		with rasterio.open( fn ) as rst:
+			grid = cls( rst.crs, rst.transform, rst.shape, mask=rst.read_masks( 1 ) != 0,
+						nodata=rst.nodata, dtype=rst.dtypes[0] )
+		if sidecar is not None:
+			grid.save( sidecar )
+		return grid
+	@classmethod
+	def from_latlon( cls, lat, lon, crs='EPSG:4326' ):
+		''' build a GridSpec from 1-D lat/lon coordinate arrays (i.e. a low-res model grid) '''
+		from downscale import utils
+		transform = utils.transform_from_latlon( lat, lon )
+		return cls( crs, transform, ( len( lat ), len( lon ) ) )
+	@property
+	def height( self ):
+		return self.shape[0]
+	@property
+	def width( self ):
+		return self.shape[1]
+	@property
+	def meta( self ):
+		''' rasterio-style single-band GTiff meta dictionary for writing on this grid '''
+		return { 'driver':'GTiff', 'dtype':self.dtype, 'nodata':self.nodata, 'width':self.width,
+				'height':self.height, 'count':1, 'crs':self.crs, 'transform':self.transform }
+	@property
+	def valid_index( self ):
+		''' flat (raveled) index of the valid cells '''
+		if self._valid_index is None:
+			self._valid_index, = np.where( self.mask.ravel() )
+		return self._valid_index
+	@property
+	def lonlat( self ):
+		''' pixel-centre ( lon, lat ) 2-D arrays from a single vectorized transform '''
+		if self._lonlat is None:
+			from pyproj import Transformer
+			from affine import Affine
+			rows, cols = np.indices( self.shape )
+			xs, ys = ( self.transform * Affine.translation( 0.5, 0.5 ) ) * ( cols.ravel(), rows.ravel() )
+			if self.crs.is_geographic:
+				lons, lats = np.asarray( xs ), np.asarray( ys )
+			else:
+				transformer = Transformer.from_crs( self.crs, 'EPSG:4326', always_xy=True )
+				lons, lats = transformer.transform( np.asarray( xs ), np.asarray( ys ) )
+			self._lonlat = ( np.asarray( lons ).reshape( self.shape ), np.asarray( lats ).reshape( self.shape ) )
+		return self._lonlat
+	@property
+	def signature( self ):
+		''' hex key identifying the grid geometry and mask '''
+		import hashlib
+		key = '|'.join([ self.crs.to_wkt(), ','.join([ repr( float( i ) ) for i in tuple( self.transform )[:6] ]),
+						'x'.join([ str( i ) for i in self.shape ]) ])
+		h = hashlib.sha1( key.encode( 'utf-8' ) )
+		h.update( np.packbits( self.mask ).tobytes() )
+		return h.hexdigest()
+	def scatter( self, values, fill=None ):
+		''' place a 1-D vector over the valid cells back into a full 2-D grid '''
+		if fill is None:
+			fill = self.nodata if self.nodata is not None else np.nan
+		out = np.full( self.height * self.width, fill, dtype=np.asarray( values ).dtype )
+		out[ self.valid_index ] = values
+		return out.reshape( self.shape )
+	def gather( self, arr ):
+		''' pull the valid cells out of a full 2-D grid as a 1-D vector '''
+		return np.asarray( arr ).ravel()[ self.valid_index ]
+	def save( self, fn ):
+		''' write the grid to a small .npz sidecar file (packed bit mask + json attributes) '''
+		attrs = { 'crs':self.crs.to_wkt(), 'transform':list( tuple( self.transform )[:6] ), 'shape':list( self.shape ),
+				'nodata':self.nodata, 'dtype':self.dtype }
+		dirname = os.path.dirname( fn )
+		try:
+			if dirname != '' and not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+		with open( fn, 'wb' ) as f:
+			np.savez_compressed( f, mask=np.packbits( self.mask ), attrs=np.array( json.dumps( attrs ) ) )
+		return fn
+	@classmethod
+	def load( cls, fn ):
+		''' read a GridSpec from a sidecar written with GridSpec.save '''
+		with np.load( fn ) as data:
+			attrs = json.loads( str( data[ 'attrs' ] ) )
+			shape = tuple( attrs[ 'shape' ] )
+			mask = np.unpackbits( data[ 'mask' ] )[ :shape[0]*shape[1] ].reshape( shape ).astype( bool )
+		return cls( attrs[ 'crs' ], attrs[ 'transform' ], shape, mask=mask, nodata=attrs[ 'nodata' ], dtype=attrs[ 'dtype' ] )
+	def __repr__( self ):
+		return 'GridSpec( crs={}, shape={}, valid={} )'.format( self.crs.to_string(), self.shape, int( self.mask.sum() ) )
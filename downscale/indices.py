@@ -0,0 +1,233 @@
+# -*- coding: utf8 -*-
+# # #
+# Vectorized climate indices computed over (time, y, x) monthly stacks.
+#  Each index is a function registered in INDICES that takes a single
+#  year of monthly data ( months, rows, cols ) and returns a 2-D array.
+#  Series are streamed one year at a time so memory is bounded by a
+#  12-month stack, and written as per-year GeoTIFFs or a multiband cube.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, warnings
+import numpy as np
+
+INDICES = {}
+
+def register( name ):
+	''' decorator to add an index function to the INDICES registry '''
+	def wrapper( f ):
+		INDICES[ name ] = f
+		return f
+	return wrapper
+
+def days_in_month( months, year ):
+	''' number of days in each month (1-12) for a given year -- leap aware '''
+	import calendar
+	return np.array([ calendar.monthrange( int( year ), int( month ) )[1] for month in months ])
+
+@register( 'swi' )
+def swi( arr, months, year, summer_months=(5,6,7,8,9), **kwargs ):
+	'''
+	Summer Warmth Index: sum of positive monthly mean temperatures for the
+	summer months (May-Sep default).
+	'''
+	idx = np.isin( months, summer_months )
+	return np.sum( np.clip( arr[ idx ], 0, None ), axis=0 )
+
+@register( 'degree_days' )
+def degree_days( arr, months, year, threshold=0.0, above=True, **kwargs ):
+	'''
+	degree-days from monthly means: sum of (monthly mean - threshold) * days in month
+	for months on the requested side of the threshold.  Below-threshold degree-days
+	are returned as positive values.
+	'''
+	days = days_in_month( months, year ).reshape( -1, 1, 1 )
+	if above == True:
+		diff = np.clip( arr - threshold, 0, None )
+	else:
+		diff = np.clip( threshold - arr, 0, None )
+	return np.sum( diff * days, axis=0 )
+
+@register( 'thawing_index' )
+def thawing_index( arr, months, year, **kwargs ):
+	''' degree-days above 0 '''
+	return degree_days( arr, months, year, threshold=0.0, above=True )
+
+@register( 'freezing_index' )
+def freezing_index( arr, months, year, **kwargs ):
+	''' degree-days below 0 (positive values) '''
+	return degree_days( arr, months, year, threshold=0.0, above=False )
+
+@register( 'percentile' )
+def percentile( arr, months, year, q=50, **kwargs ):
+	''' percentile q (0-100) of the monthly values in the year '''
+	return np.percentile( arr, q, axis=0 )
+
+@register( 'count_over' )
+def count_over( arr, months, year, threshold=0.0, **kwargs ):
+	''' count of months with values greater than threshold '''
+	return np.sum( arr > threshold, axis=0 ).astype( np.float32 )
+
+def group_years( files, split_on='_', elem_month=-2, elem_year=-1 ):
+	'''
+	group a list of SNAP-standard '<prefix>_MM_YYYY.tif' files by year
+
+	RETURNS:
+	--------
+	list of ( int year, list of int months, list of filenames ) sorted by year, month
+	'''
+	from downscale.utils import sort_files
+	files = sort_files( files, split_on=split_on, elem_month=elem_month, elem_year=elem_year )
+	parse = lambda fn, elem: int( os.path.basename( fn ).split( '.' )[0].split( split_on )[ elem ] )
+	out = []
+	for fn in files:
+		year, month = parse( fn, elem_year ), parse( fn, elem_month )
+		if len( out ) == 0 or out[-1][0] != year:
+			out.append( (year, [], []) )
+		out[-1][1].append( month )
+		out[-1][2].append( fn )
+	return out
+
+def calc_index( arr, months, year, index, **kwargs ):
+	'''
+	compute a registered index for a single year of data
+
+	ARGUMENTS:
+	----------
+	arr = [numpy.ndarray] 3-D ( months, rows, cols ) array with np.nan as nodata
+	months = [list] of int months (1-12) matching the first dimension of arr
+	year = [int] year of the data
+	index = [str] name of an index in INDICES
+	**kwargs = passed to the index function (i.e. threshold, q)
+
+	RETURNS:
+	--------
+	2-D numpy.ndarray float32
+	'''
+	if index not in INDICES:
+		raise ValueError( 'index must be one of {}'.format( sorted( INDICES.keys() ) ) )
+	with np.errstate( invalid='ignore' ), warnings.catch_warnings():
+		warnings.simplefilter( 'ignore', category=RuntimeWarning )
+		out = INDICES[ index ]( np.asarray( arr ), np.asarray( months ), year, **kwargs )
+	return np.asarray( out ).astype( np.float32 )
+
+def _read_year( files ):
+	''' [hidden] read a year of monthly files to a nan-filled stack and return the first files mask / nodata '''
+	import rasterio
+	from downscale.encoding import read_band
+	with rasterio.open( files[0] ) as rst:
+		mask = rst.read_masks( 1 )
+		nodata = rst.nodata
+	arr = []
+	for fn in files:
+		with rasterio.open( fn ) as rst:
+			arr.append( read_band( rst ) )
+	return np.array( arr ), mask, nodata
+
+def _run_year( x, index, round_func=None, **kwargs ):
+	''' [hidden] compute the index for one year group -- used for parallel runs '''
+	year, months, files = x
+	arr, mask, nodata = _read_year( files )
+	out = calc_index( arr, months, year, index, **kwargs )
+	if round_func is not None:
+		out = round_func( out )
+	out[ (mask == 0) | np.isnan( out ) ] = nodata
+	return year, out
+
+def compute_index( files, index, output_filenames=None, cube_filename=None, ncpus=1,
+					round_func=None, **kwargs ):
+	'''
+	compute an index for each year of a monthly series of SNAP-standard GeoTIFFs,
+	streaming a year at a time.  Writes either per-year rasters, a multiband cube
+	(one band per year), or both.
+
+	ARGUMENTS:
+	----------
+	files = [list] of str paths to monthly '<prefix>_MM_YYYY.tif' files.
+	index = [str] name of an index in INDICES.
+	output_filenames = [function] taking an int year and returning the output path for
+		that years raster.  If None no per-year rasters are written. default:None
+	cube_filename = [str] path to a multiband GeoTIFF with one band per year. default:None
+	ncpus = [int] number of processes to compute years in parallel. default:1
+	round_func = [function] applied to each output year array. i.e. np.rint. default:None
+	**kwargs = passed to the index function (i.e. threshold, q)
+
+	RETURNS:
+	--------
+	list of int years processed
+
+	'''
+	import rasterio
+	from functools import partial
+
+	groups = group_years( files )
+	with rasterio.open( groups[0][2][0] ) as rst:
+		meta = rst.meta.copy()
+	meta.update( compress='lzw', dtype='float32' )
+
+	f = partial( _run_year, index=index, round_func=round_func, **kwargs )
+	if ncpus > 1:
+		import multiprocessing as mp
+		pool = mp.Pool( ncpus )
+		results = pool.imap( f, groups ) # ordered -- lets us stream bands into the cube
+	else:
+		pool = None
+		results = ( f( group ) for group in groups )
+
+	cube = None
+	years = []
+	try:
+		for band, (year, arr) in enumerate( results ):
+			if output_filenames is not None:
+				output_filename = output_filenames( year )
+				dirname = os.path.dirname( output_filename )
+				try:
+					if not os.path.exists( dirname ):
+						os.makedirs( dirname )
+				except:
+					pass
+				with rasterio.open( output_filename, 'w', **meta ) as out:
+					out.write( arr, 1 )
+			if cube_filename is not None:
+				if cube is None:
+					cube_meta = meta.copy()
+					cube_meta.update( count=len( groups ) )
+					cube = rasterio.open( cube_filename, 'w', **cube_meta )
+				cube.write( arr, band+1 )
+				cube.update_tags( band+1, year=year )
+			years.append( year )
+	finally:
+		if cube is not None:
+			cube.close()
+		if pool is not None:
+			pool.close()
+			pool.join()
+	return years
+
+def compute_index_cube( da, index, **kwargs ):
+	'''
+	compute an index for each year of an xarray.DataArray ( time, y, x ) monthly cube.
+	Years are selected one at a time, so lazily opened (NetCDF) cubes are read in
+	year-sized chunks.
+
+	ARGUMENTS:
+	----------
+	da = [xarray.DataArray] monthly data with a datetime 'time' dimension first.
+	index = [str] name of an index in INDICES.
+	**kwargs = passed to the index function (i.e. threshold, q)
+
+	RETURNS:
+	--------
+	xarray.DataArray with dims ( year, y, x )
+	'''
+	import xarray as xr
+	years = np.unique( da[ 'time.year' ].values )
+	out = []
+	for year in years:
+		sub = da.isel( time=np.where( da[ 'time.year' ].values == year )[0] )
+		out.append( calc_index( sub.values, sub[ 'time.month' ].values, year, index, **kwargs ) )
+	dims = ( 'year', ) + tuple( da.dims[1:] )
+	coords = { dim:da.coords[ dim ] for dim in da.dims[1:] if dim in da.coords }
+	coords.update( year=years )
+	return xr.DataArray( np.array( out ), coords=coords, dims=dims, name=index )
@@ -0,0 +1,144 @@
+# -*- coding: utf8 -*-
+# # #
+# Structured per-phase instrumentation.  An Instrument times a named
+#  phase ( wall / cpu seconds, peak RSS, bytes read / written, task count )
+#  and hands the event dict to one or more sinks: a JSON-lines file, a
+#  logging logger or an in-memory list for tests.  Events carry the slurm
+#  job / array ids so runs of many jobs can be rolled up afterwards.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json, time, socket
+from contextlib import contextmanager
+
+SLURM_VARIABLES = [ 'SLURM_JOB_ID', 'SLURM_ARRAY_JOB_ID', 'SLURM_ARRAY_TASK_ID' ]
+
+def _rusage():
+	''' [hidden] ( cpu seconds of this process, cpu seconds of reaped children, maxrss MB ) '''
+	import resource, platform
+	own = resource.getrusage( resource.RUSAGE_SELF )
+	children = resource.getrusage( resource.RUSAGE_CHILDREN )
+	scale = 1024.0**2 if platform.system() == 'Darwin' else 1024.0
+	return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime, own.ru_maxrss / scale
+
+def _io_counters():
+	''' [hidden] ( bytes read, bytes written ) by this process from /proc/self/io, ( None, None ) if unavailable '''
+	try:
+		with open( '/proc/self/io' ) as f:
+			counters = dict( [ line.split( ':' ) for line in f if ':' in line ] )
+		return int( counters[ 'read_bytes' ] ), int( counters[ 'write_bytes' ] )
+	except Exception:
+		return None, None
+
+def files_size( files ):
+	''' total size in bytes of the files that exist -- bytes read / written by worker processes '''
+	return sum([ os.path.getsize( fn ) for fn in files if os.path.exists( fn ) ])
+
+class MemorySink( object ):
+	''' keep events in a list ( .events ) -- for tests and interactive use '''
+	def __init__( self ):
+		self.events = []
+	def __call__( self, event ):
+		self.events.append( event )
+
+class JSONLinesSink( object ):
+	''' append each event as a line of JSON.  The file is opened per event so many jobs can share it '''
+	def __init__( self, filename ):
+		self.filename = filename
+		dirname = os.path.dirname( filename )
+		try:
+			if dirname != '' and not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+	def __call__( self, event ):
+		with open( self.filename, 'a' ) as f:
+			f.write( json.dumps( event, default=str ) + '\n' )
+
+class LoggingSink( object ):
+	''' send each event to a logging logger ( by name ) as a one-line message with the event in extra['event'] '''
+	def __init__( self, name='downscale', level='INFO' ):
+		self.name = name
+		self.level = level
+	def __call__( self, event ):
+		import logging
+		level = logging.ERROR if event.get( 'status' ) == 'error' else getattr( logging, self.level )
+		logging.getLogger( self.name ).log( level, '{} {} {:.3f}s cpu:{:.3f}s rss:{:.1f}MB tasks:{}'.format( event.get( 'source' ),
+				event[ 'phase' ], event[ 'wall_seconds' ], event[ 'cpu_seconds' ], event[ 'maxrss_mb' ], event.get( 'tasks' ) ),
+				extra={ 'event':event } )
+
+class Instrument( object ):
+	'''
+	time named phases and emit one structured event per phase to the sinks.
+
+	each event has phase, source, start ( ISO time ), wall_seconds, cpu_seconds ( this process ),
+	child_cpu_seconds ( reaped worker processes ), maxrss_mb ( peak RSS of this process so far ),
+	bytes_read / bytes_written ( this process, from /proc/self/io, unless the phase sets them ),
+	tasks, status ( 'ok' / 'error' ), error, the instrument tags and any extra fields.
+	'''
+	def __init__( self, sinks=None, **tags ):
+		'''
+		ARGUMENTS:
+		----------
+		sinks = [callable/list] called with each event dict ( see MemorySink, JSONLinesSink, LoggingSink ).
+			default:None ( events are built but dropped )
+		tags = extra fields added to every event ( i.e. model, scenario, variable ). The host, pid
+			and slurm job ids are added when available.
+		'''
+		if sinks is None:
+			sinks = []
+		elif callable( sinks ):
+			sinks = [ sinks ]
+		self.sinks = list( sinks )
+		self.tags = { 'host':socket.gethostname(), 'pid':os.getpid() }
+		self.tags.update([ ( name.lower(), os.environ[ name ] ) for name in SLURM_VARIABLES if name in os.environ ])
+		self.tags.update( tags )
+	def emit( self, event ):
+		''' send an event to every sink '''
+		for sink in self.sinks:
+			sink( event )
+	@contextmanager
+	def phase( self, name, source=None, tasks=None, **fields ):
+		'''
+		context manager timing one phase.  Yields the event dict so the phase can set
+		tasks, bytes_read / bytes_written or extra fields before it is emitted.  Errors are
+		emitted with status='error' and re-raised.
+		'''
+		event = dict( self.tags, phase=name, source=source, tasks=tasks,
+					start=time.strftime( '%Y-%m-%dT%H:%M:%S' ), status='ok', error=None )
+		event.update( fields )
+		cpu0, child0, rss0 = _rusage()
+		read0, written0 = _io_counters()
+		tic = time.perf_counter()
+		try:
+			yield event
+		except Exception as e:
+			event.update( status='error', error='{}: {}'.format( type( e ).__name__, e ) )
+			raise
+		finally:
+			cpu1, child1, rss1 = _rusage()
+			read1, written1 = _io_counters()
+			event.update( wall_seconds=time.perf_counter() - tic, cpu_seconds=cpu1 - cpu0,
+						child_cpu_seconds=child1 - child0, maxrss_mb=rss1 )
+			if read0 is not None:
+				event.setdefault( 'bytes_read', read1 - read0 )
+				event.setdefault( 'bytes_written', written1 - written0 )
+			else:
+				event.setdefault( 'bytes_read', None )
+				event.setdefault( 'bytes_written', None )
+			self.emit( event )
+
+def as_instrument( instrument ):
+	'''
+	coerce the instrument argument of DeltaDownscale / Preprocess to an Instrument:
+	None ( no sinks ), an Instrument, a sink callable or list of sinks, or a str path
+	to a JSON-lines file.
+	'''
+	if instrument is None:
+		return Instrument()
+	if isinstance( instrument, Instrument ):
+		return instrument
+	if isinstance( instrument, str ):
+		return Instrument( JSONLinesSink( instrument ) )
+	return Instrument( instrument )
@@ -0,0 +1,201 @@
+# -*- coding: utf8 -*-
+# # #
+# Packaging of downscaled outputs into zip archives for CKAN / data
+#  delivery.  Members are read and hashed in parallel threads and written
+#  to the archive in order by one thread through the public ZipFile API,
+#  so deflation is serial within an archive -- build_archives runs several
+#  archives at once.  Members that are already compressed (LZW/DEFLATE
+#  GeoTIFFs, zips, gz...) are stored as-is rather than deflated again.  A sha256 manifest is written as the
+#  archive streams, and archives whose inputs are unchanged are skipped.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json, hashlib, zipfile, time
+
+COMPRESSED_EXTENSIONS = [ '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.png', '.jpg', '.jpeg' ]
+
+def already_compressed( fn ):
+	''' True if deflating the file again is a waste -- compressed formats and internally compressed GeoTIFFs '''
+	ext = os.path.splitext( fn )[1].lower()
+	if ext in COMPRESSED_EXTENSIONS:
+		return True
+	if ext in [ '.tif', '.tiff' ]:
+		import rasterio
+		with rasterio.open( fn ) as rst:
+			return rst.compression is not None
+	return False
+
+def inputs_signature( files ):
+	''' hex key of the archive inputs from their names, sizes and modification times ( no reads ) '''
+	h = hashlib.sha1()
+	for fn in files:
+		st = os.stat( fn )
+		h.update( '{}|{}|{}\n'.format( os.path.basename( fn ), st.st_size, st.st_mtime_ns ).encode( 'utf-8' ) )
+	return h.hexdigest()
+
+def _state_filename( out_fn ):
+	return out_fn + '.json'
+
+def _manifest_filename( out_fn ):
+	return out_fn + '.sha256'
+
+def is_current( files, out_fn ):
+	''' True if out_fn exists and was built from exactly these (unchanged) inputs '''
+	state_fn = _state_filename( out_fn )
+	if not os.path.exists( out_fn ) or not os.path.exists( state_fn ):
+		return False
+	with open( state_fn ) as f:
+		state = json.load( f )
+	return state.get( 'signature' ) == inputs_signature( files )
+
+def _prepare_member( fn, store=None, blocksize=2**24 ):
+	'''
+	[hidden] read a file once in a worker thread and return everything needed to write it to the
+	archive: ( fn, data, sha256, compress_type ).
+	'''
+	if store is None:
+		store = already_compressed( fn )
+	sha = hashlib.sha256()
+	chunks = []
+	with open( fn, 'rb' ) as f:
+		while True:
+			block = f.read( blocksize )
+			if not block:
+				break
+			sha.update( block )
+			chunks.append( block )
+	compress_type = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+	return fn, b''.join( chunks ), sha.hexdigest(), compress_type
+
+def _write_member( zf, arcname, mtime, data, compress_type, level=6 ):
+	''' [hidden] write ( and deflate ) a member in the writer thread through the public ZipFile.writestr '''
+	zinfo = zipfile.ZipInfo( arcname, date_time=time.localtime( mtime )[:6] )
+	zinfo.external_attr = 0o644 << 16
+	# a ZipInfo does not pick up the ZipFile's compresslevel -- writestr takes it per member
+	zf.writestr( zinfo, data, compress_type=compress_type, compresslevel=level )
+	return zinfo
+
+def build_archive( files, out_fn, nthreads=8, level=6, store=None, force=False ):
+	'''
+	build a zip archive with members read / hashed in parallel threads and written ( deflated )
+	in order by this thread, with a sha256 manifest ( <out_fn>.sha256 ) written as it streams.
+
+	ARGUMENTS:
+	----------
+	files = [list] of str paths to put in the archive (stored by basename, like zip -j)
+	out_fn = [str] output .zip path
+	nthreads = [int] number of threads reading / hashing members. default:8
+	level = [int] zlib compression level of the deflated members. default:6
+	store = [bool] force stored (True) or deflated (False) members. default:None (stored if
+		already compressed, see already_compressed)
+	force = [bool] rebuild even if the inputs are unchanged since the last build. default:False
+
+	RETURNS:
+	--------
+	dict with out_fn, skipped, members, bytes_in, bytes_out, seconds
+	'''
+	from concurrent.futures import ThreadPoolExecutor
+	from functools import partial
+
+	files = list( files )
+	if not force and is_current( files, out_fn ):
+		return { 'out_fn':out_fn, 'skipped':True, 'members':len( files ), 'bytes_in':0, 'bytes_out':0, 'seconds':0.0 }
+
+	dirname = os.path.dirname( out_fn )
+	try:
+		if dirname != '' and not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
+
+	# build next to the output and move into place so a killed run never leaves a 'current' archive
+	tmp_fn = out_fn + '.part'
+	tmp_manifest = _manifest_filename( out_fn ) + '.part'
+	signature = inputs_signature( files )
+	prepare = partial( _prepare_member, store=store )
+	bytes_in = bytes_out = 0
+	tic = time.time()
+	with ThreadPoolExecutor( max_workers=nthreads ) as executor, \
+			zipfile.ZipFile( tmp_fn, 'w', allowZip64=True, compresslevel=level ) as zf, \
+			open( tmp_manifest, 'w' ) as manifest:
+		# keep at most 2 * nthreads members in memory
+		window = 2 * nthreads
+		pending = [ executor.submit( prepare, fn ) for fn in files[ :window ] ]
+		for idx in range( len( files ) ):
+			fn, data, sha, compress_type = pending[ idx ].result()
+			pending[ idx ] = None
+			if idx + window < len( files ):
+				pending.append( executor.submit( prepare, files[ idx + window ] ) )
+			arcname = os.path.basename( fn )
+			zinfo = _write_member( zf, arcname, os.stat( fn ).st_mtime, data, compress_type, level=level )
+			manifest.write( '{}  {}\n'.format( sha, arcname ) )
+			bytes_in += zinfo.file_size
+			bytes_out += zinfo.compress_size
+
+	os.replace( tmp_fn, out_fn )
+	os.replace( tmp_manifest, _manifest_filename( out_fn ) )
+	with open( _state_filename( out_fn ), 'w' ) as f:
+		json.dump( { 'signature':signature, 'members':len( files ) }, f )
+	return { 'out_fn':out_fn, 'skipped':False, 'members':len( files ), 'bytes_in':bytes_in,
+			'bytes_out':bytes_out, 'seconds':time.time() - tic }
+
+def _build_archive( x ):
+	''' [hidden] unpack ( files, out_fn, kwargs ) for pool.imap_unordered '''
+	files, out_fn, kwargs = x
+	return build_archive( files, out_fn, **kwargs )
+
+def build_archives( jobs, ncpus=4, **kwargs ):
+	'''
+	build many archives, ncpus at a time, each with its own member threads.
+
+	ARGUMENTS:
+	----------
+	jobs = [list] of ( files, out_fn ) tuples
+	ncpus = [int] number of archives built at once. default:4
+	kwargs = passed to build_archive ( nthreads, level, store, force )
+
+	RETURNS:
+	--------
+	list of build_archive result dicts
+	'''
+	import multiprocessing as mp
+
+	args = [ ( files, out_fn, kwargs ) for files, out_fn in jobs ]
+	out = []
+	if ncpus > 1:
+		pool = mp.Pool( ncpus )
+		results = pool.imap_unordered( _build_archive, args )
+	else:
+		pool = None
+		results = map( _build_archive, args )
+	try:
+		for result in results:
+			out.append( result )
+			if result[ 'skipped' ]:
+				print( 'unchanged: {}'.format( result[ 'out_fn' ] ) )
+			else:
+				print( 'built: {} ( {} members, {:.1f} MB/s )'.format( result[ 'out_fn' ], result[ 'members' ],
+						result[ 'bytes_in' ] / 1e6 / max( result[ 'seconds' ], 1e-9 ) ) )
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	return out
+
+def verify_archive( out_fn ):
+	''' re-read an archive and check every member against its manifest. returns a list of bad member names '''
+	with open( _manifest_filename( out_fn ) ) as f:
+		expected = dict( [ line.rstrip( '\n' ).split( '  ', 1 )[::-1] for line in f if line.strip() ] )
+	bad = []
+	with zipfile.ZipFile( out_fn ) as zf:
+		names = zf.namelist()
+		for name in names:
+			sha = hashlib.sha256()
+			with zf.open( name ) as member:
+				for block in iter( lambda: member.read( 2**24 ), b'' ):
+					sha.update( block )
+			if expected.get( name ) != sha.hexdigest():
+				bad.append( name )
+	bad = bad + [ name for name in expected if name not in names ]
+	return bad
@@ -0,0 +1,208 @@
+# -*- coding: utf8 -*-
+# # #
+# Time-partitioned downscaling runs ( i.e. one slurm array task per block
+#  of years ).  Partition k of N takes a deterministic contiguous block of
+#  the years of the series, writes only those months and records them in a
+#  small json manifest beside the outputs.  Once all tasks finish the
+#  manifests are checked for gaps / overlaps / missing or truncated files
+#  and the months are merged into the chunked stores of downscale.rechunk.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json, hashlib
+import numpy as np
+
+def partition_years( years, partition, n_partitions ):
+	'''
+	the contiguous block of years handled by one partition.
+
+	ARGUMENTS:
+	----------
+	years = [array-like] years of the time steps ( repeats are fine )
+	partition = [int] 0-based partition number ( i.e. $SLURM_ARRAY_TASK_ID )
+	n_partitions = [int] number of partitions. Blocks differ in length by at most one year.
+
+	RETURNS:
+	--------
+	sorted list of the years of the partition ( empty if there are more partitions than years )
+	'''
+	if n_partitions is None or n_partitions < 1 or not 0 <= partition < n_partitions:
+		raise ValueError( 'partition must be in [0, {}), not {}'.format( n_partitions, partition ) )
+	unique = np.unique( np.asarray( years, dtype=int ) )
+	return [ int( year ) for year in np.array_split( unique, n_partitions )[ partition ] ]
+
+def partition_mask( times, partition, n_partitions ):
+	''' bool array of the time steps ( datetimes / cftimes ) falling in a partition's years '''
+	years = np.array([ t.year for t in times ])
+	return np.isin( years, partition_years( years, partition, n_partitions ) )
+
+def manifest_filename( output_dir, partition, n_partitions ):
+	return os.path.join( output_dir, 'partition_{:04d}_of_{:04d}.json'.format( partition, n_partitions ) )
+
+def _sha256( fn, blocksize=2**24 ):
+	''' [hidden] hex sha256 of a file '''
+	sha = hashlib.sha256()
+	with open( fn, 'rb' ) as f:
+		for block in iter( lambda: f.read( blocksize ), b'' ):
+			sha.update( block )
+	return sha.hexdigest()
+
+def _records( output_dir, files, checksum=True ):
+	''' [hidden] name ( relative to output_dir ), size and sha256 of each output '''
+	records = []
+	for fn in files:
+		record = { 'name':os.path.relpath( fn, output_dir ), 'size':os.path.getsize( fn ) }
+		if checksum:
+			record[ 'sha256' ] = _sha256( fn )
+		records.append( record )
+	return records
+
+def write_manifest( output_dir, partition, n_partitions, files, years, series_years, checksum=True, anom_files=None ):
+	'''
+	record the outputs of a partition.
+
+	ARGUMENTS:
+	----------
+	output_dir = [str] directory of the outputs
+	partition, n_partitions = [int] see partition_years
+	files = [list] output filenames written by the partition
+	years = [list] years of the partition
+	series_years = [tuple] ( first, last ) year of the full series
+	checksum = [bool] store the sha256 of each output. default:True
+	anom_files = [list] anomaly outputs written by the partition ( DeltaDownscale anom=True ), recorded
+		apart from the files so they are verified but not merged. default:None
+
+	RETURNS:
+	--------
+	manifest filename
+	'''
+	manifest = { 'partition':partition, 'n_partitions':n_partitions, 'years':list( years ),
+				'series_years':[ int( series_years[0] ), int( series_years[1] ) ],
+				'files':_records( output_dir, files, checksum=checksum ) }
+	if anom_files is not None:
+		manifest[ 'anom_files' ] = _records( output_dir, anom_files, checksum=checksum )
+	try:
+		if not os.path.exists( output_dir ):
+			os.makedirs( output_dir )
+	except:
+		pass
+	out_fn = manifest_filename( output_dir, partition, n_partitions )
+	# write then rename, so a manifest only exists once the partition is complete
+	with open( out_fn + '.part', 'w' ) as f:
+		json.dump( manifest, f, indent=1 )
+	os.replace( out_fn + '.part', out_fn )
+	return out_fn
+
+def verify_partitions( output_dir, n_partitions, checksum=False ):
+	'''
+	check the manifests of all partitions of a run.
+
+	ARGUMENTS:
+	----------
+	output_dir = [str] directory of the outputs and manifests
+	n_partitions = [int] number of partitions of the run
+	checksum = [bool] also compare the sha256 of each output ( reads them all ). default:False
+
+	RETURNS:
+	--------
+	list of the output filenames of the run, in chronological order ( without the anomaly outputs, which
+	are checked too ).  Raises ValueError listing missing manifests / files, size or checksum mismatches
+	and gaps or overlaps in the years.
+	'''
+	from downscale.utils import sort_files
+	problems = []
+	files = []
+	years = []
+	series = set()
+	for partition in range( n_partitions ):
+		fn = manifest_filename( output_dir, partition, n_partitions )
+		if not os.path.exists( fn ):
+			problems.append( 'missing manifest of partition {}'.format( partition ) )
+			continue
+		with open( fn ) as f:
+			manifest = json.load( f )
+		years = years + manifest[ 'years' ]
+		series.add( tuple( manifest[ 'series_years' ] ) )
+		for key in [ 'files', 'anom_files' ]:
+			for record in manifest.get( key, [] ):
+				out_fn = os.path.join( output_dir, record[ 'name' ] )
+				if not os.path.exists( out_fn ):
+					problems.append( 'missing output {}'.format( record[ 'name' ] ) )
+				elif os.path.getsize( out_fn ) != record[ 'size' ]:
+					problems.append( 'size mismatch {}'.format( record[ 'name' ] ) )
+				elif checksum and 'sha256' in record and _sha256( out_fn ) != record[ 'sha256' ]:
+					problems.append( 'checksum mismatch {}'.format( record[ 'name' ] ) )
+				if key == 'files':
+					files.append( out_fn )
+
+	if len( series ) > 1:
+		problems.append( 'partitions disagree on the series years: {}'.format( sorted( series ) ) )
+	elif len( series ) == 1 and len( problems ) == 0:
+		first, last = series.pop()
+		overlap = sorted( set([ year for year in years if years.count( year ) > 1 ]) )
+		gaps = sorted( set( range( first, last + 1 ) ) - set( years ) )
+		if len( overlap ) > 0:
+			problems.append( 'years written by more than one partition: {}'.format( overlap ) )
+		if len( gaps ) > 0:
+			problems.append( 'years not written: {}'.format( gaps ) )
+	if len( problems ) > 0:
+		raise ValueError( '{} partitions in {} failed verification:\n{}'.format( n_partitions, output_dir, '\n'.join( problems ) ) )
+	return sort_files( files )
+
+def verify_cube( store, files, fmt=None, varname=None ):
+	'''
+	check a merged store against the month files it was built from -- the time axis and the first
+	and last months.
+
+	RETURNS:
+	--------
+	list of problems ( empty if the store matches )
+	'''
+	import xarray as xr
+	from downscale.rechunk import parse_times, read_block, _store_format
+
+	if _store_format( store, fmt ) == 'zarr':
+		ds = xr.open_zarr( store )
+	else:
+		ds = xr.open_dataset( store )
+	problems = []
+	try:
+		if varname is None:
+			varname, = list( ds.data_vars )
+		times = parse_times( files )
+		if len( ds.time ) != len( times ) or not ( ds.time.to_index() == times ).all():
+			return [ '{} time axis does not match its {} files'.format( store, len( files ) ) ]
+		for idx in sorted( set([ 0, len( files ) - 1 ]) ):
+			arr = read_block( files[ idx:idx + 1 ], slice( 0, ds[ varname ].shape[1] ), slice( 0, ds[ varname ].shape[2] ) )[0]
+			if not np.allclose( ds[ varname ][ idx ].values, arr, equal_nan=True ):
+				problems.append( '{} differs from {}'.format( store, os.path.basename( files[ idx ] ) ) )
+	finally:
+		ds.close()
+	return problems
+
+def merge_partitions( output_dir, n_partitions, output_prefix, fmt='netcdf', checksum=False, **kwargs ):
+	'''
+	verify a partitioned run and merge its months into the pixel / time stores of downscale.rechunk.
+
+	ARGUMENTS:
+	----------
+	output_dir, n_partitions, checksum = see verify_partitions
+	output_prefix = [str] prefix of the stores ( see rechunk.rechunk_series )
+	fmt = [str] 'zarr' or 'netcdf'. default:'netcdf'
+	kwargs = passed to rechunk.rechunk_series ( layouts, tile, time_chunk, max_mem, ncpus... )
+
+	RETURNS:
+	--------
+	dict of layout to output store path.  Raises ValueError if the run or a store fails verification.
+	'''
+	from downscale.rechunk import rechunk_series
+
+	files = verify_partitions( output_dir, n_partitions, checksum=checksum )
+	stores = rechunk_series( files, output_prefix, fmt=fmt, **kwargs )
+	problems = []
+	for layout, store in sorted( stores.items() ):
+		problems = problems + verify_cube( store, files, fmt=fmt )
+	if len( problems ) > 0:
+		raise ValueError( '\n'.join( problems ) )
+	return stores
@@ -0,0 +1,191 @@
+# -*- coding: utf8 -*-
+# # #
+# Pipelined read / compute / write executor.  Tasks flow through stages
+#  of worker threads joined by bounded queues, so a reader prefetches the
+#  next baseline months while the compute threads regrid ( GDAL warping
+#  and numpy release the GIL ) and a writer pool LZW-encodes and writes
+#  behind them.  Each stage reports how busy its workers were, how long
+#  they waited for input ( starved ) and for room downstream ( blocked ).
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import time, threading
+from collections import OrderedDict
+
+_DONE = object()
+
+class Stage( object ):
+	''' a named step of the pipeline: func( item ) -> item for the next stage, run by workers threads '''
+	def __init__( self, name, func, workers=1 ):
+		self.name = name
+		self.func = func
+		self.workers = max( 1, int( workers ) )
+		self.items = 0
+		self.busy = 0.0
+		self.starved = 0.0
+		self.blocked = 0.0
+		self._lock = threading.Lock()
+	def _add( self, busy, starved, blocked ):
+		with self._lock:
+			self.items += 1
+			self.busy += busy
+			self.starved += starved
+			self.blocked += blocked
+	def stats( self, wall ):
+		''' dict of workers, items, busy / starved / blocked seconds ( summed over workers ) and utilization '''
+		capacity = max( wall * self.workers, 1e-9 )
+		return { 'workers':self.workers, 'items':self.items, 'busy_seconds':self.busy, 'starved_seconds':self.starved,
+				'blocked_seconds':self.blocked, 'utilization':self.busy / capacity }
+
+def run_pipeline( items, stages, depth=4 ):
+	'''
+	run items through stages of worker threads connected by bounded queues.
+
+	ARGUMENTS:
+	----------
+	items = [iterable] inputs of the first stage -- consumed lazily, so it can be a generator
+	stages = [list] of Stage.  The output of the last stage is collected.
+	depth = [int] most items waiting in front of each stage ( memory bound = depth * item size
+		per stage ). default:4
+
+	RETURNS:
+	--------
+	( list of outputs of the last stage in completion order, OrderedDict of stage name: Stage.stats )
+	The first error raised by any stage is re-raised after the pipeline drains.
+	'''
+	try:
+		from queue import Queue
+	except ImportError:
+		from Queue import Queue
+
+	queues = [ Queue( maxsize=max( 1, depth ) ) for stage in stages ]
+	results = []
+	errors = []
+	alive = [ stage.workers for stage in stages ]
+	lock = threading.Lock()
+
+	def feed():
+		try:
+			for item in items:
+				if len( errors ) > 0:
+					break
+				queues[0].put( item )
+		except Exception as e:
+			errors.append( e )
+		finally:
+			for i in range( stages[0].workers ):
+				queues[0].put( _DONE )
+
+	def work( idx ):
+		stage = stages[ idx ]
+		inbox = queues[ idx ]
+		outbox = queues[ idx + 1 ] if idx + 1 < len( stages ) else None
+		while True:
+			tic = time.perf_counter()
+			item = inbox.get()
+			starved = time.perf_counter() - tic
+			if item is _DONE:
+				break
+			if len( errors ) > 0:
+				# drain without working so upstream never blocks
+				continue
+			tic = time.perf_counter()
+			try:
+				out = stage.func( item )
+			except Exception as e:
+				errors.append( e )
+				continue
+			busy = time.perf_counter() - tic
+			tic = time.perf_counter()
+			if outbox is None:
+				with lock:
+					results.append( out )
+			else:
+				outbox.put( out )
+			stage._add( busy, starved, time.perf_counter() - tic )
+		# the last worker out of a stage closes the next one
+		with lock:
+			alive[ idx ] -= 1
+			last = alive[ idx ] == 0
+		if last and outbox is not None:
+			for i in range( stages[ idx + 1 ].workers ):
+				outbox.put( _DONE )
+
+	tic = time.perf_counter()
+	threads = [ threading.Thread( target=feed ) ]
+	for idx, stage in enumerate( stages ):
+		threads = threads + [ threading.Thread( target=work, args=( idx, ) ) for i in range( stage.workers ) ]
+	for thread in threads:
+		thread.daemon = True
+		thread.start()
+	for thread in threads:
+		thread.join()
+	wall = time.perf_counter() - tic
+	if len( errors ) > 0:
+		raise errors[0]
+	return results, OrderedDict([ ( stage.name, stage.stats( wall ) ) for stage in stages ])
+
+def report( stats ):
+	''' one line per stage of run_pipeline stats '''
+	return '\n'.join([ '{:<8} workers:{:>3} items:{:>6} utilization:{:>6.1%} busy:{:>9.2f}s starved:{:>9.2f}s blocked:{:>9.2f}s'.format(
+						name, s[ 'workers' ], s[ 'items' ], s[ 'utilization' ], s[ 'busy_seconds' ], s[ 'starved_seconds' ],
+						s[ 'blocked_seconds' ] ) for name, s in stats.items() ])
+
+class _BaseCache( object ):
+	''' [hidden] baseline months read once and kept ( the 12 months repeat across the series ) '''
+	def __init__( self, grid=None, size=12 ):
+		self.grid = grid
+		self.size = size
+		self._cache = OrderedDict()
+		self._lock = threading.Lock()
+	def __call__( self, d ):
+		from downscale.utils import _read_base
+		key = d[ 'base' ]
+		with self._lock:
+			if key in self._cache:
+				return self._cache[ key ]
+		value = _read_base( d, grid=self.grid )
+		with self._lock:
+			self._cache[ key ] = value
+			while len( self._cache ) > self.size:
+				self._cache.popitem( last=False )
+		return value
+
+def downscale_tasks( args, f, operation_switch, anom=False, mask_value=0, grid=None, ncompute=4, nwriters=2, depth=4, encoding=None ):
+	'''
+	run downscale tasks ( the dicts built in DeltaDownscale.downscale ) through a read / compute /
+	write pipeline -- the threaded counterpart of mapping utils._run_ds over a process pool.
+
+	ARGUMENTS:
+	----------
+	args = [iterable] of task dicts ( anom, base, output_filename, downscaling_operation, post_downscale_function, ... )
+	f = [function] regridding function called with **task ( i.e. partial( utils.interp_ds, ... ) )
+	operation_switch = [dict] { 'add':utils.add, 'mult':utils.mult }
+	anom = [bool] also write the regridded anomalies. default:False
+	mask_value = [int] mask value marking nodata cells. default:0
+	grid = [downscale.GridSpec] baseline grid ( mask / meta ). default:None ( read from each baseline file )
+	ncompute = [int] regrid / compute threads. default:4
+	nwriters = [int] encode / write threads. default:2
+	depth = [int] queue depth in front of each stage. default:4
+	encoding = [downscale.encoding.Encoding] store the outputs as scaled integers. default:None ( float )
+
+	RETURNS:
+	--------
+	( output filenames, stage stats ) -- see run_pipeline
+	'''
+	from downscale.utils import _compute_ds, _write_ds
+	read_base = _BaseCache( grid=grid )
+
+	def read( d ):
+		return d, read_base( d )
+	def compute( item ):
+		d, ( base_arr, mask, meta ) = item
+		interped, output_arr = _compute_ds( d, f, operation_switch, base_arr, mask, meta, mask_value=mask_value )
+		return d, interped, output_arr, meta
+	def write( item ):
+		d, interped, output_arr, meta = item
+		return _write_ds( d, interped, output_arr, meta, anom=anom, encoding=encoding )
+
+	stages = [ Stage( 'read', read, 1 ), Stage( 'compute', compute, ncompute ), Stage( 'write', write, nwriters ) ]
+	return run_pipeline( args, stages, depth=depth )
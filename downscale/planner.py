@@ -0,0 +1,283 @@
+# -*- coding: utf8 -*-
+# # #
+# Dry-run memory planner for DeltaDownscale.  Estimates the peak memory of
+#  each phase from the input series shapes / dtype and the output grid,
+#  reads how much memory and how many cpus this job may actually use
+#  ( cgroup / slurm aware, not just what the node has ) and picks the
+#  worker count and time-chunk size that fit, before anything is loaded.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+# rough per-process overhead of a downscale worker ( python, numpy, gdal, rasterio ) in bytes
+WORKER_OVERHEAD = 200 * 1024**2
+
+# bytes per output cell held by a worker in utils._run_ds: the reprojected anomaly, the baseline,
+# the int mask, the downscaled array and the masked / rounded copies for the post function
+WORKER_BYTES_PER_CELL = 32
+
+def _read_int( fn ):
+	''' [hidden] integer in a /proc or /sys file, None if missing or unlimited ( 'max' ) '''
+	try:
+		with open( fn ) as f:
+			value = f.read().strip().split()[0]
+		return None if value == 'max' else int( value )
+	except Exception:
+		return None
+
+def available_memory():
+	'''
+	bytes of memory this process can still use: the smallest of MemAvailable
+	( /proc/meminfo ), the cgroup v2 / v1 limit minus current usage and the slurm
+	allocation ( SLURM_MEM_PER_NODE or SLURM_MEM_PER_CPU * SLURM_CPUS_ON_NODE, MB ).
+	None if none of them can be read.
+	'''
+	candidates = []
+	try:
+		with open( '/proc/meminfo' ) as f:
+			meminfo = dict([ ( line.split( ':' )[0], line.split( ':' )[1] ) for line in f if ':' in line ])
+		candidates.append( int( meminfo[ 'MemAvailable' ].split()[0] ) * 1024 )
+	except Exception:
+		pass
+	for limit_fn, usage_fn in [ ( '/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current' ),
+								( '/sys/fs/cgroup/memory/memory.limit_in_bytes', '/sys/fs/cgroup/memory/memory.usage_in_bytes' ) ]:
+		limit = _read_int( limit_fn )
+		# cgroup v1 reports 'unlimited' as a huge page-rounded number
+		if limit is not None and limit < 2**60:
+			candidates.append( limit - ( _read_int( usage_fn ) or 0 ) )
+	if 'SLURM_MEM_PER_NODE' in os.environ:
+		candidates.append( int( os.environ[ 'SLURM_MEM_PER_NODE' ] ) * 1024**2 )
+	elif 'SLURM_MEM_PER_CPU' in os.environ and 'SLURM_CPUS_ON_NODE' in os.environ:
+		candidates.append( int( os.environ[ 'SLURM_MEM_PER_CPU' ] ) * int( os.environ[ 'SLURM_CPUS_ON_NODE' ] ) * 1024**2 )
+	return min( candidates ) if len( candidates ) > 0 else None
+
+def available_cpus():
+	''' cpus this process may use: cpu affinity, the cgroup v2 cpu quota and SLURM_CPUS_PER_TASK '''
+	try:
+		candidates = [ len( os.sched_getaffinity( 0 ) ) ]
+	except AttributeError:
+		candidates = [ os.cpu_count() or 1 ]
+	try:
+		with open( '/sys/fs/cgroup/cpu.max' ) as f:
+			quota, period = f.read().split()
+		if quota != 'max':
+			candidates.append( max( 1, int( int( quota ) / int( period ) ) ) )
+	except Exception:
+		pass
+	if 'SLURM_CPUS_PER_TASK' in os.environ:
+		candidates.append( int( os.environ[ 'SLURM_CPUS_PER_TASK' ] ) )
+	return min( candidates )
+
+def estimate( n_historical, n_future, src_shape, dst_shape, itemsize=8, ncpus=1, time_chunk=None, fix_clim=False, interp=False,
+			tile_size=None, n_out=None, n_series=None ):
+	'''
+	estimate peak bytes held during each DeltaDownscale phase.
+
+	ARGUMENTS:
+	----------
+	n_historical, n_future = [int] time steps in the historical and future series ( n_future 0 if None )
+	src_shape = [tuple] ( nlat, nlon ) of the model grid
+	dst_shape = [tuple] ( rows, cols ) of the baseline grid
+	itemsize = [int] bytes per value of the decoded series. default:8
+	ncpus = [int] worker processes during downscale. default:1
+	time_chunk = [int] time steps sent to the workers at once. default:None ( all of them )
+	fix_clim, interp = [bool] as passed to DeltaDownscale -- the interpolation phases run in workers.
+	tile_size = [int] as passed to DeltaDownscale.downscale -- workers hold one tile. default:None
+	n_out = [int] time steps downscaled ( i.e. those of a partition ). default:None ( all of the output series )
+	n_series = [int] time steps of the series the run concatenates and works on -- a partitioned run selects
+		the partition's years before the concat. default:None ( n_historical + n_future )
+
+	RETURNS:
+	--------
+	dict of phase: { 'parent':bytes, 'workers':bytes, 'total':bytes } in run order
+	'''
+	grid = int( np.prod( src_shape ) ) * itemsize
+	# the loaded Dataset series, and the one the run works on
+	loaded = ( n_historical + n_future ) * grid
+	series = loaded if n_series is None else n_series * grid
+	if n_out is None:
+		n_out = n_future if n_future > 0 else n_historical
+	out = n_out * grid
+	chunk = n_out if time_chunk is None else min( time_chunk, n_out )
+	dst_cells = int( np.prod( dst_shape ) )
+	if tile_size is not None:
+		dst_cells = min( dst_cells, tile_size * tile_size )
+	worker = WORKER_OVERHEAD + dst_cells * WORKER_BYTES_PER_CELL + 2 * grid
+
+	phases = [
+		# Dataset objects load and flip the series ( a list of slices and the new array )
+		( 'open', 2 * loaded, 0 ),
+		# the inputs and their concatenation are both alive
+		( 'concat', loaded + series, 0 ),
+		( 'climatology', loaded + series + 12 * grid, 0 ),
+	]
+	if fix_clim or interp:
+		# every time step is turned into x / y / z frames and pickled to the workers
+		phases.append( ( 'interp_na', loaded + series + 4 * series, ncpus * ( WORKER_OVERHEAD + 8 * grid ) ) )
+	phases = phases + [
+		# groupby arithmetic over the whole series, then the selection of the output times
+		( 'anomalies', loaded + series + series + out, 0 ),
+		# anomalies, the rotated copy, shiftgrid's temporary and the pickled task arguments
+		( 'downscale', loaded + series + 3 * out + chunk * grid, ncpus * worker ),
+	]
+	return dict([ ( name, { 'parent':parent, 'workers':workers, 'total':parent + workers } ) for name, parent, workers in phases ])
+
+class MemoryPlan( object ):
+	''' the chosen worker count / time chunk with the phase estimates they were chosen from '''
+	def __init__( self, ncpus, time_chunk, phases, available, cpus, fits ):
+		self.ncpus = ncpus
+		self.time_chunk = time_chunk
+		self.phases = phases
+		self.available = available
+		self.cpus = cpus
+		self.fits = fits
+	@property
+	def peak( self ):
+		''' estimated peak bytes over all phases '''
+		return max([ phase[ 'total' ] for phase in self.phases.values() ])
+	@property
+	def peak_phase( self ):
+		''' name of the phase with the largest estimate '''
+		return max( self.phases, key=lambda name: self.phases[ name ][ 'total' ] )
+	def report( self ):
+		''' human readable table of the plan '''
+		gb = lambda x: x / 1024.0**3
+		lines = [ 'memory plan: ncpus={} time_chunk={} ( {} cpus available )'.format( self.ncpus, self.time_chunk, self.cpus ) ]
+		for name, phase in self.phases.items():
+			lines.append( '  {:<12} parent:{:>8.2f}GB workers:{:>8.2f}GB total:{:>8.2f}GB'.format( name, gb( phase[ 'parent' ] ),
+							gb( phase[ 'workers' ] ), gb( phase[ 'total' ] ) ) )
+		available = 'unknown' if self.available is None else '{:.2f}GB'.format( gb( self.available ) )
+		lines.append( '  peak {:.2f}GB in {} -- available {}{}'.format( gb( self.peak ), self.peak_phase, available,
+							'' if self.fits else ' -- DOES NOT FIT' ) )
+		return '\n'.join( lines )
+	def check( self ):
+		''' raise MemoryError if even one worker and the smallest chunk do not fit '''
+		if not self.fits:
+			raise MemoryError( self.report() )
+		return self
+	def __repr__( self ):
+		return self.report()
+
+def plan( n_historical, n_future, src_shape, dst_shape, itemsize=8, ncpus=None, memory=None, safety=0.85,
+			min_chunk=None, fix_clim=False, interp=False, tile_size=None, n_out=None, n_series=None ):
+	'''
+	choose the worker count and time chunk that fit in memory.  Workers are added while the
+	downscale phase fits with all output time steps sent at once; if the series itself leaves
+	too little room, the time chunk is cut ( down to one step per worker ) before workers are.
+
+	ARGUMENTS:
+	----------
+	n_historical, n_future, src_shape, dst_shape, itemsize, fix_clim, interp, tile_size, n_out, n_series = see estimate
+	ncpus = [int] upper limit on workers. default:None ( available_cpus() )
+	memory = [int] bytes available. default:None ( available_memory() )
+	safety = [float] fraction of memory to plan for. default:0.85
+	min_chunk = [int] smallest time chunk to consider. default:None ( the worker count )
+
+	RETURNS:
+	--------
+	MemoryPlan
+	'''
+	cpus = available_cpus() if ncpus is None else ncpus
+	if memory is None:
+		memory = available_memory()
+	if n_out is None:
+		n_out = n_future if n_future > 0 else n_historical
+	kwargs = dict( itemsize=itemsize, fix_clim=fix_clim, interp=interp, tile_size=tile_size, n_out=n_out, n_series=n_series )
+	if memory is None:
+		phases = estimate( n_historical, n_future, src_shape, dst_shape, ncpus=cpus, **kwargs )
+		return MemoryPlan( cpus, n_out, phases, None, cpus, True )
+
+	budget = memory * safety
+	fits = lambda phases: max([ phase[ 'total' ] for phase in phases.values() ]) <= budget
+	for workers in range( cpus, 0, -1 ):
+		smallest = min( n_out, max( 1, workers if min_chunk is None else min_chunk ) )
+		for chunk in sorted( set([ n_out, max( smallest, n_out // 4 ), max( smallest, n_out // 16 ), smallest ]), reverse=True ):
+			phases = estimate( n_historical, n_future, src_shape, dst_shape, ncpus=workers, time_chunk=chunk, **kwargs )
+			if fits( phases ):
+				return MemoryPlan( workers, chunk, phases, memory, cpus, True )
+	return MemoryPlan( 1, smallest, phases, memory, cpus, False )
+
+def _series_info( ds, variable=None ):
+	''' [hidden] ( time steps, ( nlat, nlon ), itemsize ) of a downscale.Dataset or a NetCDF path, without loading data '''
+	import xarray as xr
+	if ds is None:
+		return 0, None, None
+	if isinstance( ds, str ):
+		with xr.open_dataset( ds ) as opened:
+			arr = opened[ variable ]
+			return arr.shape[0], tuple( arr.shape[-2:] ), arr.dtype.itemsize
+	arr = ds.ds[ ds.variable ]
+	return arr.shape[0], tuple( arr.shape[-2:] ), arr.dtype.itemsize
+
+def _series_years( ds, variable=None ):
+	''' [hidden] year of each time step of a downscale.Dataset or a NetCDF path, without loading data '''
+	import xarray as xr
+	if isinstance( ds, str ):
+		with xr.open_dataset( ds ) as opened:
+			return opened.time.dt.year.values
+	return ds.ds.time.dt.year.values
+
+def _cropped_shape( ds, variable, grid, crop ):
+	''' [hidden] ( nlat, nlon ) of a series cropped to a grid -- see downscale.subset '''
+	import xarray as xr
+	from downscale.subset import SourceWindow
+	if isinstance( ds, str ):
+		with xr.open_dataset( ds ) as opened:
+			lat, lon = opened.lat.values, opened.lon.values
+	else:
+		lat, lon = ds.ds.lat.values, ds.ds.lon.values
+	return SourceWindow.from_grid( lat, lon, grid, halo=crop ).shape
+
+def plan_run( historical, future=None, baseline=None, variable=None, ncpus=None, memory=None, safety=0.85, fix_clim=False, interp=False, crop=None,
+			tile_size=None, dtype='float32', partition=None, n_partitions=None ):
+	'''
+	plan a DeltaDownscale run from its inputs before constructing it.
+
+	ARGUMENTS:
+	----------
+	historical, future = [downscale.Dataset/str] the series, or NetCDF paths for a dry run ( variable required ).
+		historical may be None when the climatology comes from a cache.
+	crop = [int] halo passed to DeltaDownscale( crop=... ) -- plan for the cropped model grid. default:None
+	tile_size = [int] passed to DeltaDownscale.downscale -- plan for tiled workers. default:None
+	dtype = [str/numpy.dtype] compute dtype of the series ( Dataset / DeltaDownscale dtype ). None plans
+		for the dtype the series decode to. default:'float32'
+	partition, n_partitions = [int] passed to DeltaDownscale -- plan the workers / time chunk for the
+		partition's time steps. default:None ( the whole output series )
+	baseline = [downscale.Baseline/downscale.GridSpec/str] the baseline, its grid or a baseline raster path
+	see plan for the other arguments.
+
+	RETURNS:
+	--------
+	MemoryPlan -- pass plan.ncpus to DeltaDownscale and plan.time_chunk to DeltaDownscale.downscale
+	'''
+	from downscale.grid import GridSpec
+
+	n_historical, src_shape, itemsize = _series_info( historical, variable )
+	n_future, future_shape, future_itemsize = _series_info( future, variable )
+	if historical is None:
+		# cached climatology -- only the future series is loaded
+		src_shape, itemsize = future_shape, future_itemsize
+	if dtype is not None:
+		itemsize = np.dtype( dtype ).itemsize
+	if isinstance( baseline, str ):
+		grid = GridSpec.from_raster( baseline )
+	elif isinstance( baseline, GridSpec ):
+		grid = baseline
+	else:
+		grid = baseline.grid
+	dst_shape = grid.shape
+	if crop is not None:
+		src_shape = _cropped_shape( historical if historical is not None else future, variable, grid, crop )
+	n_out, n_series = None, None
+	if partition is not None:
+		from downscale.partition import partition_years
+		years = _series_years( future if future is not None else historical, variable )
+		n_out = int( np.isin( years, partition_years( years, partition, n_partitions ) ).sum() )
+		# the future is cut to the partition's years -- the historical keeps its climatology period as
+		#  well, so it is counted whole ( an upper bound )
+		n_series = n_historical + n_out if future is not None else n_historical
+	return plan( n_historical, n_future, src_shape, dst_shape, itemsize=itemsize, ncpus=ncpus, memory=memory,
+				safety=safety, fix_clim=fix_clim, interp=interp, tile_size=tile_size, n_out=n_out, n_series=n_series )
@@ -12,7 +12,7 @@ class Preprocess( object ):
 
 	'''
 	EXT = '.nc' # hardwired, but unlikely to change given current standard
-	def __init__( self, path, variable, model, scenario, experiment, years, ext=EXT, *args, **kwargs ):
+	def __init__( self, path, variable, model, scenario, experiment, years, ext=EXT, instrument=None, *args, **kwargs ):
 		'''
 		path = [str] path cotaining potentially multiple files for a single series to bwe
 		variable = [str] 
@@ -20,7 +20,11 @@ class Preprocess( object ):
 		scenario = [str] 
 		experiment = [str] 
 		years = [tuple] integers of beginning and ending year to preprocess (1901,2100)
+		instrument = [downscale.instrument.Instrument] per-phase timing / resource events, or a sink,
+			list of sinks or str path to a JSON-lines file. default:None ( no events )
 		'''
+		from downscale.instrument import as_instrument, files_size
+		self.instrument = as_instrument( instrument )
 		self.ext = ext
 		self.path = path
 		self.variable = variable
@@ -28,9 +32,17 @@ class Preprocess( object ):
 		self.scenario = scenario
 		self.experiment = experiment
 		self.years = years
-		self.filelist = self.list_files( )
+		with self._phase( 'list_files' ) as event:
+			self.filelist = self.list_files( )
+			event[ 'tasks' ] = len( self.filelist )
 		self._fileyears_dict = self._get_files_years( ) #
-		self.ds = self._concat_nc_list( ) #
+		with self._phase( 'concat', tasks=len( self.filelist ), bytes_read=files_size( self.filelist ) ):
+			self.ds = self._concat_nc_list( ) #
+
+	def _phase( self, name, **fields ):
+		''' [hidden] instrument a phase of the preprocessing '''
+		return self.instrument.phase( name, source=type( self ).__name__, variable=self.variable,
+									model=self.model, scenario=self.scenario, **fields )
 
 	def list_files( self ):
 		import os, glob
@@ -134,5 +146,7 @@ class Preprocess( object ):
 			os.remove( output_filename )
 		elif os.path.exists( output_filename ) and overwrite == False:
 			raise AttributeError( 'overwrite set to False, but file exists on disk' )
-		self.ds.to_netcdf( output_filename, mode='w', format=nc_format )
+		with self._phase( 'write_nc' ) as event:
+			self.ds.to_netcdf( output_filename, mode='w', format=nc_format )
+			event[ 'bytes_written' ] = os.path.getsize( output_filename )
 		return output_filename
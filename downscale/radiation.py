@@ -0,0 +1,159 @@
+# -*- coding: utf8 -*-
+# # #
+# Extraterrestrial radiation (Ra / girr) for a template grid following
+#  Allen et.al 1998 (port of S.McAfee's R script).  Latitudes for the
+#  whole grid come from a single vectorized transform and all ordinal
+#  days are evaluated as a ( days, cells ) broadcast, then averaged to
+#  monthly values.  The 12 monthly grids are cached per template grid.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+# in-process cache of monthly Ra grids keyed by the grid signature
+_CACHE = {}
+
+def grid_signature( crs, transform, shape ):
+	''' hashable / hex key identifying a template grid '''
+	import hashlib
+	key = '|'.join([ str( crs ), ','.join([ repr( float( i ) ) for i in tuple( transform )[:6] ]), \
+					'x'.join([ str( int( i ) ) for i in shape ]) ])
+	return hashlib.sha1( key.encode( 'utf-8' ) ).hexdigest()
+
+def _grid_info( grid ):
+	''' [hidden] get ( crs, transform, shape ) from a raster path, open rasterio dataset or meta dict '''
+	import rasterio
+	if isinstance( grid, str ):
+		with rasterio.open( grid ) as rst:
+			return rst.crs, rst.transform, rst.shape
+	elif isinstance( grid, dict ):
+		transform = grid[ 'transform' ] if 'transform' in grid else grid[ 'affine' ]
+		return grid[ 'crs' ], transform, ( grid[ 'height' ], grid[ 'width' ] )
+	elif hasattr( grid, 'transform' ) and hasattr( grid, 'crs' ):
+		return grid.crs, grid.transform, grid.shape
+	else:
+		raise TypeError( 'grid must be a raster filename, rasterio dataset or meta dict' )
+
+def latitude_radians( crs, transform, shape ):
+	'''
+	pixel-centre latitudes in radians for a full grid using a single
+	vectorized pyproj transform call.
+
+	RETURNS:
+	--------
+	2-D numpy.ndarray of latitude in radians matching shape
+	'''
+	from pyproj import Transformer
+	from affine import Affine
+
+	rows, cols = np.indices( shape )
+	xs, ys = ( transform * Affine.translation( 0.5, 0.5 ) ) * ( cols.ravel(), rows.ravel() )
+	transformer = Transformer.from_crs( crs, 'EPSG:4326', always_xy=True )
+	lons, lats = transformer.transform( np.asarray( xs ), np.asarray( ys ) )
+	return np.radians( np.asarray( lats ) ).reshape( shape )
+
+def calc_ra( days, lat ):
+	'''
+	calculate Ra (MJ m-2 d-1) based on Allen et.al 1998 for every combination of days and lats.
+
+	ARGUMENTS:
+	----------
+	days = [np.ndarray] 1-D array of ordinal (1-365) days of the year
+	lat = [np.ndarray] 1-D array of latitudes in radians
+
+	RETURNS:
+	--------
+	numpy.ndarray of shape ( days, lats )
+	'''
+	days = np.asarray( days, dtype=np.float64 )[ :, np.newaxis ]
+	lat = np.asarray( lat, dtype=np.float64 )[ np.newaxis, : ]
+
+	# earth-sun distance and declination are a single value per day
+	d = 1 + ( 0.033 * np.cos( 2 * np.pi * days / 365 ) )
+	dc = 0.409 * np.sin( ( ( 2 * np.pi / 365 ) * days ) - 1.39 )
+
+	# sunset hour angle -- clipping matches the real part of the complex arccos
+	w = np.arccos( np.clip( -1 * np.tan( dc ) * np.tan( lat ), -1, 1 ) )
+	return ( 24 * 60 / np.pi ) * d * 0.082 * ( w * np.sin( lat ) * np.sin( dc ) + np.cos( lat ) * np.cos( dc ) * np.sin( w ) )
+
+def day_to_month( ndays=365 ):
+	''' month (1-12) for each ordinal day of a non-leap year '''
+	import datetime
+	return np.array([ datetime.date.fromordinal( i ).month for i in range( 1, ndays+1 ) ])
+
+def ra_monthly( grid, mask=None, chunksize=50000, cache_dir=None ):
+	'''
+	monthly mean extraterrestrial radiation for a template grid.
+
+	ARGUMENTS:
+	----------
+	grid = [str/rasterio dataset/dict/downscale.GridSpec] template raster path, open rasterio 
+		dataset, GridSpec, or rasterio-style meta dict with crs, transform, height, width.
+	mask = [np.ndarray] 2-D bool array where True marks cells to compute. Cells
+		outside are np.nan. default:None (all cells)
+	chunksize = [int] number of cells per ( days, cells ) block.  Bounds memory
+		to ~ 365 * chunksize * 8 bytes. default:50000
+	cache_dir = [str] directory to persist the monthly grids as .npy files so
+		other runs on the same grid reuse them. default:None (in-process cache only)
+
+	RETURNS:
+	--------
+	numpy.ndarray float32 of shape ( 12, rows, cols ).  It is shared with the in-process cache, so it is
+	read-only -- .copy() it to modify.
+	'''
+	import hashlib
+
+	crs, transform, shape = _grid_info( grid )
+	key = grid_signature( crs, transform, shape )
+	if mask is not None:
+		mask = np.asarray( mask, dtype=bool )
+		key = key + '_' + hashlib.sha1( np.packbits( mask ).tobytes() ).hexdigest()
+
+	if key in _CACHE:
+		return _CACHE[ key ]
+
+	cache_fn = None
+	if cache_dir is not None:
+		cache_fn = os.path.join( cache_dir, 'ra_monthly_{}.npy'.format( key ) )
+		if os.path.exists( cache_fn ):
+			out = np.load( cache_fn )
+			out.setflags( write=False )
+			_CACHE[ key ] = out
+			return out
+
+	if hasattr( grid, 'lonlat' ):
+		# GridSpec -- reuse its (cached) pixel-centre coordinates
+		lat = np.radians( grid.lonlat[1] ).ravel()
+	else:
+		lat = latitude_radians( crs, transform, shape ).ravel()
+	if mask is not None:
+		idx, = np.where( mask.ravel() )
+	else:
+		idx = np.arange( lat.size )
+
+	months = day_to_month()
+	days = np.arange( 1, months.size+1 )
+	# days are in month order so the monthly sums are contiguous slices
+	starts = np.r_[ 0, np.where( np.diff( months ) != 0 )[0] + 1 ]
+	counts = np.bincount( months )[ 1: ]
+
+	out = np.full( ( 12, lat.size ), np.nan, dtype=np.float32 )
+	for i in range( 0, idx.size, chunksize ):
+		cells = idx[ i:i+chunksize ]
+		ra = calc_ra( days, lat[ cells ] )
+		out[ :, cells ] = np.add.reduceat( ra, starts, axis=0 ) / counts[ :, np.newaxis ]
+
+	out = out.reshape( ( 12, ) + tuple( shape ) )
+	# every later call on the grid gets this array -- don't let one caller change it for the others
+	out.setflags( write=False )
+	_CACHE[ key ] = out
+	if cache_fn is not None:
+		try:
+			if not os.path.exists( cache_dir ):
+				os.makedirs( cache_dir )
+		except:
+			pass
+		np.save( cache_fn, out )
+	return out
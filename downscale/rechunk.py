@@ -0,0 +1,275 @@
+# -*- coding: utf8 -*-
+# # #
+# Rechunk a month-per-file downscaled series into a single NetCDF / Zarr
+#  store.  The 'pixel' layout is chunked ( all time, small y/x tile ) so
+#  per-pixel queries (profiles, trends, DOF/DOT) touch a handful of
+#  chunks; the 'time' layout is chunked ( few months, full grid ) for map
+#  access.  Blocks are sized to a memory budget and read in parallel.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+LAYOUTS = [ 'pixel', 'time' ]
+
+def parse_times( files ):
+	''' month-start timestamps from SNAP-standard '<prefix>_MM_YYYY.tif' filenames '''
+	import pandas as pd
+	months, years = zip( *[ os.path.basename( fn ).split( '.' )[0].split( '_' )[-2:] for fn in files ] )
+	return pd.DatetimeIndex( pd.to_datetime( pd.DataFrame({ 'year':np.array( years, dtype=int ),
+						'month':np.array( months, dtype=int ), 'day':1 }) ) )
+
+def _store_format( output_filename, fmt=None ):
+	''' [hidden] 'zarr' or 'netcdf' from the fmt argument or the output extension '''
+	if fmt is None:
+		fmt = 'zarr' if output_filename.rstrip( os.sep ).endswith( '.zarr' ) else 'netcdf'
+	if fmt not in [ 'zarr', 'netcdf' ]:
+		raise ValueError( 'unknown store format: {}'.format( fmt ) )
+	return fmt
+
+def plan_blocks( ntime, shape, layout='pixel', tile=(50, 50), time_chunk=12, max_mem=2e9, nworkers=1 ):
+	'''
+	split a ( time, y, x ) cube into blocks aligned to the store chunks, each small
+	enough that nworkers blocks in flight fit in max_mem bytes (float32).
+
+	ARGUMENTS:
+	----------
+	ntime = [int] number of timesteps (files)
+	shape = [tuple] ( rows, cols ) of the grid
+	layout = [str] 'pixel' ( all time, y/x tile chunks ) or 'time' ( time_chunk, full grid chunks ).
+	tile = [tuple] ( rows, cols ) of the pixel layout chunks. default:(50, 50)
+	time_chunk = [int] number of timesteps per chunk in the time layout. default:12
+	max_mem = [int] memory budget in bytes. default:2e9
+	nworkers = [int] number of blocks held at once. default:1
+
+	RETURNS:
+	--------
+	chunks, blocks -- the store chunk shape and a list of ( time slice, row slice, col slice ).
+	'''
+	if layout not in LAYOUTS:
+		raise ValueError( 'layout must be one of {}'.format( LAYOUTS ) )
+	height, width = shape
+	budget = max( int( max_mem ) // max( nworkers, 1 ), 1 )
+	itemsize = np.dtype( np.float32 ).itemsize
+	if layout == 'pixel':
+		ty, tx = min( tile[0], height ), min( tile[1], width )
+		chunks = ( ntime, ty, tx )
+		# widest full-tile strip of a single tile row that fits, then as many tile rows as fit
+		ncols = max( ( budget // ( ntime * ty * itemsize ) ) // tx, 1 ) * tx
+		ncols = min( ncols, width )
+		nrows = max( ( budget // ( ntime * ncols * itemsize ) ) // ty, 1 ) * ty
+		nrows = min( nrows, height )
+		blocks = [ ( slice( 0, ntime ), slice( r, min( r + nrows, height ) ), slice( c, min( c + ncols, width ) ) )
+					for r in range( 0, height, nrows ) for c in range( 0, width, ncols ) ]
+	else:
+		tc = min( time_chunk, ntime )
+		chunks = ( tc, height, width )
+		nsteps = max( ( budget // ( height * width * itemsize ) ) // tc, 1 ) * tc
+		blocks = [ ( slice( t, min( t + nsteps, ntime ) ), slice( 0, height ), slice( 0, width ) )
+					for t in range( 0, ntime, nsteps ) ]
+	return chunks, blocks
+
+def read_block( files, rows, cols ):
+	''' read a ( time, rows, cols ) float32 block from a list of single-band rasters. nodata is np.nan, encoded rasters are decoded '''
+	import rasterio
+	from rasterio.windows import Window
+	from downscale.encoding import read_band
+
+	window = Window( cols.start, rows.start, cols.stop - cols.start, rows.stop - rows.start )
+	out = np.empty( ( len( files ), window.height, window.width ), dtype=np.float32 )
+	for idx, fn in enumerate( files ):
+		with rasterio.open( fn ) as rst:
+			out[ idx ] = read_band( rst, window=window )
+	return out
+
+def _read_block( x ):
+	''' [hidden] unpack args for pool.imap -- returns the block with its location '''
+	files, block = x
+	tsl, rows, cols = block
+	return block, read_block( files[ tsl ], rows, cols )
+
+def _write_zarr_block( x ):
+	''' [hidden] read a block and write it straight into its (chunk-aligned) region of the zarr store '''
+	import zarr
+	output_filename, varname, files, block = x
+	block, arr = _read_block( ( files, block ) )
+	out = zarr.open_array( os.path.join( output_filename, varname ), mode='r+' )
+	out[ block ] = arr
+	return block
+
+def _coords( grid, times ):
+	''' [hidden] pixel-centre x / y coordinates and time values for the store '''
+	import pandas as pd
+	from affine import Affine
+	transform = grid.transform * Affine.translation( 0.5, 0.5 )
+	xs = np.array([ ( transform * ( col, 0 ) )[0] for col in range( grid.width ) ])
+	ys = np.array([ ( transform * ( 0, row ) )[1] for row in range( grid.height ) ])
+	days = ( times - pd.Timestamp( '1900-01-01' ) ).days.values.astype( np.float64 )
+	return xs, ys, days
+
+def _init_netcdf( output_filename, varname, grid, times, chunks, attrs ):
+	''' [hidden] create the NetCDF file with its coordinates and an empty chunked variable '''
+	import netCDF4
+
+	xs, ys, days = _coords( grid, times )
+	rootgrp = netCDF4.Dataset( output_filename, 'w', format='NETCDF4' )
+	rootgrp.createDimension( 'time', len( times ) )
+	rootgrp.createDimension( 'y', grid.height )
+	rootgrp.createDimension( 'x', grid.width )
+	time = rootgrp.createVariable( 'time', 'f8', ( 'time', ) )
+	time.units = 'days since 1900-01-01'
+	time.calendar = 'standard'
+	time[:] = days
+	for name, values in [ ('y', ys), ('x', xs) ]:
+		var = rootgrp.createVariable( name, 'f8', ( name, ) )
+		var[:] = values
+	var = rootgrp.createVariable( varname, 'f4', ( 'time', 'y', 'x' ), chunksizes=chunks,
+								zlib=True, complevel=4, fill_value=np.float32( np.nan ) )
+	var.setncatts( attrs )
+	return rootgrp
+
+def _init_zarr( output_filename, varname, grid, times, chunks, attrs ):
+	''' [hidden] write the coordinates with xarray then add an empty chunked variable with zarr '''
+	import zarr
+	import xarray as xr
+
+	xs, ys, days = _coords( grid, times )
+	coords = xr.Dataset( coords={ 'time':( 'time', times ), 'y':( 'y', ys ), 'x':( 'x', xs ) } )
+	coords.to_zarr( output_filename, mode='w', consolidated=False )
+	group = zarr.open_group( output_filename, mode='r+' )
+	var = group.create_dataset( varname, shape=( len( times ), grid.height, grid.width ), chunks=chunks,
+								dtype='f4', fill_value=np.nan )
+	var.attrs.update( dict( attrs, _ARRAY_DIMENSIONS=[ 'time', 'y', 'x' ] ) )
+	return output_filename
+
+def rechunk( files, output_filename, layout='pixel', tile=(50, 50), time_chunk=12, fmt=None,
+				max_mem=2e9, ncpus=4, varname=None, grid=None ):
+	'''
+	convert a month-per-file series (one model/scenario/variable) into a single
+	chunked store with bounded memory.
+
+	ARGUMENTS:
+	----------
+	files = [list] of SNAP-standard '<prefix>_MM_YYYY.tif' paths. They are sorted chronologically.
+	output_filename = [str] path to the output store ( *.zarr or *.nc )
+	layout = [str] 'pixel' for time-contiguous ( all time, y/x tile ) chunks or 'time'
+		for ( time_chunk, full grid ) chunks. default:'pixel'
+	tile = [tuple] ( rows, cols ) chunk size of the pixel layout. default:(50, 50)
+	time_chunk = [int] timesteps per chunk of the time layout. default:12
+	fmt = [str] 'zarr' or 'netcdf'. default:None (from the output_filename extension)
+	max_mem = [int] bytes of block data held in memory at once. default:2e9
+	ncpus = [int] number of processes reading (and for zarr writing) blocks. default:4
+	varname = [str] name of the variable. default:None (first element of the filename)
+	grid = [downscale.GridSpec] grid of the files. default:None (read from the first file)
+
+	RETURNS:
+	--------
+	output_filename
+
+	NOTES:
+	------
+	Zarr blocks are written by the workers directly into their own chunks.  NetCDF
+	has a single writer, so workers only read and at most ncpus blocks are in flight.
+	'''
+	from downscale.grid import GridSpec
+	from downscale.utils import sort_files
+	import multiprocessing as mp
+
+	fmt = _store_format( output_filename, fmt )
+	files = sort_files( [ fn for fn in files if not fn.endswith( '_anom.tif' ) ] )
+	if len( files ) == 0:
+		raise ValueError( 'no files to rechunk' )
+	if varname is None:
+		varname = os.path.basename( files[0] ).split( '_' )[0]
+	if grid is None:
+		grid = GridSpec.from_raster( files[0] )
+
+	times = parse_times( files )
+	chunks, blocks = plan_blocks( len( files ), grid.shape, layout=layout, tile=tile,
+								time_chunk=time_chunk, max_mem=max_mem, nworkers=ncpus )
+	attrs = { 'crs':grid.crs.to_wkt(), 'transform':list( tuple( grid.transform )[:6] ), 'layout':layout }
+
+	dirname = os.path.dirname( output_filename )
+	try:
+		if dirname != '' and not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
+
+	pool = mp.Pool( ncpus ) if ncpus > 1 else None
+	try:
+		if fmt == 'zarr':
+			import zarr
+			_init_zarr( output_filename, varname, grid, times, chunks, attrs )
+			args = [ ( output_filename, varname, files, block ) for block in blocks ]
+			if pool is not None:
+				pool.map( _write_zarr_block, args, chunksize=1 )
+			else:
+				_ = [ _write_zarr_block( arg ) for arg in args ]
+			zarr.consolidate_metadata( output_filename )
+		else:
+			rootgrp = _init_netcdf( output_filename, varname, grid, times, chunks, attrs )
+			try:
+				var = rootgrp.variables[ varname ]
+				# submit ncpus blocks at a time so finished blocks can't pile up behind the writer
+				for i in range( 0, len( blocks ), max( ncpus, 1 ) ):
+					args = [ ( files, block ) for block in blocks[ i:i + max( ncpus, 1 ) ] ]
+					results = pool.imap( _read_block, args ) if pool is not None else map( _read_block, args )
+					for block, arr in results:
+						var[ block ] = arr
+			finally:
+				rootgrp.close()
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+	return output_filename
+
+def store_names( output_prefix, fmt='netcdf' ):
+	''' sibling store paths { layout:path } for an output prefix '''
+	ext = '.zarr' if fmt == 'zarr' else '.nc'
+	return { layout:'{}_{}{}'.format( output_prefix, layout, ext ) for layout in LAYOUTS }
+
+def rechunk_series( files, output_prefix, fmt='netcdf', layouts=LAYOUTS, **kwargs ):
+	'''
+	write both the pixel-major store and its time-major sibling for a series.
+	see rechunk for the keyword arguments.
+
+	RETURNS:
+	--------
+	dict of layout to output store path
+	'''
+	names = store_names( output_prefix, fmt )
+	return { layout:rechunk( files, names[ layout ], layout=layout, fmt=fmt, **kwargs ) for layout in layouts }
+
+def open_store( output_prefix, access='pixel', fmt='netcdf', varname=None ):
+	'''
+	open the sibling store whose chunking matches the access pattern.
+
+	ARGUMENTS:
+	----------
+	output_prefix = [str] prefix the stores were written with (see rechunk_series)
+	access = [str] 'pixel' / 'profile' / 'trend' for per-pixel time series or
+		'time' / 'map' for full-grid timesteps. default:'pixel'
+	fmt = [str] 'zarr' or 'netcdf'. default:'netcdf'
+	varname = [str] variable to return. default:None (the only data variable)
+
+	RETURNS:
+	--------
+	xarray.DataArray ( time, y, x ) with the store attrs (crs, transform, layout)
+	'''
+	import xarray as xr
+
+	aliases = { 'pixel':'pixel', 'profile':'pixel', 'trend':'pixel', 'time':'time', 'map':'time' }
+	if access not in aliases:
+		raise ValueError( 'access must be one of {}'.format( sorted( aliases.keys() ) ) )
+	fn = store_names( output_prefix, fmt )[ aliases[ access ] ]
+	if fmt == 'zarr':
+		ds = xr.open_zarr( fn )
+	else:
+		ds = xr.open_dataset( fn )
+	if varname is None:
+		varname, = list( ds.data_vars )
+	return ds[ varname ]
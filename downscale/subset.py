@@ -0,0 +1,145 @@
+# -*- coding: utf8 -*-
+# # #
+# Subset a native lat/lon model grid to the cells covering a destination
+#  grid ( i.e. the AKCAN / NWT / L48 baseline ) plus a halo of source
+#  cells, before any climatology / anomaly / gap filling work is done on
+#  it.  The longitude window is found on the circle, so extents across the
+#  dateline come out as one contiguous block on either a 0-360 or a
+#  -180-180 model grid, with longitudes made monotonic for GDAL.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import numpy as np
+
+def _boundary_lonlat( grid, densify=101 ):
+	''' [hidden] lon / lat of points along the edges of a GridSpec '''
+	from rasterio.warp import transform
+	rows, cols = grid.shape
+	steps = np.linspace( 0, 1, densify )
+	# ( col, row ) fractions around the outside edge of the grid
+	edges = np.concatenate([ np.column_stack([ steps, np.zeros_like( steps ) ]),
+							np.column_stack([ np.ones_like( steps ), steps ]),
+							np.column_stack([ steps, np.ones_like( steps ) ]),
+							np.column_stack([ np.zeros_like( steps ), steps ]) ])
+	xs, ys = grid.transform * ( edges[:,0] * cols, edges[:,1] * rows )
+	lons, lats = transform( grid.crs, 'EPSG:4326', list( xs ), list( ys ) )
+	return np.array( lons ), np.array( lats )
+
+def _contained_pole( grid ):
+	''' [hidden] latitude of the pole ( 90 / -90 ) inside a ( projected ) GridSpec, None if neither is '''
+	from rasterio.warp import transform
+	from rasterio.transform import array_bounds
+	if grid.crs.is_geographic:
+		return None
+	left, bottom, right, top = array_bounds( grid.shape[0], grid.shape[1], grid.transform )
+	for lat in [ 90.0, -90.0 ]:
+		try:
+			( x, ), ( y, ) = transform( 'EPSG:4326', grid.crs, [ 0.0 ], [ lat ] )
+		except Exception:
+			continue
+		if np.isfinite( x ) and left <= x <= right and bottom <= y <= top:
+			return lat
+	return None
+
+def lon_arc( lons ):
+	'''
+	the shortest arc of the circle covering a set of longitudes ( degrees ).
+
+	RETURNS:
+	--------
+	( start, width ) -- start in [0, 360) and width in degrees, going east
+	'''
+	lons = np.sort( np.mod( np.asarray( lons, dtype=np.float64 ), 360.0 ) )
+	gaps = np.diff( np.concatenate([ lons, [ lons[0] + 360.0 ] ]) )
+	idx = int( np.argmax( gaps ) )
+	return lons[ ( idx + 1 ) % len( lons ) ], 360.0 - gaps[ idx ]
+
+class SourceWindow( object ):
+	'''
+	the rows / columns of a lat/lon model grid covering a destination grid plus a halo,
+	with the monotonic longitudes and affine transform of the cropped grid.
+	'''
+	def __init__( self, lat_index, lon_index, lat, lon ):
+		'''
+		ARGUMENTS:
+		----------
+		lat_index = [slice] rows of the model grid to keep
+		lon_index = [numpy.ndarray] columns of the model grid to keep, in order ( may wrap around )
+		lat = [numpy.ndarray] latitudes of the cropped grid
+		lon = [numpy.ndarray] monotonic longitudes of the cropped grid ( may run past 180 or 360 )
+		'''
+		self.lat_index = lat_index
+		self.lon_index = np.asarray( lon_index )
+		self.lat = np.asarray( lat )
+		self.lon = np.asarray( lon )
+	@property
+	def shape( self ):
+		return ( len( self.lat ), len( self.lon ) )
+	@property
+	def transform( self ):
+		''' affine transform of the cropped grid from its cell centres -- replaces utils.transform_from_latlon '''
+		from affine import Affine
+		dlat = ( self.lat[-1] - self.lat[0] ) / ( len( self.lat ) - 1 )
+		dlon = ( self.lon[-1] - self.lon[0] ) / ( len( self.lon ) - 1 )
+		return Affine( dlon, 0.0, self.lon[0] - dlon / 2.0, 0.0, dlat, self.lat[0] - dlat / 2.0 )
+	@classmethod
+	def from_grid( cls, lat, lon, grid, halo=2, densify=101 ):
+		'''
+		the window of a lat/lon model grid covering a destination grid.
+
+		ARGUMENTS:
+		----------
+		lat, lon = [array-like] 1-D cell centre latitudes / longitudes of the model grid. Longitudes
+			may be 0-360 or -180-180.
+		grid = [downscale.GridSpec] destination grid ( i.e. Baseline.grid )
+		halo = [int] extra model cells kept on every side -- at least the resampling kernel radius and
+			wide enough for gap filling near the edges. default:2
+		densify = [int] points per edge of the destination grid used to find its extent. default:101
+
+		RETURNS:
+		--------
+		SourceWindow
+		'''
+		lat = np.asarray( lat, dtype=np.float64 )
+		lon = np.asarray( lon, dtype=np.float64 )
+		dlat = np.abs( np.diff( lat ) ).max()
+		dlon = np.abs( np.diff( lon ) ).max()
+		b_lons, b_lats = _boundary_lonlat( grid, densify=densify )
+		ok = np.isfinite( b_lons ) & np.isfinite( b_lats )
+		b_lons, b_lats = b_lons[ ok ], b_lats[ ok ]
+		lat_min, lat_max = b_lats.min(), b_lats.max()
+		pole = _contained_pole( grid )
+		if pole == 90.0:
+			lat_max = 90.0
+		elif pole == -90.0:
+			lat_min = -90.0
+
+		# rows -- cells overlapping the extent, plus the halo
+		pad = dlat / 2.0 + halo * dlat
+		rows, = np.where( ( lat >= lat_min - pad ) & ( lat <= lat_max + pad ) )
+		if len( rows ) == 0:
+			raise ValueError( 'destination grid does not overlap the model latitudes' )
+		lat_index = slice( int( rows.min() ), int( rows.max() ) + 1 )
+
+		# columns -- cells on the shortest arc covering the extent, plus the halo, in order from its start
+		start, width = lon_arc( b_lons )
+		pad = dlon / 2.0 + halo * dlon
+		start, width = start - pad, width + 2 * pad
+		if pole is not None or width >= 360.0 - dlon:
+			lon_index = np.arange( len( lon ) )
+			lons = lon
+		else:
+			offset = np.mod( lon - start, 360.0 )
+			cols, = np.where( offset <= width )
+			lon_index = cols[ np.argsort( offset[ cols ] ) ]
+			lons = lon[ lon_index ]
+			lons = lons[0] + np.mod( lons - lons[0], 360.0 )
+		return cls( lat_index, lon_index, lat[ lat_index ], lons )
+	def apply( self, ds, latitude='lat', longitude='lon' ):
+		''' crop an xarray.Dataset / DataArray on ( ..., lat, lon ) to the window, with the monotonic longitudes '''
+		out = ds.isel( **{ latitude:self.lat_index, longitude:self.lon_index } )
+		return out.assign_coords( **{ longitude:self.lon } )
+	def crop_array( self, arr ):
+		''' crop a numpy array on ( ..., lat, lon ) of the full model grid ( i.e. an aoi mask ) '''
+		return np.asarray( arr )[ ..., self.lat_index, : ][ ..., self.lon_index ]
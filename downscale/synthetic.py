@@ -0,0 +1,186 @@
+# -*- coding: utf8 -*-
+# # #
+# Synthetic inputs for tests and benchmarks: CMIP5-like monthly NetCDF
+#  series on a global lat/lon grid, a matching 12-month baseline
+#  climatology of GeoTIFFs on an Alaska Albers (EPSG:3338) grid and an
+#  AOI shapefile.  Everything is generated from a seed so runs compare.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+# ( nlat, nlon, baseline rows, baseline cols, baseline resolution (m) )
+SIZES = { 'tiny':( 18, 36, 40, 50, 50000 ),
+		'small':( 90, 144, 150, 200, 15000 ),
+		'medium':( 145, 192, 600, 800, 4000 ),
+		'large':( 180, 360, 1500, 2000, 2000 ) }
+
+# upper left corner of the baseline grids -- the AKCAN 2km extent
+AKCAN_ORIGIN = ( -2173223.2060, 2548412.9385 )
+
+VARIABLES = { 'tas':{ 'units':'K', 'long_name':'Near-Surface Air Temperature' },
+			'pr':{ 'units':'kg m-2 s-1', 'long_name':'Precipitation' } }
+
+def land_mask( lat, lon ):
+	''' [bool] smooth synthetic 'land' blobs on a lat/lon grid -- True over land '''
+	lo, la = np.meshgrid( np.radians( lon ), np.radians( lat ) )
+	return ( np.sin( 2 * lo ) * np.cos( 3 * la ) + 0.5 * np.cos( la ) ) > 0.2
+
+def _field( variable, lat, lon, months, rng ):
+	''' [hidden] ( time, lat, lon ) values with a seasonal cycle, a latitude gradient and noise '''
+	la = np.radians( lat )[ None, :, None ]
+	lo = np.radians( lon )[ None, None, : ]
+	season = np.cos( 2 * np.pi * ( np.asarray( months )[ :, None, None ] - 7 ) / 12.0 )
+	noise = rng.standard_normal( ( len( months ), len( lat ), len( lon ) ) )
+	if variable == 'pr':
+		# kg m-2 s-1 -- roughly 0-10 mm/day
+		arr = 3e-5 * ( 1.2 + np.cos( 2 * la ) + 0.3 * np.sin( lo ) + 0.3 * season * np.sin( la ) ) + 5e-6 * noise
+		arr = np.clip( arr, 0, None )
+	else:
+		# K -- warm tropics, seasonal cycle flipped across the equator
+		arr = 273.15 + 30 * np.cos( la ) - 10 + 12 * season * np.sin( la ) + 2 * np.sin( lo ) + noise
+	return arr.astype( np.float32 )
+
+def make_series( output_filename, variable='tas', nlat=90, nlon=144, begin=1950, end=1959,
+					calendar='standard', south_up=True, land_only=False, model='SYNTH-GCM',
+					scenario='historical', seed=0 ):
+	'''
+	write a CMIP5-like monthly NetCDF series.
+
+	ARGUMENTS:
+	----------
+	output_filename = [str] path to the NetCDF to write
+	variable = [str] 'tas' or 'pr'. default:'tas'
+	nlat, nlon = [int] global grid size. default:90, 144
+	begin, end = [int] first and last year ( inclusive ). default:1950, 1959
+	calendar = [str] CF calendar of the time axis ( i.e. 'standard', 'noleap', '360_day' ). default:'standard'
+	south_up = [bool] latitudes ascending from the south pole, as in CMIP5 files. default:True
+	land_only = [bool] set 'ocean' cells to np.nan ( like CRU TS ). default:False
+	model, scenario = [str] written to the global attributes.
+	seed = [int] random seed. default:0
+
+	RETURNS:
+	--------
+	output_filename
+	'''
+	import cftime
+	import xarray as xr
+
+	rng = np.random.RandomState( seed )
+	dlat, dlon = 180.0 / nlat, 360.0 / nlon
+	lat = np.linspace( -90 + dlat / 2, 90 - dlat / 2, nlat )
+	if not south_up:
+		lat = lat[ ::-1 ]
+	lon = np.arange( nlon ) * dlon + dlon / 2 # 0-360 like CMIP5
+
+	years = np.repeat( np.arange( begin, end + 1 ), 12 )
+	months = np.tile( np.arange( 1, 13 ), end - begin + 1 )
+	dates = [ cftime.datetime( y, m, 15, calendar=calendar ) for y, m in zip( years, months ) ]
+	units = 'days since 1850-01-01'
+	time = cftime.date2num( dates, units, calendar=calendar )
+
+	arr = _field( variable, lat, lon, months, rng )
+	if land_only:
+		arr[ :, ~land_mask( lat, lon ) ] = np.nan
+
+	attrs = dict( VARIABLES[ variable ] )
+	ds = xr.Dataset( { variable:( ( 'time', 'lat', 'lon' ), arr, attrs ) },
+					coords={ 'time':( 'time', time, { 'units':units, 'calendar':calendar } ),
+							'lat':( 'lat', lat, { 'units':'degrees_north' } ),
+							'lon':( 'lon', lon, { 'units':'degrees_east' } ) },
+					attrs={ 'model_id':model, 'experiment_id':scenario, 'source':'downscale.synthetic' } )
+	dirname = os.path.dirname( output_filename )
+	try:
+		if dirname != '' and not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
+	ds.to_netcdf( output_filename, mode='w' )
+	return output_filename
+
+def make_baseline( output_dir, variable='tas', shape=(150, 200), resolution=15000, nodata=-9999, seed=0 ):
+	'''
+	write a 12-month baseline climatology of GeoTIFFs on an EPSG:3338 grid with the AKCAN
+	upper left corner.  The lower right third of the grid is nodata (ocean).
+
+	RETURNS:
+	--------
+	list of the 12 filenames in chronological order
+	'''
+	import rasterio
+	from affine import Affine
+
+	rng = np.random.RandomState( seed )
+	rows, cols = shape
+	transform = Affine( resolution, 0.0, AKCAN_ORIGIN[0], 0.0, -resolution, AKCAN_ORIGIN[1] )
+	meta = { 'driver':'GTiff', 'dtype':'float32', 'nodata':nodata, 'count':1, 'height':rows, 'width':cols,
+			'crs':'EPSG:3338', 'transform':transform, 'compress':'lzw' }
+	yy, xx = np.mgrid[ 0:rows, 0:cols ]
+	ocean = ( yy / float( rows ) + xx / float( cols ) ) > 1.4
+	units = { 'pr':'mm', 'tas':'C' }[ variable ]
+	metric = { 'pr':'total', 'tas':'mean' }[ variable ]
+
+	if not os.path.exists( output_dir ):
+		os.makedirs( output_dir )
+	out = []
+	for month in range( 1, 13 ):
+		season = np.cos( 2 * np.pi * ( month - 7 ) / 12.0 )
+		if variable == 'pr':
+			arr = 40 + 30 * season * ( yy / float( rows ) ) + 5 * rng.rand( rows, cols )
+		else:
+			arr = -5 + 15 * season - 10 * ( yy / float( rows ) ) + rng.rand( rows, cols )
+		arr = arr.astype( np.float32 )
+		arr[ ocean ] = nodata
+		fn = os.path.join( output_dir, '{}_{}_{}_baseline_{:02d}.tif'.format( variable, metric, units, month ) )
+		with rasterio.open( fn, 'w', **meta ) as rst:
+			rst.write( arr, 1 )
+		out.append( fn )
+	return out
+
+def make_aoi( output_filename, baseline_fn, buffer_fraction=0.2 ):
+	''' write a single polygon shapefile ( EPSG:4326 ) inset from the extent of a baseline raster '''
+	import rasterio
+	import geopandas as gpd
+	from shapely.geometry import box
+
+	with rasterio.open( baseline_fn ) as rst:
+		left, bottom, right, top = rst.bounds
+		crs = rst.crs
+	dx, dy = ( right - left ) * buffer_fraction, ( top - bottom ) * buffer_fraction
+	gdf = gpd.GeoDataFrame( { 'id':[ 1 ] }, geometry=[ box( left + dx, bottom + dy, right - dx, top - dy ) ], crs=crs.to_wkt() )
+	gdf.to_crs( 'EPSG:4326' ).to_file( output_filename )
+	return output_filename
+
+def make_case( output_dir, size='small', variable='tas', historical=(1950, 1969), future=(2006, 2015),
+				calendar='noleap', south_up=True, land_only=False, seed=0 ):
+	'''
+	write a full synthetic downscaling case -- historical / future series, baseline and AOI.
+
+	ARGUMENTS:
+	----------
+	output_dir = [str] directory to write into
+	size = [str] one of SIZES ( 'tiny', 'small', 'medium', 'large' ). default:'small'
+	variable = [str] 'tas' or 'pr'. default:'tas'
+	historical, future = [tuple] ( begin, end ) years of the series. future may be None.
+	calendar, south_up, land_only, seed = see make_series
+
+	RETURNS:
+	--------
+	dict with historical, future, baseline ( list ), aoi, variable, size and clim_begin / clim_end
+	'''
+	nlat, nlon, rows, cols, resolution = SIZES[ size ]
+	name = '{}_{}_{}'.format( variable, size, 'land' if land_only else 'global' )
+	kwargs = dict( variable=variable, nlat=nlat, nlon=nlon, calendar=calendar, south_up=south_up, land_only=land_only )
+	case = { 'variable':variable, 'size':size, 'clim_begin':str( historical[0] ), 'clim_end':str( historical[1] ) }
+	case[ 'historical' ] = make_series( os.path.join( output_dir, name + '_historical.nc' ), begin=historical[0],
+										end=historical[1], scenario='historical', seed=seed, **kwargs )
+	case[ 'future' ] = None
+	if future is not None:
+		case[ 'future' ] = make_series( os.path.join( output_dir, name + '_rcp85.nc' ), begin=future[0],
+										end=future[1], scenario='rcp85', seed=seed + 1, **kwargs )
+	case[ 'baseline' ] = make_baseline( os.path.join( output_dir, name + '_baseline' ), variable=variable,
+										shape=( rows, cols ), resolution=resolution, seed=seed )
+	case[ 'aoi' ] = make_aoi( os.path.join( output_dir, name + '_aoi.shp' ), case[ 'baseline' ][0] )
+	return case
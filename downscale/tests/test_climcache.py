@@ -0,0 +1,88 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the shared climatology cache
+# # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+
+class TestClimatologyCache( unittest.TestCase ):
+	''' tests for downscale.climcache and DeltaDownscale( climatology_cache=... ) '''
+	def setUp( self ):
+		from downscale.synthetic import make_case
+		self.tmp_dir = tempfile.mkdtemp()
+		self.case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1952), future=(2006, 2007) )
+		self.cache_dir = os.path.join( self.tmp_dir, 'cache' )
+	def _datasets( self ):
+		from downscale import Dataset
+		historical = Dataset( self.case[ 'historical' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+		future = Dataset( self.case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+		return historical, future
+	def _run( self, historical, future, cache, sink, **kwargs ):
+		from downscale import Baseline, DeltaDownscale
+		return DeltaDownscale( Baseline( self.case[ 'baseline' ] ), '1950', '1952', historical, future, downscaling_operation='add',
+							ncpus=1, src_nodata=None, climatology_cache=cache, instrument=sink, **kwargs )
+	def test_entry_key( self ):
+		from downscale.climcache import ClimatologyCache
+		cache = ClimatologyCache( self.cache_dir )
+		a = cache.entry( self.case[ 'historical' ], '1961', '1990', 'tas', units='C', fix_clim=False )
+		b = cache.entry( self.case[ 'historical' ], '1961', '1990', 'tas', units='C', fix_clim=True )
+		c = cache.entry( self.case[ 'historical' ], '1961', '1990', 'tas', units='C', fix_clim=False )
+		self.assertNotEqual( a.filename, b.filename )
+		self.assertEqual( a.filename, c.filename )
+		self.assertFalse( a.exists() )
+	def test_cached_run_matches( self ):
+		from downscale.climcache import climatology_entry
+		from downscale.instrument import MemorySink
+		historical, future = self._datasets()
+		uncached = self._run( historical, future, None, None )
+
+		# first run computes and stores, the next reads it back without the historical series
+		first = MemorySink()
+		self._run( historical, future, self.cache_dir, first )
+		self.assertIn( 'climatology_store', [ event[ 'phase' ] for event in first.events ] )
+		# keyed by the shared builder as a run script would, without the historical series
+		entry = climatology_entry( self.cache_dir, self.case[ 'historical' ], '1950', '1952', 'tas', units='C' )
+		self.assertTrue( entry.exists() )
+
+		second = MemorySink()
+		historical, future = self._datasets()
+		cached = self._run( None, future, entry, second )
+		events = dict([ ( event[ 'phase' ], event ) for event in second.events ])
+		self.assertTrue( events[ 'climatology' ][ 'cached' ] )
+		self.assertNotIn( 'climatology_store', events )
+		self.assertEqual( cached.ds.shape[0], 24 )
+		np.testing.assert_allclose( cached.climatology.values, uncached.climatology.values, rtol=1e-6 )
+		np.testing.assert_allclose( cached.anomalies.values, uncached.anomalies.values, rtol=1e-6, atol=1e-5 )
+	def test_interp_keys_entry( self ):
+		# gap filling the series before the climatology changes it -- runs differing only in interp never share
+		historical, future = self._datasets()
+		dd = self._run( historical, future, self.cache_dir, None, interp=False )
+		self.assertTrue( dd.climatology_cache.exists() )
+		dd.interp = True
+		interped = dd._climatology_entry( self.cache_dir, historical )
+		self.assertNotEqual( dd.climatology_cache.filename, interped.filename )
+		self.assertFalse( interped.exists() )
+		self.assertTrue( interped.key[ 'interp' ] )
+	def test_crop_keys_entry( self ):
+		historical, future = self._datasets()
+		full = self._run( historical, future, self.cache_dir, None )
+		historical, future = self._datasets()
+		cropped = self._run( historical, future, self.cache_dir, None, crop=1 )
+		self.assertNotIn( 'grid', full.climatology_cache.key )
+		self.assertEqual( cropped.climatology_cache.key[ 'grid' ], cropped.baseline.grid.signature )
+		self.assertNotEqual( full.climatology_cache.filename, cropped.climatology_cache.filename )
+	def test_mismatched_grid_raises( self ):
+		# a full grid climatology handed to a cropped run
+		historical, future = self._datasets()
+		full = self._run( historical, future, self.cache_dir, None )
+		historical, future = self._datasets()
+		self.assertRaises( ValueError, self._run, None, future, full.climatology_cache, None, crop=1 )
+	def test_historical_required_without_cache( self ):
+		historical, future = self._datasets()
+		self.assertRaises( ValueError, self._run, None, future, None, None )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
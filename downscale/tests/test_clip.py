@@ -0,0 +1,104 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the window-based crop / clip
+# # # #
+
+import unittest, os, shutil, tempfile
+import rasterio
+import numpy as np
+
+class TestClipPlan( unittest.TestCase ):
+	''' tests for downscale.clip.ClipPlan '''
+	def setUp( self ):
+		from affine import Affine
+		from shapely.geometry import Polygon
+		from downscale.grid import GridSpec
+		self.tmp_dir = tempfile.mkdtemp()
+		rng = np.random.RandomState( 3 )
+		self.arr = ( rng.rand( 40, 50 ) * 100 ).astype( np.float32 )
+		self.grid = GridSpec( 'EPSG:3338', Affine( 2000.0, 0.0, 0.0, 0.0, -2000.0, 1000000.0 ), (40, 50), nodata=-9999 )
+		self.fn = os.path.join( self.tmp_dir, 'tas_mean_C_ar5_model_rcp85_01_2000.tif' )
+		with rasterio.open( self.fn, 'w', **self.grid.meta ) as out:
+			out.write( self.arr, 1 )
+		# triangle inside the grid
+		self.geom = Polygon([ (10500, 990500), (60500, 990500), (10500, 950500) ])
+	def test_clip_same_grid( self ):
+		from rasterio.features import geometry_mask
+		from downscale.clip import ClipPlan, clip_files
+		plan = ClipPlan( self.grid, [ self.geom ] )
+		self.assertEqual( ( plan.window.row_off, plan.window.col_off ), ( 4, 5 ) )
+		out_fn = os.path.join( self.tmp_dir, 'out', 'clip.tif' )
+		clip_files( plan, [ ( self.fn, out_fn ) ], ncpus=1 )
+		with rasterio.open( out_fn ) as rst:
+			out = rst.read( 1 )
+			self.assertEqual( rst.transform, plan.dst_transform )
+		expected = self.arr[ 4:25, 5:31 ].copy()
+		inside = geometry_mask( [ self.geom ], out_shape=expected.shape, transform=plan.dst_transform, invert=True )
+		expected[ ~inside ] = -9999
+		self.assertEqual( out.shape, expected.shape )
+		np.testing.assert_array_equal( out, expected )
+	def test_clip_keeps_encoding( self ):
+		from downscale.clip import ClipPlan, clip_files
+		from downscale.encoding import ONE_DECIMAL, read_band
+		enc_fn = os.path.join( self.tmp_dir, 'encoded.tif' )
+		with rasterio.open( enc_fn, 'w', **ONE_DECIMAL.meta( self.grid.meta ) ) as out:
+			ONE_DECIMAL.write( out, self.arr )
+		plan = ClipPlan( self.grid, [ self.geom ] )
+		clip_files( plan, [ ( self.fn, os.path.join( self.tmp_dir, 'float.tif' ) ), ( enc_fn, os.path.join( self.tmp_dir, 'int.tif' ) ) ], ncpus=1 )
+		with rasterio.open( os.path.join( self.tmp_dir, 'float.tif' ) ) as a, rasterio.open( os.path.join( self.tmp_dir, 'int.tif' ) ) as b:
+			self.assertEqual( b.dtypes[0], 'int16' )
+			self.assertEqual( ( b.scales, b.nodata ), ( ( 0.1, ), ONE_DECIMAL.nodata ) )
+			expected = a.read( 1, masked=True )
+			out = read_band( b, masked=True )
+		np.testing.assert_array_equal( out.mask, expected.mask )
+		np.testing.assert_allclose( out.compressed(), expected.compressed(), atol=0.05 + 1e-4 )
+	def test_clip_reproject_matches_full_warp( self ):
+		from rasterio.warp import reproject, Resampling
+		from downscale.clip import ClipPlan, clip_files
+		plan = ClipPlan( self.grid, [ self.geom ], dst_crs='EPSG:3338', resolution=2000.0 )
+		self.assertFalse( plan.reproject )
+		plan = ClipPlan.from_shapefile( self._shapefile(), self.fn, dst_crs='EPSG:3857', resolution=5000.0 )
+		self.assertTrue( plan.reproject )
+		self.assertEqual( plan.dst_transform.c % 5000.0, 0 )
+		out = plan.clip( self.arr[ plan.window.toslices() ], -9999 )
+		expected = np.full( plan.dst_shape, -9999, dtype=np.float32 )
+		reproject( self.arr, expected, src_transform=self.grid.transform, src_crs=self.grid.crs,
+					dst_transform=plan.dst_transform, dst_crs=plan.dst_crs, src_nodata=-9999,
+					dst_nodata=-9999, resampling=Resampling.nearest )
+		expected[ ~plan.mask ] = -9999
+		np.testing.assert_array_equal( out, expected )
+		self.assertTrue( ( out != -9999 ).any() )
+		done = clip_files( plan, [ ( self.fn, os.path.join( self.tmp_dir, 'a.tif' ) ),
+									( self.fn, os.path.join( self.tmp_dir, 'b.tif' ) ) ], ncpus=2, threads=True )
+		self.assertEqual( len( done ), 2 )
+	def test_clip_tap_unaligned_source( self ):
+		from affine import Affine
+		from rasterio.warp import reproject, Resampling
+		from downscale.grid import GridSpec
+		from downscale.clip import ClipPlan
+		# 2km grid whose origin is not on multiples of 2000m, like AKCAN
+		grid = GridSpec( 'EPSG:3338', Affine( 2000.0, 0.0, -2173223.2060, 0.0, -2000.0, 2548412.9385 ), (40, 50), nodata=-9999 )
+		geom = self.geom.__class__([ ( x - 2173223.2060 + 3000, y + 2548412.9385 - 1000000.0 ) for x, y in self.geom.exterior.coords ])
+		plan = ClipPlan( grid, [ geom ], dst_crs='EPSG:3338', resolution=2000.0 )
+		self.assertTrue( plan.reproject )
+		self.assertEqual( ( plan.dst_transform.c % 2000.0, plan.dst_transform.f % 2000.0 ), ( 0, 0 ) )
+		out = plan.clip( self.arr[ plan.window.toslices() ], -9999 )
+		expected = np.full( plan.dst_shape, -9999, dtype=np.float32 )
+		reproject( self.arr, expected, src_transform=grid.transform, src_crs=grid.crs, dst_transform=plan.dst_transform,
+					dst_crs=plan.dst_crs, src_nodata=-9999, dst_nodata=-9999, resampling=Resampling.nearest )
+		expected[ ~plan.mask ] = -9999
+		np.testing.assert_array_equal( out, expected )
+		# without tap the source grid is windowed as is
+		plan = ClipPlan( grid, [ geom ], dst_crs='EPSG:3338', resolution=2000.0, tap=False )
+		self.assertFalse( plan.reproject )
+		self.assertEqual( plan.dst_transform.c % 2000.0, grid.transform.c % 2000.0 )
+	def _shapefile( self ):
+		import geopandas as gpd
+		shp_fn = os.path.join( self.tmp_dir, 'aoi.shp' )
+		gpd.GeoDataFrame( { 'id':[1] }, geometry=[ self.geom ], crs='EPSG:3338' ).to_file( shp_fn )
+		return shp_fn
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
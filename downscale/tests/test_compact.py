@@ -0,0 +1,157 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for valid-cell ( compact ) downscaling
+# # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+
+def _regrid( anom, base, grid=None, **kwargs ):
+	''' stand-in for utils.interp_ds -- the anomaly mean plus a gradient across the baseline grid '''
+	rows, cols = np.indices( grid.shape )
+	return ( np.mean( anom ) + rows * 0.01 - cols * 0.02 ).astype( np.float32 )
+
+class TestCompact( unittest.TestCase ):
+	''' tests for downscale.compact '''
+	def setUp( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		from downscale.synthetic import make_baseline
+		self.tmp_dir = tempfile.mkdtemp()
+		self.baseline = make_baseline( os.path.join( self.tmp_dir, 'baseline' ), shape=( 30, 40 ), resolution=50000 )
+		self.grid = GridSpec.from_raster( self.baseline[0] )
+		d = 2.5
+		self.lat = 90 - d / 2 - np.arange( 72 ) * d
+		self.lon = np.arange( 144 ) * d + d / 2
+		lo, la = np.meshgrid( self.lon, self.lat )
+		self.arr = ( np.sin( np.radians( lo ) ) * 10 + la ).astype( np.float32 )
+		self.transform = Affine( d, 0.0, 0.0, 0.0, -d, 90.0 )
+	def _reproject( self, arr, grid, method ):
+		from rasterio.warp import reproject, Resampling
+		out = np.full( grid.shape, np.nan, dtype=np.float32 )
+		reproject( arr, out, src_transform=self.transform, src_crs='EPSG:4326', dst_transform=grid.transform,
+					dst_crs=grid.crs, dst_nodata=np.nan, resampling=getattr( Resampling, method ) )
+		return grid.gather( out )
+	def test_weights_match_gdal( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		from downscale.compact import RegridWeights
+		# on a lat/lon destination the warp is exact, on either side of the dateline and from a -180-180 source
+		rolled = np.roll( self.arr, 72, axis=1 )
+		for origin in [ 180.3, -179.7 ]:
+			grid = GridSpec( 'EPSG:4326', Affine( 0.5, 0.0, origin, 0.0, -0.5, 70.2 ), ( 20, 30 ) )
+			for method in RegridWeights.methods:
+				expected = self._reproject( self.arr, grid, method )
+				np.testing.assert_allclose( RegridWeights( grid, self.transform, self.arr.shape, method=method ).apply( self.arr ),
+											expected, atol=1e-4 )
+				weights = RegridWeights( grid, self.transform * Affine.translation( -72, 0 ), rolled.shape, method=method )
+				np.testing.assert_allclose( weights.apply( rolled ), expected, atol=1e-4 )
+		# projected grids differ only by GDAL's approximate ( 0.125 pixel ) transformer
+		weights = RegridWeights( self.grid, self.transform, self.arr.shape, src_crs={'init':'epsg:4326'} )
+		self.assertEqual( weights.index.shape, ( len( self.grid.valid_index ), 4 ) )
+		np.testing.assert_allclose( weights.apply( self.arr ), self._reproject( self.arr, self.grid, 'bilinear' ), atol=0.25 )
+	def test_cropped_window( self ):
+		from downscale.compact import RegridWeights
+		from downscale.subset import SourceWindow
+		win = SourceWindow.from_grid( self.lat, self.lon, self.grid, halo=2 )
+		full = RegridWeights( self.grid, self.transform, self.arr.shape ).apply( self.arr )
+		cropped = RegridWeights( self.grid, win.transform, win.shape ).apply( win.crop_array( self.arr ) )
+		np.testing.assert_allclose( cropped, full, atol=1e-5 )
+	def test_nodata_renormalized( self ):
+		from downscale.compact import RegridWeights
+		weights = RegridWeights( self.grid, self.transform, self.arr.shape, src_nodata=-9999.0 )
+		arr = np.full( self.arr.shape, 5.0, dtype=np.float32 )
+		arr[ 8:10 ] = np.nan
+		arr[ 10 ] = -9999.0
+		out = weights.apply( arr )
+		self.assertTrue( np.allclose( out[ np.isfinite( out ) ], 5.0 ) )
+		self.assertTrue( np.isfinite( out ).any() )
+		self.assertTrue( np.isnan( weights.apply( np.full( self.arr.shape, np.nan ) ) ).all() )
+		self.assertRaises( ValueError, weights.apply, self.arr[ 1: ] )
+		self.assertRaises( ValueError, RegridWeights, self.grid, self.transform, self.arr.shape, method='cubic' )
+	def test_compact_matches_run_ds( self ):
+		import rasterio
+		from functools import partial
+		from downscale import utils
+		from downscale.compact import downscale_compact
+		rng = np.random.RandomState( 0 )
+		anoms = [ rng.rand( 6, 8 ) for i in range( 24 ) ]
+		def tasks( name ):
+			return [ { 'anom':anoms[ i ], 'base':self.baseline[ i % 12 ], 'output_filename':os.path.join( self.tmp_dir, name, 'tas_{:02d}.tif'.format( i ) ),
+					'downscaling_operation':'add', 'post_downscale_function':partial( np.round, decimals=1 ), 'mask':None, 'mask_value':0 } for i in range( 24 ) ]
+		f = partial( _regrid, grid=self.grid )
+		switch = { 'add':utils.add, 'mult':utils.mult }
+		expected = [ utils._run_ds( d, f, switch, anom=True, grid=self.grid ) for d in tasks( 'full' ) ]
+		out = downscale_compact( tasks( 'compact' ), self.grid, switch, f=f, anom=True, ncpus=2 )
+		self.assertEqual( out, [ fn.replace( 'full', 'compact' ) for fn in expected ] )
+		for fn in expected:
+			with rasterio.open( fn ) as a, rasterio.open( fn.replace( 'full', 'compact' ) ) as b:
+				np.testing.assert_array_equal( a.read( 1 ), b.read( 1 ) )
+				self.assertEqual( a.meta, b.meta )
+		with rasterio.open( os.path.join( self.tmp_dir, 'compact', 'anom', 'tas_00_anom.tif' ) ) as rst:
+			arr = rst.read( 1 )
+			self.assertTrue( ( arr[ ~self.grid.mask ] == rst.nodata ).all() )
+		self.assertRaises( ValueError, downscale_compact, tasks( 'none' ), self.grid, switch )
+	def test_delta_downscale_compact( self ):
+		import glob, rasterio
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		from downscale.compact import RegridWeights
+		case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1951), future=(2006, 2006) )
+		historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+		future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+		baseline = Baseline( case[ 'baseline' ] )
+		down = DeltaDownscale( baseline, case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+								downscaling_operation='add', ncpus=1, src_nodata=None, crop=1 )
+		output_dir = os.path.join( self.tmp_dir, 'out' )
+		self.assertRaises( ValueError, down.downscale, output_dir, compact=True, pipeline=True )
+		down.downscale( output_dir, compact=True )
+		files = sorted( glob.glob( os.path.join( output_dir, '*.tif' ) ) )
+		self.assertEqual( len( files ), 12 )
+		grid = baseline.grid
+		weights = RegridWeights( grid, down._subset.transform, down.anomalies_rot.shape[1:] )
+		with rasterio.open( [ fn for fn in files if fn.endswith( '_01_2006.tif' ) ][0] ) as rst, \
+				rasterio.open( baseline.filelist[0] ) as base:
+			arr = rst.read( 1 )
+			self.assertTrue( ( arr[ ~grid.mask ] == rst.nodata ).all() )
+			np.testing.assert_allclose( grid.gather( arr ), grid.gather( base.read( 1 ) ) + weights.apply( down.anomalies_rot[0] ), rtol=1e-5 )
+	def test_round_it_post_function( self ):
+		# the production rounder bound to the full-grid mask cannot run on vectors / tiles -- refused up front,
+		#  while the elementwise rounder gives the same outputs as round_it in a whole-grid run
+		import glob, rasterio
+		from functools import partial
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1951), future=(2006, 2006) )
+		baseline = Baseline( case[ 'baseline' ] )
+		with rasterio.open( baseline.filelist[0] ) as rst:
+			mask = rst.read_masks( 1 )
+		def round_it( x, mask ):
+			return np.round( np.ma.masked_array( data=x, mask=mask ), decimals=1 )
+		def run( post ):
+			historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+			future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+			return DeltaDownscale( baseline, case[ 'clim_begin' ], case[ 'clim_end' ], historical, future, downscaling_operation='add',
+									ncpus=1, src_nodata=None, post_downscale_function=post )
+		down = run( partial( round_it, mask=( mask == 0 ) ) )
+		self.assertRaises( ValueError, down.downscale, os.path.join( self.tmp_dir, 'refused' ), compact=True )
+		self.assertRaises( ValueError, down.downscale, os.path.join( self.tmp_dir, 'refused' ), tile_size=16 )
+		self.assertFalse( os.path.exists( os.path.join( self.tmp_dir, 'refused' ) ) )
+		down.downscale( os.path.join( self.tmp_dir, 'round_it' ) )
+		rounder = run( partial( np.round, decimals=1 ) )
+		rounder.downscale( os.path.join( self.tmp_dir, 'full' ) )
+		rounder.downscale( os.path.join( self.tmp_dir, 'compact' ), compact=True )
+		files = sorted( glob.glob( os.path.join( self.tmp_dir, 'round_it', '*.tif' ) ) )
+		self.assertEqual( len( files ), 12 )
+		for fn in files:
+			with rasterio.open( fn ) as a, rasterio.open( fn.replace( 'round_it', 'full' ) ) as b, \
+					rasterio.open( fn.replace( 'round_it', 'compact' ) ) as c:
+				np.testing.assert_array_equal( a.read( 1 ), b.read( 1 ) )
+				arr = c.read( 1 )
+				self.assertTrue( ( arr[ mask == 0 ] == c.nodata ).all() )
+				np.testing.assert_allclose( arr[ mask > 0 ], np.round( arr[ mask > 0 ], decimals=1 ), atol=1e-5 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,84 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the derived-variable graph
+# # # #
+
+import unittest, os, shutil, tempfile, weakref
+import numpy as np
+
+class TestDerivedGraph( unittest.TestCase ):
+	''' tests for downscale.derived.DerivedGraph.run_month '''
+	def setUp( self ):
+		import rasterio
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		meta = { 'driver':'GTiff', 'dtype':'float32', 'count':1, 'height':4, 'width':5, 'crs':'EPSG:3338',
+				'transform':Affine( 1000, 0, 0, 0, -1000, 0 ), 'nodata':-9999.0 }
+		self.sources = {}
+		for name, value, nodata_cell in [ ( 'tas', 10.0, ( 0, 0 ) ), ( 'hurs', 80.0, ( 3, 4 ) ) ]:
+			self.sources[ name ] = os.path.join( self.tmp_dir, name + '.tif' )
+			arr = np.full( ( 4, 5 ), value, dtype=np.float32 )
+			arr[ nodata_cell ] = -9999.0
+			with rasterio.open( self.sources[ name ], 'w', **meta ) as out:
+				out.write( arr, 1 )
+		self.calls = []
+		self.refs = {}
+	def graph( self ):
+		''' a -> b -> c chain: a( tas ), b( a, hurs ), c( b ) -- tas is free once a has run '''
+		from downscale.derived import Product, DerivedGraph
+		def a( tas ):
+			self.calls.append( 'a' )
+			self.refs[ 'tas' ] = weakref.ref( tas )
+			return tas + 1
+		def b( a, hurs ):
+			self.calls.append( 'b' )
+			self.tas_alive_in_b = self.refs[ 'tas' ]() is not None
+			self.refs[ 'a' ] = weakref.ref( a )
+			return a * hurs
+		def c( b ):
+			self.calls.append( 'c' )
+			self.a_alive_in_c = self.refs[ 'a' ]() is not None
+			return b / 2
+		# declared out of order on purpose
+		return DerivedGraph([ Product( 'c', [ 'b' ], c ), Product( 'b', [ 'a', 'hurs' ], b ), Product( 'a', [ 'tas' ], a ) ])
+	def test_order_and_sources( self ):
+		graph = self.graph()
+		self.assertEqual( graph.order, [ 'a', 'b', 'c' ] )
+		self.assertEqual( graph.sources, [ 'hurs', 'tas' ] )
+		self.assertEqual( graph.required([ 'b' ]), [ 'a', 'b' ] )
+		self.assertRaises( ValueError, graph.required, [ 'missing' ] )
+	def test_run_month( self ):
+		import rasterio
+		from unittest import mock
+		graph = self.graph()
+		opened = []
+		real_open = rasterio.open
+		def counting_open( fp, mode='r', **kwargs ):
+			if mode == 'r':
+				opened.append( fp )
+			return real_open( fp, mode, **kwargs )
+		outputs = { 'c':os.path.join( self.tmp_dir, 'out', 'c.tif' ) }
+		with mock.patch( 'rasterio.open', counting_open ):
+			graph.run_month( self.sources, outputs )
+		# each source read once, products in dependency order, only c written
+		self.assertEqual( sorted( opened ), sorted( self.sources.values() ) )
+		self.assertEqual( self.calls, [ 'a', 'b', 'c' ] )
+		self.assertEqual( os.listdir( os.path.join( self.tmp_dir, 'out' ) ), [ 'c.tif' ] )
+		# inputs are dropped after their last consumer
+		self.assertFalse( self.tas_alive_in_b )
+		self.assertFalse( self.a_alive_in_c )
+		# nodata of any input is nodata in the output
+		with rasterio.open( outputs[ 'c' ] ) as rst:
+			arr = rst.read( 1, masked=True )
+		self.assertEqual( rst.nodata, -9999.0 )
+		self.assertTrue( arr.mask[ 0, 0 ] and arr.mask[ 3, 4 ] )
+		self.assertEqual( int( arr.mask.sum() ), 2 )
+		np.testing.assert_allclose( arr.compressed(), ( 10.0 + 1 ) * 80.0 / 2 )
+	def test_missing_source( self ):
+		graph = self.graph()
+		self.assertRaises( ValueError, graph.run_month, { 'tas':self.sources[ 'tas' ] }, { 'c':os.path.join( self.tmp_dir, 'c.tif' ) } )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,59 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the archive regression diff
+# # # #
+
+import unittest, os, shutil, tempfile, json
+import rasterio
+import numpy as np
+
+class TestDiffTrees( unittest.TestCase ):
+	''' tests for downscale.diff '''
+	def setUp( self ):
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		meta = {'transform': Affine(1.0, 0.0, -180.0, 0.0, -1.0, 90.0), 'count': 1, 'crs': 'EPSG:4326',
+				'driver': 'GTiff', 'dtype': 'float32', 'height': 30, 'width': 40, 'nodata': -9999.0 }
+		rng = np.random.RandomState( 5 )
+		self.old_dir = os.path.join( self.tmp_dir, 'old' )
+		self.new_dir = os.path.join( self.tmp_dir, 'new' )
+		self.arr = rng.rand( 30, 40 ).astype( np.float32 )
+		changed = self.arr.copy()
+		changed[ 0, :4 ] += np.array([ 1.0, -0.5, 0.0, 2.0 ], dtype=np.float32 )
+		changed[ 29, 39 ] = -9999.0
+		self.changed = changed
+		for base, arrs in [ ( self.old_dir, [ self.arr, self.arr, self.arr ] ), ( self.new_dir, [ self.arr, changed ] ) ]:
+			dirname = os.path.join( base, 'model', 'rcp85', 'tas' )
+			os.makedirs( dirname )
+			for month, arr in enumerate( arrs ):
+				fn = os.path.join( dirname, 'tas_mean_C_ar5_model_rcp85_{:02d}_2000.tif'.format( month + 1 ) )
+				with rasterio.open( fn, 'w', **meta ) as out:
+					out.write( arr, 1 )
+	def test_diff_trees( self ):
+		from downscale.diff import diff_trees
+		df = diff_trees( self.old_dir, self.new_dir, ncpus=1 ).set_index( 'month' )
+		self.assertEqual( df.status.tolist(), [ 'identical', 'different', 'missing_new' ] )
+		row = df.loc[ 2 ]
+		self.assertEqual( row[ 'n_diff' ], 3 )
+		self.assertEqual( row[ 'mask_mismatch' ], 1 )
+		self.assertEqual( row[ 'count' ], 30 * 40 - 1 )
+		self.assertAlmostEqual( row[ 'max_abs' ], 2.0, places=5 )
+		diff = ( self.changed - self.arr ).astype( np.float64 ).ravel()[ :-1 ]
+		self.assertAlmostEqual( row[ 'bias' ], diff.mean(), places=6 )
+		self.assertAlmostEqual( row[ 'rmse' ], np.sqrt( ( diff ** 2 ).mean() ), places=6 )
+	def test_report( self ):
+		from downscale.diff import diff_trees, write_report
+		df = diff_trees( self.old_dir, self.new_dir, ncpus=2 )
+		out_fn = write_report( df, os.path.join( self.tmp_dir, 'report', 'diff.json' ), summary_by=[ 'variable' ] )
+		with open( out_fn ) as f:
+			report = json.load( f )
+		summary, = report[ 'summary' ]
+		self.assertEqual( ( summary[ 'files' ], summary[ 'files_different' ], summary[ 'files_identical' ] ), ( 3, 2, 1 ) )
+		self.assertEqual( len( report[ 'files' ] ), 3 )
+		write_report( df, os.path.join( self.tmp_dir, 'report', 'diff.csv' ) )
+		self.assertTrue( os.path.exists( os.path.join( self.tmp_dir, 'report', 'diff_summary.csv' ) ) )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the compute dtype of Dataset / DeltaDownscale
+# # #
+
+import unittest, os, glob, shutil, tempfile
+import numpy as np
+
+class TestDtype( unittest.TestCase ):
+	''' tests for the dtype policy of downscale.Dataset and downscale.DeltaDownscale '''
+	def setUp( self ):
+		import xarray as xr
+		from downscale.synthetic import make_case
+		self.tmp_dir = tempfile.mkdtemp()
+		self.case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1959), future=(2006, 2007) )
+		# double precision copies of the series -- the inputs that upcast today
+		for key in [ 'historical', 'future' ]:
+			fn = self.case[ key ].replace( '.nc', '_f8.nc' )
+			with xr.open_dataset( self.case[ key ] ) as ds:
+				ds = ds.load()
+			ds[ 'tas' ] = ds[ 'tas' ].astype( np.float64 )
+			ds[ 'tas' ].encoding.update( dtype='float64' )
+			ds.to_netcdf( fn )
+			self.case[ key + '_f8' ] = fn
+	def run_case( self, output_dir, dtype ):
+		from downscale import Dataset, Baseline, DeltaDownscale
+		case = self.case
+		historical = Dataset( case[ 'historical_f8' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='K', metric='mean', dtype=dtype )
+		future = Dataset( case[ 'future_f8' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='K', metric='mean', dtype=dtype )
+		down = DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+								downscaling_operation='add', ncpus=1, src_nodata=None, dtype=dtype )
+		down.downscale( output_dir )
+		return down
+	def test_float32_policy( self ):
+		import rasterio
+		single = self.run_case( os.path.join( self.tmp_dir, 'f4' ), 'float32' )
+		for arr in [ single.historical.ds[ 'tas' ], single.ds, single.climatology, single.anomalies, single.anomalies_rot ]:
+			self.assertEqual( arr.dtype, np.float32 )
+		double = self.run_case( os.path.join( self.tmp_dir, 'f8' ), None )
+		for arr in [ double.ds, double.climatology, double.anomalies ]:
+			self.assertEqual( arr.dtype, np.float64 )
+
+		# the climatology accumulates in float64 either way
+		np.testing.assert_allclose( single.climatology.data, double.climatology.data, rtol=0, atol=1e-4 )
+		files = sorted( glob.glob( os.path.join( self.tmp_dir, 'f8', '*.tif' ) ) )
+		self.assertEqual( len( files ), 24 )
+		for fn in files:
+			with rasterio.open( fn ) as a, rasterio.open( os.path.join( self.tmp_dir, 'f4', os.path.basename( fn ) ) ) as b:
+				a, b = a.read( 1, masked=True ), b.read( 1, masked=True )
+			np.testing.assert_array_equal( a.mask, b.mask )
+			# K-scale temperatures: a few float32 ulps
+			self.assertLess( np.abs( a - b ).max(), 1e-4 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,96 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the scaled-integer output encoding
+# # #
+
+import unittest, os, glob, shutil, tempfile
+from functools import partial
+import numpy as np
+
+class TestEncoding( unittest.TestCase ):
+	''' tests for downscale.encoding and the encoding= outputs '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_encode_decode( self ):
+		from downscale.encoding import Encoding, ONE_DECIMAL
+		arr = np.array([ -40.04, 0.0, 12.35, np.nan, -9999.0, 3276.7 ], dtype=np.float32 )
+		packed = ONE_DECIMAL.encode( arr, nodata=-9999.0 )
+		self.assertEqual( packed.dtype, np.int16 )
+		self.assertEqual( packed.tolist(), [ -400, 0, 124, -32768, -32768, 32767 ] )
+		decoded = ONE_DECIMAL.decode( packed )
+		np.testing.assert_allclose( decoded[[ 0, 1, 2, 5 ]], [ -40.0, 0.0, 12.4, 3276.7 ], atol=1e-4 )
+		self.assertTrue( np.isnan( decoded[[ 3, 4 ]] ).all() )
+		# wraps are refused, the nodata value is not a value
+		self.assertRaises( ValueError, ONE_DECIMAL.encode, np.array([ 3276.8 ]) )
+		self.assertRaises( ValueError, ONE_DECIMAL.encode, np.array([ -3276.8 ]) )
+		self.assertRaises( ValueError, Encoding, 'float32' )
+		offset = Encoding( 'uint16', scale_factor=0.01, add_offset=-100.0, nodata=65535 )
+		np.testing.assert_allclose( offset.decode( offset.encode( np.array([ -100.0, 0.0, 555.34 ]) ) ), [ -100.0, 0.0, 555.34 ], atol=1e-4 )
+	def test_whole_pr( self ):
+		from downscale.encoding import WHOLE, ENCODINGS
+		# half the bytes of float32, and a dry month ( 0mm ) is a value, not nodata
+		self.assertIs( ENCODINGS[ 'pr' ], WHOLE )
+		self.assertEqual( np.dtype( WHOLE.dtype ).itemsize, 2 )
+		packed = WHOLE.encode( np.array([ 0.0, 0.4, 9300.0, np.nan ]) )
+		self.assertEqual( packed.tolist(), [ 0, 0, 9300, 65535 ] )
+		self.assertEqual( WHOLE.valid_range(), ( 0.0, 65534.0 ) )
+		self.assertRaises( ValueError, WHOLE.encode, np.array([ -1.0 ]) )
+		self.assertRaises( ValueError, WHOLE.encode, np.array([ 65535.0 ]) )
+	def test_downscale_encoded( self ):
+		import rasterio
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		from downscale.encoding import Encoding, ONE_DECIMAL, read_band
+		from downscale.rechunk import read_block
+		case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1951), future=(2006, 2007) )
+		historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='K', metric='mean' )
+		future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='K', metric='mean' )
+		down = DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+								downscaling_operation='add', ncpus=1, src_nodata=None,
+								post_downscale_function=partial( np.round, decimals=1 ) )
+		float_dir = down.downscale( os.path.join( self.tmp_dir, 'float' ), compact=True )
+		files = sorted( glob.glob( os.path.join( float_dir, '*.tif' ) ) )
+		for name, kwargs in [ ( 'int', dict( compact=True ) ), ( 'full', {} ), ( 'tiled', dict( tile_size=16 ) ) ]:
+			output_dir = down.downscale( os.path.join( self.tmp_dir, name ), encoding=ONE_DECIMAL, **kwargs )
+			encoded = [ os.path.join( output_dir, os.path.basename( fn ) ) for fn in files ]
+			with rasterio.open( encoded[0] ) as rst:
+				self.assertEqual( rst.dtypes[0], 'int16' )
+				self.assertEqual( rst.nodata, -32768 )
+				self.assertAlmostEqual( rst.scales[0], 0.1 )
+				self.assertEqual( Encoding.from_raster( rst ), ONE_DECIMAL )
+			if name == 'int':
+				for a, b in zip( files, encoded ):
+					with rasterio.open( a ) as a, rasterio.open( b ) as b:
+						a, b = read_band( a, masked=True ), read_band( b, masked=True )
+					np.testing.assert_array_equal( a.mask, b.mask )
+					self.assertLess( np.abs( a - b ).max(), 1e-4 )
+				rows, cols = slice( 0, 40 ), slice( 0, 50 )
+				np.testing.assert_allclose( read_block( encoded, rows, cols ), read_block( files, rows, cols ), atol=1e-4 )
+	def test_derived_encoded( self ):
+		import rasterio
+		from affine import Affine
+		from downscale.derived import Product, DerivedGraph
+		from downscale.encoding import Encoding, read_band
+		meta = { 'driver':'GTiff', 'dtype':'float32', 'count':1, 'height':4, 'width':5, 'crs':'EPSG:3338',
+				'transform':Affine( 1000, 0, 0, 0, -1000, 0 ), 'nodata':-9999.0 }
+		sources = {}
+		for name, value in [ ( 'tas', 10.0 ), ( 'hurs', 80.0 ) ]:
+			sources[ name ] = os.path.join( self.tmp_dir, name + '.tif' )
+			arr = np.full( ( 4, 5 ), value, dtype=np.float32 )
+			arr[ 0, 0 ] = -9999.0
+			with rasterio.open( sources[ name ], 'w', **meta ) as out:
+				out.write( arr, 1 )
+		from downscale.derived import vap
+		product = Product( 'vap', [ 'tas', 'hurs' ], vap, round_func=partial( np.around, decimals=2 ), encoding=Encoding( 'int16', scale_factor=0.01 ) )
+		fn = os.path.join( self.tmp_dir, 'out', 'vap.tif' )
+		DerivedGraph([ product ]).run_month( sources, { 'vap':fn } )
+		with rasterio.open( fn ) as rst:
+			self.assertEqual( rst.dtypes[0], 'int16' )
+			arr = read_band( rst )
+		self.assertTrue( np.isnan( arr[ 0, 0 ] ) )
+		np.testing.assert_allclose( arr[ 1: ], np.around( vap( 10.0, 80.0 ), 2 ), atol=1e-4 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
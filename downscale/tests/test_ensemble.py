@@ -0,0 +1,57 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the windowed ensemble statistics
+# # # #
+
+import unittest, os, shutil, tempfile
+import rasterio
+import numpy as np
+
+class TestEnsembleStats( unittest.TestCase ):
+	''' tests for downscale.ensemble.ensemble_stats '''
+	def setUp( self ):
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		meta = {'transform': Affine(1.0, 0.0, -180.0, 0.0, -1.0, 90.0),
+				'count': 1,
+				'crs': 'EPSG:4326',
+				'driver': 'GTiff',
+				'dtype': 'float32',
+				'height': 40,
+				'width': 60,
+				'nodata': -9999.0,
+				'tiled': True,
+				'blockxsize': 16,
+				'blockysize': 16 }
+		rng = np.random.RandomState( 1234 )
+		self.arrs = rng.rand( 5, 40, 60 ).astype( np.float32 ) * 10
+		self.arrs[ :, :5, : ] = -9999.0 # oob rows
+		self.files = []
+		for i, arr in enumerate( self.arrs ):
+			fn = os.path.join( self.tmp_dir, 'model{}.tif'.format( i ) )
+			with rasterio.open( fn, 'w', **meta ) as out:
+				out.write( arr, 1 )
+			self.files = self.files + [ fn ]
+	def test_stats_match_numpy( self ):
+		from downscale.ensemble import ensemble_stats
+		names = [ 'mean', 'median', 'std', 'min', 'max', 'p90' ]
+		output_filenames = { name:os.path.join( self.tmp_dir, name, 'out.tif' ) for name in names }
+		ensemble_stats( self.files, output_filenames, stats=names[:-1], percentiles=[90], max_rows=7 )
+		valid = self.arrs[ :, 5:, : ]
+		expected = { 'mean':np.mean( valid, axis=0 ), 'median':np.median( valid, axis=0 ),
+					'std':np.std( valid, axis=0 ), 'min':np.min( valid, axis=0 ),
+					'max':np.max( valid, axis=0 ), 'p90':np.percentile( valid, 90, axis=0 ) }
+		for name in names:
+			with rasterio.open( output_filenames[ name ] ) as rst:
+				arr = rst.read( 1 )
+			np.testing.assert_allclose( arr[ 5:, : ], expected[ name ], rtol=1e-5 )
+			self.assertTrue( (arr[ :5, : ] == -9999.0).all() )
+	def test_missing_output_filename( self ):
+		from downscale.ensemble import ensemble_stats
+		with self.assertRaises( ValueError ):
+			ensemble_stats( self.files, {'mean':os.path.join( self.tmp_dir, 'm.tif' )}, stats=['mean','std'] )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
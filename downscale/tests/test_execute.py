@@ -0,0 +1,28 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the shared downscale option checks
+# # #
+
+import unittest
+
+class TestCheckOptions( unittest.TestCase ):
+	''' tests for downscale.execute.check_options '''
+	def test_valid( self ):
+		from downscale.execute import check_options
+		from downscale.encoding import ONE_DECIMAL
+		grid = object()
+		check_options( None, time_chunk=12, pipeline=True )
+		check_options( grid, compact=True, partition=1, n_partitions=4, encoding=ONE_DECIMAL )
+		check_options( grid, tile_size=256 )
+	def test_invalid( self ):
+		from downscale.execute import check_options
+		grid = object()
+		for kwargs in [ dict( time_chunk=0 ), dict( compact=True, pipeline=True ), dict( tile_size=256, compact=True ),
+						dict( tile_size=100 ), dict( partition=0 ), dict( partition=4, n_partitions=4 ),
+						dict( encoding='int16' ) ]:
+			self.assertRaises( ValueError, check_options, grid, **kwargs )
+		self.assertRaises( ValueError, check_options, None, compact=True )
+		self.assertRaises( ValueError, check_options, None, tile_size=256 )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for point time-series extraction
+# # # #
+
+import unittest, os, shutil, tempfile, warnings
+import numpy as np
+
+class TestExtract( unittest.TestCase ):
+	''' tests for downscale.extract '''
+	def setUp( self ):
+		import rasterio
+		from affine import Affine
+		from pyproj import Transformer
+		from downscale.grid import GridSpec
+		from downscale.encoding import ONE_DECIMAL
+		self.tmp_dir = tempfile.mkdtemp()
+		self.transform = Affine( 2000, 0, -2173223.2060, 0, -2000, 2548412.9385 )
+		self.grid = GridSpec( 'EPSG:3338', self.transform, ( 20, 30 ) )
+		meta = { 'driver':'GTiff', 'dtype':'float32', 'count':1, 'height':20, 'width':30, 'crs':'EPSG:3338',
+				'transform':self.transform, 'nodata':-9999.0 }
+		rows, cols = np.mgrid[ 0:20, 0:30 ]
+		self.base = ( rows * 30 + cols ).astype( np.float32 ) / 10.0
+		for variable in [ 'tas', 'hurs' ]:
+			dirname = os.path.join( self.tmp_dir, 'archive', 'MODEL', 'rcp85', variable )
+			os.makedirs( dirname )
+			# written out of time order -- the extraction sorts by year / month
+			for year in [ 2001, 2000 ]:
+				for month in [ 2, 1 ]:
+					fn = os.path.join( dirname, '{}_mean_C_ar5_MODEL_rcp85_{:02d}_{}.tif'.format( variable, month, year ) )
+					arr = self.value( month, year )
+					if variable == 'hurs':
+						with rasterio.open( fn, 'w', **ONE_DECIMAL.meta( meta ) ) as out:
+							ONE_DECIMAL.write( out, arr )
+					else:
+						with rasterio.open( fn, 'w', **meta ) as out:
+							out.write( arr, 1 )
+		# lon / lat of three pixel centres, and one point off the grid
+		self.pixels = [ ( 0, 0 ), ( 5, 7 ), ( 19, 29 ) ]
+		xs, ys = self.transform * ( np.array([ c + 0.5 for r, c in self.pixels ]), np.array([ r + 0.5 for r, c in self.pixels ]) )
+		lons, lats = Transformer.from_crs( 'EPSG:3338', 'EPSG:4326', always_xy=True ).transform( xs, ys )
+		self.lons, self.lats = list( lons ) + [ 0.0 ], list( lats ) + [ 0.0 ]
+	def value( self, month, year ):
+		return ( self.base + month * 100 + ( year - 2000 ) * 1000 ).astype( np.float32 )
+	def test_pixel_index( self ):
+		from downscale.extract import pixel_index
+		rows, cols, inside = pixel_index( np.array( self.lons ), np.array( self.lats ), 'EPSG:4326', self.grid )
+		self.assertEqual( inside.tolist(), [ True, True, True, False ] )
+		self.assertEqual( list( zip( rows[ inside ].tolist(), cols[ inside ].tolist() ) ), self.pixels )
+	def test_points( self ):
+		from downscale.extract import points
+		with warnings.catch_warnings( record=True ) as caught:
+			warnings.simplefilter( 'always' )
+			df = points( os.path.join( self.tmp_dir, 'archive' ), ( self.lons, self.lats ), [ 'tas', 'hurs' ], [ 'MODEL' ],
+						[ 'rcp85' ], names=[ 'a', 'b', 'c', 'off' ], ncpus=1 )
+		self.assertTrue( any([ 'off' in str( w.message ) for w in caught ]) )
+		self.assertEqual( sorted( df.point.unique() ), [ 'a', 'b', 'c' ] )
+		self.assertEqual( len( df ), 2 * 4 * 3 )
+		for variable in [ 'tas', 'hurs' ]:
+			sub = df[ df.variable == variable ]
+			# time ordered: one row per point for each month of each year
+			self.assertEqual( sub.year.tolist(), [ 2000 ] * 6 + [ 2001 ] * 6 )
+			self.assertEqual( sub.month.tolist(), ( [ 1 ] * 3 + [ 2 ] * 3 ) * 2 )
+			self.assertEqual( sub.point.tolist(), [ 'a', 'b', 'c' ] * 4 )
+			expected = [ self.value( m, y )[ self.pixels[ 'abc'.index( p ) ] ] for y, m, p in zip( sub.year, sub.month, sub.point ) ]
+			# the encoded ( int16, 0.1 ) variable decodes to the same physical values
+			np.testing.assert_allclose( sub.value.values, expected, atol=1e-3 )
+	def test_points_from_cube( self ):
+		import pandas as pd
+		import xarray as xr
+		from downscale.extract import points_from_cube
+		# pixel-centre coordinates
+		x = np.asarray( ( self.transform * ( np.arange( 30 ) + 0.5, np.zeros( 30 ) ) )[0] )
+		y = np.asarray( ( self.transform * ( np.zeros( 20 ), np.arange( 20 ) + 0.5 ) )[1] )
+		times = pd.date_range( '2000-01-01', periods=2, freq='MS' )
+		da = xr.DataArray( np.array([ self.value( 1, 2000 ), self.value( 2, 2000 ) ]), dims=( 'time', 'y', 'x' ),
+							coords={ 'time':times, 'y':y, 'x':x }, attrs={ 'crs':'EPSG:3338' } )
+		df = points_from_cube( da, ( self.lons[:3], self.lats[:3] ), names=[ 'a', 'b', 'c' ] )
+		self.assertEqual( list( df.columns ), [ 'point', 'time', 'value' ] )
+		for month, p, value in zip( df.time.dt.month, df.point, df.value ):
+			self.assertAlmostEqual( value, self.value( month, 2000 )[ self.pixels[ 'abc'.index( p ) ] ], places=4 )
+		self.assertEqual( len( df ), 6 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
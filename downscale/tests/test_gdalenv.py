@@ -0,0 +1,52 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the GDAL performance profile of the workers
+# # #
+
+import unittest
+import numpy as np
+
+class TestGDALProfile( unittest.TestCase ):
+	''' tests for downscale.gdalenv '''
+	def setUp( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		self.grid = GridSpec( 'EPSG:3338', Affine( 20000, 0, -1e6, 0, -20000, 2e6 ), ( 120, 150 ) )
+		self.anom = np.random.RandomState( 0 ).rand( 90, 180 ).astype( np.float32 )
+		self.src_transform = Affine( 2, 0, 0, 0, -2, 90 )
+	def test_warp_kwargs( self ):
+		from downscale.gdalenv import GDALProfile, DEFAULT_SOURCE_EXTRA, KERNEL_SOURCE_EXTRA
+		self.assertEqual( GDALProfile().warp_kwargs( 'cubic' ), { 'num_threads':1, 'warp_mem_limit':0, 'SOURCE_EXTRA':DEFAULT_SOURCE_EXTRA } )
+		profile = GDALProfile( num_threads=4, warp_mem_limit=256, source_extra=KERNEL_SOURCE_EXTRA )
+		self.assertEqual( profile.warp_kwargs( 'cubic' )[ 'SOURCE_EXTRA' ], 3 )
+		self.assertEqual( profile.warp_kwargs( 'max' )[ 'SOURCE_EXTRA' ], DEFAULT_SOURCE_EXTRA )
+		self.assertEqual( GDALProfile( num_threads=4, cache_max=128 ).options(), { 'GDAL_NUM_THREADS':'4', 'GDAL_CACHEMAX':128 } )
+		self.assertEqual( GDALProfile().options(), {} )
+	def test_activate( self ):
+		import rasterio.env
+		from downscale.gdalenv import GDALProfile, activate, deactivate
+		profile = GDALProfile( num_threads=2, cache_max=64 )
+		try:
+			self.assertIsNone( activate( None ) )
+			self.assertIs( activate( profile ), profile )
+			self.assertEqual( rasterio.env.getenv()[ 'GDAL_NUM_THREADS' ], '2' )
+			# an equal profile is already active
+			self.assertIs( activate( GDALProfile( num_threads=2, cache_max=64 ) ), profile )
+			activate( GDALProfile( cache_max=32 ) )
+			self.assertNotIn( 'GDAL_NUM_THREADS', rasterio.env.getenv() )
+		finally:
+			deactivate()
+		self.assertFalse( rasterio.env.hasenv() )
+	def test_threads_match_default( self ):
+		from downscale import utils
+		from downscale.gdalenv import GDALProfile, deactivate
+		kwargs = dict( src_crs={'init':'epsg:4326'}, src_nodata=None, dst_nodata=None, src_transform=self.src_transform, grid=self.grid )
+		try:
+			expected = utils.interp_ds( self.anom, None, **kwargs )
+			profile = GDALProfile( num_threads=4, warp_mem_limit=64, cache_max=64 )
+			np.testing.assert_array_equal( utils.interp_ds( self.anom, None, gdal_profile=profile, **kwargs ), expected )
+		finally:
+			deactivate()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the GridSpec grid geometry object
+# # # #
+
+import unittest, os, shutil, tempfile
+import rasterio
+import numpy as np
+
+class TestGridSpec( unittest.TestCase ):
+	''' tests for downscale.GridSpec '''
+	def setUp( self ):
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		self.fn = os.path.join( self.tmp_dir, 'template.tif' )
+		meta = {'transform': Affine(2000.0, 0.0, -100000.0, 0.0, -2000.0, 1500000.0),
+				'count': 1, 'crs': 'EPSG:3338', 'driver': 'GTiff', 'dtype': 'float32',
+				'height': 15, 'width': 20, 'nodata': -9999.0 }
+		arr = np.ones( (15, 20), dtype=np.float32 )
+		arr[ :3, : ] = -9999.0
+		with rasterio.open( self.fn, 'w', **meta ) as out:
+			out.write( arr, 1 )
+	def test_from_raster( self ):
+		from downscale import GridSpec
+		grid = GridSpec.from_raster( self.fn )
+		self.assertEqual( grid.shape, (15, 20) )
+		self.assertEqual( grid.mask.sum(), 12 * 20 )
+		self.assertEqual( grid.valid_index[0], 3 * 20 )
+		self.assertEqual( grid.meta[ 'nodata' ], -9999.0 )
+	def test_sidecar_roundtrip( self ):
+		from downscale import GridSpec
+		sidecar = os.path.join( self.tmp_dir, 'sub', 'grid.npz' )
+		grid = GridSpec.from_raster( self.fn, sidecar=sidecar )
+		self.assertTrue( os.path.exists( sidecar ) )
+		os.unlink( self.fn ) # the sidecar is all we need now
+		loaded = GridSpec.from_raster( self.fn, sidecar=sidecar )
+		self.assertEqual( loaded.signature, grid.signature )
+		self.assertEqual( loaded.transform, grid.transform )
+		np.testing.assert_array_equal( loaded.mask, grid.mask )
+	def test_scatter_gather_lonlat( self ):
+		from downscale import GridSpec
+		grid = GridSpec.from_raster( self.fn )
+		arr = np.arange( 15 * 20, dtype=np.float32 ).reshape( 15, 20 )
+		vec = grid.gather( arr )
+		self.assertEqual( vec.size, grid.mask.sum() )
+		out = grid.scatter( vec )
+		np.testing.assert_array_equal( out[ grid.mask ], arr[ grid.mask ] )
+		self.assertTrue( (out[ ~grid.mask ] == -9999.0).all() )
+		lons, lats = grid.lonlat
+		self.assertEqual( lons.shape, grid.shape )
+		self.assertTrue( (lats > 45).all() and (lats < 75).all() )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,34 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the lazy package imports
+# # #
+
+import unittest, sys, json, subprocess
+
+class TestImports( unittest.TestCase ):
+	''' tests for the deferred imports in downscale/__init__.py '''
+	def _loaded( self, code ):
+		code = code + '\nimport sys, json\nprint( json.dumps( sorted( sys.modules ) ) )'
+		out = subprocess.check_output([ sys.executable, '-c', code ])
+		return set( json.loads( out.decode().strip().splitlines()[-1] ) )
+	def test_import_is_light( self ):
+		loaded = self._loaded( 'import downscale' )
+		for name in [ 'xarray', 'geopandas', 'pandas', 'rasterio', 'downscale.ds', 'downscale.utils' ]:
+			self.assertNotIn( name, loaded )
+		loaded = self._loaded( 'import downscale.grid, downscale.clip, downscale.rechunk' )
+		for name in [ 'xarray', 'geopandas', 'pandas' ]:
+			self.assertNotIn( name, loaded )
+	def test_names_resolve( self ):
+		import downscale
+		from downscale.ds import DeltaDownscale
+		from downscale.grid import GridSpec
+		self.assertIs( downscale.DeltaDownscale, DeltaDownscale )
+		self.assertIs( downscale.GridSpec, GridSpec )
+		for name in downscale.__all__:
+			self.assertTrue( hasattr( downscale, name ) )
+		self.assertEqual( downscale.utils.__name__, 'downscale.utils' )
+		self.assertIn( 'Dataset', dir( downscale ) )
+		self.assertRaises( AttributeError, getattr, downscale, 'not_a_module' )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,43 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the vectorized climate indices
+# # # #
+
+import unittest
+import numpy as np
+
+class TestIndices( unittest.TestCase ):
+	''' tests for downscale.indices '''
+	def setUp( self ):
+		import pandas as pd
+		import xarray as xr
+		rng = np.random.RandomState( 42 )
+		self.arr = ( rng.rand( 24, 4, 5 ) * 40 - 20 ).astype( np.float32 )
+		time = pd.date_range( '2000-01-01', periods=24, freq='MS' )
+		self.da = xr.DataArray( self.arr, coords={'time':time}, dims=('time','y','x') )
+	def test_swi( self ):
+		from downscale.indices import compute_index_cube
+		out = compute_index_cube( self.da, 'swi' )
+		expected = np.clip( self.arr[ 4:9 ], 0, None ).sum( axis=0 )
+		np.testing.assert_allclose( out.sel( year=2000 ).values, expected, rtol=1e-5 )
+	def test_degree_days_leap( self ):
+		from downscale.indices import calc_index
+		arr = np.ones( (12, 2, 2), dtype=np.float32 )
+		months = np.arange( 1, 13 )
+		self.assertEqual( calc_index( arr, months, 2000, 'thawing_index' )[0,0], 366 )
+		self.assertEqual( calc_index( arr, months, 2001, 'thawing_index' )[0,0], 365 )
+		self.assertEqual( calc_index( arr, months, 2001, 'freezing_index' )[0,0], 0 )
+		self.assertEqual( calc_index( -arr, months, 2001, 'degree_days', threshold=1.0, above=False )[0,0], 730 )
+	def test_count_over_and_percentile( self ):
+		from downscale.indices import compute_index_cube
+		count = compute_index_cube( self.da, 'count_over', threshold=5.0 )
+		np.testing.assert_array_equal( count.sel( year=2001 ).values, (self.arr[ 12: ] > 5.0).sum( axis=0 ) )
+		pct = compute_index_cube( self.da, 'percentile', q=90 )
+		np.testing.assert_allclose( pct.sel( year=2001 ).values, np.percentile( self.arr[ 12: ], 90, axis=0 ), rtol=1e-5 )
+	def test_unknown_index( self ):
+		from downscale.indices import calc_index
+		with self.assertRaises( ValueError ):
+			calc_index( self.arr[:12], np.arange( 1, 13 ), 2000, 'not_an_index' )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,85 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the per-phase instrumentation
+# # # #
+
+import unittest, os, json, shutil, tempfile, logging
+
+class TestInstrument( unittest.TestCase ):
+	''' tests for downscale.instrument '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_phase_event( self ):
+		from downscale.instrument import Instrument, MemorySink
+		sink = MemorySink()
+		instrument = Instrument( sink, model='m1' )
+		with instrument.phase( 'work', source='Test', tasks=3 ) as event:
+			sum( range( 100000 ) )
+			event[ 'bytes_written' ] = 42
+		event, = sink.events
+		self.assertEqual( ( event[ 'phase' ], event[ 'source' ], event[ 'tasks' ], event[ 'model' ] ), ( 'work', 'Test', 3, 'm1' ) )
+		self.assertEqual( event[ 'status' ], 'ok' )
+		self.assertEqual( event[ 'bytes_written' ], 42 )
+		self.assertGreater( event[ 'wall_seconds' ], 0 )
+		self.assertGreaterEqual( event[ 'cpu_seconds' ], 0 )
+		self.assertGreater( event[ 'maxrss_mb' ], 0 )
+	def test_error_is_emitted_and_raised( self ):
+		from downscale.instrument import Instrument, MemorySink
+		sink = MemorySink()
+		instrument = Instrument( sink )
+		with self.assertRaises( ValueError ):
+			with instrument.phase( 'broken' ):
+				raise ValueError( 'bad' )
+		self.assertEqual( sink.events[0][ 'status' ], 'error' )
+		self.assertEqual( sink.events[0][ 'error' ], 'ValueError: bad' )
+	def test_jsonlines_and_logging_sinks( self ):
+		from downscale.instrument import as_instrument, LoggingSink
+		fn = os.path.join( self.tmp_dir, 'events', 'events.jsonl' )
+		instrument = as_instrument( fn )
+		instrument.sinks.append( LoggingSink( 'downscale.test' ) )
+		with self.assertLogs( 'downscale.test', level='INFO' ) as logs:
+			for name in [ 'a', 'b' ]:
+				with instrument.phase( name ):
+					pass
+		with open( fn ) as f:
+			events = [ json.loads( line ) for line in f ]
+		self.assertEqual( [ event[ 'phase' ] for event in events ], [ 'a', 'b' ] )
+		self.assertEqual( logs.records[0].event[ 'phase' ], 'a' )
+	def test_delta_downscale_phases( self ):
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		from downscale.instrument import MemorySink
+		case = make_case( self.tmp_dir, size='tiny', historical=(1950, 1951), future=(2006, 2006) )
+		historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+		future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+		sink = MemorySink()
+		DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+						downscaling_operation='add', ncpus=1, src_nodata=None, instrument=sink )
+		self.assertEqual( [ event[ 'phase' ] for event in sink.events ], [ 'concat', 'climatology', 'anomalies' ] )
+		self.assertTrue( all([ event[ 'source' ] == 'DeltaDownscale' for event in sink.events ]) )
+	def test_progress_goes_to_the_sinks( self ):
+		import io
+		from contextlib import redirect_stdout
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		from downscale.instrument import MemorySink
+		case = make_case( self.tmp_dir, size='tiny', historical=(1950, 1951), future=(2006, 2006) )
+		def run( instrument ):
+			historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+			future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+			stdout = io.StringIO()
+			with redirect_stdout( stdout ):
+				DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+								downscaling_operation='add', ncpus=1, src_nodata=None,
+								instrument=instrument ).downscale( os.path.join( self.tmp_dir, 'out' ), pipeline=True )
+			return stdout.getvalue()
+		# the pipeline report is printed without sinks, and only carried by the downscale event with them
+		self.assertNotEqual( run( None ), '' )
+		sink = MemorySink()
+		self.assertEqual( run( sink ), '' )
+		self.assertIn( 'stages', sink.events[-1] )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
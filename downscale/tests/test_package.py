@@ -0,0 +1,62 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the archive packaging
+# # # #
+
+import unittest, os, shutil, tempfile, zipfile
+import rasterio
+import numpy as np
+
+class TestPackage( unittest.TestCase ):
+	''' tests for downscale.package '''
+	def setUp( self ):
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		meta = {'transform': Affine(1.0, 0.0, -180.0, 0.0, -1.0, 90.0), 'count': 1, 'crs': 'EPSG:4326',
+				'driver': 'GTiff', 'dtype': 'float32', 'height': 50, 'width': 60, 'nodata': -9999.0 }
+		self.files = []
+		for i, compress in enumerate( [ 'lzw', None, 'lzw' ] ):
+			fn = os.path.join( self.tmp_dir, 'tas_mean_C_ar5_model_rcp85_{:02d}_2000.tif'.format( i + 1 ) )
+			kw = dict( meta, compress=compress ) if compress else meta
+			with rasterio.open( fn, 'w', **kw ) as out:
+				out.write( np.full( (50, 60), i, dtype=np.float32 ), 1 )
+			self.files = self.files + [ fn ]
+		self.out_fn = os.path.join( self.tmp_dir, 'zips', 'tas.zip' )
+	def test_build_and_verify( self ):
+		from downscale.package import build_archive, verify_archive
+		result = build_archive( self.files, self.out_fn, nthreads=2 )
+		self.assertFalse( result[ 'skipped' ] )
+		with zipfile.ZipFile( self.out_fn ) as zf:
+			self.assertIsNone( zf.testzip() )
+			infos = zf.infolist()
+			self.assertEqual( [ i.filename for i in infos ], [ os.path.basename( fn ) for fn in self.files ] )
+			self.assertEqual( [ i.compress_type for i in infos ], [ zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED, zipfile.ZIP_STORED ] )
+			for fn in self.files:
+				with open( fn, 'rb' ) as f:
+					self.assertEqual( zf.read( os.path.basename( fn ) ), f.read() )
+		self.assertEqual( verify_archive( self.out_fn ), [] )
+	def test_level( self ):
+		from downscale.package import build_archive
+		sizes = []
+		for level in [ 1, 9 ]:
+			out_fn = os.path.join( self.tmp_dir, 'zips', 'level{}.zip'.format( level ) )
+			build_archive( self.files[1:2], out_fn, nthreads=1, level=level, store=False )
+			with zipfile.ZipFile( out_fn ) as zf:
+				info, = zf.infolist()
+				self.assertEqual( zf.read( info ), open( self.files[1], 'rb' ).read() )
+				sizes.append( info.compress_size )
+		self.assertLess( sizes[1], sizes[0] )
+	def test_skip_unchanged( self ):
+		from downscale.package import build_archive, build_archives
+		build_archive( self.files, self.out_fn, nthreads=2 )
+		self.assertTrue( build_archive( self.files, self.out_fn )[ 'skipped' ] )
+		# an input changes -> rebuilt
+		st = os.stat( self.files[0] )
+		os.utime( self.files[0], ns=( st.st_atime_ns, st.st_mtime_ns + 10**9 ) )
+		result, = build_archives( [ ( self.files, self.out_fn ) ], ncpus=1, nthreads=2 )
+		self.assertFalse( result[ 'skipped' ] )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
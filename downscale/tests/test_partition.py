@@ -0,0 +1,79 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for time-partitioned runs and their merge
+# # #
+
+import unittest, os, glob, json, shutil, tempfile
+import numpy as np
+
+class TestPartition( unittest.TestCase ):
+	''' tests for downscale.partition and DeltaDownscale.downscale( partition=... ) '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_partition_years( self ):
+		from downscale.partition import partition_years
+		years = np.repeat( np.arange( 1860, 2101 ), 12 )
+		blocks = [ partition_years( years, k, 7 ) for k in range( 7 ) ]
+		self.assertEqual( sum( blocks, [] ), list( range( 1860, 2101 ) ) )
+		self.assertTrue( all([ block == list( range( block[0], block[-1] + 1 ) ) for block in blocks ]) )
+		self.assertLessEqual( max( map( len, blocks ) ) - min( map( len, blocks ) ), 1 )
+		self.assertEqual( blocks, [ partition_years( years[::-1], k, 7 ) for k in range( 7 ) ] )
+		self.assertEqual( partition_years([ 2000, 2001 ], 2, 3 ), [] )
+		self.assertRaises( ValueError, partition_years, years, 7, 7 )
+		self.assertRaises( ValueError, partition_years, years, 0, None )
+	def test_partitioned_run_merges( self ):
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		from downscale.partition import verify_partitions, merge_partitions, manifest_filename
+		from downscale.rechunk import open_store
+		from downscale.utils import sort_files
+		case = make_case( os.path.join( self.tmp_dir, 'case' ), size='tiny', historical=(1950, 1951), future=(2006, 2010) )
+		def build( **kwargs ):
+			historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+			future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+			return DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+									downscaling_operation='add', ncpus=1, src_nodata=None, crop=1, **kwargs )
+		whole = build().downscale( os.path.join( self.tmp_dir, 'whole' ), compact=True )
+		parts = os.path.join( self.tmp_dir, 'parts' )
+		self.assertRaises( ValueError, verify_partitions, parts, 2 )
+		# partition 0 is selected when the run is built -- only the climatology period and its years are processed
+		down = build( partition=0, n_partitions=2, anom=True )
+		self.assertEqual( sorted( set( down.ds.time.dt.year.values ) ), [ 1950, 1951, 2006, 2007, 2008 ] )
+		self.assertEqual( down.anomalies.shape[0], 36 )
+		self.assertRaises( ValueError, down.downscale, parts, partition=1, n_partitions=2 )
+		down.downscale( parts, compact=True )
+		# partition 1 only at write time, from the whole series
+		build().downscale( parts, compact=True, partition=1, n_partitions=2 )
+		# 5 years in 2 blocks -- 3 then 2 years
+		self.assertEqual( len( glob.glob( os.path.join( parts, '*_2008.tif' ) ) ), 12 )
+		files = verify_partitions( parts, 2, checksum=True )
+		# the anomalies of partition 0 are recorded ( and verified ) but not merged
+		with open( manifest_filename( parts, 0, 2 ) ) as f:
+			anom_files = [ record[ 'name' ] for record in json.load( f )[ 'anom_files' ] ]
+		self.assertEqual( len( anom_files ), 36 )
+		self.assertTrue( all([ name.startswith( 'anom' + os.sep ) and name.endswith( '_anom.tif' ) for name in anom_files ]) )
+		anom_fn = os.path.join( parts, anom_files[0] )
+		os.rename( anom_fn, anom_fn + '.moved' )
+		self.assertRaises( ValueError, verify_partitions, parts, 2 )
+		os.rename( anom_fn + '.moved', anom_fn )
+		self.assertEqual([ os.path.basename( fn ) for fn in files ],
+						[ os.path.basename( fn ) for fn in sort_files( glob.glob( os.path.join( whole, '*.tif' ) ) ) ])
+		for fn in files:
+			with open( fn, 'rb' ) as a, open( os.path.join( whole, os.path.basename( fn ) ), 'rb' ) as b:
+				self.assertEqual( a.read(), b.read() )
+
+		stores = merge_partitions( parts, 2, os.path.join( self.tmp_dir, 'cube', 'tas' ), tile=( 16, 16 ), ncpus=1 )
+		self.assertEqual( sorted( stores ), [ 'pixel', 'time' ] )
+		self.assertEqual( open_store( os.path.join( self.tmp_dir, 'cube', 'tas' ), access='pixel' ).shape[0], 60 )
+
+		# a truncated output and a missing partition both fail
+		with open( files[-1], 'r+b' ) as f:
+			f.truncate( 100 )
+		self.assertRaises( ValueError, verify_partitions, parts, 2 )
+		os.remove( manifest_filename( parts, 1, 2 ) )
+		self.assertRaises( ValueError, merge_partitions, parts, 2, os.path.join( self.tmp_dir, 'cube', 'again' ) )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,70 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for the pipelined read / compute / write executor
+# # #
+
+import unittest, os, shutil, tempfile, time
+import numpy as np
+
+def _regrid( anom, base, grid=None, **kwargs ):
+	''' stand-in for utils.interp_ds -- a constant field of the anomaly mean on the baseline grid '''
+	return np.full( grid.shape, np.mean( anom ), dtype=np.float32 )
+
+class TestPipeline( unittest.TestCase ):
+	''' tests for downscale.pipeline '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_run_pipeline( self ):
+		from downscale.pipeline import Stage, run_pipeline
+		def slow( x ):
+			time.sleep( 0.001 )
+			return x * 2
+		stages = [ Stage( 'read', lambda x: x + 1 ), Stage( 'compute', slow, 4 ), Stage( 'write', lambda x: -x, 2 ) ]
+		out, stats = run_pipeline( iter( range( 50 ) ), stages, depth=2 )
+		self.assertEqual( sorted( out ), sorted([ -( i + 1 ) * 2 for i in range( 50 ) ]) )
+		self.assertEqual( list( stats ), [ 'read', 'compute', 'write' ] )
+		self.assertTrue( all([ s[ 'items' ] == 50 for s in stats.values() ]) )
+		self.assertTrue( all([ 0 <= s[ 'utilization' ] <= 1 for s in stats.values() ]) )
+	def test_errors_propagate( self ):
+		from downscale.pipeline import Stage, run_pipeline
+		def fail( x ):
+			if x == 7:
+				raise ValueError( 'bad item' )
+			return x
+		stages = [ Stage( 'read', lambda x: x ), Stage( 'compute', fail, 3 ), Stage( 'write', lambda x: x ) ]
+		self.assertRaises( ValueError, run_pipeline, range( 1000 ), stages, 1 )
+		def items():
+			yield 1
+			raise IOError( 'feed failed' )
+		self.assertRaises( IOError, run_pipeline, items(), [ Stage( 'read', lambda x: x ) ], 1 )
+	def test_downscale_tasks_match_run_ds( self ):
+		import rasterio
+		from functools import partial
+		from downscale import utils
+		from downscale.grid import GridSpec
+		from downscale.synthetic import make_baseline
+		from downscale.pipeline import downscale_tasks
+		baseline = make_baseline( os.path.join( self.tmp_dir, 'baseline' ), shape=( 30, 40 ), resolution=50000 )
+		grid = GridSpec.from_raster( baseline[0] )
+		rng = np.random.RandomState( 0 )
+		def tasks( name ):
+			return [ { 'anom':rng.rand( 6, 8 ) if name == 'serial' else anoms[ i ], 'base':baseline[ i % 12 ],
+					'output_filename':os.path.join( self.tmp_dir, name, 'tas_{:02d}.tif'.format( i ) ), 'downscaling_operation':'add',
+					'post_downscale_function':partial( np.round, decimals=1 ), 'mask':None, 'mask_value':0 } for i in range( 24 ) ]
+		serial = tasks( 'serial' )
+		anoms = [ d[ 'anom' ] for d in serial ]
+		f = partial( _regrid, grid=grid )
+		switch = { 'add':utils.add, 'mult':utils.mult }
+		expected = [ utils._run_ds( d, f, switch, anom=True, grid=grid ) for d in serial ]
+		out, stats = downscale_tasks( tasks( 'piped' ), f, switch, anom=True, grid=grid, ncompute=3, nwriters=2, depth=2 )
+		self.assertEqual( len( out ), 24 )
+		self.assertEqual( stats[ 'write' ][ 'items' ], 24 )
+		for fn in expected:
+			with rasterio.open( fn ) as a, rasterio.open( fn.replace( 'serial', 'piped' ) ) as b:
+				np.testing.assert_array_equal( a.read( 1 ), b.read( 1 ) )
+		self.assertTrue( os.path.exists( os.path.join( self.tmp_dir, 'piped', 'anom', 'tas_00_anom.tif' ) ) )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
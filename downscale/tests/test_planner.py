@@ -0,0 +1,58 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the memory planner
+# # # #
+
+import unittest, os, shutil, tempfile
+
+class TestPlanner( unittest.TestCase ):
+	''' tests for downscale.planner '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+		# a 10min-like global series: 1860-2005 historical + 2006-2100 future
+		self.shape = dict( n_historical=146 * 12, n_future=95 * 12, src_shape=( 1080, 2160 ), dst_shape=( 2000, 3000 ), itemsize=4 )
+	def test_estimate_grows_with_workers_and_chunk( self ):
+		from downscale.planner import estimate
+		small = estimate( ncpus=2, time_chunk=10, **self.shape )
+		large = estimate( ncpus=16, time_chunk=None, **self.shape )
+		self.assertEqual( list( small ), [ 'open', 'concat', 'climatology', 'anomalies', 'downscale' ] )
+		self.assertGreater( large[ 'downscale' ][ 'total' ], small[ 'downscale' ][ 'total' ] )
+		self.assertEqual( large[ 'concat' ], small[ 'concat' ] )
+		self.assertIn( 'interp_na', estimate( fix_clim=True, **self.shape ) )
+	def test_plan_fits_memory( self ):
+		from downscale.planner import plan, estimate
+		roomy = plan( ncpus=32, memory=2**42, **self.shape )
+		self.assertEqual( ( roomy.ncpus, roomy.time_chunk ), ( 32, 95 * 12 ) )
+		memory = 112 * 1024**3
+		tight = plan( ncpus=32, memory=memory, **self.shape )
+		self.assertTrue( tight.fits )
+		self.assertLess( tight.time_chunk, 95 * 12 )
+		self.assertLessEqual( tight.peak, memory * 0.85 )
+		self.assertIn( 'memory plan', tight.report() )
+	def test_plan_does_not_fit( self ):
+		from downscale.planner import plan
+		out = plan( ncpus=8, memory=1024**3, **self.shape )
+		self.assertFalse( out.fits )
+		self.assertRaises( MemoryError, out.check )
+	def test_plan_run_dry( self ):
+		from downscale.synthetic import make_case
+		from downscale.planner import plan_run, available_memory, available_cpus
+		case = make_case( self.tmp_dir, size='tiny', historical=(1950, 1951), future=(2006, 2007) )
+		out = plan_run( case[ 'historical' ], case[ 'future' ], case[ 'baseline' ][0], variable='tas', ncpus=2, memory=2**34 )
+		self.assertEqual( ( out.ncpus, out.time_chunk ), ( 2, 24 ) )
+		# a partition of one of the two future years is sized by its 12 time steps
+		part = plan_run( case[ 'historical' ], case[ 'future' ], case[ 'baseline' ][0], variable='tas', ncpus=2, memory=2**34,
+						partition=1, n_partitions=2 )
+		self.assertEqual( part.time_chunk, 12 )
+		self.assertLess( part.phases[ 'downscale' ][ 'parent' ], out.phases[ 'downscale' ][ 'parent' ] )
+		# the concatenated series holds the 24 historical and 12 future steps, the loaded Datasets all 48
+		self.assertLess( part.phases[ 'anomalies' ][ 'parent' ], out.phases[ 'anomalies' ][ 'parent' ] )
+		self.assertEqual( part.phases[ 'open' ], out.phases[ 'open' ] )
+		self.assertGreaterEqual( available_cpus(), 1 )
+		memory = available_memory()
+		self.assertTrue( memory is None or memory > 0 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the vectorized extraterrestrial radiation
+# # # #
+
+import unittest, shutil, tempfile, os
+import numpy as np
+
+def _calc_ra_day( day, lat ):
+	''' reference single-day version from the original girr scripts '''
+	d = 1+(0.033*np.cos( (2*np.pi*day/365) ) )
+	dc = 0.409*np.sin(((2*np.pi/365)*day)-1.39)
+	w = np.real( np.arccos( (-1*np.tan(dc)*np.tan(lat)).astype(np.complex128) ) )
+	return (24*60/np.pi) * d * 0.082 * (w*np.sin(lat)*np.sin(dc)+np.cos(lat)*np.cos(dc)*np.sin(w))
+
+class TestRaMonthly( unittest.TestCase ):
+	''' tests for downscale.radiation.ra_monthly '''
+	def setUp( self ):
+		from affine import Affine
+		self.meta = {'crs':'EPSG:3338', 'transform':Affine( 50000.0, 0.0, -2000000.0, 0.0, -50000.0, 2500000.0 ),
+					'height':20, 'width':25 }
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_matches_daily_loop( self ):
+		from downscale import radiation
+		out = radiation.ra_monthly( self.meta, chunksize=37 )
+		lat = radiation.latitude_radians( self.meta['crs'], self.meta['transform'], (20, 25) )
+		months = radiation.day_to_month()
+		ra = np.array([ _calc_ra_day( day, lat ) for day in range( 1, 366 ) ])
+		expected = np.array([ ra[ months == month ].mean( axis=0 ) for month in range( 1, 13 ) ])
+		np.testing.assert_allclose( out, expected, rtol=1e-5, atol=1e-5 )
+	def test_mask_and_cache( self ):
+		from downscale import radiation
+		mask = np.zeros( (20, 25), dtype=bool )
+		mask[ 5:10, 5:10 ] = True
+		out = radiation.ra_monthly( self.meta, mask=mask, cache_dir=self.tmp_dir )
+		self.assertTrue( np.isnan( out[ :, ~mask ] ).all() )
+		self.assertFalse( np.isnan( out[ :, mask ] ).any() )
+		self.assertEqual( len( os.listdir( self.tmp_dir ) ), 1 )
+		self.assertTrue( radiation.ra_monthly( self.meta, mask=mask ) is out )
+		with self.assertRaises( ValueError ):
+			out[ 0, 0, 0 ] = 0
+		# a new process loads it read-only from the cache_dir too
+		radiation._CACHE.clear()
+		loaded = radiation.ra_monthly( self.meta, mask=mask, cache_dir=self.tmp_dir )
+		self.assertFalse( loaded.flags.writeable )
+		np.testing.assert_array_equal( loaded, out )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
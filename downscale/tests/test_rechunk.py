@@ -0,0 +1,63 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the rechunked archive stores
+# # # #
+
+import unittest, os, shutil, tempfile
+import rasterio
+import numpy as np
+
+class TestRechunk( unittest.TestCase ):
+	''' tests for downscale.rechunk '''
+	def setUp( self ):
+		from affine import Affine
+		self.tmp_dir = tempfile.mkdtemp()
+		meta = {'transform': Affine(1.0, 0.0, -180.0, 0.0, -1.0, 90.0),
+				'count': 1,
+				'crs': 'EPSG:4326',
+				'driver': 'GTiff',
+				'dtype': 'float32',
+				'height': 23,
+				'width': 31,
+				'nodata': -9999.0 }
+		rng = np.random.RandomState( 99 )
+		self.arrs = rng.rand( 24, 23, 31 ).astype( np.float32 ) * 10
+		self.arrs[ :, :3, : ] = -9999.0
+		self.files = []
+		for i, arr in enumerate( self.arrs ):
+			fn = os.path.join( self.tmp_dir, 'tas_mean_C_ar5_model_rcp85_{:02d}_{}.tif'.format( i % 12 + 1, 2000 + i // 12 ) )
+			with rasterio.open( fn, 'w', **meta ) as out:
+				out.write( arr, 1 )
+			self.files = self.files + [ fn ]
+		self.expected = np.where( self.arrs == -9999.0, np.nan, self.arrs )
+	def test_plan_blocks_cover_grid( self ):
+		from downscale.rechunk import plan_blocks
+		chunks, blocks = plan_blocks( 24, (23, 31), layout='pixel', tile=(5, 5), max_mem=24*5*10*4 )
+		self.assertEqual( chunks, (24, 5, 5) )
+		covered = np.zeros( (23, 31), dtype=int )
+		for tsl, rows, cols in blocks:
+			covered[ rows, cols ] += 1
+			self.assertEqual( rows.start % 5, 0 )
+			self.assertEqual( cols.start % 5, 0 )
+		self.assertTrue( (covered == 1).all() )
+	def test_series_layouts( self ):
+		import netCDF4
+		from downscale.rechunk import rechunk_series, open_store
+		prefix = os.path.join( self.tmp_dir, 'stores', 'tas_model_rcp85' )
+		# tiny budget to force many blocks
+		out = rechunk_series( self.files[::-1], prefix, tile=(5, 5), time_chunk=6, max_mem=24*5*10*4, ncpus=2 )
+		with netCDF4.Dataset( out[ 'pixel' ] ) as rootgrp:
+			self.assertEqual( rootgrp.variables[ 'tas' ].chunking(), [24, 5, 5] )
+		with netCDF4.Dataset( out[ 'time' ] ) as rootgrp:
+			self.assertEqual( rootgrp.variables[ 'tas' ].chunking(), [6, 23, 31] )
+		for access in [ 'profile', 'map' ]:
+			da = open_store( prefix, access=access )
+			np.testing.assert_allclose( da.values, self.expected )
+			self.assertEqual( str( da.time.values[13] )[:10], '2001-02-01' )
+			np.testing.assert_allclose( da.x.values[:2], [-179.5, -178.5] )
+			da.close()
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
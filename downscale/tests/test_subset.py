@@ -0,0 +1,75 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for cropping model grids to the baseline extent
+# # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+
+class TestSubset( unittest.TestCase ):
+	''' tests for downscale.subset and DeltaDownscale( crop=... ) '''
+	def setUp( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		from downscale.synthetic import AKCAN_ORIGIN
+		self.tmp_dir = tempfile.mkdtemp()
+		self.grid = GridSpec( 'EPSG:3338', Affine( 20000, 0.0, AKCAN_ORIGIN[0], 0.0, -20000, AKCAN_ORIGIN[1] ), ( 150, 200 ) )
+		d = 1.25
+		self.d = d
+		self.lat = 90 - d / 2 - np.arange( 144 ) * d
+		self.lon360 = np.arange( 288 ) * d + d / 2
+		self.lon180 = self.lon360 - 180.0
+	def test_lon_arc( self ):
+		from downscale.subset import lon_arc
+		start, width = lon_arc([ 170.0, -170.0, 179.0, -150.0 ])
+		self.assertAlmostEqual( start, 170.0 )
+		self.assertAlmostEqual( width, 40.0 )
+		start, width = lon_arc([ 10.0, 20.0, 15.0 ])
+		self.assertEqual( ( start, width ), ( 10.0, 10.0 ) )
+	def test_window_across_dateline( self ):
+		from downscale.subset import SourceWindow
+		win360 = SourceWindow.from_grid( self.lat, self.lon360, self.grid, halo=2 )
+		win180 = SourceWindow.from_grid( self.lat, self.lon180, self.grid, halo=2 )
+		for win in [ win360, win180 ]:
+			self.assertTrue( ( np.diff( win.lon ) > 0 ).all() )
+			self.assertLess( win.shape[0] * win.shape[1], 144 * 288 / 10 )
+		# the same cells either way, and the greenwich grid wraps around its end
+		np.testing.assert_allclose( np.mod( win360.lon, 360 ), np.mod( win180.lon, 360 ) )
+		self.assertTrue( ( np.diff( win180.lon_index ) < 0 ).any() )
+		self.assertEqual( win360.lat_index, win180.lat_index )
+	def test_cropped_reproject_matches_global( self ):
+		from affine import Affine
+		from rasterio.warp import reproject, Resampling
+		from downscale.subset import SourceWindow
+		lo, la = np.meshgrid( self.lon360, self.lat )
+		arr = ( np.sin( np.radians( lo ) ) * 10 + la ).astype( np.float32 )
+		def run( src, transform ):
+			out = np.full( self.grid.shape, np.nan, dtype=np.float32 )
+			reproject( src, out, src_transform=transform, src_crs='EPSG:4326', dst_transform=self.grid.transform,
+						dst_crs=self.grid.crs, dst_nodata=np.nan, resampling=Resampling.bilinear )
+			return out
+		full = run( arr, Affine( self.d, 0.0, 0.0, 0.0, -self.d, 90.0 ) )
+		win = SourceWindow.from_grid( self.lat, self.lon360, self.grid, halo=2 )
+		cropped = run( win.crop_array( arr ), win.transform )
+		self.assertFalse( np.isnan( full ).any() )
+		np.testing.assert_allclose( cropped, full, atol=1e-4 )
+	def test_delta_downscale_crop( self ):
+		from downscale import Dataset, Baseline, DeltaDownscale
+		from downscale.synthetic import make_case
+		case = make_case( self.tmp_dir, size='tiny', historical=(1950, 1951), future=(2006, 2006) )
+		def run( crop ):
+			historical = Dataset( case[ 'historical' ], 'tas', 'SYNTH-GCM', 'historical', project='ar5', units='C', metric='mean' )
+			future = Dataset( case[ 'future' ], 'tas', 'SYNTH-GCM', 'rcp85', project='ar5', units='C', metric='mean' )
+			return DeltaDownscale( Baseline( case[ 'baseline' ] ), case[ 'clim_begin' ], case[ 'clim_end' ], historical, future,
+								downscaling_operation='add', ncpus=1, src_nodata=None, crop=crop )
+		full = run( None )
+		cropped = run( 1 )
+		win = cropped._subset
+		self.assertEqual( cropped.anomalies.shape[1:], win.shape )
+		self.assertLess( cropped.ds.size, full.ds.size )
+		np.testing.assert_allclose( cropped.anomalies.values, win.crop_array( full.anomalies.values ), rtol=1e-6 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,38 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the synthetic data generator
+# # # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+
+class TestSynthetic( unittest.TestCase ):
+	''' tests for downscale.synthetic '''
+	def setUp( self ):
+		self.tmp_dir = tempfile.mkdtemp()
+	def test_series( self ):
+		import xarray as xr
+		from downscale.synthetic import make_series
+		fn = make_series( os.path.join( self.tmp_dir, 'pr.nc' ), variable='pr', nlat=18, nlon=36, begin=2000, end=2001,
+							calendar='360_day', south_up=True, land_only=True )
+		with xr.open_dataset( fn ) as ds:
+			self.assertEqual( ds.pr.shape, ( 24, 18, 36 ) )
+			self.assertEqual( ds.time.values[0].calendar, '360_day' )
+			self.assertLess( ds.lat.values[0], 0 )
+			self.assertTrue( np.isnan( ds.pr.values ).any() )
+			self.assertTrue( ( ds.pr.values[ ~np.isnan( ds.pr.values ) ] >= 0 ).all() )
+	def test_case( self ):
+		import rasterio
+		from downscale.synthetic import make_case
+		case = make_case( self.tmp_dir, size='tiny', historical=(1950, 1951), future=None )
+		self.assertIsNone( case[ 'future' ] )
+		self.assertEqual( len( case[ 'baseline' ] ), 12 )
+		with rasterio.open( case[ 'baseline' ][0] ) as rst:
+			self.assertEqual( rst.shape, ( 40, 50 ) )
+			self.assertEqual( rst.crs.to_epsg(), 3338 )
+		self.assertTrue( os.path.exists( case[ 'aoi' ] ) )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
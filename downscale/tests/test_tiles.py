@@ -0,0 +1,76 @@
+# -*- coding: utf8 -*-
+# # #
+# tests for spatially tiled downscaling
+# # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+
+def _regrid( anom, base, src_transform=None, grid=None, **kwargs ):
+	''' stand-in for utils.interp_ds -- exact bilinear onto the ( tile ) grid '''
+	from downscale.compact import RegridWeights
+	weights = RegridWeights( grid, src_transform, anom.shape )
+	return grid.scatter( weights.apply( anom ), fill=np.nan )
+
+class TestTiles( unittest.TestCase ):
+	''' tests for downscale.tiles '''
+	def setUp( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		from downscale.synthetic import make_baseline
+		self.tmp_dir = tempfile.mkdtemp()
+		self.baseline = make_baseline( os.path.join( self.tmp_dir, 'baseline' ), shape=( 40, 56 ), resolution=40000 )
+		self.grid = GridSpec.from_raster( self.baseline[0] )
+		d = 2.5
+		lo, la = np.meshgrid( np.arange( 144 ) * d + d / 2, 90 - d / 2 - np.arange( 72 ) * d )
+		self.arr = ( np.sin( np.radians( lo ) ) * 10 + la ).astype( np.float32 )
+		self.transform = Affine( d, 0.0, 0.0, 0.0, -d, 90.0 )
+	def test_make_tiles( self ):
+		from downscale.tiles import tile_windows, make_tiles
+		windows = tile_windows( ( 40, 56 ), 16 )
+		self.assertEqual( len( windows ), 3 * 4 )
+		self.assertEqual( sum([ w.height * w.width for w in windows ]), 40 * 56 )
+		self.assertEqual( ( windows[-1].height, windows[-1].width ), ( 8, 8 ) )
+		tiles = make_tiles( self.grid, self.transform, self.arr.shape, tile_size=16 )
+		# the synthetic baseline is nodata in its lower right corner
+		self.assertTrue( tiles[-1].empty )
+		self.assertIsNone( tiles[-1].source )
+		self.assertFalse( tiles[0].empty )
+		self.assertLess( tiles[0].source.shape[0] * tiles[0].source.shape[1], self.arr.size / 20 )
+		self.assertRaises( ValueError, make_tiles, self.grid, self.transform, self.arr.shape, 20 )
+	def test_tiled_matches_run_ds( self ):
+		import rasterio
+		from functools import partial
+		from downscale import utils
+		from downscale.tiles import downscale_tiled
+		def tasks( name ):
+			return [ { 'anom':self.arr + i, 'base':self.baseline[ i % 12 ], 'output_filename':os.path.join( self.tmp_dir, name, 'tas_{:02d}.tif'.format( i ) ),
+					'downscaling_operation':'add', 'post_downscale_function':partial( np.round, decimals=1 ), 'mask':self.grid.mask,
+					'mask_value':0 } for i in range( 4 ) ]
+		f = partial( _regrid, src_transform=self.transform, grid=self.grid )
+		switch = { 'add':utils.add, 'mult':utils.mult }
+		expected = [ utils._run_ds( d, f, switch, anom=True, grid=self.grid ) for d in tasks( 'full' ) ]
+		out = downscale_tiled( tasks( 'tiled' ), self.grid, f, switch, self.transform, self.arr.shape, tile_size=16, anom=True, ncpus=2 )
+		self.assertEqual( out, [ fn.replace( 'full', 'tiled' ) for fn in expected ] )
+		for fn in expected:
+			with rasterio.open( fn ) as a, rasterio.open( fn.replace( 'full', 'tiled' ) ) as b:
+				self.assertTrue( b.profile[ 'tiled' ] )
+				self.assertEqual( b.block_shapes[0], ( 16, 16 ) )
+				np.testing.assert_allclose( b.read( 1 ), a.read( 1 ), atol=0.11 )
+				self.assertTrue( ( b.read( 1 )[ ~self.grid.mask ] == b.nodata ).all() )
+		anoms = []
+		for name in [ 'full', 'tiled' ]:
+			with rasterio.open( os.path.join( self.tmp_dir, name, 'anom', 'tas_03_anom.tif' ) ) as rst:
+				anoms.append( rst.read( 1 )[ self.grid.mask ] )
+		np.testing.assert_allclose( anoms[1], anoms[0], atol=1e-4 )
+	def test_planner_tile_size( self ):
+		from downscale.planner import estimate
+		whole = estimate( 360, 1140, ( 145, 192 ), ( 4000, 5000 ), ncpus=8 )
+		tiled = estimate( 360, 1140, ( 145, 192 ), ( 4000, 5000 ), ncpus=8, tile_size=512 )
+		self.assertLess( tiled[ 'downscale' ][ 'workers' ], whole[ 'downscale' ][ 'workers' ] / 3 )
+		self.assertEqual( tiled[ 'climatology' ], whole[ 'climatology' ] )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
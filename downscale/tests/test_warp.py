@@ -0,0 +1,79 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the cached warp plan
+# # # #
+
+import unittest, os, shutil, tempfile
+import rasterio
+import numpy as np
+
+class TestWarpPlan( unittest.TestCase ):
+	''' tests for downscale.warp.WarpPlan '''
+	def setUp( self ):
+		from affine import Affine
+		from downscale.grid import GridSpec
+		self.tmp_dir = tempfile.mkdtemp()
+		rng = np.random.RandomState( 7 )
+		self.src_arr = ( rng.rand( 20, 30 ) * 100 ).astype( np.float32 )
+		self.src_grid = GridSpec( 'EPSG:3338', Affine( 2000.0, 0.0, 0.0, 0.0, -2000.0, 1000000.0 ), (20, 30), nodata=-9999 )
+		# 1km grid offset by half a source pixel and running off the source edge
+		mask = np.ones( (44, 50), dtype=bool )
+		mask[ :4, :4 ] = False
+		self.dst_grid = GridSpec( 'EPSG:3338', Affine( 1000.0, 0.0, 1000.0, 0.0, -1000.0, 999000.0 ), (44, 50), mask=mask, nodata=-9999 )
+	def test_apply_matches_reproject( self ):
+		from rasterio.warp import reproject, Resampling
+		from downscale.warp import WarpPlan
+		plan = WarpPlan( self.src_grid, self.dst_grid )
+		out = plan.apply( self.src_arr )
+		expected = np.full( self.dst_grid.shape, -9999, dtype=np.float32 )
+		reproject( self.src_arr, expected, src_transform=self.src_grid.transform, src_crs=self.src_grid.crs,
+					dst_transform=self.dst_grid.transform, dst_crs=self.dst_grid.crs, resampling=Resampling.nearest,
+					src_nodata=None, dst_nodata=-9999 )
+		expected[ ~self.dst_grid.mask ] = -9999
+		np.testing.assert_array_equal( out, expected )
+		self.assertTrue( (out[ 40:, : ] == -9999).all() ) # off the source grid
+	def test_sidecar_and_warp_files( self ):
+		from functools import partial
+		from downscale.warp import WarpPlan, warp_files
+		src_fn = os.path.join( self.tmp_dir, 'tas_mean_C_ar5_model_rcp85_01_2000.tif' )
+		with rasterio.open( src_fn, 'w', **dict( self.src_grid.meta, nodata=-9999 ) ) as out:
+			out.write( self.src_arr, 1 )
+		mask_fn = os.path.join( self.tmp_dir, 'mask.tif' )
+		with rasterio.open( mask_fn, 'w', **dict( self.dst_grid.meta, dtype='uint8', nodata=None ) ) as out:
+			out.write( self.dst_grid.mask.astype( np.uint8 ), 1 )
+		sidecar = os.path.join( self.tmp_dir, 'plan.npz' )
+		plan = WarpPlan.from_rasters( src_fn, mask_fn, sidecar=sidecar )
+		loaded = WarpPlan.from_rasters( src_fn, mask_fn, sidecar=sidecar )
+		np.testing.assert_array_equal( plan.rows, loaded.rows )
+		np.testing.assert_array_equal( loaded.dst_grid.mask, self.dst_grid.mask )
+		out_fn = os.path.join( self.tmp_dir, 'out', 'tas.tif' )
+		done = warp_files( loaded, [ ( src_fn, out_fn, partial( np.around, decimals=1 ) ) ], ncpus=1 )
+		self.assertEqual( done, [ out_fn ] )
+		with rasterio.open( out_fn ) as rst:
+			arr = rst.read( 1 )
+			self.assertEqual( rst.nodata, -9999 )
+		np.testing.assert_allclose( arr, np.where( arr == -9999, -9999, np.around( plan.apply( self.src_arr ), 1 ) ) )
+		self.assertTrue( (arr[ :4, :4 ] == -9999).all() )
+	def test_warp_keeps_encoding( self ):
+		from downscale.warp import WarpPlan
+		from downscale.encoding import ONE_DECIMAL, read_band
+		src_fn = os.path.join( self.tmp_dir, 'encoded.tif' )
+		with rasterio.open( src_fn, 'w', **ONE_DECIMAL.meta( self.src_grid.meta ) ) as out:
+			ONE_DECIMAL.write( out, self.src_arr )
+		plan = WarpPlan( self.src_grid, self.dst_grid )
+		out_fn = plan.warp_file( src_fn, os.path.join( self.tmp_dir, 'out', 'encoded.tif' ) )
+		with rasterio.open( out_fn ) as rst:
+			self.assertEqual( ( rst.dtypes[0], rst.scales ), ( 'int16', ( 0.1, ) ) )
+			out = read_band( rst, masked=True )
+		expected = plan.apply( ONE_DECIMAL.decode( ONE_DECIMAL.encode( self.src_arr ) ) )
+		np.testing.assert_array_equal( out.mask, expected == -9999 )
+		np.testing.assert_allclose( out.compressed(), expected[ expected != -9999 ], atol=1e-4 )
+		float_fn = plan.warp_file( src_fn, os.path.join( self.tmp_dir, 'out', 'float.tif' ), keep_encoding=False )
+		with rasterio.open( float_fn ) as rst:
+			self.assertEqual( rst.dtypes[0], 'float32' )
+			np.testing.assert_allclose( rst.read( 1 ), expected, atol=1e-4 )
+	def tearDown( self ):
+		shutil.rmtree( self.tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
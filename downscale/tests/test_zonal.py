@@ -0,0 +1,97 @@
+# -*- coding: utf8 -*-
+# # # #
+# tests for the single-pass zonal statistics
+# # # #
+
+import unittest, os, shutil, tempfile
+import numpy as np
+import pandas as pd
+
+class TestZones( unittest.TestCase ):
+	''' tests for downscale.zonal.Zones '''
+	def setUp( self ):
+		rng = np.random.RandomState( 0 )
+		self.labels = rng.randint( 0, 5, size=(30, 40) )
+		self.labels[ self.labels == 3 ] = 7 # non-contiguous ids
+		self.arr = rng.rand( 30, 40 ) * 100
+		self.arr[ 0, : ] = np.nan
+	def test_stats_match_masks( self ):
+		from downscale.zonal import Zones
+		zones = Zones( self.labels, names={1:'one'} )
+		df = zones.stats( self.arr ).set_index( 'zone' )
+		self.assertEqual( sorted( df.index.tolist() ), [1, 2, 4, 7] )
+		self.assertEqual( df.loc[ 1, 'name' ], 'one' )
+		for zone in df.index:
+			vals = self.arr[ self.labels == zone ]
+			vals = vals[ ~np.isnan( vals ) ]
+			self.assertEqual( df.loc[ zone, 'count' ], vals.size )
+			self.assertAlmostEqual( df.loc[ zone, 'mean' ], vals.mean() )
+			self.assertAlmostEqual( df.loc[ zone, 'std' ], vals.std() )
+			self.assertAlmostEqual( df.loc[ zone, 'min' ], vals.min() )
+			self.assertAlmostEqual( df.loc[ zone, 'max' ], vals.max() )
+	def test_mask_and_combine( self ):
+		from downscale.zonal import Zones, combine
+		mask = np.ones( self.labels.shape, dtype=bool )
+		mask[ :, :20 ] = False
+		zones = Zones( self.labels, mask=mask )
+		df1 = zones.stats( self.arr )
+		df2 = zones.stats( self.arr + 10 )
+		df1[ 'year' ], df2[ 'year' ] = 2000, 2001
+		out = combine( pd.concat( [df1, df2] ), by=[ 'zone' ] ).set_index( 'zone' )
+		vals = self.arr[ (self.labels == 2) & mask ]
+		vals = vals[ ~np.isnan( vals ) ]
+		both = np.concatenate( [vals, vals + 10] )
+		self.assertEqual( out.loc[ 2, 'count' ], both.size )
+		self.assertAlmostEqual( out.loc[ 2, 'mean' ], both.mean() )
+		self.assertAlmostEqual( out.loc[ 2, 'std' ], both.std() )
+	def test_from_shapefile_overlap_and_empty( self ):
+		import geopandas as gpd
+		from affine import Affine
+		from shapely.geometry import box
+		from downscale import GridSpec
+		from downscale.zonal import Zones
+		grid = GridSpec( 'EPSG:3338', Affine( 1.0, 0.0, 0.0, 0.0, -1.0, 30.0 ), (30, 40) )
+		# zones 1 and 2 share columns 10-19, zone 3 lies off the grid
+		gdf = gpd.GeoDataFrame({ 'id':[ 1, 2, 3 ], 'name':[ 'a', 'b', 'c' ] },
+								geometry=[ box( 0, 0, 20, 30 ), box( 10, 0, 30, 30 ), box( 100, 100, 110, 110 ) ], crs='EPSG:3338' )
+		zones = Zones.from_shapefile( gdf, grid, id_field='id', name_field='name' )
+		df = zones.stats( self.arr ).set_index( 'zone' )
+		self.assertEqual( df.index.tolist(), [1, 2, 3] )
+		for zone, cols in [ (1, slice( 0, 20 )), (2, slice( 10, 30 )) ]:
+			vals = self.arr[ :, cols ]
+			vals = vals[ ~np.isnan( vals ) ]
+			self.assertEqual( df.loc[ zone, 'count' ], vals.size )
+			self.assertAlmostEqual( df.loc[ zone, 'mean' ], vals.mean() )
+		self.assertEqual( df.loc[ 3, 'name' ], 'c' )
+		self.assertEqual( df.loc[ 3, 'count' ], 0 )
+		self.assertTrue( np.isnan( df.loc[ 3, 'mean' ] ) )
+		# without the overlap the single label grid is used, still with a row for zone 3
+		gdf.geometry = [ box( 0, 0, 10, 30 ), box( 10, 0, 30, 30 ), box( 100, 100, 110, 110 ) ]
+		df = Zones.from_shapefile( gdf, grid, id_field='id' ).stats( self.arr ).set_index( 'zone' )
+		self.assertEqual( df.loc[ 1, 'count' ] + df.loc[ 2, 'count' ], np.isfinite( self.arr[ :, :30 ] ).sum() )
+		self.assertEqual( df.loc[ 3, 'count' ], 0 )
+
+	def test_file_stats_decodes( self ):
+		import rasterio
+		from affine import Affine
+		from downscale import zonal
+		from downscale.zonal import Zones
+		from downscale.encoding import ONE_DECIMAL
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			fn = os.path.join( tmp_dir, 'tas_mean_C_ar5_model_rcp85_01_2000.tif' )
+			meta = { 'driver':'GTiff', 'dtype':'float32', 'count':1, 'height':30, 'width':40, 'crs':'EPSG:3338',
+					'transform':Affine( 1000.0, 0.0, 0.0, 0.0, -1000.0, 0.0 ), 'nodata':-9999 }
+			with rasterio.open( fn, 'w', **ONE_DECIMAL.meta( meta ) ) as out:
+				ONE_DECIMAL.write( out, self.arr )
+			zones = Zones( self.labels )
+			zonal._init_worker( zones )
+			df = zonal._file_stats( fn ).set_index( 'zone' )
+			expected = zones.stats( ONE_DECIMAL.decode( ONE_DECIMAL.encode( self.arr ) ).astype( np.float64 ) ).set_index( 'zone' )
+			np.testing.assert_array_equal( df[ 'count' ], expected[ 'count' ] )
+			np.testing.assert_allclose( df[ 'mean' ], expected[ 'mean' ], rtol=1e-6 )
+		finally:
+			shutil.rmtree( tmp_dir )
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,221 @@
+# -*- coding: utf8 -*-
+# # #
+# Spatially tiled downscaling for very large destination grids ( i.e. the
+#  800m / 1km L48 and IEM grids ).  The baseline grid is split into square
+#  tiles and every ( month, tile ) pair is a task: the worker regrids only
+#  the model cells that tile needs, adds the matching baseline window and
+#  hands the tile back to the parent, which writes it into a tiled GeoTIFF
+#  with a windowed write.  Worker memory is bounded by the tile size and
+#  tiles of all months are scheduled together across the cores.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+class Tile( object ):
+	''' a window of the destination grid and the window of model cells it needs '''
+	def __init__( self, window, grid, source=None ):
+		'''
+		ARGUMENTS:
+		----------
+		window = [rasterio.windows.Window] tile of the destination grid
+		grid = [downscale.GridSpec] the tile as a grid of its own ( transform / shape / mask of the window )
+		source = [downscale.subset.SourceWindow] model cells covering the tile plus a halo. default:None
+		'''
+		self.window = window
+		self.grid = grid
+		self.source = source
+	@property
+	def empty( self ):
+		''' True if the tile has no valid cells -- it is filled with nodata, not computed '''
+		return not self.grid.mask.any()
+
+def tile_windows( shape, tile_size=512 ):
+	''' rasterio Windows of tile_size x tile_size ( smaller at the right / bottom edges ) covering shape '''
+	from rasterio.windows import Window
+	rows, cols = shape
+	return [ Window( col, row, min( tile_size, cols - col ), min( tile_size, rows - row ) )
+			for row in range( 0, rows, tile_size ) for col in range( 0, cols, tile_size ) ]
+
+def make_tiles( grid, src_transform, src_shape, tile_size=512, halo=2 ):
+	'''
+	split a destination grid into tiles and find the model cells each one needs.
+
+	ARGUMENTS:
+	----------
+	grid = [downscale.GridSpec] destination ( baseline ) grid
+	src_transform = [affine.Affine] transform of the lat/lon model arrays ( the anomalies )
+	src_shape = [tuple] ( nlat, nlon ) of the model arrays
+	tile_size = [int] tile edge in destination cells, a multiple of 16 ( GeoTIFF block size ). default:512
+	halo = [int] extra model cells around each tile, at least the resampling kernel radius. default:2
+
+	RETURNS:
+	--------
+	list of Tile
+	'''
+	from rasterio.windows import transform as window_transform
+	from downscale.grid import GridSpec
+	from downscale.subset import SourceWindow
+
+	if tile_size % 16 != 0:
+		raise ValueError( 'tile_size must be a multiple of 16, not {}'.format( tile_size ) )
+	lat = src_transform.f + src_transform.e * ( np.arange( src_shape[0] ) + 0.5 )
+	lon = src_transform.c + src_transform.a * ( np.arange( src_shape[1] ) + 0.5 )
+	tiles = []
+	for window in tile_windows( grid.shape, tile_size ):
+		rows, cols = window.toslices()
+		tile_grid = GridSpec( grid.crs, window_transform( window, grid.transform ), ( window.height, window.width ),
+							mask=grid.mask[ rows, cols ], nodata=grid.nodata, dtype=grid.dtype )
+		tile = Tile( window, tile_grid )
+		if not tile.empty:
+			tile.source = SourceWindow.from_grid( lat, lon, tile_grid, halo=halo )
+		tiles.append( tile )
+	return tiles
+
+# regrid function / operations of the worker processes -- set once per worker by the pool initializer
+_F = None
+_SWITCH = None
+_MASK_VALUE = 0
+
+def _init_worker( f, operation_switch, mask_value=0 ):
+	''' [hidden] share the regrid function and operations with each worker once rather than per task '''
+	global _F, _SWITCH, _MASK_VALUE
+	_F, _SWITCH, _MASK_VALUE = f, operation_switch, mask_value
+
+def _run_tile( task ):
+	'''
+	[hidden] downscale one ( month, tile ) -- regrid the model window to the tile grid and combine it with
+	the baseline window, the tiled counterpart of utils._run_ds without the write.
+
+	RETURNS:
+	--------
+	( output_filename, window, interped, output_arr )
+	'''
+	import rasterio
+	from downscale.utils import _compute_ds
+	d, window = task
+	with rasterio.open( d[ 'base' ] ) as base:
+		base_arr = base.read( 1, window=window )
+	grid = d[ 'grid' ]
+	mask = np.where( grid.mask, 255, 0 )
+	interped, output_arr = _compute_ds( d, _F, _SWITCH, base_arr, mask, grid.meta, mask_value=_MASK_VALUE )
+	return d[ 'output_filename' ], window, interped, output_arr
+
+def _tile_tasks( args, tiles ):
+	''' [hidden] ( task, window ) of every non-empty tile of every month, month by month '''
+	for d in args:
+		for tile in tiles:
+			if tile.empty:
+				continue
+			task = dict( d )
+			# the regrid function is called on the tile ( src_transform / grid override the partial ) and
+			# the full-grid mask is not shipped with every tile
+			task.update( anom=tile.source.crop_array( d[ 'anom' ] ), src_transform=tile.source.transform, grid=tile.grid, mask=None )
+			yield task, tile.window
+
+def _open_output( fn, meta, empty=(), encoding=None ):
+	''' [hidden] open a tiled GeoTIFF for windowed writes, making its directory and filling the empty tiles '''
+	import rasterio
+	dirname = os.path.dirname( fn )
+	try:
+		if not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
+	if encoding is not None:
+		meta = encoding.meta( meta )
+	rst = rasterio.open( fn, 'w', **meta )
+	if encoding is not None:
+		encoding.tag( rst )
+	fill = meta[ 'nodata' ] if meta[ 'nodata' ] is not None else np.nan
+	for window in empty:
+		rst.write( np.full( ( window.height, window.width ), fill, dtype=meta[ 'dtype' ] ), 1, window=window )
+	return rst
+
+def _anom_filename( fn ):
+	''' [hidden] the anomaly output beside a downscaled output -- as written by utils._write_ds '''
+	dirname, basename = os.path.split( fn )
+	return os.path.join( dirname, 'anom', basename.replace( '.tif', '_anom.tif' ) )
+
+def downscale_tiled( args, grid, f, operation_switch, src_transform, src_shape, tile_size=512, halo=2,
+						anom=False, mask_value=0, ncpus=1, encoding=None ):
+	'''
+	run downscale tasks ( the dicts built in DeltaDownscale.downscale ) tile by tile.
+
+	ARGUMENTS:
+	----------
+	args = [list] of task dicts ( anom, base, output_filename, downscaling_operation, post_downscale_function, ... )
+	grid = [downscale.GridSpec] baseline grid
+	f = [function] regridding function called with **task, where the task carries the tile's src_transform
+		and grid ( i.e. partial( utils.interp_ds, ... ) ).  Must be picklable.
+	operation_switch = [dict] { 'add':utils.add, 'mult':utils.mult }
+	src_transform, src_shape = [affine.Affine, tuple] transform and ( nlat, nlon ) of the anomalies
+	tile_size, halo = see make_tiles
+	anom = [bool] also write the regridded anomalies. default:False
+	mask_value = [int] mask value marking nodata cells. default:0
+	ncpus = [int] number of processes. default:1
+	encoding = [downscale.encoding.Encoding] store the outputs ( not the anomalies ) as scaled integers.
+		default:None ( float )
+
+	post_downscale_function must be elementwise ( i.e. np.round ) -- it is called on each tile.
+	Tiles without valid cells are not computed, just filled with nodata.
+
+	RETURNS:
+	--------
+	list of output filenames written
+	'''
+	import multiprocessing as mp
+
+	tiles = make_tiles( grid, src_transform, src_shape, tile_size=tile_size, halo=halo )
+	ntiles = len([ tile for tile in tiles if not tile.empty ])
+	meta = grid.meta
+	meta.update( compress='lzw', tiled=True, blockxsize=tile_size, blockysize=tile_size )
+
+	if ncpus > 1:
+		pool = mp.Pool( ncpus, initializer=_init_worker, initargs=( f, operation_switch, mask_value ) )
+		results = pool.imap_unordered( _run_tile, _tile_tasks( args, tiles ) )
+	else:
+		pool = None
+		_init_worker( f, operation_switch, mask_value )
+		results = ( _run_tile( task ) for task in _tile_tasks( args, tiles ) )
+
+	# the parent is the only writer -- outputs are open while tiles of their month are outstanding
+	empty = [ tile.window for tile in tiles if tile.empty ]
+	def open_outputs( fn ):
+		out = [ _open_output( fn, meta, empty, encoding=encoding ) ]
+		if anom == True:
+			out.append( _open_output( _anom_filename( fn ), meta, empty ) )
+		return out
+
+	outputs = {}
+	remaining = dict([ ( d[ 'output_filename' ], ntiles ) for d in args ])
+	try:
+		for fn, window, interped, output_arr in results:
+			if fn not in outputs:
+				outputs[ fn ] = open_outputs( fn )
+			if encoding is not None:
+				outputs[ fn ][0].write( encoding.encode( output_arr, nodata=meta[ 'nodata' ] ), 1, window=window )
+			else:
+				outputs[ fn ][0].write( output_arr.astype( meta[ 'dtype' ] ), 1, window=window )
+			if anom == True:
+				outputs[ fn ][1].write( interped.astype( meta[ 'dtype' ] ), 1, window=window )
+			remaining[ fn ] -= 1
+			if remaining[ fn ] == 0:
+				for rst in outputs.pop( fn ):
+					rst.close()
+	finally:
+		for fn in list( outputs ):
+			for rst in outputs.pop( fn ):
+				rst.close()
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+	# with no valid cells at all the outputs are still written, as all nodata
+	if ntiles == 0:
+		for fn in remaining:
+			for rst in open_outputs( fn ):
+				rst.close()
+	return [ d[ 'output_filename' ] for d in args ]
@@ -5,7 +5,6 @@
 # as an object comprehension
 # # # # 
 import numpy as np
-import rasterio
 
 def write_gtiff( output_arr, template_meta, output_filename, compress=True ):
 	'''
@@ -183,7 +182,7 @@ def xyz_to_grid( x, y, z, grid, method='linear', output_dtype=np.float32, *args,
 	zi = griddata( x, y, z, xi, yi, interp=method )
 	return zi.astype( output_dtype )
 
-def interp_ds( anom, base, src_crs, src_nodata, dst_nodata, src_transform, resample_type='bilinear',*args, **kwargs ):
+def interp_ds( anom, base, src_crs, src_nodata, dst_nodata, src_transform, resample_type='bilinear', grid=None, gdal_profile=None, *args, **kwargs ):
 	'''	
 	anom = [numpy.ndarray] 2-d array representing a single monthly timestep of the data to be downscaled. 
 							Must also be representative of anomalies.
@@ -191,9 +190,20 @@ def interp_ds( anom, base, src_crs, src_nodata, dst_nodata, src_transform, resam
 							baseline for combining with anomalies.
 	src_transform = [affine.affine] 6 element affine transform of the input anomalies. [should be greenwich-centered]
 	resample_type = [str] one of ['bilinear', 'count', 'nearest', 'mode', 'cubic', 'index', 'average', 'lanczos', 'cubic_spline']
+	grid = [downscale.GridSpec] destination grid of the baseline. If given the baseline file is not 
+							opened. default:None
+	gdal_profile = [downscale.gdalenv.GDALProfile] warp threads / memory, cache and SOURCE_EXTRA. Its
+							rasterio.Env is entered once per worker. default:None ( single-threaded,
+							SOURCE_EXTRA=1000 )
 	'''	
 	import rasterio
-	from rasterio.warp import reproject, RESAMPLING
+	from rasterio.warp import reproject
+	from downscale.gdalenv import GDALProfile, activate
+	try:
+		from rasterio.warp import RESAMPLING
+	except ImportError:
+		# renamed in rasterio 1.0
+		from rasterio.enums import Resampling as RESAMPLING
 
 	# resampling = {'average':RESAMPLING.average,
 	# 			'cubic':RESAMPLING.cubic,
@@ -208,15 +218,25 @@ def interp_ds( anom, base, src_crs, src_nodata, dst_nodata, src_transform, resam
 	# if we are missing some of these methods in the gdal version.
 	resampling = RESAMPLING.__members__
 	
-	base = rasterio.open( base )
-	baseline_arr = base.read( 1 )
-	baseline_meta = base.meta
-	baseline_meta.update( compress='lzw' )
-	output_arr = np.empty_like( baseline_arr )
+	if grid is not None:
+		output_arr = np.empty( grid.shape, dtype=grid.dtype )
+		dst_transform, dst_crs = grid.transform, grid.crs
+	else:
+		base = rasterio.open( base )
+		baseline_arr = base.read( 1 )
+		baseline_meta = base.meta
+		baseline_meta.update( compress='lzw' )
+		output_arr = np.empty_like( baseline_arr )
+		dst_transform, dst_crs = baseline_meta['affine'], baseline_meta['crs']
 	
+	if gdal_profile is None:
+		gdal_profile = GDALProfile()
+	else:
+		activate( gdal_profile )
+
 	reproject( anom, output_arr, src_transform=src_transform, src_crs=src_crs, src_nodata=src_nodata, \
-			dst_transform=baseline_meta['affine'], dst_crs=baseline_meta['crs'],\
-			dst_nodata=dst_nodata, resampling=resampling[ resample_type ], SOURCE_EXTRA=1000 )
+			dst_transform=dst_transform, dst_crs=dst_crs,\
+			dst_nodata=dst_nodata, resampling=resampling[ resample_type ], **gdal_profile.warp_kwargs( resample_type ) )
 	return output_arr
 
 def add( base, anom ):
@@ -227,33 +247,62 @@ def mult( base, anom ):
 	''' multiply anomalies to baseline '''
 	return base * anom
 
-def _run_ds( d, f, operation_switch, anom=False, mask_value=0 ):
+def _read_base( d, grid=None ):
 	'''
-	[hidden] run the meat of downscaling with this runner function for parallel processing
-
-	ARGUMENTS:
-	----------
-	d = [dict] kwargs dict of args to pass to interpolation function
-	f = [ ]
-	operation_switch = []
+	[hidden] read the baseline month of a task and the output mask / metadata
 
 	RETURNS:
 	--------
+	( base_arr, mask, meta )
+	'''
+	import rasterio
+	with rasterio.open( d[ 'base' ] ) as base:
+		base_arr = base.read( 1 )
+		# set up output file metadata.
+		if grid is not None:
+			mask = np.where( grid.mask, 255, 0 )
+			meta = grid.meta
+			meta.update( compress='lzw' )
+		else:
+			mask = base.read_masks( 1 )
+			meta = base.meta
+			meta.update( compress='lzw' )
+			if 'transform' in meta.keys():
+				meta.pop( 'transform' )
+	return base_arr, mask, meta
+
+def _compute_ds( d, f, operation_switch, base_arr, mask, meta, mask_value=0 ):
+	'''
+	[hidden] regrid the anomalies of a task and apply the downscaling operation and post function
 
+	RETURNS:
+	--------
+	( interped, output_arr )
 	'''
-	import copy, rasterio, os
-		
 	post_downscale_function = d[ 'post_downscale_function' ]
 	interped = f( **d )
-	base = rasterio.open( d[ 'base' ] )
-	base_arr = base.read( 1 )
-	mask = base.read_masks( 1 )
 
-	# set up output file metadata.
-	meta = base.meta
-	meta.update( compress='lzw' )
-	if 'transform' in meta.keys():
-		meta.pop( 'transform' )
+	# operation switch
+	output_arr = operation_switch[ d[ 'downscaling_operation' ] ]( base_arr, interped )
+	
+	# post downscale it if func given
+	if post_downscale_function != None:
+		output_arr = post_downscale_function( output_arr )
+		# drop the mask if there is one
+		if hasattr( output_arr, 'mask'):
+			output_arr = output_arr.data
+
+	# make sure data is masked
+	output_arr[ mask == mask_value ] = meta[ 'nodata' ]
+	return interped, output_arr
+
+def _write_ds( d, interped, output_arr, meta, anom=False, encoding=None ):
+	'''
+	[hidden] write the downscaled array ( and the regridded anomalies if anom ) of a task.  With an
+	encoding ( downscale.encoding.Encoding ) the downscaled array is stored as scaled integers --
+	the anomalies are not rounded and stay float.
+	'''
+	import copy, rasterio, os
 
 	# write out the anomalies
 	if anom == True:
@@ -272,27 +321,46 @@ def _run_ds( d, f, operation_switch, anom=False, mask_value=0 ):
 	
 	# make sure the output dir exists and if not, create it
 	dirname = os.path.dirname( d[ 'output_filename' ] )
-	if not os.path.exists( dirname ):
-		os.makedirs( dirname )
-
-	# operation switch
-	output_arr = operation_switch[ d[ 'downscaling_operation' ] ]( base_arr, interped )
-	
-	# post downscale it if func given
-	if post_downscale_function != None:
-		output_arr = post_downscale_function( output_arr )
-		# drop the mask if there is one
-		if hasattr( output_arr, 'mask'):
-			output_arr = output_arr.data
-
-	# make sure data is masked
-	output_arr[ mask == mask_value ] = meta[ 'nodata' ]
+	try:
+		if not os.path.exists( dirname ):
+			os.makedirs( dirname )
+	except:
+		pass
 
 	# write it to disk.
-	with rasterio.open( d[ 'output_filename' ], 'w', **meta ) as out:
-		out.write( output_arr, 1 )
+	if encoding is not None:
+		with rasterio.open( d[ 'output_filename' ], 'w', **encoding.meta( meta ) ) as out:
+			encoding.write( out, output_arr, nodata=meta[ 'nodata' ] )
+	else:
+		with rasterio.open( d[ 'output_filename' ], 'w', **meta ) as out:
+			out.write( output_arr, 1 )
 	return d['output_filename']
 
+def _run_ds( d, f, operation_switch, anom=False, mask_value=0, grid=None, gdal_profile=None, encoding=None ):
+	'''
+	[hidden] run the meat of downscaling with this runner function for parallel processing
+
+	ARGUMENTS:
+	----------
+	d = [dict] kwargs dict of args to pass to interpolation function
+	f = [ ]
+	operation_switch = []
+	grid = [downscale.GridSpec] baseline grid. If given its mask and meta are used instead
+		of reading them from the baseline file. default:None
+	gdal_profile = [downscale.gdalenv.GDALProfile] entered before the baseline is read, so the block
+		cache size applies to the worker. default:None
+	encoding = [downscale.encoding.Encoding] store the output as scaled integers. default:None ( float )
+
+	RETURNS:
+	--------
+
+	'''
+	from downscale.gdalenv import activate
+	activate( gdal_profile )
+	base_arr, mask, meta = _read_base( d, grid=grid )
+	interped, output_arr = _compute_ds( d, f, operation_switch, base_arr, mask, meta, mask_value=mask_value )
+	return _write_ds( d, interped, output_arr, meta, anom=anom, encoding=encoding )
+
 
 # def downscale( anom_arr, baseline_arr, output_filename,	downscaling_operation, \
 # 	meta, post_downscale_function, mask=None, mask_value=0, *args, **kwargs ):
@@ -484,3 +552,31 @@ def only_years( files, begin=1901, end=2100, split_on='_', elem_year=-1 ):
 	df_slice = df[ (df.year >= begin ) & (df.year <= end ) ]
 	return df_slice.fn.tolist()
 
+
+def iter_windows( rst, max_rows=256 ):
+	'''
+	iterate over the read windows of a rasterio dataset following its internal
+	block layout.  Tiled rasters are walked tile by tile.  Striped rasters 
+	(one row per block, the GDAL default) are grouped into windows of up to 
+	max_rows full-width rows so we are not making a read call per row.
+
+	ARGUMENTS:
+	----------
+	rst = [rasterio.DatasetReader] open raster to walk.
+	max_rows = [int] max number of rows to group together for striped rasters. default:256
+
+	RETURNS:
+	--------
+	generator of rasterio.windows.Window objects covering the full raster once.
+
+	'''
+	from rasterio.windows import Window
+
+	block_height, block_width = rst.block_shapes[ 0 ]
+	if block_width == rst.width and block_height < max_rows:
+		# striped -- group whole rows
+		for row in range( 0, rst.height, max_rows ):
+			yield Window( 0, row, rst.width, min( max_rows, rst.height - row ) )
+	else:
+		for ij, window in rst.block_windows( 1 ):
+			yield window
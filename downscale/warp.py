@@ -0,0 +1,197 @@
+# -*- coding: utf8 -*-
+# # #
+# In-process nearest-neighbour warp between two fixed grids (i.e. the 2km
+#  AKCAN downscaled grid to the 1km IEM / ALFRESCO grids).  The source
+#  pixel for every valid destination cell is computed once (a warp plan)
+#  and each file is then warped with a single fancy-index, rounded, masked
+#  and written once -- no gdalwarp subprocess or intermediate copies.
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os, json
+import numpy as np
+
+class WarpPlan( object ):
+	'''
+	nearest-neighbour source pixel ( row, col ) for each valid cell of a destination
+	grid.  Matches gdalwarp's default (near) resampling: each destination pixel
+	takes the source pixel containing its centre.
+	'''
+	def __init__( self, src_grid, dst_grid, rows=None, cols=None ):
+		'''
+		ARGUMENTS:
+		----------
+		src_grid = [downscale.GridSpec] grid of the files being warped.
+		dst_grid = [downscale.GridSpec] destination grid.  Its mask marks the cells written.
+		rows, cols = [numpy.ndarray] precomputed source indices for dst_grid.valid_index
+			(i.e. from a saved plan). default:None (computed here)
+		'''
+		self.src_grid = src_grid
+		self.dst_grid = dst_grid
+		if rows is None or cols is None:
+			rows, cols = self._plan()
+		self.rows = np.asarray( rows )
+		self.cols = np.asarray( cols )
+		# destination cells with no source pixel get nodata
+		self.inside = ( self.rows >= 0 ) & ( self.rows < src_grid.height ) & ( self.cols >= 0 ) & ( self.cols < src_grid.width )
+	def _plan( self ):
+		''' source ( row, col ) of the valid destination pixel centres '''
+		from affine import Affine
+
+		dst_rows, dst_cols = np.unravel_index( self.dst_grid.valid_index, self.dst_grid.shape )
+		xs, ys = ( self.dst_grid.transform * Affine.translation( 0.5, 0.5 ) ) * ( dst_cols, dst_rows )
+		xs, ys = np.asarray( xs ), np.asarray( ys )
+		if self.src_grid.crs != self.dst_grid.crs:
+			from pyproj import Transformer
+			transformer = Transformer.from_crs( self.dst_grid.crs, self.src_grid.crs, always_xy=True )
+			xs, ys = transformer.transform( xs, ys )
+		cols, rows = ~self.src_grid.transform * ( np.asarray( xs ), np.asarray( ys ) )
+		rows = np.floor( rows ).astype( np.int32 )
+		cols = np.floor( cols ).astype( np.int32 )
+		return rows, cols
+	@classmethod
+	def from_rasters( cls, src_fn, mask_fn, mask_value=0, sidecar=None ):
+		'''
+		build a plan from a source template raster and a destination mask raster where
+		cells equal to mask_value are nodata (i.e. the IEM / ALFRESCO domain masks).
+		If a sidecar path is given and exists it is loaded, otherwise it is written there.
+		'''
+		import rasterio
+		from downscale.grid import GridSpec
+
+		if sidecar is not None and os.path.exists( sidecar ):
+			return cls.load( sidecar )
+		src_grid = GridSpec.from_raster( src_fn )
+		with rasterio.open( mask_fn ) as rst:
+			dst_grid = GridSpec( rst.crs, rst.transform, rst.shape, mask=rst.read( 1 ) != mask_value,
+								nodata=-9999, dtype='float32' )
+		plan = cls( src_grid, dst_grid )
+		if sidecar is not None:
+			plan.save( sidecar )
+		return plan
+	def apply( self, arr, round_func=None, src_nodata=None ):
+		'''
+		warp a 2-D array on the source grid to the destination grid.
+
+		ARGUMENTS:
+		----------
+		arr = [numpy.ndarray] 2-D array on src_grid
+		round_func = [function] applied to the warped valid values. default:None
+		src_nodata = [float] source value to treat as missing. default:None (gdalwarp -srcnodata None)
+
+		RETURNS:
+		--------
+		2-D float32 numpy.ndarray on dst_grid with dst_grid.nodata outside the mask.
+		'''
+		values = np.full( self.rows.shape, np.nan, dtype=np.float32 )
+		values[ self.inside ] = arr[ self.rows[ self.inside ], self.cols[ self.inside ] ]
+		if src_nodata is not None:
+			values[ values == src_nodata ] = np.nan
+		if round_func is not None:
+			values = round_func( values )
+		nodata = self.dst_grid.nodata if self.dst_grid.nodata is not None else np.nan
+		values[ np.isnan( values ) ] = nodata
+		return self.dst_grid.scatter( values.astype( np.float32 ), fill=nodata )
+	def warp_file( self, fn, out_fn, round_func=None, src_nodata=None, keep_encoding=True, **kwargs ):
+		'''
+		read a source raster, warp / round / mask it in memory and write it once.  Scaled-integer
+		sources ( downscale.encoding ) are read as physical values with their nodata missing and, with
+		keep_encoding, written with the same encoding -- float32 otherwise.
+		'''
+		import rasterio
+		from downscale.encoding import Encoding, read_band
+
+		with rasterio.open( fn ) as rst:
+			encoding = Encoding.from_raster( rst )
+			if encoding is not None:
+				arr = read_band( rst )
+			else:
+				# as stored -- the source nodata is only missing if passed as src_nodata
+				arr = np.ma.getdata( read_band( rst, masked=True ) )
+		out_arr = self.apply( arr, round_func=round_func, src_nodata=src_nodata )
+		meta = self.dst_grid.meta
+		meta.update( dtype='float32', compress='lzw' )
+		meta.update( kwargs )
+		if not keep_encoding:
+			encoding = None
+		if encoding is not None:
+			meta = encoding.meta( meta )
+		dirname = os.path.dirname( out_fn )
+		try:
+			if not os.path.exists( dirname ):
+				os.makedirs( dirname )
+		except:
+			pass
+		with rasterio.open( out_fn, 'w', **meta ) as out:
+			if encoding is not None:
+				encoding.write( out, out_arr, nodata=self.dst_grid.nodata )
+			else:
+				out.write( out_arr, 1 )
+		return out_fn
+	def save( self, fn ):
+		''' write the plan (both grids and the source indices) to a single .npz file '''
+		grids = {}
+		for name, grid in [ ('src', self.src_grid), ('dst', self.dst_grid) ]:
+			grids[ name ] = { 'crs':grid.crs.to_wkt(), 'transform':list( tuple( grid.transform )[:6] ),
+							'shape':list( grid.shape ), 'nodata':grid.nodata, 'dtype':grid.dtype }
+		with open( fn, 'wb' ) as f:
+			np.savez_compressed( f, rows=self.rows, cols=self.cols, dst_mask=np.packbits( self.dst_grid.mask ),
+								attrs=np.array( json.dumps( grids ) ) )
+		return fn
+	@classmethod
+	def load( cls, fn ):
+		''' read a plan written with WarpPlan.save '''
+		from downscale.grid import GridSpec
+
+		with np.load( fn ) as data:
+			grids = json.loads( str( data[ 'attrs' ] ) )
+			rows, cols = data[ 'rows' ], data[ 'cols' ]
+			dst_shape = tuple( grids[ 'dst' ][ 'shape' ] )
+			dst_mask = np.unpackbits( data[ 'dst_mask' ] )[ :dst_shape[0]*dst_shape[1] ].reshape( dst_shape ).astype( bool )
+		src, dst = grids[ 'src' ], grids[ 'dst' ]
+		src_grid = GridSpec( src[ 'crs' ], src[ 'transform' ], src[ 'shape' ], nodata=src[ 'nodata' ], dtype=src[ 'dtype' ] )
+		dst_grid = GridSpec( dst[ 'crs' ], dst[ 'transform' ], dst_shape, mask=dst_mask, nodata=dst[ 'nodata' ], dtype=dst[ 'dtype' ] )
+		return cls( src_grid, dst_grid, rows=rows, cols=cols )
+
+# plan for the worker processes -- set once per worker by the pool initializer
+_PLAN = None
+
+def _init_worker( plan ):
+	''' [hidden] share the WarpPlan with each worker once rather than per task '''
+	global _PLAN
+	_PLAN = plan
+
+def _warp_file( x ):
+	''' [hidden] unpack ( fn, out_fn, round_func, kwargs ) for pool.imap_unordered '''
+	fn, out_fn, round_func, kwargs = x
+	return _PLAN.warp_file( fn, out_fn, round_func=round_func, **kwargs )
+
+def warp_files( plan, jobs, ncpus=32, **kwargs ):
+	'''
+	warp many files to the plan destination grid with one process pool.
+
+	ARGUMENTS:
+	----------
+	plan = [downscale.warp.WarpPlan] the warp plan.
+	jobs = [list] of ( input filename, output filename, round_func ) tuples. round_func may be None
+		and must be picklable (a module level function or functools.partial of one).
+	ncpus = [int] number of processes. default:32
+	kwargs = passed to WarpPlan.warp_file ( src_nodata or output meta overrides such as crs )
+
+	RETURNS:
+	--------
+	list of output filenames written
+	'''
+	import multiprocessing as mp
+
+	args = [ ( fn, out_fn, round_func, kwargs ) for fn, out_fn, round_func in jobs ]
+	if ncpus > 1:
+		pool = mp.Pool( ncpus, initializer=_init_worker, initargs=( plan, ) )
+		out = list( pool.imap_unordered( _warp_file, args, chunksize=max( 1, len( args ) // ( ncpus * 4 ) ) ) )
+		pool.close()
+		pool.join()
+	else:
+		_init_worker( plan )
+		out = [ _warp_file( arg ) for arg in args ]
+	return out
@@ -0,0 +1,234 @@
+# -*- coding: utf8 -*-
+# # #
+# Zonal statistics for many polygons at once.  All polygons are burned
+#  into a single integer label grid ( one grid per zone where polygons
+#  overlap ), the zone cells are sorted by label
+#  once, and every raster is then summarized for all zones in a single
+#  pass with np.add.reduceat (count / sum / sum-of-squares) and
+#  np.fmin / np.fmax.reduceat (min / max).
+#
+# Author: Michael Lindgren (malindgren@alaska.edu)
+# # #
+
+import os
+import numpy as np
+
+class Zones( object ):
+	'''
+	integer label grid of zones (0 = background) with the cell ordering
+	needed to summarize any raster on the same grid in one pass.
+	'''
+	def __init__( self, labels, names=None, mask=None, ids=None ):
+		'''
+		ARGUMENTS:
+		----------
+		labels = [numpy.ndarray] 2-D integer array of zone ids. 0 is background.
+		names = [dict] of zone id to zone name. default:None (ids are used)
+		mask = [numpy.ndarray] 2-D bool array of valid cells. cells outside are dropped
+			from every zone (i.e. the template nodata mask). default:None
+		ids = [list] zone ids to report even if they have no cells ( count 0, np.nan
+			stats ). default:None (the ids in labels)
+		'''
+		labels = np.asarray( labels ).astype( np.int64 )
+		if mask is not None:
+			labels = np.where( np.asarray( mask, dtype=bool ), labels, 0 )
+		self.shape = labels.shape
+		flat = labels.ravel()
+		cells, = np.where( flat > 0 )
+		order = np.argsort( flat[ cells ], kind='mergesort' )
+		index = cells[ order ]
+		self._set_index( index, flat[ index ], names=names, ids=ids )
+	@classmethod
+	def from_cells( cls, cells, shape, names=None, mask=None ):
+		'''
+		zones from the flat cell indices of each zone -- zones may share cells ( overlapping
+		polygons ), each cell is counted in every zone it falls in.
+
+		ARGUMENTS:
+		----------
+		cells = [dict] of zone id to 1-D array of flat cell indices on a grid of shape.
+		shape = [tuple] ( rows, cols ) of the grid.
+		names, mask = see Zones.
+		'''
+		zones = cls.__new__( cls )
+		zones.shape = tuple( shape )
+		ids = sorted( cells.keys() )
+		valid = None if mask is None else np.asarray( mask, dtype=bool ).ravel()
+		index, labels = [], []
+		for i in ids:
+			idx = np.unique( np.asarray( cells[ i ], dtype=np.int64 ) )
+			if valid is not None:
+				idx = idx[ valid[ idx ] ]
+			index.append( idx )
+			labels.append( np.full( idx.size, i, dtype=np.int64 ) )
+		empty = np.array( [], dtype=np.int64 )
+		zones._set_index( np.concatenate( [ empty ] + index ), np.concatenate( [ empty ] + labels ), names=names, ids=ids )
+		return zones
+	def _set_index( self, index, sorted_labels, names=None, ids=None ):
+		'''[hidden] cell ordering of the zones: zone cells sorted by zone id, with the start of each zone '''
+		self.index = index # flat index of zone cells sorted by zone
+		present, self.starts = np.unique( sorted_labels, return_index=True )
+		self.ids = present
+		if ids is not None:
+			self.ids = np.union1d( present, np.asarray( ids, dtype=np.int64 ) )
+		self._present = np.isin( self.ids, present ) # zones with cells, in the order of starts
+		if names is None:
+			names = {}
+		self.names = { i:names.get( i, i ) for i in self.ids }
+	@classmethod
+	def from_shapefile( cls, fn, grid, id_field, name_field=None, all_touched=False ):
+		'''
+		rasterize all polygons of a shapefile / GeoDataFrame onto a grid in a single call.
+		Where polygons of different ids overlap, each id is rasterized on its own instead
+		( see Zones.from_cells ) so the shared cells count in every zone.  Every id gets a
+		row in stats, with count 0 where it covers no valid cell.
+
+		ARGUMENTS:
+		----------
+		fn = [str/geopandas.GeoDataFrame] path to the polygons or a GeoDataFrame.
+		grid = [downscale.GridSpec] grid to rasterize to.  Its valid-cell mask is applied.
+		id_field = [str] integer (>0) id field for each zone.
+		name_field = [str] name field for each zone. default:None
+		all_touched = [bool] burn all cells touched by a polygon. default:False
+		'''
+		import geopandas as gpd
+		from rasterio.enums import MergeAlg
+		from rasterio.features import rasterize
+
+		gdf = gpd.read_file( fn ) if isinstance( fn, str ) else fn
+		if gdf.crs is not None and grid.crs is not None:
+			gdf = gdf.to_crs( grid.crs.to_wkt() )
+		ids = gdf[ id_field ].astype( int ).values
+		names = None
+		if name_field is not None:
+			names = dict( zip( ids, gdf[ name_field ] ) )
+		if len( gdf ) == 0:
+			return cls( np.zeros( grid.shape, dtype=np.int64 ), mask=grid.mask )
+		kwargs = dict( out_shape=grid.shape, transform=grid.transform, all_touched=all_touched )
+		# features burned per cell -- more than one where polygons overlap
+		counts = rasterize( ( (geom, 1) for geom in gdf.geometry ), fill=0, merge_alg=MergeAlg.add, dtype='int32', **kwargs )
+		if ( counts[ grid.mask ] > 1 ).any() and len( np.unique( ids ) ) > 1:
+			cells = {}
+			for i in np.unique( ids ):
+				burned = rasterize( gdf.geometry[ ids == i ], fill=0, default_value=1, dtype='uint8', **kwargs )
+				cells[ i ], = np.where( burned.ravel() > 0 )
+			return cls.from_cells( cells, grid.shape, names=names, mask=grid.mask )
+		labels = rasterize( ( (geom, int( value )) for geom, value in zip( gdf.geometry, ids ) ),
+							fill=0, dtype='int32', **kwargs )
+		return cls( labels, names=names, mask=grid.mask, ids=ids )
+	def stats( self, arr ):
+		'''
+		summarize a 2-D array for every zone.  np.nan cells are ignored, zones without
+		cells get count 0 and np.nan stats.
+
+		RETURNS:
+		--------
+		pandas.DataFrame with columns: zone, name, count, sum, sumsq, min, max, mean, std
+		'''
+		import pandas as pd
+		n = len( self.ids )
+		count = np.zeros( n, dtype=np.int64 )
+		total, sumsq = np.zeros( n ), np.zeros( n )
+		zmin, zmax = np.full( n, np.nan ), np.full( n, np.nan )
+		if len( self.starts ) > 0:
+			vals = np.asarray( arr, dtype=np.float64 ).ravel()[ self.index ]
+			valid = ~np.isnan( vals )
+			filled = np.where( valid, vals, 0.0 )
+			count[ self._present ] = np.add.reduceat( valid.astype( np.int64 ), self.starts )
+			total[ self._present ] = np.add.reduceat( filled, self.starts )
+			sumsq[ self._present ] = np.add.reduceat( filled * filled, self.starts )
+			with np.errstate( invalid='ignore' ):
+				zmin[ self._present ] = np.fmin.reduceat( vals, self.starts )
+				zmax[ self._present ] = np.fmax.reduceat( vals, self.starts )
+		with np.errstate( invalid='ignore', divide='ignore' ):
+			mean = total / count
+			std = np.sqrt( np.maximum( sumsq / count - mean * mean, 0 ) )
+		return pd.DataFrame({ 'zone':self.ids, 'name':[ self.names[ i ] for i in self.ids ],
+							'count':count, 'sum':total, 'sumsq':sumsq, 'min':zmin, 'max':zmax,
+							'mean':mean, 'std':std })
+
+# zones for the worker processes -- set once per worker by the pool initializer
+_ZONES = None
+
+def _init_worker( zones ):
+	''' [hidden] share the Zones object with each worker once rather than per task '''
+	global _ZONES
+	_ZONES = zones
+
+def _file_stats( fn ):
+	''' [hidden] read a raster once and summarize it for all zones '''
+	import rasterio
+	from downscale.encoding import read_band
+	# physical values of scaled-integer outputs, np.nan at nodata
+	with rasterio.open( fn ) as rst:
+		arr = read_band( rst ).astype( np.float64 )
+	df = _ZONES.stats( arr )
+	df[ 'fn' ] = fn
+	return df
+
+def parse_snap_filename( fn ):
+	'''
+	parse a SNAP-standard '<variable>_<metric>_<units>_<project>_<model>_<scenario>_<MM>_<YYYY>.tif'
+	filename to a dict.  Shorter names only return what can be parsed from the right.
+	'''
+	elems = os.path.basename( fn ).split( '.' )[0].split( '_' )
+	keys = [ 'variable', 'metric', 'units', 'project', 'model', 'scenario', 'month', 'year' ]
+	if len( elems ) < len( keys ):
+		keys = keys[ -len( elems ): ]
+	out = dict( zip( keys, elems[ -len( keys ): ] ) )
+	for key in [ 'month', 'year' ]:
+		if key in out:
+			out[ key ] = int( out[ key ] )
+	return out
+
+def zonal_table( files, zones, ncpus=32, parse=parse_snap_filename ):
+	'''
+	zonal statistics for all zones over many rasters in parallel, as one combined table.
+
+	ARGUMENTS:
+	----------
+	files = [list] of str paths to rasters on the zones grid.
+	zones = [downscale.zonal.Zones] zones to summarize.
+	ncpus = [int] number of processes. default:32
+	parse = [function] returning a dict of columns to add for each filename (i.e. model,
+		scenario, month, year). default:parse_snap_filename
+
+	RETURNS:
+	--------
+	pandas.DataFrame with a row per file per zone.
+	'''
+	import pandas as pd
+	if ncpus > 1:
+		import multiprocessing as mp
+		pool = mp.Pool( ncpus, initializer=_init_worker, initargs=( zones, ) )
+		out = pool.map( _file_stats, files, chunksize=max( 1, len( files ) // ( ncpus * 4 ) ) )
+		pool.close()
+		pool.join()
+	else:
+		_init_worker( zones )
+		out = [ _file_stats( fn ) for fn in files ]
+	df = pd.concat( out, ignore_index=True )
+	if parse is not None:
+		parsed = pd.DataFrame([ parse( fn ) for fn in df.fn ], index=df.index )
+		df = pd.concat( [ parsed, df ], axis=1 )
+	return df
+
+def combine( df, by ):
+	'''
+	aggregate zonal rows (i.e. over years in a decade) using the additive
+	count / sum / sumsq / min / max fields.
+
+	ARGUMENTS:
+	----------
+	df = [pandas.DataFrame] output of zonal_table / Zones.stats
+	by = [list] of column names to group by (i.e. ['model','scenario','zone','month'])
+
+	RETURNS:
+	--------
+	pandas.DataFrame with count, sum, sumsq, min, max, mean, std per group
+	'''
+	out = df.groupby( by ).agg({ 'count':'sum', 'sum':'sum', 'sumsq':'sum', 'min':'min', 'max':'max' }).reset_index()
+	with np.errstate( invalid='ignore', divide='ignore' ):
+		out[ 'mean' ] = out[ 'sum' ] / out[ 'count' ]
+		out[ 'std' ] = np.sqrt( np.maximum( out[ 'sumsq' ] / out[ 'count' ] - out[ 'mean' ]**2, 0 ) )
+	return out
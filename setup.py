@@ -18,7 +18,12 @@ classifiers = [
 
 		# Specify the Python versions you support here. In particular, ensure
 		# that you indicate whether you support Python 2, Python 3 or both.
-		'Programming Language :: Python :: 2.7'
+		# 3.7+ -- the lazy package imports use the module __getattr__ of PEP 562
+		'Programming Language :: Python :: 3',
+		'Programming Language :: Python :: 3 :: Only',
+		'Programming Language :: Python :: 3.7',
+		'Programming Language :: Python :: 3.8',
+		'Programming Language :: Python :: 3.9'
 		]
 
 setup(	name='downscale',
@@ -30,6 +35,7 @@ setup(	name='downscale',
 		license='MIT',
 		packages=find_packages(),
 		install_requires=dependencies_list,
+		python_requires='>=3.7',
 		zip_safe=False,
 		include_package_data=True,
 		dependency_links=['git+https://git@github.com:ua-snap/downscale.git'],
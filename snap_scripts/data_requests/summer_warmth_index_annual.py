@@ -10,53 +10,21 @@ def list_files( base_dir, wildcard='tas_*.tif' ):
 			out = out + glob.glob(os.path.join( root, wildcard ) )
 	return out
 
-def make_grouper( x ):
-	group = os.path.basename( x ).split('.')[0].split('_')
-	year = group[-1]
-	return year
-
-def swi( files, output_path ):
-	import rasterio
-	import numpy as np
-
-	months = [ fn.split('_')[-2] for fn in files ]
-	files = [ fn for fn, month in zip( files, months ) if month in ['05', '06', '07', '08', '09'] ]
-
-	arr = np.array( [ rasterio.open(i).read(1) for i in files ] )
-	arr[ arr < 0 ] = 0
-	arr = np.sum( arr, axis=0 )
-	
+def output_filenames( fn, output_path ):
+	''' make a function returning the output swi filename for a year using a template input filename '''
 	variable, metric, units, project, model, \
 		scenario, month, year = \
-			os.path.basename( files[0] ).split( '.' )[0].split( '_' )
-
-	# make sure the year is a decadal year for grouping if annual...
-	# this works with both decadal and annual monthlies.
-	rst = rasterio.open( files[0] )
-	mask = rst.read_masks( 1 )
-	meta = rst.meta
-
-	meta.update( compress='lzw' )
-	output_filename = os.path.join( output_path, model, scenario, 'swi', '_'.join(['swi', 'cumulative', units, project, model, scenario, year])+'.tif' )
-
-	try:
-		dirname = os.path.dirname( output_filename )
-		if not os.path.exists( dirname ):
-			os.makedirs( dirname )
-	except:
-		pass
-
-	with rasterio.open( output_filename, 'w', **meta ) as out:
-		arr[ mask == 0 ] = meta[ 'nodata' ]
-		out.write( np.round( arr, 1 ), 1 )
-	return output_filename
+			os.path.basename( fn ).split( '.' )[0].split( '_' )
+	def f( year ):
+		return os.path.join( output_path, model, scenario, 'swi', '_'.join(['swi', 'cumulative', units, project, model, scenario, str(year)])+'.tif' )
+	return f
 
 if __name__ == '__main__':
 	import os
-	import pandas as pd
-	import multiprocessing as mp
+	import numpy as np
 	from functools import partial
 	import argparse
+	from downscale import indices
 
 	parser = argparse.ArgumentParser( description='downscale the AR5-CMIP5 data to the AKCAN extent required by SNAP' )
 	parser.add_argument( "-b", "--base_path", action='store', dest='base_path', type=str, help="path to the directory where the downscaled modeled data are stored" )
@@ -76,19 +44,11 @@ if __name__ == '__main__':
 	variable = 'tas' # swi only on tas data
 
 	# list data
-	l = pd.Series( list_files( os.path.join( base_path, model, scenario, variable ) ) )
-
-	# group it by year
-	groups = l.apply( make_grouper )
-	grouped = l.groupby( groups )
-	data_grouped = [ sorted(group) for name, group in grouped ]
+	files = list_files( os.path.join( base_path, model, scenario, variable ) )
 
-	# parallel
-	swi_f = partial( swi, output_path=output_path )
-	pool = mp.Pool(32)
-	done = pool.map( swi_f, data_grouped )
-	pool.close()
-	pool.join()
+	# stream the series a year at a time -- years run in parallel
+	done = indices.compute_index( files, 'swi', output_filenames=output_filenames( files[0], output_path ), \
+						ncpus=32, round_func=partial( np.round, decimals=1 ) )
 
 
 # # # # # NOTES:
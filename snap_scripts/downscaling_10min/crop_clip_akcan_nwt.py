@@ -1,32 +1,6 @@
-def crop_clip( shp_fn, rst_fn, out_fn ):
-	'''
-	crop/clip to the shapefile we want using gdalwarp.
-	'''
-	import subprocess, os
-	try:
-		dirname = os.path.dirname( out_fn )
-		if not os.path.exists( dirname ):
-			os.makedirs( dirname )
-	except:
-		pass
-
-	# proj4string = '+proj=aea +lat_1=55 +lat_2=65 +lat_0=50 +lon_0=-154 +x_0=0 +y_0=0 +ellps=GRS80 +datum=NAD83 +units=m +no_defs'
-	proj4string = 'EPSG:3338'
-	subprocess.call(['gdalwarp', '-q', '-overwrite', '-tap','-t_srs', proj4string, '-co', 'COMPRESS=LZW', '-tr', '15000', '15000', 
-						'-srcnodata', '-9999', '-dstnodata', '-9999', '-wo', 'CUTLINE_ALL_TOUCHED=TRUE', '-crop_to_cutline', '-cutline',
-						shp_fn, rst_fn, out_fn ])
-		subprocess.call(['gdalwarp', '-q', '-overwrite', '-co', 'COMPRESS=LZW', '-tr', '15000', '15000', 
-						'-srcnodata', '-9999', '-dstnodata', '-9999', '-wo', 'CUTLINE_ALL_TOUCHED=TRUE', '-crop_to_cutline', '-cutline',
-						shp_fn, rst_fn, out_fn ])
-	return out_fn
-
-def wrap( x ):
-	''' wrapper for clean multiprocessing call to pool.map '''
-	return crop_clip( *x )
-
 if __name__ == '__main__':
 	import os
-	from pathos.mp_map import mp_map
+	from downscale.clip import ClipPlan, clip_files
 
 	# setup args
 	base_path = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/downscaled_10min_nwt'
@@ -37,8 +11,11 @@ if __name__ == '__main__':
 	# BUILD ARGS
 	args_list = [ ( subdomain_fn, os.path.join( root, fn ), os.path.join( root, fn ).replace( base_path, output_path ) ) for root, subs, files in os.walk( base_path ) for fn in files if fn.endswith( '.tif' ) ]
 
-	# RUN IN PARALLEL
-	out = mp_map( wrap, args_list, nproc=ncpus )
+	# rasterize the cutline ONCE on the EPSG:3338 15km target grid (gdalwarp -tap -tr 15000 15000 -wo CUTLINE_ALL_TOUCHED=TRUE)
+	plan = ClipPlan.from_shapefile( subdomain_fn, args_list[0][1], dst_crs='EPSG:3338', resolution=15000, all_touched=True )
+
+	# RUN IN PARALLEL -- only the cutline window is read from each file
+	out = clip_files( plan, [ (rst_fn, out_fn) for shp_fn, rst_fn, out_fn in args_list ], ncpus=ncpus, nodata=-9999 )
 
 # # # SOME NOTES ON THE CLIPPING OF THE 10' outputs on Feb 8, 2018 ...
 # running this on Phobos with the new CUTLINE_ALL_TOUCHED=TRUE warp option as a test to see if we can not clip the coastline unnecessarily.
@@ -1,36 +1,22 @@
-# compare new / old versions of SNAP downscaled outputs 
-def open_raster( fn, band=1 ):
-	with rasterio.open( fn ) as rst:
-		arr = rst.read(1)
-	return arr
-
-def compare_files( old, new ):
-	old = open_raster(old)
-	new = open_raster(new)
-	diff = (old-new)
-	return (np.min(diff),np.max(diff))
-
-def wrap( x ):
-	old, new = x
-	return compare_files(old, new)
-
+# compare new / old versions of SNAP downscaled outputs
 if __name__ == '__main__':
-	import os, glob, rasterio
-	import multiprocessing as mp
-	import numpy as np
-
-	variable = 'tas'
-	model = '5ModelAvg'
-	scenario = 'rcp85'
+	import os
+	from downscale import diff
+	import argparse
 
-	old_dir = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data_OLD_March2018/downscaled/{}/{}/{}'.format(model, scenario, variable)
-	new_dir = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/downscaled/{}/{}/{}'.format(model, scenario, variable)
+	parser = argparse.ArgumentParser( description='regression diff of two versions of the downscaled outputs' )
+	parser.add_argument( "-m", "--model", action='store', dest='model', type=str, default='5ModelAvg', help="model name" )
+	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, default='rcp85', help="scenario name" )
+	parser.add_argument( "-v", "--variable", action='store', dest='variable', type=str, default='tas', help="variable name" )
+	parser.add_argument( "-a", "--atol", action='store', dest='atol', type=float, default=0.0, help="absolute difference counted as a change" )
+	parser.add_argument( "-o", "--output_filename", action='store', dest='output_filename', type=str, default='diff_report.json', help="report path (.json or .csv)" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=64, help="number of cores to use" )
+	args = parser.parse_args()
 
-	old_files = glob.glob(os.path.join(old_dir,'*.tif'))
-	new_files = [ fn.replace(old_dir, new_dir) for fn in old_files ]
-	args = zip( old_files, new_files ) 
+	old_dir = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data_OLD_March2018/downscaled/{}/{}/{}'.format(args.model, args.scenario, args.variable)
+	new_dir = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/downscaled/{}/{}/{}'.format(args.model, args.scenario, args.variable)
 
-	pool = mp.Pool( 64 )
-	out = pool.map( wrap, zip(old_files, new_files) )
-	pool.close()
-	pool.join()
+	# identical files are skipped on their hash, the rest are compared window by window
+	df = diff.diff_trees( old_dir, new_dir, ncpus=args.ncpus, atol=args.atol )
+	diff.write_report( df, args.output_filename, summary_by=[ 'variable', 'month' ] )
+	print( diff.summarize( df, by=[ 'variable', 'month' ] ) )
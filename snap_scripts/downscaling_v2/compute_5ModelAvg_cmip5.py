@@ -9,72 +9,47 @@ def list_files( input_path, begin=1900, end=2005 ):
 	# var, units, metric, model, month, year = os.path.basename( fn ).split( '.' )[0].split( '_' )
 	return [ fn for fn in files if int(os.path.basename( fn ).split( '.' )[0].split( '_' )[-1]) in range( begin, end+1 ) ]
 
-def generate( files ):
-	from functools import partial
-	# from pathos.mp_map import mp_map
-
-	rst = rasterio.open( files[0] )
-	meta = rst.meta
-	meta.update( compress='lzw' )
-	mask = rst.read_masks( 1 )
-
-	# if 'transform' in meta.keys():
-	# 	meta.pop( 'transform' )
-
-	# arr_group = mp_map( lambda x:rasterio.open( x ).read( 1 ), files, nproc=32 )
-	arr_group = np.array([ rasterio.open( fn ).read( 1 ) for fn in files ])
-	group_mean = np.mean( arr_group, axis=0 )
-	group_mean[ mask == 0 ] = rst.nodata # add back the oob 
+# output name labels for each ensemble stat -- mean keeps the legacy 5ModelAvg name
+STAT_LABELS = { 'mean':'5ModelAvg', 'median':'5ModelMedian', 'std':'5ModelStd', 'min':'5ModelMin', 'max':'5ModelMax' }
 
+def output_filenames( files, stats, percentiles ):
+	''' build the stat:output_filename dict from the NCAR-CCSM4 filename in the group '''
 	fn, = [ i for i in files if 'NCAR-CCSM4' in i ]
-	output_filename = fn.replace( 'NCAR-CCSM4', '5ModelAvg' )
-	new_path = os.path.dirname( output_filename )
-	try:
-		# new directory -- if needed:
-		if not os.path.exists( new_path ):
-			os.makedirs( new_path )
-	except:
-		pass
+	names = list( stats ) + [ 'p{}'.format( q ) for q in percentiles ]
+	return { name:fn.replace( 'NCAR-CCSM4', STAT_LABELS.get( name, '5Model'+name.upper() ) ) for name in names }
 
-	# round the data 
-	# dynamically get the first element of the filename which is variable
-	variable = os.path.basename(files[0]).split( '_' )[0]
-	
+def rounder( variable ):
+	''' round the data -- pr to whole number, others to 1 decimal '''
+	from functools import partial
 	if variable == 'pr':
 		# truncate to whole number
-		rounder = np.rint
+		return np.rint
 	else:
-		# round to 2 decimals
-		rounder = partial( np.round, decimals=1 )
-
-	def round_it( x, mask ):
-		arr = np.ma.masked_array( x, mask == 0 )
-		return rounder( arr )
-
-	# round the data -- though for > 0 it does nothing
-	group_mean = round_it( group_mean, mask=mask )
-	group_mean.fill_value = rst.nodata
-
-	with rasterio.open( output_filename, 'w', **meta ) as out:
-		out.write( group_mean.filled(), 1 )
-	return output_filename
+		# round to 1 decimal
+		return partial( np.round, decimals=1 )
 
 if __name__ == '__main__':
 	import glob, os, rasterio, itertools
 	import numpy as np
-	from pathos.mp_map import mp_map
 	import argparse
+	from downscale import ensemble
 
 	parser = argparse.ArgumentParser( description='downscale the AR5-CMIP5 data to the AKCAN extent required by SNAP' )
 	parser.add_argument( "-b", "--base_dir", action='store', dest='base_dir', type=str, help="base directory where data is stored in structured folders" )
 	parser.add_argument( "-v", "--variable", action='store', dest='variable', type=str, help="cmip5 variable name (exact)" )
 	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, help="scenario name (exact)" )
+	parser.add_argument( "-st", "--stats", action='store', dest='stats', type=str, default='mean', help="comma-separated ensemble stats to compute. any of mean,median,std,min,max. default:mean" )
+	parser.add_argument( "-p", "--percentiles", action='store', dest='percentiles', type=str, default='', help="comma-separated percentiles to compute. ex. 10,90" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=32, help="number of cores to run months in parallel" )
 	args = parser.parse_args()
 	
 	# unpack
 	variable = args.variable
 	base_dir = args.base_dir
 	scenario = args.scenario
+	stats = args.stats.split( ',' )
+	percentiles = [ float( q ) if '.' in q else int( q ) for q in args.percentiles.split( ',' ) if q != '' ]
+	ncpus = args.ncpus
 
 	# some setup args
 	base_dir = os.path.join( base_dir, 'downscaled' )
@@ -91,7 +66,9 @@ if __name__ == '__main__':
 
 		# list the files we want
 		input_files = [ list_files( os.path.join( base_dir, model, scenario, variable ), begin, end ) for model in models ]
-		grouped = zip( *input_files )
+		grouped = [ list( group ) for group in zip( *input_files ) ]
+		out_fns = [ output_filenames( group, stats, percentiles ) for group in grouped ]
 
-		# run it in parallel
-		output_filenames = mp_map( generate, grouped, nproc=32 )
+		# run it in parallel -- all stats for a month come from one windowed read of the models
+		done = ensemble.run_ensemble( grouped, out_fns, ncpus=ncpus, stats=stats, \
+						percentiles=percentiles, round_func=rounder( variable ) )
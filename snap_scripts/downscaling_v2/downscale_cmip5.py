@@ -5,6 +5,10 @@ if __name__ == '__main__':
 	from functools import partial
 	import downscale
 	from downscale import preprocess, Mask, utils
+	from downscale.planner import plan_run
+	from downscale.climcache import ClimatologyCache, climatology_entry
+	from downscale.gdalenv import GDALProfile
+	from downscale.encoding import ENCODINGS
 	import numpy as np
 	import argparse
 
@@ -16,6 +20,15 @@ if __name__ == '__main__':
 	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, help="cmip5 scenario name (exact)" )
 	parser.add_argument( "-u", "--units", action='store', dest='units', type=str, help="cmip5 units name (exact)" )
 	parser.add_argument( "-met", "--metric", action='store', dest='metric', type=str, help="cmip5 metric name (exact)" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=32, help="most cores to use -- fewer if memory is short" )
+	parser.add_argument( "--dry_run", action='store_true', dest='dry_run', help="print the memory plan and exit" )
+	parser.add_argument( "--crop_halo", action='store', dest='crop_halo', type=int, default=2, help="crop the model grid to the baseline extent plus this many cells. -1 to use the full grid" )
+	parser.add_argument( "--climatology_cache", action='store', dest='climatology_cache', type=str, default=None, help="directory of cached historical climatologies. default:<base_dir>/climatology_cache" )
+	parser.add_argument( "--warp_threads", action='store', dest='warp_threads', type=int, default=1, help="GDAL warp threads per worker -- the workers are cut to ncpus / warp_threads" )
+	parser.add_argument( "--gdal_cachemax", action='store', dest='gdal_cachemax', type=int, default=None, help="MB of GDAL block cache per worker. default:GDAL's" )
+	parser.add_argument( "--encode", action='store_true', dest='encode', help="store the rounded outputs as scaled integers ( int16 / uint16 )" )
+	parser.add_argument( "--partition", action='store', dest='partition', type=int, default=os.environ.get( 'SLURM_ARRAY_TASK_ID' ), help="0-based block of years to write. default:$SLURM_ARRAY_TASK_ID" )
+	parser.add_argument( "--n_partitions", action='store', dest='n_partitions', type=int, default=os.environ.get( 'SLURM_ARRAY_TASK_COUNT' ), help="number of blocks of years. default:$SLURM_ARRAY_TASK_COUNT" )
 	args = parser.parse_args()
 
 	# unpack the args
@@ -45,6 +58,11 @@ if __name__ == '__main__':
 	scenarios = [ scenario ]
 	models = [ model ]
 	anom = True # write out anoms (True) or not (False)
+	crop = args.crop_halo if args.crop_halo >= 0 else None
+	clim_begin = '1961'
+	clim_end = '1990'
+	# the historical climatology is computed once per model / variable and shared by the scenario runs
+	cache = ClimatologyCache( args.climatology_cache or os.path.join( base_dir, 'climatology_cache' ) )
 	interp = False # interpolate across space -- Low Res
 	find_bounds = False
 
@@ -85,49 +103,55 @@ if __name__ == '__main__':
 		# list files for this set of downscaling -- one per folder
 		fn, = glob.glob( os.path.join( input_path, '*.nc' ) )
 
+		if 'historical' in scenario:
+			historical_fn = fn
+		else:
+			historical_fn, = glob.glob( os.path.join( os.path.dirname( fn ).replace( scenario, 'historical' ), '*.nc' ) )
+		# keyed as DeltaDownscale keys it -- the historical Dataset is built without a level
+		climatology = climatology_entry( cache, historical_fn, clim_begin, clim_end, variable, units=units, fix_clim=fix_clim,
+										find_bounds=find_bounds, interp=interp, level=None, crop=crop, grid=baseline.grid,
+										aoi_mask=aoi_mask_fn )
+
 		if 'historical' in scenario:
 			historical = downscale.Dataset( fn, variable, model, scenario, project=project, units=units, metric=metric, begin=1860, end=2005 )
 			future = None # no need for futures here....
 		else:
-			# get the historical data for anomalies
-			historical_fn, = glob.glob( os.path.join( os.path.dirname( fn ).replace( scenario, 'historical' ), '*.nc' ) )
-			historical = downscale.Dataset( historical_fn, variable, model, scenario, project=project, units=units, metric=metric, begin=1860, end=2005 )
+			# get the historical data for anomalies -- unless its climatology is already cached
+			if climatology.exists():
+				print( 'using cached climatology: {}'.format( climatology.filename ) )
+				historical = None
+			else:
+				historical = downscale.Dataset( historical_fn, variable, model, scenario, project=project, units=units, metric=metric, begin=1860, end=2005 )
 			future = downscale.Dataset( fn, variable, model, scenario, project=project, units=units, metric=metric, begin=2006, end=2100 )
 		
-		# convert from Kelvin to Celcius
+		# convert from Kelvin to Celcius -- scalars / factors in the series dtype so the cube isn't upcast
 		if variable != 'pr':
 			if historical:
-				historical.ds[ variable ] = historical.ds[ variable ] - 273.15
+				historical.ds[ variable ] = historical.ds[ variable ] - historical.dtype.type( 273.15 )
 				historical.ds[ variable ][ 'units' ] = units
 			
 			if future:
-				future.ds[ variable ] = future.ds[ variable ] - 273.15
+				future.ds[ variable ] = future.ds[ variable ] - future.dtype.type( 273.15 )
 				future.ds[ variable ][ 'units' ] = units
 
 		if variable == 'pr':
 			# convert to mm/month
 			if historical:
 				timesteps, = historical.ds.time.shape # this assumes time begins in January
-				days = [31,28,31,30,31,30,31,31,30,31,30,31] * (timesteps / 12)
-
-				for index, days_in_month in zip(range( len( days ) ), days ):
-					historical.ds[ variable ][index, ...] = historical.ds[ variable ][index, ...].data * 86400 * days_in_month
-
+				days = [31,28,31,30,31,30,31,31,30,31,30,31] * (timesteps // 12)
+				factor = np.array( days, dtype=historical.dtype ) * 86400
+				historical.ds[ variable ] = historical.ds[ variable ] * factor[ :, None, None ]
 				historical.ds[ variable ][ 'units' ] = units
 			
 			if future:
 				timesteps, = future.ds.time.shape # this assumes time begins in January
-				days = [31,28,31,30,31,30,31,31,30,31,30,31] * (timesteps / 12)
-
-				for index, days_in_month in enumerate( days ):
-					future.ds[ variable ][index, ...] = future.ds[ variable ][index, ...] * 86400 * days_in_month
-					
+				days = [31,28,31,30,31,30,31,31,30,31,30,31] * (timesteps // 12)
+				factor = np.array( days, dtype=future.dtype ) * 86400
+				future.ds[ variable ] = future.ds[ variable ] * factor[ :, None, None ]
 				future.ds[ variable ][ 'units' ] = units
 
 		# DOWNSCALE
 		mask = rasterio.open( baseline.filelist[0] ).read_masks( 1 )
-		clim_begin = '1961'
-		clim_end = '1990'
 
 		if variable == 'pr':
 			# truncate to whole number
@@ -136,7 +160,7 @@ if __name__ == '__main__':
 			aoi_mask = aoi_mask_fn
 			# make AOI_Mask input resolution for computing 95th percentiles...
 			if aoi_mask_fn is not None:
-				aoi_mask = Mask( aoi_mask_fn, historical, 1, 0 )
+				aoi_mask = Mask( aoi_mask_fn, historical if historical else future, 1, 0 )
 			else:
 				aoi_mask = None
 		else:
@@ -145,16 +169,26 @@ if __name__ == '__main__':
 			downscaling_operation = 'add'
 			aoi_mask = None
 
-		def round_it( x, mask ):
-			arr = np.ma.masked_array( data=x, mask=mask )
-			return rounder( arr )
+		# elementwise, so it also runs on the valid-cell vectors / tiles of compact and tiled runs --
+		#  the cells outside the mask are set to nodata after it
+		round_data = rounder
 
-		round_data = partial( round_it, mask=( mask==0 ) )
+		# size the workers / time chunks to the memory this job actually has before running
+		plan = plan_run( historical, future, baseline, ncpus=max( 1, args.ncpus // args.warp_threads ), fix_clim=fix_clim, crop=crop,
+						partition=args.partition, n_partitions=args.n_partitions )
+		print( plan.report() )
+		if args.dry_run:
+			continue
+		plan.check()
 
 		ar5 = downscale.DeltaDownscale( baseline, clim_begin, clim_end, historical, future, 
-				downscaling_operation=downscaling_operation, mask=mask, mask_value=0, ncpus=32, 
+				downscaling_operation=downscaling_operation, mask=mask, mask_value=0, ncpus=plan.ncpus, 
 				src_crs={'init':'epsg:4326'}, src_nodata=None, dst_nodata=None,
-				post_downscale_function=round_data, varname=variable, modelname=modelname, anom=anom,
-				fix_clim=fix_clim, aoi_mask=aoi_mask )
-
-		ar5.downscale( output_dir=output_path )
+				post_downscale_function=round_data, varname=variable, modelname=modelname, anom=anom, interp=interp,
+				fix_clim=fix_clim, aoi_mask=aoi_mask, climatology_cache=climatology, crop=crop,
+				gdal_profile=GDALProfile( num_threads=args.warp_threads, cache_max=args.gdal_cachemax ),
+				partition=args.partition, n_partitions=args.n_partitions )
+
+		# slurm array tasks each write a block of years -- merge with rechunk_archive_cmip5.py --n_partitions
+		encoding = ENCODINGS[ variable ] if args.encode else None
+		ar5.downscale( output_dir=output_path, time_chunk=plan.time_chunk, encoding=encoding )
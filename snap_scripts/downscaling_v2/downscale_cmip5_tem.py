@@ -133,11 +133,9 @@ if __name__ == '__main__':
 			rounder = partial( np.round, decimals=1 )
 			downscaling_operation = 'add'
 
-		def round_it( x, mask ):
-			arr = np.ma.masked_array( data=x, mask=mask )
-			return rounder( arr )
-
-		round_data = partial( round_it, mask=( mask==0 ) )
+		# elementwise, so it also runs on the valid-cell vectors / tiles of compact and tiled runs --
+		#  the cells outside the mask are set to nodata after it
+		round_data = rounder
 
 		def round_data_clamp_hur( x ):
 			''' see group emails circa 6/7/2012 '''
@@ -1,62 +1,36 @@
 # - - - - - - - - - - - - - - - - - - 
 # masking NEW ALFRESCO Input Dataset
 # - - - - - - - - - - - - - - - - - - 
-def make_alfresco_compatible( fn, mask_fn, input_base_dir, output_base_dir ):
-	import shutil, os, subprocess, rasterio
-	import numpy as np	
-
-	# split the input filename to parts
+def output_filename( fn, input_base_dir, output_base_dir ):
+	''' output filename in a new directory -- preserving the model/scenario/variable hierarchy '''
+	import os
 	dirname, basename = os.path.split( fn )
-	
-	# output filename to a new directory -- preserving the model/scenario/variable hierarchy
-	out_fn = os.path.join( dirname.replace( input_base_dir, output_base_dir ), basename.replace( '_ar5_', '_alf_ar5_' ) )
-	
-	# read in the mask file where 0=nodata
-	mask = rasterio.open( mask_fn ).read( 1 )
-	
-	try:
-		# make sure the new dir exists...
-		newdir = os.path.dirname( out_fn ) 
-		if not os.path.exists( newdir ):
-			os.makedirs( newdir )
-	except:
-		pass
-
-	# copy mask_fn to new output filename
-	_ = shutil.copy( mask_fn, out_fn )
-
-	# gdalwarp -- subprocess... this is the best, easiest, fastest way... welcome to python.
-	_ = subprocess.call([ 'gdalwarp', '-q', '-multi', '-dstnodata', 'None' ,'-srcnodata', 'None', fn, out_fn ])
-
-	# read the array back in and mask it
-	with rasterio.open( out_fn ) as rst:
-		arr = rst.read( 1 )
-		meta = rst.meta
-	
-	del rst
-
-
-	# overwrite with a mask
-	meta.update( nodata=-9999, crs={'init':'epsg:3338'}, dtype='float32', compress='lzw' )
-	with rasterio.open( out_fn, 'w', **meta ) as out:
-		if 'pr_' in fn:
-			arr = np.around( arr, 0 )
-		elif 'tas_' in fn:
-			arr = np.around( arr, 1 )
-		else:
-			BaseException( 'only tas / pr are currently supported in the rounder' )
+	return os.path.join( dirname.replace( input_base_dir, output_base_dir ), basename.replace( '_ar5_', '_alf_ar5_' ) )
 
-		arr[ mask == 0 ] = -9999
-		out.write( arr.astype( np.float32 ), 1 )
-
-	return out_fn
+def rounder( fn ):
+	''' rounding for ALFRESCO: pr to whole mm and tas to a single decimal '''
+	import numpy as np
+	from functools import partial
+	if 'pr_' in fn:
+		return partial( np.around, decimals=0 )
+	elif 'tas_' in fn:
+		return partial( np.around, decimals=1 )
+	else:
+		BaseException( 'only tas / pr are currently supported in the rounder' )
+	return None
+
+def make_alfresco_compatible( fn, mask_fn, input_base_dir, output_base_dir, plan=None ):
+	''' warp / round / mask a single file to the ALFRESCO 1km grid -- see downscale.warp for doing many at once '''
+	from downscale.warp import WarpPlan
+	if plan is None:
+		plan = WarpPlan.from_rasters( fn, mask_fn, mask_value=0 )
+	out_fn = output_filename( fn, input_base_dir, output_base_dir )
+	return plan.warp_file( fn, out_fn, round_func=rounder( fn ), crs='EPSG:3338' )
 
 if __name__ == '__main__':
-	import rasterio, subprocess, os
+	import rasterio, os
 	import numpy as np
-	# from pathos.mp_map import mp_map
-	from functools import partial
-	import multiprocessing as mp
+	from downscale.warp import WarpPlan, warp_files
 	import argparse
 
 	# # parse the commandline arguments
@@ -64,6 +38,7 @@ if __name__ == '__main__':
 	parser.add_argument( "-m", "--model", action='store', dest='model', type=str, help="cmip5 model name (exact)" )
 	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, help="cmip5 scenario name (exact)" )
 	parser.add_argument( "-v", "--variable", action='store', dest='variable', type=str, help="cmip5 variable name (exact)" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=32, help="number of cores to use" )
 	args = parser.parse_args()
 
 	# unpack args
@@ -78,6 +53,8 @@ if __name__ == '__main__':
 	# HARDWIRED ARGS...
 	alf_v1 = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/alfresco_formatting/tas_mean_C_alf_ar4_cccma_cgcm3_1_sresa2_01_2001.tif'
 	mask_fn = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/alfresco_formatting/alf_v1_mask_1km.tif'
+	# 2km -> 1km warp plan -- computed once and reused by every model/scenario/variable run
+	plan_fn = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/alfresco_formatting/alf_1km_warp_plan.npz'
 
 	# make the mask file --- this only need be run once...
 	# # this is the old data
@@ -96,13 +73,8 @@ if __name__ == '__main__':
 
 	# STEP2 list all the data and make args for passing to the parallel function
 	filelist = [ os.path.join( r, fn ) for r,s,files in os.walk( input_base_dir ) for fn in files if fn.endswith( '.tif' ) ]
-	f = partial( make_alfresco_compatible, mask_fn=mask_fn, input_base_dir=input_base_dir, output_base_dir=output_base_dir )
-
-	# # # # STEP3 run in parallel
-	pool = mp.Pool( 32 )
-	done = pool.map( f, filelist )
-	pool.close()
-	pool.join()
+	plan = WarpPlan.from_rasters( filelist[0], mask_fn, mask_value=0, sidecar=plan_fn )
+	jobs = [ ( fn, output_filename( fn, input_base_dir, output_base_dir ), rounder( fn ) ) for fn in filelist ]
 
-	pool = None
-	del pool
+	# # # # STEP3 run in parallel -- warp, round and mask in memory and write each file once
+	done = warp_files( plan, jobs, ncpus=args.ncpus, crs='EPSG:3338' )
@@ -1,58 +1,33 @@
 # - - - - - - - - - - - - - - - - - - 
 # masking NEW ALFRESCO Input Dataset
 # - - - - - - - - - - - - - - - - - - 
-def make_iem_compatible( fn, mask_fn, input_base_dir, output_base_dir ):
-	import shutil, os, subprocess, rasterio
-	import numpy as np	
-
-	# split the input filename to parts
+def output_filename( fn, input_base_dir, output_base_dir ):
+	''' output filename in a new directory -- preserving the model/scenario/variable hierarchy '''
+	import os
 	dirname, basename = os.path.split( fn )
-	
-	# output filename to a new directory -- preserving the model/scenario/variable hierarchy
-	out_fn = os.path.join( dirname.replace( input_base_dir, output_base_dir ), basename.replace( '_ar5_', '_iem_ar5_' ) ).replace('_CRU-TS40_','_iem_CRU-TS40_')
-	
-	# read in the mask file where 0=nodata
-	mask = rasterio.open( mask_fn ).read( 1 )
-	
-	try:
-		# make sure the new dir exists...
-		newdir = os.path.dirname( out_fn ) 
-		if not os.path.exists( newdir ):
-			os.makedirs( newdir )
-	except:
-		pass
-
-	# copy mask_fn to new output filename
-	_ = shutil.copy( mask_fn, out_fn )
-
-	# gdalwarp -- subprocess... this is the best, easiest, fastest way... welcome to python.
-	_ = subprocess.call([ 'gdalwarp', '-q', '-multi', '-dstnodata', 'None' ,'-srcnodata', 'None', fn, out_fn ])
-
-	# read the array back in and mask it
-	with rasterio.open( out_fn ) as rst:
-		arr = rst.read( 1 )
-		meta = rst.meta
-	
-	del rst
-
-	# overwrite with a mask
-	meta.update( nodata=-9999, crs={'init':'epsg:3338'}, dtype='float32', compress='lzw' )
-	with rasterio.open( out_fn, 'w', **meta ) as out:
-		if 'pr_' in fn:
-			arr = np.around( arr, 0 )
-		elif 'rsds_' not in fn and 'pr_' not in fn:
-			arr = np.around( arr, 1 )
-
-		arr[ mask == 0 ] = -9999
-		out.write( arr.astype( np.float32 ), 1 )
+	return os.path.join( dirname.replace( input_base_dir, output_base_dir ), basename.replace( '_ar5_', '_iem_ar5_' ) ).replace('_CRU-TS40_','_iem_CRU-TS40_')
 
-	return out_fn
-
-if __name__ == '__main__':
-	import rasterio, subprocess, os
+def rounder( fn ):
+	''' rounding for IEM: pr to whole mm, rsds untouched, everything else to a single decimal '''
 	import numpy as np
 	from functools import partial
-	import multiprocessing as mp
+	if 'pr_' in fn:
+		return partial( np.around, decimals=0 )
+	elif 'rsds_' not in fn:
+		return partial( np.around, decimals=1 )
+	return None
+
+def make_iem_compatible( fn, mask_fn, input_base_dir, output_base_dir, plan=None ):
+	''' warp / round / mask a single file to the IEM 1km grid -- see downscale.warp for doing many at once '''
+	from downscale.warp import WarpPlan
+	if plan is None:
+		plan = WarpPlan.from_rasters( fn, mask_fn, mask_value=0 )
+	out_fn = output_filename( fn, input_base_dir, output_base_dir )
+	return plan.warp_file( fn, out_fn, round_func=rounder( fn ), crs='EPSG:3338' )
+
+if __name__ == '__main__':
+	import os
+	from downscale.warp import WarpPlan, warp_files
 	import argparse
 
 	# # parse the commandline arguments
@@ -60,6 +35,7 @@ if __name__ == '__main__':
 	parser.add_argument( "-m", "--model", action='store', dest='model', type=str, help="cmip5 model name (exact)" )
 	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, help="cmip5 scenario name (exact)" )
 	parser.add_argument( "-v", "--variable", action='store', dest='variable', type=str, help="cmip5 variable name (exact)" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=32, help="number of cores to use" )
 	args = parser.parse_args()
 
 	# unpack args
@@ -74,16 +50,13 @@ if __name__ == '__main__':
 	# HARDWIRED ARGS...
 	# iem_v1 = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/iem_formatting/pr_total_mm_iem_ar5_MRI-CGCM3_rcp85_03_2061.tif'
 	mask_fn = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/iem_formatting/iem_domain_mask.tif'
+	# 2km -> 1km warp plan -- computed once and reused by every model/scenario/variable run
+	plan_fn = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/iem_formatting/iem_1km_warp_plan.npz'
 
 	# STEP2 list all the data and make args for passing to the parallel function
 	filelist = [ os.path.join( r, fn ) for r,s,files in os.walk( input_base_dir ) for fn in files if fn.endswith( '.tif' ) ]
-	f = partial( make_iem_compatible, mask_fn=mask_fn, input_base_dir=input_base_dir, output_base_dir=output_base_dir )
-
-	# run in parallel
-	pool = mp.Pool( 32 )
-	done = pool.map( f, filelist )
-	pool.close()
-	pool.join()
+	plan = WarpPlan.from_rasters( filelist[0], mask_fn, mask_value=0, sidecar=plan_fn )
+	jobs = [ ( fn, output_filename( fn, input_base_dir, output_base_dir ), rounder( fn ) ) for fn in filelist ]
 
-	pool = None
-	del pool
+	# run in parallel -- warp, round and mask in memory and write each file once
+	done = warp_files( plan, jobs, ncpus=args.ncpus, crs='EPSG:3338' )
@@ -0,0 +1,46 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # generate vap (tas/hurs) and rsds (girr/clt) in a single pass over
+# # the downscaled archive using downscale.derived.  Each tas/hurs/clt
+# # raster is read once per (model, scenario, month).
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+def make_job( hurs_fn, girr_files ):
+	''' build the (sources, output_filenames) pair for a single month from its hurs file '''
+	month = os.path.basename( hurs_fn ).split( '.' )[0].split( '_' )[-2]
+	tas_fn = hurs_fn.replace( '/hurs', '/tas' ).replace( 'mean_pct', 'mean_C' )
+	clt_fn = hurs_fn.replace( '/hurs', '/clt' )
+	sources = { 'hurs':hurs_fn, 'tas':tas_fn }
+	outputs = { 'vap':hurs_fn.replace( '/hurs', '/vap' ).replace( 'mean_pct', 'mean_hPa' ) }
+	if os.path.exists( clt_fn ):
+		sources.update( clt=clt_fn, girr=girr_files[ month ] )
+		outputs.update( rsds=clt_fn.replace( 'clt', 'rsds' ).replace( '_pct_', '_MJ-m2-d1_' ) )
+	return sources, outputs
+
+if __name__ == '__main__':
+	import os, glob
+	from downscale import derived, GridSpec
+	import argparse
+
+	parser = argparse.ArgumentParser( description='generate vap and rsds from the downscaled tas/hurs/clt archive in one pass' )
+	parser.add_argument( "-b", "--base_path", action='store', dest='base_path', type=str, help="path to the project_data directory" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=64, help="number of cores to use" )
+	args = parser.parse_args()
+
+	base_path = args.base_path
+	ncpus = args.ncpus
+	base_dir = os.path.join( base_path, 'downscaled' )
+	girr_dir = os.path.join( base_path, 'climatologies', 'other', '2km', 'girr' )
+
+	# monthly girr climatologies -- read with the clt for each month
+	months = [ '01', '02', '03', '04', '05', '06', '07', '08', '09', '10', '11', '12' ]
+	girr_files = dict( zip( months, sorted( glob.glob( os.path.join( girr_dir, '*.tif' ) ) ) ) )
+
+	# list ALL relative humidity -- the other inputs follow the same pathing
+	hurs_files = [ os.path.join(r,fn) for r,s,files in os.walk( base_dir ) for fn in files if fn.endswith( '.tif' ) and 'hurs_' in fn and '_anom.tif' not in fn ]
+	jobs = [ make_job( fn, girr_files ) for fn in hurs_files ]
+
+	# 2km AKCAN grid geometry -- shared by all inputs and cached next to the girr climatologies
+	grid = GridSpec.from_raster( hurs_files[0], sidecar=os.path.join( girr_dir, 'akcan_2km_gridspec.npz' ) )
+
+	graph = derived.DerivedGraph([ derived.VAP, derived.NIRR ], grid=grid )
+	out = graph.run( jobs, ncpus=ncpus )
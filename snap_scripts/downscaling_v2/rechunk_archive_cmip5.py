@@ -0,0 +1,35 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+# # rechunk a downscaled model/scenario/variable series from month-per-file
+# # GeoTiffs into a pixel-major (time-contiguous) store for profile and
+# # trend queries and a time-major sibling for map access.
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+if __name__ == '__main__':
+	import os, glob
+	from downscale import rechunk
+	import argparse
+
+	parser = argparse.ArgumentParser( description='rechunk a downscaled series to pixel-major and time-major stores' )
+	parser.add_argument( "-b", "--base_dir", action='store', dest='base_dir', type=str, help="base directory of the downscaled archive" )
+	parser.add_argument( "-o", "--output_dir", action='store', dest='output_dir', type=str, help="directory to write the stores to" )
+	parser.add_argument( "-m", "--model", action='store', dest='model', type=str, help="model name" )
+	parser.add_argument( "-s", "--scenario", action='store', dest='scenario', type=str, help="scenario name" )
+	parser.add_argument( "-v", "--variable", action='store', dest='variable', type=str, help="variable name" )
+	parser.add_argument( "-f", "--fmt", action='store', dest='fmt', type=str, default='netcdf', help="store format: netcdf or zarr" )
+	parser.add_argument( "-t", "--tile", action='store', dest='tile', type=int, default=50, help="y/x tile size of the pixel-major chunks" )
+	parser.add_argument( "-mm", "--max_mem", action='store', dest='max_mem', type=float, default=8e9, help="bytes of data held in memory at once" )
+	parser.add_argument( "-n", "--ncpus", action='store', dest='ncpus', type=int, default=16, help="number of cores to use" )
+	parser.add_argument( "--n_partitions", action='store', dest='n_partitions', type=int, default=None, help="verify and merge a run downscaled in this many partitions" )
+	args = parser.parse_args()
+
+	series_dir = os.path.join( args.base_dir, args.model, args.scenario, args.variable )
+	output_prefix = os.path.join( args.output_dir, '_'.join([ args.variable, args.model, args.scenario ]) )
+	if args.n_partitions is not None:
+		from downscale.partition import merge_partitions
+		out = merge_partitions( series_dir, args.n_partitions, output_prefix, fmt=args.fmt, tile=(args.tile, args.tile),
+									max_mem=args.max_mem, ncpus=args.ncpus )
+	else:
+		files = glob.glob( os.path.join( series_dir, '*.tif' ) )
+		out = rechunk.rechunk_series( files, output_prefix, fmt=args.fmt, tile=(args.tile, args.tile),
+										max_mem=args.max_mem, ncpus=args.ncpus )
+	print( out )
@@ -10,14 +10,10 @@ def sort_files( files ):
 	df = pd.DataFrame(split_fn)[elems+['fn']]
 	return df.sort_values(['year','month']).fn.tolist()
 	
-def zip_it( args ):
-	dirname, out_fn = args
-	return os.system( 'zip -q -rj9 {} {}'.format( out_fn, os.path.join(dirname,'*') ) )
-
 if __name__ == '__main__':
 	import os, glob, itertools
 	import pandas as pd
-	import multiprocessing as mp
+	from downscale.package import build_archives
 
 	base_path = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/downscaled'
 	output_path = '/workspace/Shared/Tech_Projects/DeltaDownscaling/project_data/downscaled_zips_for_CKAN/SNAP'
@@ -44,11 +40,11 @@ if __name__ == '__main__':
 			begin = '_'.join(os.path.basename(files[0]).split('.tif')[0].split('_')[-2:])
 			end = '_'.join(os.path.basename(files[-1]).split('.tif')[0].split('_')[-2:])
 			out_fn = os.path.join( output_path, '{}_AK_CAN_2km_{}_{}_{}-{}.zip'.format(variable, model, scenario, begin, end ) )
-			args = args + [[ os.path.dirname(files[0]), out_fn ]]
+			args = args + [( files, out_fn )]
 
-	# now zip the data in parallel
+	# now zip the data -- 8 archives at a time, each with 8 threads reading / hashing members and
+	# the members deflated in order by the archive's writer.
+	# LZW GeoTIFFs are stored not re-deflated, a <zip>.sha256 manifest is written alongside
+	# and archives whose inputs are unchanged since the last run are skipped.
 	print( 'running...' )
-	pool = mp.Pool( 40 )
-	out = pool.map( zip_it, args )
-	pool.close()
-	pool.join()
+	out = build_archives( args, ncpus=8, nthreads=8 )
@@ -15,36 +15,12 @@ def make_args( rst_fn, shp_fn, output_path ):
 	out_fn = out_fn.replace( '_c_', '_C_' )
 	return ( shp_fn, rst_fn, out_fn )
 
-def crop_clip( shp_fn, rst_fn, out_fn ):
-	'''
-	crop/clip to the shapefile we want using gdalwarp.
-	'''
-	import subprocess, os
-	try:
-		dirname = os.path.dirname( out_fn )
-		if not os.path.exists( dirname ):
-			os.makedirs( dirname )
-	except:
-		pass
-
-	# proj4string = '+proj=aea +lat_1=55 +lat_2=65 +lat_0=50 +lon_0=-154 +x_0=0 +y_0=0 +ellps=GRS80 +datum=NAD83 +units=m +no_defs'
-	proj4string = 'EPSG:3338'
-	subprocess.call(['gdalwarp', '-q', '-t_srs', proj4string, '-tap','-overwrite', \
-						'-co', 'COMPRESS=LZW','-tr', '2000', '2000', \
-						'-dstnodata', '-3.4e+38','-crop_to_cutline', '-cutline',
-						shp_fn, rst_fn, out_fn ])
-	return out_fn
-
-def wrap( x ):
-	''' wrapper for clean multiprocessing call to pool.map '''
-	return crop_clip( *x )
-
 if __name__ == '__main__':
 	import os, glob, itertools, rasterio
 	import xarray as xr
 	import numpy as np
 	import pandas as pd
-	from pathos.mp_map import mp_map
+	from downscale.clip import ClipPlan, clip_files
 
 	# setup args
 	base_path = '/Data/Base_Data/Climate/AK_CAN_2km/projected/AR5_CMIP5_models'
@@ -62,5 +38,10 @@ if __name__ == '__main__':
 					fn_list = fn_list + glob.glob( os.path.join( root, '*.tif' ) )
 
 	args_list = [ make_args( rst_fn, subdomain_fn, output_path ) for rst_fn in fn_list if 'dof' in rst_fn or 'dot' in rst_fn or 'logs' in rst_fn ]
-	out = mp_map( lambda x: wrap( x ), args_list, nproc=32 )
-	
\ No newline at end of file
+
+	# rasterize the cutline ONCE on the EPSG:3338 2km grid (gdalwarp -t_srs EPSG:3338 -tr 2000 2000 -tap -crop_to_cutline)
+	# tap: the AKCAN origin is not on 2000m multiples, so its cells are resampled ( nearest ) onto them as gdalwarp did
+	plan = ClipPlan.from_shapefile( subdomain_fn, args_list[0][1], dst_crs='EPSG:3338', resolution=2000, tap=True )
+
+	# only the cutline window is read from each file and masked in memory
+	out = clip_files( plan, [ (rst_fn, out_fn) for shp_fn, rst_fn, out_fn in args_list ], ncpus=ncpus, nodata=-3.4e+38 )